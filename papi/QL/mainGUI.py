@@ -70,13 +70,15 @@ import datetime
 # os.environ['PYRAF_NO_DISPLAY'] = '0'
 
 # PANIC modules
-from papi.reduce.threadsmod import ExecTaskThread
+from papi.reduce.threadsmod import ExecTaskThread, TaskExecutor, JobScheduler
+from papi.reduce.threadsmod import PRIO_LAZY, PRIO_SCIENCE, PRIO_CALIBRATION
 from papi.reduce.calDark import MasterDark
 from papi.reduce.calTwFlat import MasterTwilightFlat
 from papi.reduce.calGainMap import DomeGainMap, TwlightGainMap, SkyGainMap
 from papi.reduce.calDomeFlat import MasterDomeFlat
 from papi.reduce.calBPM import BadPixelMask
 from papi.reduce.applyDarkFlat import ApplyDarkFlat
+from papi.reduce.incrementalReduction import IncrementalReduction
 from papi.reduce.checkQuality import CheckQuality
 from papi.reduce.astrowarp import doAstrometry
 from papi.reduce.reductionset import ReductionSet
@@ -117,7 +119,6 @@ from astropy import units as u
 from pyraf import iraf
 
 # Multiprocessing
-from multiprocessing import Process, Queue
 
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 from PyQt5.QtCore import QSize
@@ -201,6 +202,10 @@ locale.setlocale(locale.LC_NUMERIC, 'C')
 
 
 class MainGUI(QtWidgets.QMainWindow, form_class):
+    
+    # Signal emitted (from the JobScheduler threads) when a job has finished
+    job_done = QtCore.pyqtSignal(object, object)
+    
     def __init__(self, source_dir="/tmp/data", output_dir="/tmp/out", 
                  temp_dir="/tmp", config_opts=None, *args):
         super(MainGUI, self).__init__(*args)
@@ -286,7 +291,6 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         self.m_processing = False
         self.proc_started = False # QL processing activated (True) or deactivated (False)
         self._proc = None # variable to handle QProcess tasks
-        self._process = None # pointer to the current running multiprocessing.Process
         self.read_error_files = {} # a dictionary to track the error while reading/detecting FITS files
         
         
@@ -362,25 +366,28 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         self._task_info = None
         self._task_info_list = []     # Queue-list where task status is saved
         
+        # Heavy tasks are run in a pool of processes (out of the GUI process),
+        # following the same protocol than ExecTaskThread 
+        self._executor = TaskExecutor(self.config_opts['general']['ncpus'])
+        
         self._task_timer = QTimer(self)
         self._task_timer.timeout.connect(self.checkLastTask)
         self._task_timer.start(1000)    # 1 second continuous timer
         
-        # Task management using Processing Queue management
-        # -------------------------------------------------
-        # Create queues
-        self._task_queue = Queue()
-        self._done_queue = Queue()
-        
-        # Timer for DoneQueue (tasks already done)
-        self._queue_timer_done = QTimer(self)
-        self._queue_timer_done.timeout.connect(self.checkDoneQueue)
-        self._queue_timer_done.start(1000)    # 1 second continuous timer
-        
-        # Timer for TaskQueue (pending tasks)
-        self._queue_timer_todo = QTimer(self)
-        self._queue_timer_todo.timeout.connect(self.taskRunner)
-        self._queue_timer_todo.start(1000)    # 1 second continuous timer
+        # Task management using a prioritized JobScheduler (Processes)
+        # -----------------------------------------------------------
+        # Jobs (sequence reductions, lazy processing, ...) are run by priority
+        # on 'max_jobs' concurrent processes; the completion of each job is
+        # notified with the job_done signal (no polling).
+        self._scheduler = JobScheduler(self.job_done.emit,
+                                       self.config_opts['quicklook']['max_jobs'],
+                                       self.config_opts['quicklook']['preempt'])
+        self.job_done.connect(self.checkDoneJob)
+        
+        # State of the incremental reduction of the current dither sequence
+        # (Lazy mode), kept in memory while the frames of the sequence arrive
+        self._incremental = None
+        self._incremental_key = None
         
     def __initializeGUI(self):
         """
@@ -617,7 +624,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                                      bpm_action='grab') # fix is a heavy process for QL
                     params = ()
                     log.debug("Inserting in queue the task ....")
-                    self._task_queue.put([(func_to_run.apply, params)])
+                    self.submitJob(func_to_run.apply, params, PRIO_LAZY)
                     
                 else:
                     self.logConsole.error("[processLazy] Cannot find the appropriate master calibration for file %s"%filename)
@@ -644,7 +651,9 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     out_filename = self.m_outputdir + "/" + os.path.basename(filename).replace(".fits", _suffix) 
                     params = ([filename, last_file], '-', 
                                          out_filename, self.m_tempdir)
-                    self._task_queue.put([(func_to_run, params)])
+                    # mathOp runs IRAF in m_tempdir
+                    self.submitJob(func_to_run, params, PRIO_LAZY,
+                                   workdir=self.m_tempdir)
                     
                 else:
                     log.debug("Cannot find the previous file to subtract by")
@@ -656,11 +665,64 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         # ##########################################################################################
         elif self.checkBox_subSky.isChecked():
             try:
-                self.subtract_nearSky_slot(True)
+                # MEF files (e.g., H2RG detectors) are not supported by the
+                # incremental reduction, so they are sky subtracted as usual
+                if (self.config_opts['quicklook']['incremental'] and 
+                    not ClFits(filename).isMEF()):
+                    self.incrementalReduction(filename)
+                else:
+                    self.subtract_nearSky_slot(True)
             except Exception as e:
                 self.m_processing = False # ANY MORE REQUIRED ?
                 raise e    
         
+    def incrementalReduction(self, filename):
+        """
+        Add the science frame to the incremental reduction of its dither 
+        sequence; a new one is started when the frame belongs to a different
+        sequence (OB_ID, OB_PAT, FILTER, EXPTIME) or it is the first frame of
+        the pattern.
+        
+        The state of the sequence (calibrated frames of the sky window, 
+        offsets, coadd and weights) is kept in memory by IncrementalReduction,
+        so the frame is processed in a thread of the QL process; the updated
+        coadd is displayed as any other task result.
+        """
+        
+        fits_file = ClFits(filename)
+        key = (fits_file.getOBId(), fits_file.getOBPat(), 
+               fits_file.getFilter(), fits_file.expTime())
+        
+        if (self._incremental is None or key != self._incremental_key or
+            fits_file.getExpNo() == 1):
+            mDark, mFlat, mBPM = self.getCalibFor([filename])
+            output = os.path.join(self.m_outputdir, "QL_" + 
+                      os.path.basename(filename).replace(".fits", "_stack.fits"))
+            self._incremental = IncrementalReduction(output, mDark, mFlat, 
+                                                     mBPM, self._skyHalfWidth())
+            self._incremental_key = key
+            self.logConsole.info("[incremental] New sequence; coadd: %s" % output)
+        
+        # the coadd is overwritten with each new frame; the frames are queued
+        # here, so they are added in order whatever thread runs first
+        self.outputsDB.delete(self._incremental.output_file)
+        self._incremental.queue_frame(filename)
+        ExecTaskThread(self._incremental.add_queued_frame, 
+                       self._task_info_list).start()
+    
+    def _skyHalfWidth(self):
+        """
+        Half width of the sky window selected in the Setup tab.
+        """
+        
+        if self.comboBox_pre_skyWindow.currentText() == "2-frames": nhw = 1
+        elif self.comboBox_pre_skyWindow.currentText() == "4-frames": nhw = 2
+        elif self.comboBox_pre_skyWindow.currentText() == "6-frames": nhw = 3
+        elif self.comboBox_pre_skyWindow.currentText() == "8-frames": nhw = 4
+        else: nhw = 2
+        
+        return nhw
+        
             
     def getCalibFor(self, sci_obj_list):
         """
@@ -994,114 +1056,121 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                 self.checkBox_autocheck.setChecked(True)
                 self.autocheck_slot()
                 
-    def checkDoneQueue(self):
+    def checkDoneJob(self, job, r):
         """
-        Check Queue of done tasks launched with Process in taskRunner.
-        Function called periodically (every 1 sec).
+        Receive the result of a job run by the JobScheduler. 
+        Slot connected to the job_done signal, so it is run in the GUI thread.
         """
-        if not self._done_queue.empty():
-            log.debug("Something new in the DoneQueue !")
-            try:
-                r = self._done_queue.get()
-                self.logConsole.debug("[checkDoneQueue] Task finished")
-                log.info("Got from Queue: %s"%str(r))
-                
-                if r != None:
-                    if type(r) == type(Exception()):
-                        self.logConsole.error(str(r))
-                        self.logConsole.error("No processing results obtained")
-                    elif type(r) == type(list()):
-                        if len(r) == 0 :
-                            self.logConsole.info("No value returned")
-                        else:
-                            str_list = ""
-                            # print "FILES CREATED=",self._task_info._return
-                            # display.showFrame(r) #_return is a file list
-                            for i_file in r:
-                                if i_file.endswith(".fits"):
-                                    if self.getDisplayMode() >= 2: 
-                                        display.showFrame(i_file)
-                                elif i_file.endswith(".pdf"):
-                                    # Show PDF
-                                    try:
-                                        display.showPDF(i_file)
-                                    except Exception as e:
-                                        msg = "Cannot display PDF file, cannot find PDF client mupdf"
-                                        self.logConsole.info(msg)
-                                        log.debug(msg + str(e))
-                                        QMessageBox.critical(self, "Error", "Error, cannot display PDF file (cannot find mupdf)")
-                                else:
-                                    msg = "Cannot display file; file format not supported yet"
-                                    self.logConsole.error(msg)
-                                    log.error(msg)
-                                # display.showFrame(file)
-                                str_list += " +File: " + str(i_file) + "\n"
-                                #!!! keep up-date the out DB for future calibrations !!!
-                                # Because some science sequences could need the
-                                # master calibration created by a former reduction,
-                                # and only if apply_master_dark flat is activated,
-                                # the last produced file is inserted into the output DB
-                                # However, in order to avoid twice insert into
-                                # outputDB (although I think it should not be a
-                                # problem), if the checkBox for the outputs is 
-                                # activated on the GUI, the DB insertion will be 
-                                # done there (I hope), and not here !
-                                if not self.checkBox_outDir_autocheck.isChecked() and i_file.endswith(".fits"):
-                                    log.debug("Updating DB...")
-                                    self.outputsDB.insert(i_file)
-                                #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
-                            self.logConsole.debug("%s file/s created : \n %s"
-                                                      %(len(r), str(str_list)))
-                    elif type(r) == type("") and os.path.isfile(r):
-                        self.logConsole.debug("New file %s created " % r)
-
-                        if r.endswith(".fits"):
-                            if self.getDisplayMode() >= 2: display.showFrame(r)
-                        elif r.endswith(".pdf"):
-                            # Show PDF
-                            try:
-                                display.showPDF(r)
-                            except Exception as e:
-                                msg = "Cannot display PDF file, cannot find PDF client mupdf"
-                                self.logConsole.info(msg)
-                                log.debug(msg + str(e))
-                                QMessageBox.critical(self, "Error", "Error, cannot display PDF file (cannot find mupdf)")
-                        else:
-                            msg = "Cannot display file; file format not supported yet"
-                            self.logConsole.error(msg)
-                            log.error(msg)
-                        
-                        # Keep updated the out-DB for future calibrations
-                        # See comments above
-                        if not self.checkBox_outDir_autocheck.isChecked() and r.endswith(".fits"):
-                            log.debug("Updating DB...")
-                            self.outputsDB.insert(r)
-                        #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+        log.debug("Job #%d (%s) done" % (job.id, job.name))
+        try:
+            self.logConsole.debug("[checkDoneJob] Task finished")
+            log.info("Got from Queue: %s"%str(r))
+            
+            if r != None:
+                if isinstance(r, Exception):
+                    self.logConsole.error(str(r))
+                    self.logConsole.error("No processing results obtained")
+                elif type(r) == type(list()):
+                    if len(r) == 0 :
+                        self.logConsole.info("No value returned")
+                    else:
+                        str_list = ""
+                        # print "FILES CREATED=",self._task_info._return
+                        # display.showFrame(r) #_return is a file list
+                        for i_file in r:
+                            if i_file.endswith(".fits"):
+                                if self.getDisplayMode() >= 2: 
+                                    display.showFrame(i_file)
+                            elif i_file.endswith(".pdf"):
+                                # Show PDF
+                                try:
+                                    display.showPDF(i_file)
+                                except Exception as e:
+                                    msg = "Cannot display PDF file, cannot find PDF client mupdf"
+                                    self.logConsole.info(msg)
+                                    log.debug(msg + str(e))
+                                    QMessageBox.critical(self, "Error", "Error, cannot display PDF file (cannot find mupdf)")
+                            else:
+                                msg = "Cannot display file; file format not supported yet"
+                                self.logConsole.error(msg)
+                                log.error(msg)
+                            # display.showFrame(file)
+                            str_list += " +File: " + str(i_file) + "\n"
+                            #!!! keep up-date the out DB for future calibrations !!!
+                            # Because some science sequences could need the
+                            # master calibration created by a former reduction,
+                            # and only if apply_master_dark flat is activated,
+                            # the last produced file is inserted into the output DB
+                            # However, in order to avoid twice insert into
+                            # outputDB (although I think it should not be a
+                            # problem), if the checkBox for the outputs is 
+                            # activated on the GUI, the DB insertion will be 
+                            # done there (I hope), and not here !
+                            if not self.checkBox_outDir_autocheck.isChecked() and i_file.endswith(".fits"):
+                                log.debug("Updating DB...")
+                                self.outputsDB.insert(i_file)
+                            #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
+                        self.logConsole.debug("%s file/s created : \n %s"
+                                                  %(len(r), str(str_list)))
+                elif type(r) == type("") and os.path.isfile(r):
+                    self.logConsole.debug("New file %s created " % r)
+
+                    if r.endswith(".fits"):
+                        if self.getDisplayMode() >= 2: display.showFrame(r)
+                    elif r.endswith(".pdf"):
+                        # Show PDF
+                        try:
+                            display.showPDF(r)
+                        except Exception as e:
+                            msg = "Cannot display PDF file, cannot find PDF client mupdf"
+                            self.logConsole.info(msg)
+                            log.debug(msg + str(e))
+                            QMessageBox.critical(self, "Error", "Error, cannot display PDF file (cannot find mupdf)")
                     else:
-                        # Cannot identify the type of the results...for sure
-                        # something was wrong...
-                        self.logConsole.error("No processing results obtained")
+                        msg = "Cannot display file; file format not supported yet"
+                        self.logConsole.error(msg)
+                        log.error(msg)
+                    
+                    # Keep updated the out-DB for future calibrations
+                    # See comments above
+                    if not self.checkBox_outDir_autocheck.isChecked() and r.endswith(".fits"):
+                        log.debug("Updating DB...")
+                        self.outputsDB.insert(r)
+                    #!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
                 else:
-                    self.logConsole.warning("Nothing returned; processing maybe failed !")
-            except Exception as e:
-                raise Exception("Error while checking_task_info_list: %s"%str(e))
-            finally:
-                # Anyway, restore cursor
-                QApplication.restoreOverrideCursor()
-                self.m_processing = False
-                # Return to the previus working directory
-                os.chdir(self._ini_cwd)
-                # Good moment to update the master calibration files in widgets   
-                self._update_master_calibrations()
+                    # Cannot identify the type of the results...for sure
+                    # something was wrong...
+                    self.logConsole.error("No processing results obtained")
+            else:
+                self.logConsole.warning("Nothing returned; processing maybe failed !")
+        except Exception as e:
+            raise Exception("Error while checking_task_info_list: %s"%str(e))
+        finally:
+            # Anyway, restore cursor
+            QApplication.restoreOverrideCursor()
+            # Start the next pending jobs
+            self._scheduler.finished(job)
+            self._updateJobQueue()
+            # Return to the previus working directory
+            os.chdir(self._ini_cwd)
+            # Good moment to update the master calibration files in widgets   
+            self._update_master_calibrations()
+            
                 
-                    
     def checkLastTask(self):
         """
         Receiver function signaled by QTimer 'self._task_timer' object.
         Funtion called periodically (every 1 sec) to check last task results
-        launched with the ExecTaskThread function.
+        launched with the ExecTaskThread function or the TaskExecutor.
         """
         
+        # Progress messages of the tasks run by the TaskExecutor
+        for task_id, status, pid in self._executor.progress():
+            if pid:
+                self.logConsole.debug("Task #%d %s (PID %d)" % (task_id, status, pid))
+            else:
+                self.logConsole.debug("Task #%d %s" % (task_id, status))
+        
         if len(self._task_info_list) > 0:
             self.logConsole.debug("Task finished")
             try:
@@ -2725,6 +2794,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         if self.checkBox_autocheck.isChecked():
             self.timer_dc.stop()
         
+        # Cancel the pending tasks
+        self._executor.shutdown()
+        self._scheduler.cancel()
+        
         os.system("killall ds9")
         sys.exit(0)
         
@@ -2878,7 +2951,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                 # Put into the queue the task to be done
                 func_to_run = mathOp
                 params = (last2_files, "-", self.m_tempdir + "/sub.fits", self.m_tempdir)
-                self._task_queue.put([(func_to_run, params)])
+                # the output file is always the same, so these jobs are run 
+                # one after the other
+                self.submitJob(func_to_run, params, PRIO_LAZY,
+                               workdir=self.m_tempdir)
             except:
                 QMessageBox.critical(self, "Error", "Error while subtracting files.")
                 raise
@@ -2909,21 +2985,22 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
 
         QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
         
-        for file in self.m_popup_l_sel:
-            try:
-                self.m_processing = False    
-                thread = ExecTaskThread(convRaw2CDS,
-                                            self._task_info_list,
-                                            [file],
-                                            self.m_outputdir,
-                                            "CDS",
-                                            True)
-                thread.start()
-            except Exception as e:
-                log.debug("Cannot convert Single-Fits-Cube to CDS file %s. Maybe it's "
-                          "not a Single-Fits-Cube", str(e))
-                QMessageBox.critical(self, "Error", "Cannot convert Single-FITS-Cube to "
-                    "CDS file : %s \n Maybe it's not a Cube file" % (file))
+        # All the selected files are converted in a single task, that uses
+        # a pool of processes (one file per process)
+        try:
+            self.m_processing = False    
+            self._executor.submit(convRaw2CDS,
+                                        self._task_info_list,
+                                        list(self.m_popup_l_sel),
+                                        self.m_outputdir,
+                                        "CDS",
+                                        True,
+                                        self.config_opts['general']['ncpus'])
+        except Exception as e:
+            log.debug("Cannot convert Single-Fits-Cube to CDS file %s. Maybe it's "
+                      "not a Single-Fits-Cube", str(e))
+            QMessageBox.critical(self, "Error", "Cannot convert Single-FITS-Cube to "
+                "CDS files : %s \n Maybe they are not Cube files" % (self.m_popup_l_sel))
             
         QApplication.restoreOverrideCursor()
         
@@ -2948,11 +3025,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     # Pause autochecking coming files - ANY MORE REQUIRED ?, 
                     # now using a mutex in thread !!!!
                     self.m_processing = False    
-                    thread = ExecTaskThread(mathOp,
+                    self._executor.submit(mathOp,
                                             self._task_info_list,
                                             self.m_popup_l_sel,'-',
                                             str(outFilename))
-                    thread.start()
                 except:
                     QMessageBox.critical(self, "Error", 
                                          "Error while subtracting files")
@@ -2982,11 +3058,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     self.m_processing = False    
                     # Pause autochecking coming files - ANY MORE REQUIRED ?, 
                     # now using a mutex in thread !!!!
-                    thread = ExecTaskThread(mathOp,
+                    self._executor.submit(mathOp,
                                                    self._task_info_list, 
                                                    self.m_popup_l_sel,
                                                    'combine', str(outFilename))
-                    thread.start()
                 except:
                     QMessageBox.critical(self, "Error", 
                                          "Error while adding files")
@@ -3013,11 +3088,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     self.m_processing = False    
                     # Pause autochecking coming files - ANY MORE REQUIRED ?, 
                     # now using a mutex in thread !!!!
-                    thread = ExecTaskThread(mathOp,
+                    self._executor.submit(mathOp,
                                                    self._task_info_list, 
                                                    self.m_popup_l_sel,
                                                    '+', str(outFilename))
-                    thread.start()
                 except:
                     QMessageBox.critical(self, "Error", 
                                          "Error while adding files")
@@ -3042,11 +3116,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     # Pause autochecking coming files - ANY MORE REQUIRED ?, 
                     # now using a mutex in thread !!!!
                     self.m_processing = False
-                    thread = ExecTaskThread(mathOp,
+                    self._executor.submit(mathOp,
                                                  self._task_info_list, 
                                                  self.m_popup_l_sel, 
                                                  '/',  str(outFilename))
-                    thread.start()
                 except:
                     QMessageBox.critical(self, "Error", 
                                          "Error while dividing files")
@@ -3073,9 +3146,8 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                                        self.m_tempdir, 
                                                        str(outfileName), 
                                                        texp_scale)
-                thread = ExecTaskThread(self._task.createMaster,
+                self._executor.submit(self._task.createMaster,
                                                 self._task_info_list)
-                thread.start()
             except Exception as e:
                 QApplication.restoreOverrideCursor() 
                 QMessageBox.critical(self, "Error", 
@@ -3121,9 +3193,8 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                         self.m_popup_l_sel, 
                                         self.m_tempdir, 
                                         str(outfileName))
-                    thread = ExecTaskThread(self._task.createMaster,
+                    self._executor.submit(self._task.createMaster,
                                                  self._task_info_list)
-                    thread.start()
                 except:
                     QApplication.restoreOverrideCursor()
                     QMessageBox.critical(self, "Error", "Error while creating master Dome Flat")
@@ -3167,9 +3238,8 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                         master_dark_list=darks,
                         output_filename=str(outfileName))
                     
-                    thread = ExecTaskThread(self._task.createMaster,
+                    self._executor.submit(self._task.createMaster,
                                                  self._task_info_list)
-                    thread.start()
                 except Exception as e:
                     QApplication.restoreOverrideCursor()
                     msg = "Error creating master Twilight Flat file: %s" % str(e)
@@ -3205,8 +3275,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     self._task = SkyGainMap(self.m_popup_l_sel,
                                                               str(outfileName), 
                                                               None, self.m_tempdir)
-                    thread = ExecTaskThread(self._task.create, self._task_info_list)
-                    thread.start()
+                    self._executor.submit(self._task.create, self._task_info_list)
                 except Exception as e:
                     QApplication.restoreOverrideCursor()
                     QMessageBox.critical(self, "Error", "Error while creating Gain Map. "+str(e))
@@ -3217,8 +3286,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     self._task = DomeGainMap(self.m_popup_l_sel,
                                                               str(outfileName), 
                                                               None)
-                    thread = ExecTaskThread(self._task.create, self._task_info_list)
-                    thread.start()
+                    self._executor.submit(self._task.create, self._task_info_list)
                 except Exception as e:
                     QApplication.restoreOverrideCursor()
                     QMessageBox.critical(self, "Error", "Error while creating Gain Map. " + str(e))
@@ -3231,8 +3299,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                                               darks, 
                                                               str(outfileName), 
                                                               None, self.m_tempdir)
-                    thread = ExecTaskThread(self._task.create, self._task_info_list)
-                    thread.start()
+                    self._executor.submit(self._task.create, self._task_info_list)
                 except Exception as e:
                     QApplication.restoreOverrideCursor()
                     QMessageBox.critical(self, "Error", "Error while creating Gain Map. " + str(e))
@@ -3409,12 +3476,11 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                           check_data=True, 
                                           config_dict=self.config_opts)
             
-            thread = ExecTaskThread(self._task.subtractNearSky,
+            self._executor.submit(self._task.subtractNearSky,
                                            self._task_info_list, 
                                            self._task.rs_filelist, 
                                            file_n # range used by subtractNearSky is [1-N]
                                            )
-            thread.start()
         except:
             # Anyway, restore cursor
             # Although it should be restored in checkLastTask, could happen an
@@ -3450,9 +3516,8 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                         outputfile=str(outfileName), lthr=4.0, hthr=4.0,
                         temp_dir=self.m_tempdir)
                     
-                    thread = ExecTaskThread(self._task.create,
+                    self._executor.submit(self._task.create,
                                                    self._task_info_list)
-                    thread.start()
                 except:
                     # Restore cursor
                     QApplication.restoreOverrideCursor()
@@ -3615,7 +3680,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                                          force_apply=force_apply)
                         params = ()
                         log.debug("Inserting in queue the task ....")
-                        self._task_queue.put([(func_to_run.apply, params)])
+                        self.submitJob(func_to_run.apply, params, PRIO_SCIENCE)
                         
                     else:
                         self.logConsole.error("[ApplyDarkFlat] Cannot find the appropriate master calibrations for file %s"%filename)
@@ -3744,7 +3809,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                         func_to_run = nl_task.runMultiNLC
                         params = ()
                         log.debug("Inserting in queue the task ....")
-                        self._task_queue.put([(func_to_run, params)])
+                        self.submitJob(func_to_run, params, PRIO_SCIENCE)
                     except Exception as e:
                         log.error("Error while applying NL model: %s"%str(e))
                         raise e
@@ -4203,7 +4268,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                     self.logConsole.info("Starting Astrometric calibration (%s)" % catalog)
                     if self.comboBox_AstromEngine.currentText() == "SCAMP":
                         self.logConsole.info(" +Engine: SCAMP")
-                        thread = ExecTaskThread(doAstrometry,
+                        self._executor.submit(doAstrometry,
                                                        self._task_info_list,
                                                        #args of the doAstrometry function
                                                        file_to_calib, 
@@ -4211,14 +4276,13 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                                                        self.config_opts)
                     else: # Astrometry.net
                         self.logConsole.info(" +Engine: Astrometry.net")
-                        thread = ExecTaskThread(solveField,
+                        self._executor.submit(solveField,
                                                     self._task_info_list,
                                                     # args of the solveAstrometry
                                                     file_to_calib, 
                                                     self.m_outputdir,
                                                     self.m_tempdir,
                                                     self.config_opts['general']['pix_scale'])
-                    thread.start()
                 except:
                     QMessageBox.critical(self, "Error", "Error while computing astrometry.")
                     raise
@@ -4282,7 +4346,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                               snr,
                               zero_point,
                               False) # it is shown by the main thread, to avoid problems.
-                    self._task_queue.put([(func_to_run, params)])
+                    self.submitJob(func_to_run, params, PRIO_SCIENCE)
                     return
                     
                     res = doPhotometry(self.m_listView_item_selected,
@@ -4337,7 +4401,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
                 log.debug("Let's create Calibrations ...")
                 func_to_run = ReductionSet(*(params[0])).buildCalibrations
                 log.debug("ReductionSet created !")
-                self._task_queue.put([(func_to_run,())])
+                # a new request supersedes any former one not finished yet
+                self.submitJob(func_to_run, (), PRIO_CALIBRATION, 
+                               key='buildCalibrations',
+                               workdir=self.m_outputdir)
                 log.debug("New task queued")
 
             except Exception as e:
@@ -4432,17 +4499,12 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         Stop the processing throwing away all the tasks in the queue.
         """
         
-        while not self._task_queue.empty():
-            self._task_queue.get_nowait()
-            log.debug("Queue empted")
-        
-        if self._process != None and self._process.is_alive():
-            self._process.terminate()
-        #else:
-        #    print "da igual, lo paro"
-        #    self._process.terminate()
+        # Discard the pending jobs and kill the running ones
+        self._scheduler.cancel()
+        self._incremental = None
+        log.debug("Queue empted")
+        self._updateJobQueue()
         
-        self.m_processing = False
         QApplication.restoreOverrideCursor()
         log.info("Processing stopped !")
         self.logConsole.debug("Processing stopped !")
@@ -4460,9 +4522,9 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
         """
         Process the files provided; if any files were given, all the files 
         in the current Source List View (but not the output files) will be
-        processed. The processing task will be inserted into the _task_queue
-        to be processed as soon as the current (if any) processing has finished
-        (m_processing=False).  
+        processed. The processing task will be submitted to the JobScheduler
+        to be processed as soon as a slot is free, according to its priority
+        (science sequences first).  
         
         Parameters
         ----------
@@ -4500,6 +4562,9 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
             # All the files in ListView, even the generated output 
             # files (but they will not be processed)
             files = self.inputsDB.GetFiles() 
+            seq_key = None
+        else:
+            seq_key = "seq:" + sorted(files)[0]
 
         if len(files) == 0:
             return
@@ -4563,12 +4628,7 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
             else:
                 self.config_opts['astrometry']['engine'] = "AstrometryNet"
             #
-            if self.comboBox_pre_skyWindow.currentText() == "2-frames": nhw = 1
-            elif self.comboBox_pre_skyWindow.currentText() == "4-frames": nhw = 2
-            elif self.comboBox_pre_skyWindow.currentText() == "6-frames": nhw = 3
-            elif self.comboBox_pre_skyWindow.currentText() == "8-frames": nhw = 4
-            else: nhw = 2
-            self.config_opts['skysub']['hwidth'] = nhw
+            self.config_opts['skysub']['hwidth'] = self._skyHalfWidth()
             
             # Select detector (map SGi to Qi)
             if self.comboBox_detector.currentText() == "All": detector = 'all'
@@ -4616,7 +4676,10 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
 
             func_to_run = ReductionSet(*(params[0])).reduceSet
             log.debug("ReductionSet created !")
-            self._task_queue.put([(func_to_run,())])
+            # Science sequences have higher priority than calibrations, and
+            # a new reduction of a sequence supersedes the former (stale) one
+            self.submitJob(func_to_run, (), self._jobPriority(files),
+                           key=seq_key, workdir=self.m_outputdir)
             log.debug("New task queued") 
             #self._task_queue.put(params) #default function supposed!
             
@@ -4627,41 +4690,55 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
             QMessageBox.critical(self, "Error", "Error while processing Obs. Sequence: \n%s"%str(e))
             raise e # Para que seguir elevando la excepcion ?
         
-    def taskRunner(self):
+    def submitJob(self, func, args=(), priority=PRIO_SCIENCE, key=None,
+                  workdir=None):
+        """
+        Submit a job (func(*args)) to the JobScheduler; the results are 
+        obtained later at checkDoneJob().
+
+        Parameters
+        ----------
+        priority: int
+            PRIO_SCIENCE, PRIO_LAZY or PRIO_CALIBRATION (from highest to 
+            lowest); higher priority jobs preempt lower priority ones.
+        key: str
+            If given, any former job with the same key not finished yet is 
+            cancelled (superseded).
+        workdir: str
+            Directory where the job cleans up and writes fixed-name files 
+            (ReductionSet jobs); jobs with the same workdir are not run at
+            the same time, neither one of them suspended.
         """
-        Procedure that continuisly in checking the queue of pending tasks to be 
-        done. The results are obtained later at checkDoneQueue().
+        
+        job = self._scheduler.submit(func, args, priority, key, 
+                                     workdir=workdir)
+        self.logConsole.debug("Task #%d queued (%s)" % (job.id, job.name))
+        self._updateJobQueue()
 
-        The tasks are processed sequentially, that is, a new proccesing start only
-        when the previous one has finished. 
+    def _jobPriority(self, files):
         """
- 
-        # Update the number of tasks (not necessarialy equals to number of
-        # sequences) in to queue to be processed !
-        # Current processing will also be taken into account.
-        self.lineEdit_queue_size.setText(str(self._task_queue.qsize() + 
-                                            int(self.m_processing)))
-        
-        if not self._task_queue.empty() and not self.m_processing:
-            log.debug("Something new in the TaskQueue !")
-            try:
-                self.logConsole.debug("Starting to process queued task")
-                #Change cursor
-                QApplication.setOverrideCursor(QCursor(Qt.WaitCursor))
-                #'mutex' variable 
-                self.m_processing = True
-                self._process = Process(target=self.worker, 
-                    args=(self._task_queue, self._done_queue))
-                self._process.start()
-            except Exception as e:
-                #NOTE: I think this point will never be reached !!!
-                log.error("Error in task Runner: %s"%(str(e)))
-                self.logConsole.debug("Error in taskRunner")
-                self.m_processing = False
-                QApplication.restoreOverrideCursor()
-            finally:
-                log.debug("End of taskRunner")
-                 
+        Priority of the reduction of the given files: science (and standard
+        star) sequences have higher priority than calibration ones.
+        """
+
+        for filename in files:
+            info = self.inputsDB.GetFileInfo(filename)
+            # same test as ClFits.isScience()
+            if info and info[2] and ("SCIENCE" in info[2] or "STD" in info[2]):
+                return PRIO_SCIENCE
+
+        return PRIO_CALIBRATION
+
+    def _updateJobQueue(self):
+        """
+        Update the number of tasks (not necessarialy equals to number of
+        sequences) in to queue to be processed, current processing included.
+        """
+
+        self.m_processing = self._scheduler.running() > 0
+        self.lineEdit_queue_size.setText(str(self._scheduler.size() +
+                                             self._executor.pending()))
+
     def worker_original(self, input, output):
         """
         NOT USED - Callback function used by Process task
@@ -4680,40 +4757,6 @@ class MainGUI(QtWidgets.QMainWindow, form_class):
             self.m_processing = False
             log.debug("Worker finished its task !")
     
-    def worker(self, input, output):
-        """
-        Callback function used by Process task.
-        It is run in a separate/parallel process, similar to a thread.
-        
-        Parameters
-        ----------
-        
-        input : Queue
-            Input queue of tasks to be done
-        output : Queue
-            Output queue of tasks already done
-            
-        """
-        
-        # Get the next task from the queue
-        func, args = input.get()[0]
-        #print "FUNC=",func
-        #print "ARGS=",args
-        
-        log.debug("[worker] Worker start to work ...")
-        try:
-            output.put(func(*args))
-            log.info("[worker] task done !")
-        except Exception as e:
-            log.error("[worker] Error while processing task: %s"%str(e))
-            # Because excetions cannot be catched in taskRunner due to a 
-            # multiprocessing.Process exception is inserted in output queue 
-            # and then recognized
-            output.put(e) # the DoneQueue timer will detect it
-        finally:
-            self.m_processing = False
-            log.debug("Worker finished its task !")
-    
     # Menus stuff functions 
     def editCopy(self):
         print("panicQL.editCopy(): Not implemented yet")
@@ -44,12 +44,11 @@ Tested on SCAMP versions 1.4.6 and 1.7.0
 
 import sys
 import os
-import re
 import copy
-import subprocess
 
 # PAPI modules
 from papi.misc.paLog import log
+from papi.astromatic import toolrunner
 
 
 # ======================================================================
@@ -64,6 +63,11 @@ class SCAMP_Exception(Exception):
 class SCAMP_AccuracyException(Exception):
     pass
 
+# Messages in the output of SCAMP that mean it failed
+_SC_errors = ('ERROR ', 'error ', 'Error ', '*Error*', 'Segmentation fault',
+              'No source found', 'No such file or directory',
+              'WARNING: Not enough matched detections')
+
 # ======================================================================
 
 class SCAMP:
@@ -379,6 +383,12 @@ class SCAMP:
 
     _SC_config_special_keys = ["CONFIG_FILE"]
 
+    # -- Config. keys with filenames (made absolute in the command line)
+
+    _SC_config_path_keys = ["ASTREFCAT_NAME", "MERGEDOUTCAT_NAME",
+                            "FULLOUTCAT_NAME", "XML_NAME", "AHEADER_GLOBAL",
+                            "CHECKIMAGE_NAME"]
+
 
 
     def __init__(self):
@@ -403,68 +413,23 @@ class SCAMP:
         If a full path is provided, only this path is checked.
         Raise a SCAMP_Exception if it failed.
         Return program and version if it succeed.
+        The program is only looked for the first time in the process.
         """
 
-        # -- Finding scamp program and its version
-        # first look for 'scamp'
-
-        candidates = ['scamp']
-
-        if path:
-            candidates = [path]
-        
-        selected = None
-        for candidate in candidates:
-            try:
-                p = subprocess.Popen(candidate, shell=True, bufsize=0,
-                    stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT, close_fds=True)
-                
-                versionline = p.communicate()[0].decode()
- 
-                if versionline.find("SCAMP") != -1:
-                    selected = candidate
-                    break
-            except (IOError, OSError):
-                continue
-                
-        if not selected:
-            raise SCAMP_Exception(
-                  """
-                  Cannot find SCAMP program. Check your PATH,
-                  or provide the SCAMP program path in the constructor.
-                  """)
-
-        _program = selected
-
-        #print versionline
-        _version_match = re.search("[Vv]ersion ([0-9\.])+", versionline)
-        if not _version_match:
-            raise SCAMP_Exception(
-                  "Cannot determine SCAMP version.")
-
-        _version = _version_match.group()[8:]
-        if not _version:
-            raise SCAMP_Exception(
-                  "Cannot determine SCAMP version.")
-
-        # print "Use " + self.program + " [" + self.version + "]"
-
-        return _program, _version
+        try:
+            return toolrunner.find_program("SCAMP", ['scamp'], path)
+        except toolrunner.ToolNotFound as e:
+            raise SCAMP_Exception(str(e))
 
 
 
-    def update_config(self):
+    def _main_text(self):
         """
-        Update the configuration files according to the current
+        Return the content of the main configuration file for the current
         in-memory SCAMP configuration.
         """
-        
-
-        # -- Write main configuration file
-
-        main_f = open(self.config['CONFIG_FILE'], 'w')
 
+        text = ""
         for key in self.config.keys():
             if key in SCAMP._SC_config_special_keys:
                 continue
@@ -474,10 +439,22 @@ class SCAMP:
             else:
                 value = str(self.config[key])
             
-            main_f.write( ("%-16s       %-16s # %s" %
-                             (key, value, SCAMP._SC_config[key]['comment'])))
+            text += ("%-16s       %-16s # %s\n" %
+                     (key, value, SCAMP._SC_config[key]['comment']))
 
-        main_f.close()
+        return text
+
+    def update_config(self):
+        """
+        Update the configuration files according to the current
+        in-memory SCAMP configuration.
+        """
+        
+
+        # -- Write main configuration file
+
+        with open(self.config['CONFIG_FILE'], 'w') as main_f:
+            main_f.write(self._main_text())
 
 
     def run(self, catalog_list, updateconfig=True, clean=False, path=None):
@@ -489,8 +466,9 @@ class SCAMP:
         ----------
         
         updateconfig: bool
-            Is True (default), the configuration files will be updated before 
-            running SCAMP.
+            Is True (default), the in-memory configuration is used (written 
+            only once per different content, see toolrunner.materialize());
+            otherwise, the configuration file config['CONFIG_FILE'] is used.
 
         clean: bool
             If True (default: False), configuration files (if any) will be 
@@ -505,46 +483,46 @@ class SCAMP:
         SCAMP_AccuracyException
             SCAMP Warning/error: Significant inaccuracy likely to occur in 
             projection.
-            
-        """
 
-        if updateconfig:
-            self.update_config()
+        Notes
+        -----
+        SCAMP runs without a shell, in its own scratch directory (where the
+        XML report and check plots are written, if not given with absolute
+        paths); the .head files are written next to the catalogs.
+        """
 
         # Try to find SCAMP program
         # This will raise an exception if it failed
 
         self.program, self.version = self.setup(path)
-        
-        # check how many files in the input
-        my_catalogs = ""
-        #if type(catalog_list) == types.ListType:
-        if isinstance(catalog_list, list):
-            for file in catalog_list:
-               my_catalogs = my_catalogs + " " + file
+
+        if updateconfig:
+            config_file = toolrunner.materialize(self._main_text(), '.scamp')
         else:
-            my_catalogs = catalog_list  # a single file
+            config_file = os.path.abspath(self.config['CONFIG_FILE'])
         
+        # check how many files in the input
+        if not isinstance(catalog_list, list):
+            catalog_list = [catalog_list]  # a single file
             
         # Compound extra config command line args
-        ext_args = ""
+        args = [self.program, "-c", config_file]
         for key in self.ext_config.keys():
-            ext_args = ext_args + " -" + key+ " " + str(self.ext_config[key])
-            
-        commandline = (
-            self.program + " -c " + self.config['CONFIG_FILE'] + " " + ext_args + " " + my_catalogs)
+            value = self.ext_config[key]
+            if key in SCAMP._SC_config_path_keys:
+                value = toolrunner.abs_value(value)
+            args += ["-" + key, str(value)]
+        args += [toolrunner.abs_value(f) for f in catalog_list]
         
-        #print commandline
-
-        rcode = runCmd(commandline)
+        rcode, output = toolrunner.run_job("scamp", args)
         
-        if rcode == 1:
-            #print "ERROR!!!"
-            raise SCAMP_Exception(
-                  "SCAMP command [%s] failed." % str(commandline))
-        elif rcode == 2:
+        if output.count('WARNING: Significant inaccuracy'):
             raise SCAMP_AccuracyException(
-                  "SCAMP Warning/error: Significant inaccuracy likely to occur in projection.\n%s" % commandline)
+                  "SCAMP Warning/error: Significant inaccuracy likely to occur in projection.\n%s" % " ".join(args))
+        elif toolrunner.job_failed(rcode, output, _SC_errors, ignore_case=False):
+            log.error("An error happened while running command --> %s \n" % output)
+            raise SCAMP_Exception(
+                  "SCAMP command [%s] failed." % " ".join(args))
             
         if clean:
             self.clean()
@@ -568,68 +546,6 @@ class SCAMP:
         except OSError:
             pass
 # ======================================================================
-# A utility function
-# ======================================================================
-def runCmd( str_cmd, p_shell=True ):
-    """ 
-    A wrapper to run system commands.
-      
-    Parameters
-    ----------
-    str_cmd: str      
-      Command string to be executed in the shell
-    
-    p_shell: bool
-      If True (default), command will be executed through the shell, and all 
-      cout/cerr messages will be available.
-      If False, exception is the only way to find out problems during the call.
-
-    Returns
-    -------
-      0 if some error, or 1 if all was OK
-
-    Notes
-    -----
-    TODO:
-      - allow to launch commands in background 
-      - best checking of error when shell=True
-    """
-           
-    log.info("Running command : %s \n", str_cmd)
-    
-    try:
-        p = subprocess.Popen(str_cmd, bufsize = 0, shell = p_shell, stdin = subprocess.PIPE, 
-                             stdout = subprocess.PIPE, stderr = subprocess.PIPE, 
-                             close_fds = True)
-    except:
-        print("Some error while running command...")
-        raise
-       
-    #Warning
-    #We use communicate() rather than .stdin.write, .stdout.read or .stderr.read 
-    #to avoid deadlocks due to any of the other OS pipe buffers filling up and 
-    #blocking the child process.(Python Ref.doc)
-
-    (stdoutdata, stderrdata) = p.communicate()
-    err = stdoutdata.decode() + " " + stderrdata.decode()
-
-    # IMPORTANT: Next checking (only available when shell=True) not always detect all kind of errors !!
-    if err.count('WARNING: Significant inaccuracy'):
-        print("Canno't get accuracy astrometric calibration")
-        return 2
-    elif (err.count('ERROR ') or err.count('error ') or err.count("Error ")\
-      or err.count('*Error*')\
-      or err.count('Segmentation fault') or err.count("command not found") \
-      or err.count('No source found') \
-      or err.count("No such file or directory")
-      or err.count('WARNING: Not enough matched detections') # SCAMP
-      or err.count('WARNING: Significant inaccuracy likely to occur in projection')): #SCAMP
-        print("An error happened while running command --> %s \n" % err)
-        return 1 # ERROR
-    else:
-        return 0 # NO ERROR
-    
-# ======================================================================
 if __name__ == "__main__":
 
     if len(sys.argv) < 2:
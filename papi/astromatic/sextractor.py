@@ -92,15 +92,13 @@ Example of use:
 
 
 import os
-import subprocess
-import re
 import copy
 
 from papi.astromatic.sexcatalog import *
 
 
 # PAPI packages
-import papi.misc.utils as utils
+from papi.astromatic import toolrunner
 
 # ======================================================================
 #__version__ = "0.1.5 (2005-02-14)"
@@ -338,6 +336,13 @@ class SExtractor(object):
 
     _SE_config_special_keys = ["PARAMETERS_LIST", "CONFIG_FILE", "FILTER_MASK"]
 
+    # -- Config. keys with filenames of the images/catalogs of each job; they
+    #    are given in the command line (with absolute paths), so the same
+    #    configuration files are used for all the jobs.
+
+    _SE_config_path_keys = ["CATALOG_NAME", "CHECKIMAGE_NAME", "FLAG_IMAGE",
+                            "WEIGHT_IMAGE"]
+
 
     # -- Dictionary of all possible parameters (from sexcatalog.py module)
 
@@ -365,53 +370,64 @@ class SExtractor(object):
         If a full path is provided, only this path is checked.
         Raise a SExtractorException if it failed.
         Return program and version if it succeed.
+        The program is only looked for the first time in the process.
         """
 
         # -- Finding sextractor program and its version
         # first look for 'sextractor', then 'sex'
 
-        candidates = ['sextractor', 'sex']
-
-        if path:
-            candidates = [path]
-        
-        selected = None
-        for candidate in candidates:
-            try:
-                p = subprocess.Popen(candidate, shell=True, bufsize=0,
-                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
-                    stderr=subprocess.STDOUT, close_fds=True)
-                versionline = (p.communicate()[0]).decode()
- 
-                if versionline.find("SExtractor") != -1:
-                    selected = candidate
-                    break
-            except (IOError, OSError):
-                continue
-                
-        if not selected:
-            raise SExtractorException(
-                  """
-                  Cannot find SExtractor program. Check your PATH,
-                  or provide the SExtractor program path in the constructor.
-                  """)
+        try:
+            return toolrunner.find_program("SExtractor", ['sextractor', 'sex'],
+                                           path)
+        except toolrunner.ToolNotFound as e:
+            raise SExtractorException(str(e))
 
-        _program = selected
+    def _filter_text(self):
+        """
+        Return the content of the filter configuration file.
+        """
 
-        # print versionline
-        _version_match = re.search("[Vv]ersion ([0-9\.])+", versionline)
-        if not _version_match:
-            raise SExtractorException(
-                  "Cannot determine SExtractor version.")
+        # First check the filter itself
 
-        _version = _version_match.group()[8:]
-        if not _version:
-            raise SExtractorException(
-                  "Cannot determine SExtractor version.")
+        filter = self.config['FILTER_MASK']
+        rows = len(filter)
+        cols = len(filter[0])   # May raise ValueError, OK
+
+        text = "CONV NORM\n"
+        text += "# %dx%d Generated from sextractor.py module.\n" % (rows, cols)
+        for row in filter:
+            text += " ".join(map(repr, row)) + "\n"
+
+        return text
+
+    def _parameters_text(self):
+        """
+        Return the content of the parameter list file.
+        """
+
+        return "".join(parameter + "\n"
+                       for parameter in self.config['PARAMETERS_LIST'])
+
+    def _main_text(self, config, skip_keys=()):
+        """
+        Return the content of the main configuration file for the given
+        config values.
+        """
+
+        text = ""
+        for key in config.keys():
+            if key in SExtractor._SE_config_special_keys or key in skip_keys:
+                continue
+
+            if key == "PHOT_AUTOPARAMS": # tuple instead of a single value
+                value = " ".join(map(str, config[key]))
+            else:
+                value = str(config[key])
 
-        # print "Use " + self.program + " [" + self.version + "]"
+            text += ("%-16s       %-16s # %s\n" %
+                     (key, value, SExtractor._SE_config[key]['comment']))
 
-        return _program, _version
+        return text
 
     def update_config(self):
         """
@@ -421,90 +437,86 @@ class SExtractor(object):
 
         # -- Write filter configuration file
 
-        # First check the filter itself
-
-        filter = self.config['FILTER_MASK']
-        rows = len(filter)
-        cols = len(filter[0])   # May raise ValueError, OK
-
-        filter_f = open(self.config['FILTER_NAME'], mode='w')
-        filter_f.write("CONV NORM\n")
-        filter_f.write("# %dx%d Generated from sextractor.py module.\n" %
-                       (rows, cols))
-        for row in filter:
-            filter_f.write(" ".join(map(repr, row)))
-            filter_f.write("\n")
-            
-        filter_f.close()
+        with open(self.config['FILTER_NAME'], mode='w') as filter_f:
+            filter_f.write(self._filter_text())
 
         # -- Write parameter list file
 
-        parameters_f = open(self.config['PARAMETERS_NAME'], 'w')
-        for parameter in self.config['PARAMETERS_LIST']:
-            parameters_f.write(parameter+"\n")
-
-        parameters_f.close()
+        with open(self.config['PARAMETERS_NAME'], 'w') as parameters_f:
+            parameters_f.write(self._parameters_text())
 
         # -- Write NNW configuration file
 
-        nnw_f = open(self.config['STARNNW_NAME'], 'w')
-        nnw_f.write(nnw_config)
-        nnw_f.close()
-
+        with open(self.config['STARNNW_NAME'], 'w') as nnw_f:
+            nnw_f.write(nnw_config)
 
         # -- Write main configuration file
 
-        main_f = open(self.config['CONFIG_FILE'], 'w')
+        with open(self.config['CONFIG_FILE'], 'w') as main_f:
+            main_f.write(self._main_text(self.config))
 
-        for key in self.config.keys():
-            if key in SExtractor._SE_config_special_keys:
-                continue
+    def materialize_config(self):
+        """
+        Write (only once per different content, see toolrunner.materialize())
+        the configuration files for the current in-memory SExtractor
+        configuration, and return the filename of the main one.
+        The filenames of the images and catalogs are not included (see
+        _SE_config_path_keys); they must be given in the command line.
+        """
 
-            if key == "PHOT_AUTOPARAMS": # tuple instead of a single value
-                value = " ".join(map(str, self.config[key]))
-            else:
-                value = str(self.config[key])
-            
-            main_f.write("%-16s       %-16s # %s\n" %
-                             (key, value, SExtractor._SE_config[key]['comment']))
+        config = dict(self.config)
+        config['FILTER_NAME'] = toolrunner.materialize(self._filter_text(), '.conv')
+        config['PARAMETERS_NAME'] = toolrunner.materialize(self._parameters_text(),
+                                                           '.param')
+        config['STARNNW_NAME'] = toolrunner.materialize(nnw_config, '.nnw')
 
-        main_f.close()
+        return toolrunner.materialize(
+            self._main_text(config, SExtractor._SE_config_path_keys), '.sex')
 
     def run(self, file, updateconfig=True, clean=False, path=None):
         """
         Run SExtractor.
 
-        If updateconfig is True (default), the configuration
-        files will be updated before running SExtractor.
+        If updateconfig is True (default), the in-memory configuration
+        is used (see materialize_config()); otherwise, the configuration
+        file given in config['CONFIG_FILE'] is used.
+        In both cases, the values in ext_config are given in the command
+        line (i.e., they have priority).
 
         If clean is True (default: False), configuration files 
         (if any) will be deleted after SExtractor terminates.
 
+        SExtractor runs without a shell, in its own scratch directory, so
+        several jobs can be run concurrently.
         """
-        if updateconfig:
-            self.update_config()
 
         # Try to find SExtractor program
         # This will raise an exception if it failed
 
-
         self.program, self.version = self.setup(path)
 
         # Compound extra config command line args
-        ext_args = ""
-
-        for key in self.ext_config.keys():
-            ext_args = ext_args + " -" + key + " " + str(self.ext_config[key])
-
-        commandline = (
-            self.program + " -c " + self.config['CONFIG_FILE'] + " " + ext_args + " " + file)
-
-        # print commandline
-        rcode = utils.runCmd(commandline)
-
-        if rcode == 0:
+        cmd_config = {}
+        if updateconfig:
+            config_file = self.materialize_config()
+            for key in SExtractor._SE_config_path_keys:
+                cmd_config[key] = self.config[key]
+        else:
+            config_file = os.path.abspath(self.config['CONFIG_FILE'])
+        cmd_config.update(self.ext_config)
+
+        args = [self.program, "-c", config_file]
+        for key, value in cmd_config.items():
+            if key in SExtractor._SE_config_path_keys:
+                value = toolrunner.abs_value(value)
+            args += ["-" + key, str(value)]
+        args.append(toolrunner.abs_value(file))
+
+        rcode, output = toolrunner.run_job("sex", args)
+
+        if toolrunner.job_failed(rcode, output):
             raise SExtractorException(
-                  "SExtractor command [%s] failed." % str(commandline))
+                  "SExtractor command [%s] failed: %s" % (" ".join(args), output))
 
         if clean:
             self.clean()
@@ -45,14 +45,12 @@ Tested on SWARP versions 2.17.x
 
 import sys
 import os
-import subprocess
-import re
 import copy
 import fileinput
 
 
 # PAPI
-import papi.misc.utils
+from papi.astromatic import toolrunner
 
 # ======================================================================
 
@@ -310,6 +308,11 @@ class SWARP(object):
 
     _SW_config_special_keys = ["CONFIG_FILE"]
 
+    # -- Config. keys with filenames (made absolute in the command line)
+
+    _SW_config_path_keys = ["IMAGEOUT_NAME", "WEIGHTOUT_NAME", "WEIGHT_IMAGE",
+                            "XML_NAME"]
+
 
 
     def __init__(self):
@@ -336,68 +339,23 @@ class SWARP(object):
         If a full path is provided, only this path is checked.
         Raise a SWARPException if it failed.
         Return program and version if it succeed.
+        The program is only looked for the first time in the process.
         """
 
-        # -- Finding SWARP program and its version
-        # first look for 'swarp'
-
-        candidates = ['swarp']
-
-        if (path):
-            candidates = [path]
-        
-        selected = None
-        for candidate in candidates:
-            try:
-                p = subprocess.Popen (candidate, shell = True, bufsize = 0,
-                    stdin = subprocess.PIPE, stdout = subprocess.PIPE, 
-                    stderr = subprocess.STDOUT, close_fds = True)
-                
-                versionline = p.communicate()[0].decode()
-                
-                if versionline.find("SWarp") != -1:
-                    selected = candidate
-                    break
-            except IOError:
-                continue
-                
-        if not selected:
-            raise SWARPException(
-                  """
-                  Cannot find SWARP program. Check your PATH,
-                  or provide the SWARP program path in the constructor.
-                  """)
-
-        _program = selected
-
-        #print versionline
-        _version_match = re.search("[Vv]ersion ([0-9\.])+", versionline)
-        if not _version_match:
-            raise SWARPException(
-                  "Cannot determine SWARP version.")
-
-        _version = _version_match.group()[8:]
-        if not _version:
-            raise SWARPException(
-                  "Cannot determine SWARP version.")
-
-        # print "Use " + self.program + " [" + self.version + "]"
-
-        return _program, _version
+        try:
+            return toolrunner.find_program("SWarp", ['swarp'], path)
+        except toolrunner.ToolNotFound as e:
+            raise SWARPException(str(e))
 
 
 
-    def update_config(self):
+    def _main_text(self):
         """
-        Update the configuration files according to the current in-memory SWARP 
-        configuration.
+        Return the content of the main configuration file for the current
+        in-memory SWARP configuration.
         """
-        
-
-        # -- Write main configuration file
-
-        main_f = open(self.config['CONFIG_FILE'], 'w')
 
+        text = ""
         for key in self.config.keys():
             if (key in SWARP._SW_config_special_keys):
                 continue
@@ -407,10 +365,22 @@ class SWARP(object):
             else:
                 value = str(self.config[key])
             
-            print >>main_f, ("%-16s       %-16s # %s" %
-                             (key, value, SWARP._SW_config[key]['comment']))
+            text += ("%-16s       %-16s # %s\n" %
+                     (key, value, SWARP._SW_config[key]['comment']))
+
+        return text
+
+    def update_config(self):
+        """
+        Update the configuration files according to the current in-memory SWARP 
+        configuration.
+        """
+        
 
-        main_f.close()
+        # -- Write main configuration file
+
+        with open(self.config['CONFIG_FILE'], 'w') as main_f:
+            main_f.write(self._main_text())
 
 
     def run(self, file_list, updateconfig=True, clean=False, path=None):
@@ -425,8 +395,9 @@ class SWARP(object):
         ----------
         
         updateconfig: bool
-            If True (default), the configuration files will be updated before 
-            running SWARP.
+            If True (default), the in-memory configuration is used (written
+            only once per different content, see toolrunner.materialize());
+            otherwise, the configuration file config['CONFIG_FILE'] is used.
 
         clean: bool
             If clean is True (default: False), configuration files (if any) will 
@@ -434,43 +405,48 @@ class SWARP(object):
 
         path: str
             Path to the 'swarp' application (binary file) in the system.
-        """
 
-        if updateconfig:
-            self.update_config()
+        Notes
+        -----
+        SWARP runs without a shell, in its own scratch directory, where the
+        resampled images (RESAMPLE_DIR) and swap files (VMEM_DIR) are written
+        if they are given as relative paths.
+        """
 
         # Try to find SWARP program
         # This will raise an exception if it failed
         
         self.program, self.version = self.setup(path)
+
+        if updateconfig:
+            config_file = toolrunner.materialize(self._main_text(), '.swarp')
+        else:
+            config_file = os.path.abspath(self.config['CONFIG_FILE'])
         
         # check how many files in the input
-        if isinstance(file_list,list):
-            my_files = ""
-            for file in file_list:
-                my_files = my_files + " " + file
-        else:
-            my_files = file_list # a single file
+        if not isinstance(file_list, list):
+            file_list = [file_list] # a single file
 
 
         # Compound extra config command line args
-        ext_args=""
+        args = [self.program, "-c", config_file]
         for key in self.ext_config.keys():
-            ext_args=ext_args + " -" + key+ " " + str(self.ext_config[key])
-
-       
-        commandline = (
-            self.program + " -c " + self.config['CONFIG_FILE'] + " " + ext_args + " " + my_files)
-        
-
-        #print commandline
+            value = self.ext_config[key]
+            if key in SWARP._SW_config_path_keys:
+                value = toolrunner.abs_value(value)
+            args += ["-" + key, str(value)]
+        for my_file in file_list:
+            # '@file' is a file with the list of files to be processed
+            if my_file.startswith('@'):
+                args.append('@' + os.path.abspath(my_file[1:]))
+            else:
+                args.append(toolrunner.abs_value(my_file))
 
-        #rcode = os.system(commandline)
-        rcode = papi.misc.utils.runCmd(commandline)
+        rcode, output = toolrunner.run_job("swarp", args)
         
-        if rcode == 0:
+        if toolrunner.job_failed(rcode, output):
             raise SWARPException(
-                  "SWARP command [%s] failed." % str(commandline))
+                  "SWARP command [%s] failed: %s" % (" ".join(args), output))
             
         if clean:
             self.clean()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# toolrunner.py
+#
+# Common layer used by the Astromatic wrappers (SExtractor, SCAMP, SWarp) to
+# run the external programs:
+#
+#   - the program and its version are looked for only once per process
+#     (find_program());
+#   - the configuration files are written only once per different content,
+#     with a name given by their hash, so they can be shared by any number of
+#     jobs and processes (materialize());
+#   - each job is run without a shell, in its own scratch directory, so that
+#     the files written by the tools in the working directory (XML reports,
+#     check plots, resampled images, ...) of concurrent jobs do not collide
+#     (run_job()).
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import re
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc import profiling
+
+
+__all__ = ['ToolNotFound', 'find_program', 'materialize', 'run_job',
+           'job_failed', 'abs_value']
+
+# Messages in the output of a tool that mean the job failed (see
+# papi.misc.utils.runCmd)
+ERROR_PATTERNS = ('error ', 'error:', 'segmentation fault',
+                  'no source found', 'no such file or directory')
+
+# Programs already found in this process: (candidates, path) -> (program, version)
+_programs = {}
+_programs_lock = threading.Lock()
+
+
+class ToolNotFound(Exception):
+    pass
+
+
+def find_program(banner, candidates, path=None):
+    """
+    Look for an Astromatic program and get its version. The result is kept,
+    so the program is only looked for once per process.
+
+    Parameters
+    ----------
+    banner: str
+        Name of the program in its usage message (e.g. 'SExtractor')
+    candidates: list
+        Names of the program to look for in the PATH (e.g. ['sextractor', 'sex'])
+    path: str
+        If given, only this program path is checked
+
+    Returns
+    -------
+    The full path and the version of the program.
+
+    Raises
+    ------
+    ToolNotFound
+        The program or its version was not found
+    """
+
+    if path:
+        candidates = [path]
+    cache_key = (banner, tuple(candidates))
+
+    with _programs_lock:
+        if cache_key in _programs:
+            return _programs[cache_key]
+
+        for candidate in candidates:
+            program = shutil.which(candidate)
+            if program is None:
+                continue
+            try:
+                # run without arguments, the program prints its usage
+                p = subprocess.run([program], stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, timeout=60)
+            except (IOError, OSError, subprocess.TimeoutExpired):
+                continue
+            usage = p.stdout.decode(errors='replace')
+            if usage.find(banner) != -1:
+                break
+        else:
+            raise ToolNotFound("Cannot find %s program. Check your PATH, or "
+                               "provide the %s program path." % (banner, banner))
+
+        match = re.search(r"[Vv]ersion ([0-9\.]+)", usage)
+        if not match:
+            raise ToolNotFound("Cannot determine %s version." % banner)
+
+        log.debug("Using %s [%s]" % (program, match.group(1)))
+        _programs[cache_key] = (program, match.group(1))
+
+        return _programs[cache_key]
+
+
+def config_dir():
+    """
+    Return the directory where the configuration files are materialized.
+    """
+
+    cdir = os.path.join(tempfile.gettempdir(), 'papi_astromatic_%d' % os.getuid())
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir, exist_ok=True)
+
+    return cdir
+
+
+def materialize(content, suffix):
+    """
+    Write a configuration file with the given content, unless it already
+    exists, and return its filename. The filename is given by the hash of
+    the content, so the file is never modified once written.
+    """
+
+    digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    filename = os.path.join(config_dir(), digest + suffix)
+
+    if not os.path.exists(filename):
+        fd, tmp_file = tempfile.mkstemp(suffix=suffix, dir=config_dir())
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+        # atomic, concurrent writers produce the same content anyway
+        os.rename(tmp_file, filename)
+
+    return filename
+
+
+def abs_value(value):
+    """
+    Convert to absolute the path(s) of a (comma separated) value of a
+    config parameter, as the jobs do not run in the working directory of
+    the caller.
+    """
+
+    paths = []
+    for path in str(value).split(','):
+        path = path.strip()
+        if path and path.upper() != 'NONE' and not path.startswith('$'):
+            path = os.path.abspath(path)
+        paths.append(path)
+
+    return ','.join(paths)
+
+
+def run_job(name, args):
+    """
+    Run a job of an external program, without a shell and in a new scratch
+    directory.
+
+    Parameters
+    ----------
+    name: str
+        Name of the job (for logging and profiling)
+    args: list
+        Program and arguments; relative paths must be already converted to
+        absolute ones (see abs_value()).
+
+    Returns
+    -------
+    The exit code and the output (stdout + stderr) of the job.
+    """
+
+    log.debug("Running command : %s \n", " ".join(args))
+
+    scratch = tempfile.mkdtemp(prefix='papi_%s_' % name)
+    try:
+        # (the call is recorded in the active Profiler, if any)
+        with profiling.tool_call(name):
+            p = subprocess.run(args, cwd=scratch, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    finally:
+        shutil.rmtree(scratch, True)
+
+    output = p.stdout.decode(errors='replace') + " " + \
+             p.stderr.decode(errors='replace')
+
+    return p.returncode, output
+
+
+def job_failed(returncode, output, patterns=ERROR_PATTERNS, ignore_case=True):
+    """
+    Tells whether a job failed, from its exit code and the error messages
+    (patterns) found in its output.
+    """
+
+    if returncode != 0:
+        return True
+
+    if ignore_case:
+        output = output.lower()
+    return any(output.count(pattern) for pattern in patterns)
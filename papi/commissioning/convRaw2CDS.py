@@ -37,6 +37,7 @@ _version = '1.0'
 
 import fileinput
 import argparse
+import multiprocessing
 import sys
 import os
 
@@ -45,7 +46,19 @@ import astropy.io.fits as fits
 import numpy as np
 
 
-def convRaw2CDS(files, out_dir, suffix, quick=False):
+# List of WCS keywords to remove (those ending with 'A')
+WCS_KEYWORDS = [
+    'CUNIT1A', 'CUNIT2A', 
+    'CRVAL1A', 'CRVAL2A',
+    'CD1_1A', 'CD2_2A',
+    'CD1_2A', 'CD2_1A',
+    'CRPIX1A', 'CRPIX2A',
+    'WCSNAMEA',
+    'CTYPE1A', 'CTYPE2A'
+    ]
+
+
+def convRaw2CDS(files, out_dir, suffix, quick=False, ncpus=1):
     """
     Method used convert Single frame cubes (raw data) to
     CDS data and compute stats of a list of FITS files.
@@ -58,147 +71,182 @@ def convRaw2CDS(files, out_dir, suffix, quick=False):
         Output directory for created CDS files
     suffix: string
         suffix to add to the new created FITS files
+    quick: bool
+        If True, only the coadd of the NEXP CDS frames is saved, and no 
+        stats are computed; otherwise, each CDS frame is also saved.
+    ncpus: int
+        Number of processes used to convert the files in parallel
 
     Returns
     -------
-    Number of files read    
+    The last output file created (or the input file, if no conversion was 
+    needed).
     """
 
     print("Starting convRaw2CDS...")
 
-    for file in files:      
+    # A daemonic process (i.e., a worker of a Pool) cannot have children
+    if (ncpus is None or ncpus <= 1 or len(files) <= 1 or
+            multiprocessing.current_process().daemon):
+        results = [convRaw2CDS_file(file, out_dir, suffix, quick) 
+                   for file in files]
+    else:
+        pool = multiprocessing.Pool(processes=min(ncpus, len(files)))
         try:
-            # To preserve image scale (BITPIX)--> do_not_scale_image_data 
-            # (http://goo.gl/zYkc6)
-            # Other option, is use fits.ImageHDU.scale_back
-            hdulist = fits.open(file, mode="readonly", do_not_scale_image_data=False,  ignore_blank=True)
-        except IOError:
-            print('Error, can not open file %s' % (file))
-            continue
+            results = pool.map_async(unwrap_convRaw2CDS_file,
+                                     [(file, out_dir, suffix, quick) 
+                                      for file in files]).get()
+        finally:
+            pool.close()
+            pool.join()
+
+    results = [r for r in results if r is not None]
+    outfitsname = results[-1] if results else None
+    
+    print("End of convRaw2CDS")
+    return outfitsname
+
+
+def unwrap_convRaw2CDS_file(arg):
+    """
+    Helper for the process pool of convRaw2CDS(); Pool.map_async() only 
+    passes one argument.
+    """
+
+    return convRaw2CDS_file(*arg)
+
+
+def cds_frames(data, cpar1, nexps):
+    """
+    Compute at once the CDS frames of all the exposures of a raw single 
+    frame cube.
+
+    Parameters
+    ----------
+    data: array or HDU.section
+        Raw cube (nframes, ny, nx), with cpar1 frames for each of the 
+        nexps exposures (reset frame first). Using the section of the HDU,
+        only the required frames are read from disk.
+    cpar1: int
+        Number of frames per exposure
+    nexps: int
+        Number of exposures (repetitions)
+
+    Returns
+    -------
+    The int32 cube (nexps, ny, nx) of CDS frames (last - reset frame of 
+    each exposure).
+    """
+
+    if data.shape[0] < cpar1 * nexps:
+        raise Exception("Cube with %d frames, but expected CPAR1*NEXP = %d" 
+                        % (data.shape[0], cpar1 * nexps))
+
+    # Only the reset and last frames of each exposure are read
+    last = data[cpar1 - 1: cpar1 * nexps: cpar1]
+    reset = data[0: cpar1 * nexps: cpar1]
 
+    # the frames can be float (scaled with BSCALE/BZERO), so they are cast 
+    # to int32 before the subtraction, as the whole cube was before
+    return np.subtract(last.astype(np.int32), reset.astype(np.int32))
+
+
+def convRaw2CDS_file(file, out_dir, suffix, quick=False):
+    """
+    Convert a single frame cube (raw data) to CDS data; see convRaw2CDS().
+
+    Returns
+    -------
+    The last output file created, the input file if no conversion is needed,
+    or None if the file cannot be converted.
+    """
+
+    try:
+        # To preserve image scale (BITPIX)--> do_not_scale_image_data 
+        # (http://goo.gl/zYkc6)
+        # Other option, is use fits.ImageHDU.scale_back
+        hdulist = fits.open(file, mode="readonly", do_not_scale_image_data=False,  
+                            ignore_blank=True)
+    except IOError:
+        print('Error, can not open file %s' % (file))
+        return None
+
+    try:
         # Check if it is a MEF file
         if len(hdulist) > 1:
             print("[Error] Wrong Extension number for file: %s" % file)
-            continue
+            return None
+
+        header = hdulist[0].header
+
+        cpar1 = header['CPAR1'] # cycle type parameter (number of frames per exp)
+        nexps = header['NEXP'] # crep (number of repetitions)
+        save_mode = header['SAVEMODE'] # 'single.frame.read'
+        print(save_mode)
+        if save_mode != 'single.frame.read':
+            print("No conversion needed. Image is not saved as raw image")
+            return file
+        print("NEXP = %02i" %nexps)
+        rmode = header['READMODE'] 
+        if rmode != 'continuous.sampling.read':
+            print("[Error] Read mode %s not supported for file: %s" % (rmode, file))
+            return None
+
+        # Header template shared by all the output files of this cube
+        template = header.copy()
+        for keyword in WCS_KEYWORDS:
+            if keyword in template:
+                del template[keyword]
+        template['BZERO'] = 0
+        template['BSCALE'] = 1
+
+        cdscube = cds_frames(hdulist[0].section, cpar1, nexps)
+        mfnp = os.path.basename(file).partition('.fits')
+
+        if not quick:
+            exp_header = template.copy()
+            exp_header['HISTORY'] = 'CNTSR: raw single cube CONVERTED to CDS'
+            data = hdulist[0].section
+            for iexp in range(nexps):
+                # Compose output filename
+                # add suffix before .fits extension, or at the end if no such extension present
+                outfitsname = out_dir + '/' + mfnp[0] + suffix + "_%04i"%(iexp+1) + mfnp[1] + mfnp[2]
+                outfitsname = os.path.normpath(outfitsname)
+                fits.PrimaryHDU(data=cdscube[iexp].astype('float32'), 
+                                header=exp_header).writeto(outfitsname, overwrite=True)
+                median_last_frame = np.median(data[cpar1*iexp + cpar1 -1])
+                median_reset_frame = np.median(data[cpar1*iexp])
+                print('FITS file created: %s' % outfitsname)
+                print('Median last frame = %f' %median_last_frame)
+                print('Median reset frame = %f' %median_reset_frame)
+                print('STD reset frame = %f' %np.std(data[cpar1*iexp]))
+                print('Frame diff  = %f' %(median_last_frame - median_reset_frame))
+                print('CDS Median = %f' %np.median(cdscube[iexp]))
+
+        # NCOADDS indicates how many frames have been added to generate one image
+        # EXPTIME is the product of NEXP and ITIME, because each pixel in the image represents 
+        # the arithmetic sum of the ixels in the individual exposures. 
+        # Usually this equals the integration time.
+        # If the data have been created using a repetition factor larger than one
+        # (command crep and keyword NEXP), EXPTIME still is the time for the single image, in case of
+        # saving the images in a FITS cube the time for each individual slice in the cube.
+        coadd_header = template.copy()
+        coadd_header['NCOADDS'] = nexps
+        coadd_header['EXPTIME'] = float(coadd_header['ITIME']) * nexps
+        coadd_header['HISTORY'] = 'CDS and coadd of NEXPs'
+        outfitsname = out_dir + '/' + mfnp[0] + suffix + "_coadd" + mfnp[1] + mfnp[2]
+        outfitsname = os.path.normpath(outfitsname)
+        print('    - Saving output file %s' %outfitsname)
+        fits.PrimaryHDU(data=cdscube.sum(0).astype('float32'), 
+                        header=coadd_header).writeto(outfitsname, overwrite=True)
+        del cdscube
+
+    except Exception as e:
+        print("[Error] Cannot do conversion of file %s: \n %s"%(file, str(e)))
+        return None
+    finally:
+        hdulist.close()
 
-        try:
-            new_fits = fits.PrimaryHDU()
-            new_fits.header = hdulist[0].header.copy()
-            header = hdulist[0].header
-
-            # List of WCS keywords to remove (those ending with 'A')
-            wcs_keywords = [
-            'CUNIT1A', 'CUNIT2A', 
-            'CRVAL1A', 'CRVAL2A',
-            'CD1_1A', 'CD2_2A',
-            'CD1_2A', 'CD2_1A',
-            'CRPIX1A', 'CRPIX2A',
-            'WCSNAMEA',
-            'CTYPE1A', 'CTYPE2A'
-            ]
-        
-            # Remove each keyword if it exists
-            for keyword in wcs_keywords:
-                if keyword in new_fits.header:
-                    del new_fits.header[keyword]
-            
-            # -- End of deleting
-
-            cpar1 = header['CPAR1'] # cycle type parameter (number of frames per exp)
-            nexps = header['NEXP'] # crep (number of repetitions)
-            save_mode = header['SAVEMODE'] # 'single.frame.read'
-            print(save_mode)
-            if save_mode != 'single.frame.read':
-                print("No conversion needed. Image is not saved as raw image")
-                outfitsname = file
-                continue 
-            print("NEXP = %02i" %nexps)
-            rmode = header['READMODE'] 
-            mfnp = os.path.basename(file).partition('.fits')
-            if rmode == 'continuous.sampling.read':
-                data = np.rollaxis(hdulist[0].data.astype('int32'), 0, 3)
-                nx, ny, nz = data.shape
-                cdscube = np.zeros((nx, ny, nexps)).astype('int32')
-                for iexp in range(nexps):
-                    # print("IEXP=%02i"%iexp)
-                    # CDS from multiple frame cubes
-                    # cdsdata = data[:, :, 1] - data[:, :, 0]
-                    cdscube[:, :, iexp] = (data[:, :, cpar1*iexp + cpar1 -1] - data[:,:, cpar1*iexp])
-                    if not quick:
-                        cds_median = np.median(cdscube[:, :, iexp])
-                        median_last_frame = np.median(data[:, :, cpar1*iexp + cpar1 -1])
-                        median_reset_frame = np.median(data[:,:, cpar1*iexp])
-                        std_reset_frame = np.std(data[:,:, cpar1*iexp])
-                        new_fits.data = cdscube[:, :, iexp].astype('float32')
-                        new_fits.header['BZERO'] = 0
-                        new_fits.header['BSCALE'] = 1
-                        new_fits.header['HISTORY'] = 'CNTSR: raw single cube CONVERTED to CDS'
-                        new_hdulist = fits.HDUList([new_fits])
-                        # Compose output filename
-                        # add suffix before .fits extension, or at the end if no such extension present
-                        outfitsname = out_dir + '/' + mfnp[0] + suffix + "_%04i"%(iexp+1) + mfnp[1] + mfnp[2]
-                        outfitsname = os.path.normpath(outfitsname)
-                        # outfitsname = file.replace(".fits", "_%s.fits"%suffix)
-                        new_hdulist.writeto(outfitsname, overwrite=True)
-                        print('FITS file created: %s' % outfitsname)
-                        print('Median last frame = %f' %median_last_frame)
-                        print('Median reset frame = %f' %median_reset_frame)
-                        print('STD reset frame = %f' %std_reset_frame)
-                        print('Frame diff  = %f' %(median_last_frame - median_reset_frame))
-                        print('CDS Median = %f' %cds_median)
-
-                combine = True
-                combine_sum = True
-                combine_median = False
-                if combine_median or combine_sum:
-                    if combine_median:
-                        # Apply sigma clipping to the cube
-                        sigma = 3.0
-                        print('Sigma clipping...')
-                        clipped_cube = sigma_clip(cdscube, sigma=sigma, maxiters=2, axis=2)
-                        # Calculate the median along the axis (axis=2)
-                        # shortcut if nothing is clipped
-                        if clipped_cube.count() == clipped_cube.size:
-                            pr('No data clipped')
-                            median_image = np.median(cdscube, axis=2)
-                        else:
-                            median_image = np.ma.median(cdscube, axis=2).filled(np.nan)
-
-                    elif combine_sum:
-                        median_image = cdscube.sum(2)
-
-                    # create and save fits file
-                    new_fits.data = median_image.astype('float32')
-                    new_fits.header['BZERO'] = 0
-                    new_fits.header['BSCALE'] = 1
-                    new_hdulist = fits.HDUList([new_fits])
-                    if combine_median:
-                        outfitsname = out_dir + '/' + mfnp[0] + suffix + "_median" + mfnp[1] + mfnp[2]
-                        new_fits.header['HISTORY'] = 'CDS and median average sigclip'
-                    else:
-                        # NCOADDS indicates how many frames have been added to generate one image
-                        # EXPTIME is the product of NEXP and ITIME, because each pixel in the image represents 
-                        # the arithmetic sum of the ixels in the individual exposures. 
-                        # Usually this equals the integration time.
-                        # If the data have been created using a repetition factor larger than one
-                        # (command crep and keyword NEXP), EXPTIME still is the time for the single image, in case of
-                        # saving the images in a FITS cube the time for each individual slice in the cube.
-                        new_fits.header['NCOADDS'] = nexps
-                        new_fits.header['EXPTIME'] = float(new_fits.header['ITIME']) * nexps
-                        outfitsname = out_dir + '/' + mfnp[0] + suffix + "_coadd" + mfnp[1] + mfnp[2]
-                        new_fits.header['HISTORY'] = 'CDS and coadd of NEXPs'
-
-                    outfitsname = os.path.normpath(outfitsname)
-                    print('    - Saving output file %s' %outfitsname)
-                    new_hdulist.writeto(outfitsname, overwrite=True)
-
-                del cdscube
-
-        except Exception as e:
-            print("[Error] Cannot do conversion of file %s: \n %s"%(file, str(e)))
-            hdulist.close()
-    
-    print("End of convRaw2CDS")
     return outfitsname
     
 def nowtime():
@@ -236,6 +284,10 @@ def main(arguments=None):
                   action="store", dest="suffix", default="_CDS",
                   help="Suffix to use for new corrected files (default: %(default)s)")
     
+    parser.add_argument("-n", "--ncpus", type=int,
+                  action="store", dest="ncpus", default=1,
+                  help="Number of processes used to convert the files (default: %(default)s)")
+
     parser.add_argument("-Q", "--quick",
                   action="store_true", dest="quick", default=True,
                   help="Use quick mode, with no stats (default: %(default)s)")
@@ -251,7 +303,8 @@ def main(arguments=None):
         parser.error("incorrect number of arguments ")
             
     try:
-        convRaw2CDS(filelist, options.out_dir, options.suffix, options.quick)
+        convRaw2CDS(filelist, options.out_dir, options.suffix, options.quick,
+                    options.ncpus)
     except Exception as e:
         raise e
 
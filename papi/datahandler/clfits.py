@@ -45,7 +45,7 @@ import time
 
 from astropy import wcs
 import astropy.io.fits as fits
-from papi.misc.check_open import check_open
+from papi.misc.check_complete import check_complete
 
 # Logging (PAPI or Python built-in)
 try:
@@ -58,6 +58,33 @@ except ImportError:
 import warnings
 
 
+# Keywords of the primary header read by ClFits (see ClFits._parseHeader()),
+# including the WCS ones. A header with only these cards is enough to
+# classify a frame (see ClFits(..., header=) and fitsaccess.get_cards()).
+HEADER_KEYWORDS = frozenset(
+    ['SIMPLE', 'NAXIS', 'NAXIS1', 'NAXIS2', 'NAXIS3', 'NEXTEND',
+     'INSTRUME', 'OBS_TOOL', 'SOFTWARE', 'CREATOR', 'CAMERA', 'TELESCOPE',
+     'PAPITYPE', 'IMAGETYP', 'OBJECT', 'FILTER', 'FILTER1', 'FILTER2',
+     'EXPTIME', 'ITIME', 'NCOADDS', 'NDIT', 'NEXP', 'READMODE',
+     'DATE-OBS', 'MJD-OBS', 'RA', 'DEC', 'OBJCTRA', 'OBJCTDEC', 'EQUINOX',
+     'CHIPCODE', 'OB_ID', 'OB_PAT', 'PAT_EXPN', 'PAT_NEXP', 'POINT_NO',
+     'DITH_NO', 'BINNING', 'XBINNING', 'PIXSCALE',
+     'HIERARCH ESO DET CHIP NAME', 'HIERARCH ESO DET NCORRS NAME',
+     'HIERARCH ESO DET NDIT', 'HIERARCH ESO INS FILT1 NAME',
+     'HIERARCH ESO INS FILT2 NAME', 'HIERARCH ESO OBS ID',
+     'HIERARCH ESO TPL EXPNO', 'HIERARCH ESO TPL ID', 'HIERARCH ESO TPL NEXP',
+     # WCS
+     'WCSAXES', 'RADESYS', 'RADECSYS', 'LONPOLE', 'LATPOLE',
+     'A_ORDER', 'B_ORDER', 'AP_ORDER', 'BP_ORDER'] +
+    ['%s%d' % (k, i) for k in ('CTYPE', 'CUNIT', 'CRVAL', 'CRPIX', 'CDELT')
+     for i in (1, 2, 3)] +
+    ['%s%d_%d' % (k, i, j) for k in ('CD', 'PC')
+     for i in (1, 2, 3) for j in (1, 2, 3)] +
+    ['PV%d_%d' % (i, j) for i in (1, 2) for j in range(40)] +
+    ['%s_%d_%d' % (k, i, j) for k in ('A', 'B', 'AP', 'BP')
+     for i in range(10) for j in range(10) if i + j < 10])
+
+
 ###############################################################################
 class FitsTypeError(ValueError):
     """Raised when trying to classify a FITS file which is
@@ -93,7 +120,7 @@ class ClFits (object):
     """
 
     # Class initialization
-    def __init__(self, full_pathname, check_integrity=True, *a,**k):
+    def __init__(self, full_pathname, check_integrity=True, header=None, *a,**k):
       
         """
         Init the object
@@ -106,6 +133,10 @@ class ClFits (object):
         check_integrity: bool
             When True, the FITS integrity is done to check the file is complete.
             Mainly used on QL the know whether file writting finished. 
+
+        header: astropy.io.fits.Header
+            If given, the frame is classified from this (primary) header
+            and the file is not opened (see recognizeHeader()).
         """
         
         super(ClFits, self).__init__(*a, **k)
@@ -172,7 +203,10 @@ class ClFits (object):
         # Next variable is to identify the new PANIC detector H4RG
         self._is_panic_h4rg = False
 
-        self.recognize()
+        if header is None:
+            self.recognize()
+        else:
+            self.recognizeHeader(header)
 
     def getType(self, distinguish_domeflat=True):
         
@@ -351,7 +385,7 @@ class ClFits (object):
                 log.error('Could not open frame - something wrong with input data')
                 raise
 
-    def recognize(self, retries=10):
+    def recognize(self, retries=3):
      
         # Check the file exists
         if not os.path.exists(self.pathname):
@@ -370,10 +404,10 @@ class ClFits (object):
                 log.error(msg)
                 raise Exception(msg)
                 
-            # Secondly, we check if file is still being saved, ie., still 
-            # open by some GEIRS's process
-            if check_open(self.pathname, "geirs_save"):
-                # File is still open by 'save' process of GEIRS
+            # Secondly, we check if file is still being saved (e.g. by GEIRS),
+            # ie., its headers are not complete or it is shorter than given
+            # by them
+            if not check_complete(self.pathname):
                 log.warning("Error reading file %s, still being saved by GEIRS"%self.pathname) 
                 raise IOError("Error, file %s still being saved " % self.pathname)
 
@@ -460,11 +494,55 @@ class ClFits (object):
         # pointer to the primary-main header
         self.my_header = myfits[0].header
 
-         
+        self._parseHeader(self.my_header)
+
+        # 
+        # Close the file. Some updates can be done (PRESS1, ...) but it mustn't
+        #            
+        try:
+            myfits.close(output_verify='ignore')
+        except Exception as e:
+            log.error("Error while closing FITS file %s   : %s",
+                      self.pathname, str(e))
+        
+        #log.debug("End of FITS recognition: %s"%self.pathname)
+        
+
+    def recognizeHeader(self, header):
+        """
+        Classify the frame from its primary header only, already read by the
+        caller (e.g. a log-sheet or a catalog of frames built from a subset of
+        header cards); the file is not opened.
+
+        Note that MEF files are recognized by a primary header without data
+        (NAXIS = 0), and then the image size is unknown (naxis1 = naxis2 = -1).
+        """
+
+        self.my_header = header
+        if header.get('NAXIS', 0) == 0:
+            self.mef = True
+            self.next = header.get('NEXTEND', 0)
+        else:
+            self.mef = False
+            self.next = 1
+            self.naxis1 = header.get('NAXIS1', -1)
+            self.naxis2 = header.get('NAXIS2', -1)
+            if 'NAXIS3' in header:
+                self._shape = (header['NAXIS3'], self.naxis2, self.naxis1)
+            else:
+                self._shape = (self.naxis2, self.naxis1)
+
+        self._parseHeader(header)
+
+    def _parseHeader(self, header):
+        """
+        Read the values of the frame from its primary header.
+        """
+
         # INSTRUMENT
         try:
-            if 'INSTRUME' in myfits[0].header:
-                self.instrument = myfits[0].header['INSTRUME'].lower()
+            if 'INSTRUME' in header:
+                self.instrument = header['INSTRUME'].lower()
             else:
                 self.instrument = "Unknown"
         except Exception as e:
@@ -472,35 +550,35 @@ class ClFits (object):
             self.instrument = "Unknown"
         
         # Find out the how data file were"observed"
-        if 'OBS_TOOL' in myfits[0].header or self.instrument=='hawki':
+        if 'OBS_TOOL' in header or self.instrument=='hawki':
             self.obs_tool = True
         else:
             self.obs_tool = False
         
         # Software Version (GEIRS Version):
         # Old versions of GEIRS used 'SOFTWARE'
-        if 'SOFTWARE' in myfits[0].header:
-            self._softwareVer = myfits[0].header['SOFTWARE']
+        if 'SOFTWARE' in header:
+            self._softwareVer = header['SOFTWARE']
         # New versions of GEIRS moved to CREATOR keyword for software version
-        if 'CREATOR' in myfits[0].header:
-            self._softwareVer = myfits[0].header['CREATOR']
+        if 'CREATOR' in header:
+            self._softwareVer = header['CREATOR']
         
         # IMAGE TYPE
         try:
-            if self.instrument == 'omega2000' and 'PAPITYPE' in myfits[0].header:
+            if self.instrument == 'omega2000' and 'PAPITYPE' in header:
                 keyword_with_frame_type = 'PAPITYPE'
                 # It happens if the image is product of PAPI 
-            elif self.instrument == 'omega2000' and 'IMAGETYP' in myfits[0].header:
+            elif self.instrument == 'omega2000' and 'IMAGETYP' in header:
                 keyword_with_frame_type = 'IMAGETYP'
-            elif self.instrument == 'omega2000' and 'OBJECT' in myfits[0].header:
+            elif self.instrument == 'omega2000' and 'OBJECT' in header:
                 keyword_with_frame_type = 'OBJECT'
-            elif self.instrument == 'hawki' and 'IMAGETYP' in myfits[0].header:
+            elif self.instrument == 'hawki' and 'IMAGETYP' in header:
                 keyword_with_frame_type = 'IMAGETYP'
-            elif self.instrument == 'hawki' and 'OBJECT' in myfits[0].header:
+            elif self.instrument == 'hawki' and 'OBJECT' in header:
                 keyword_with_frame_type = 'OBJECT'
-            elif self.instrument == 'omegacass_mpia' and 'IMAGETYP' in myfits[0].header:
+            elif self.instrument == 'omegacass_mpia' and 'IMAGETYP' in header:
                 keyword_with_frame_type = 'IMAGETYP'    
-            elif self.instrument == 'omegacass_mpia' and 'OBJECT' in myfits[0].header:
+            elif self.instrument == 'omegacass_mpia' and 'OBJECT' in header:
                 keyword_with_frame_type = 'OBJECT'
             elif self.instrument == 'panic':  # current ID in GEIRS for PANIC
                 if self.obs_tool:
@@ -521,14 +599,14 @@ class ClFits (object):
         if self.instrument == 'panic':
             try:
                 # Self-typed file, created by PAPI
-                if 'PAPITYPE' in myfits[0].header:
-                    self.type = myfits[0].header['PAPITYPE']
+                if 'PAPITYPE' in header:
+                    self.type = header['PAPITYPE']
                 else:
                     #
-                    if 'IMAGETYP' in myfits[0].header:
-                        ltype = myfits[0].header['IMAGETYP'].lower()
+                    if 'IMAGETYP' in header:
+                        ltype = header['IMAGETYP'].lower()
                     else:
-                        ltype = myfits[0].header[keyword_with_frame_type].lower()
+                        ltype = header[keyword_with_frame_type].lower()
                         
                     if ltype.count('dark'):
                         self.type = "DARK"
@@ -560,8 +638,8 @@ class ClFits (object):
             # Find out whether is PANICv2 (H4RG detector)
             try:
                 self._is_panic_h4rg = False
-                if ('CAMERA' in myfits[0].header and
-                    'H4RG' in myfits[0].header['CAMERA']):
+                if ('CAMERA' in header and
+                    'H4RG' in header['CAMERA']):
                     self._is_panic_h4rg = True
                 else:
                     # log.debug("NOT a H4RG !!!! ")
@@ -572,27 +650,27 @@ class ClFits (object):
         elif self.instrument == 'hawki':
             try:
                 # Self-typed file, created by PAPI (master calibrations)
-                if 'PAPITYPE' in myfits[0].header:
-                    self.type = myfits[0].header['PAPITYPE']
+                if 'PAPITYPE' in header:
+                    self.type = header['PAPITYPE']
                 # rest of raw images
-                elif myfits[0].header[keyword_with_frame_type].lower().count('master'):
-                    self.type = myfits[0].header[keyword_with_frame_type]
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dark'):
+                elif header[keyword_with_frame_type].lower().count('master'):
+                    self.type = header[keyword_with_frame_type]
+                elif header[keyword_with_frame_type].lower().count('dark'):
                     self.type = "DARK"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('lamp off'):
+                elif header[keyword_with_frame_type].lower().count('lamp off'):
                     self.type = "DOME_FLAT_LAMP_OFF"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('lamp on'):
+                elif header[keyword_with_frame_type].lower().count('lamp on'):
                     self.type = "DOME_FLAT_LAMP_ON"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dusk'):
+                elif header[keyword_with_frame_type].lower().count('dusk'):
                     self.type = "TW_FLAT_DUSK"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dawn'):
+                elif header[keyword_with_frame_type].lower().count('dawn'):
                     self.type = "TW_FLAT_DAWN"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('sky_flat') or \
-                     myfits[0].header[keyword_with_frame_type].lower().count('flat'): 
+                elif header[keyword_with_frame_type].lower().count('sky_flat') or \
+                     header[keyword_with_frame_type].lower().count('flat'): 
                     self.type = "SKY_FLAT"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('sky'):
+                elif header[keyword_with_frame_type].lower().count('sky'):
                     self.type = "SKY"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('object'):
+                elif header[keyword_with_frame_type].lower().count('object'):
                     self.type = "SCIENCE"
                 else:
                     #By default, the image is classified as SCIENCE object
@@ -604,33 +682,33 @@ class ClFits (object):
         else: #o2000, Omegacass, Roper, etc
             try:
                 # Self-typed file, created by PAPI (master calibrations)
-                if 'PAPITYPE' in myfits[0].header:
-                    self.type = myfits[0].header['PAPITYPE']
-                elif myfits[0].header[keyword_with_frame_type].lower().count('master'):
-                    self.type = myfits[0].header[keyword_with_frame_type]
-                elif myfits[0].header[keyword_with_frame_type].lower().count('bias'):
+                if 'PAPITYPE' in header:
+                    self.type = header['PAPITYPE']
+                elif header[keyword_with_frame_type].lower().count('master'):
+                    self.type = header[keyword_with_frame_type]
+                elif header[keyword_with_frame_type].lower().count('bias'):
                     self.type = "BIAS"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dark'):
+                elif header[keyword_with_frame_type].lower().count('dark'):
                     self.type = "DARK"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('lamp off'):
+                elif header[keyword_with_frame_type].lower().count('lamp off'):
                     self.type = "DOME_FLAT_LAMP_OFF"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('lamp on'):
+                elif header[keyword_with_frame_type].lower().count('lamp on'):
                     self.type = "DOME_FLAT_LAMP_ON"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dusk'):
+                elif header[keyword_with_frame_type].lower().count('dusk'):
                     self.type = "TW_FLAT_DUSK"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('dawn'):
+                elif header[keyword_with_frame_type].lower().count('dawn'):
                     self.type = "TW_FLAT_DAWN"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('sky_flat') or \
-                     myfits[0].header[keyword_with_frame_type].lower().count('flat'): 
+                elif header[keyword_with_frame_type].lower().count('sky_flat') or \
+                     header[keyword_with_frame_type].lower().count('flat'): 
                     self.type = "SKY_FLAT"
-                elif myfits[0].header[keyword_with_frame_type].lower().count('sky'):
+                elif header[keyword_with_frame_type].lower().count('sky'):
                     self.type = "SCIENCE" #"SKY" # because we cannot group correctly; however it will be correctly detected in skyfilter
-                elif myfits[0].header[keyword_with_frame_type].lower().count('focus'):
+                elif header[keyword_with_frame_type].lower().count('focus'):
                     self.type = "FOCUS"  
-                elif myfits[0].header[keyword_with_frame_type].lower().count('science'):
+                elif header[keyword_with_frame_type].lower().count('science'):
                     self.type = "SCIENCE"
                 # CCD Roper (OSN)
-                elif myfits[0].header[keyword_with_frame_type].lower().count('light'):
+                elif header[keyword_with_frame_type].lower().count('light'):
                     self.type = "SCIENCE"
                 else:
                     #By default, the image is classified as SCIENCE object
@@ -646,33 +724,33 @@ class ClFits (object):
         # FILTER
         try:
             if self.instrument == 'hawki':
-                if 'HIERARCH ESO INS FILT1 NAME' in myfits[0].header: 
-                    self.filter = myfits[0].header['HIERARCH ESO INS FILT1 NAME']
-                elif 'HIERARCH ESO INS FILT2 NAME' in myfits[0].header: 
-                    self.filter = myfits[0].header['HIERARCH ESO INS FILT2 NAME']
-                elif 'FILTER1' in myfits[0].header:
-                    self.filter = myfits[0].header['FILTER1']
-                elif 'FILTER2' in myfits[0].header:
-                    self.filter = myfits[0].header['FILTER2']
+                if 'HIERARCH ESO INS FILT1 NAME' in header: 
+                    self.filter = header['HIERARCH ESO INS FILT1 NAME']
+                elif 'HIERARCH ESO INS FILT2 NAME' in header: 
+                    self.filter = header['HIERARCH ESO INS FILT2 NAME']
+                elif 'FILTER1' in header:
+                    self.filter = header['FILTER1']
+                elif 'FILTER2' in header:
+                    self.filter = header['FILTER2']
                 else:
                     log.warning("Cannot find out FILTER")
                     self.filter = 'UNKNOWN'
             else: # PANIC, O2000, Roper, ...
-                self.filter = myfits[0].header['FILTER']
+                self.filter = header['FILTER']
         except KeyError:
             log.warning('Cannot find out FILTER')
             self.filter  = 'UNKNOWN'
         
         # Exposition Time
         try:
-            self.exptime = myfits[0].header['EXPTIME']
+            self.exptime = header['EXPTIME']
         except KeyError:
             log.warning('EXPTIME keyword not found')
             self.exptime = -1
 
         # Integration Time
         try:
-            self.itime = myfits[0].header['ITIME']
+            self.itime = header['ITIME']
         except KeyError:
             if self.instrument == 'panic':
                 log.warning('ITIME keyword not found')
@@ -680,12 +758,12 @@ class ClFits (object):
             
         # Number of coadds
         try:
-            if 'NCOADDS' in myfits[0].header:
-                self.ncoadds = myfits[0].header['NCOADDS']
-            elif 'NDIT' in myfits[0].header:
-                self.ncoadds = myfits[0].header['NDIT']
-            elif 'HIERARCH ESO DET NDIT' in myfits[0].header:
-                self.ncoadds = myfits[0].header['HIERARCH ESO DET NDIT']
+            if 'NCOADDS' in header:
+                self.ncoadds = header['NCOADDS']
+            elif 'NDIT' in header:
+                self.ncoadds = header['NDIT']
+            elif 'HIERARCH ESO DET NDIT' in header:
+                self.ncoadds = header['HIERARCH ESO DET NDIT']
             else:
                 self.ncoadds = 1
         except KeyError:
@@ -694,8 +772,8 @@ class ClFits (object):
         
         # Number of expositions (cycle repeat count) - only PANIC/O2k
         try:
-            if 'NEXP' in myfits[0].header:
-                self.nexp = myfits[0].header['NEXP']
+            if 'NEXP' in header:
+                self.nexp = header['NEXP']
             else:
                 self.nexp = 1
         except KeyError:
@@ -706,16 +784,16 @@ class ClFits (object):
         # Read-Mode
         try:
             if self.instrument == 'panic':
-                self.readmode = myfits[0].header['READMODE']
+                self.readmode = header['READMODE']
             elif self.instrument == 'hawki':
-                self.readmode = myfits[0].header['HIERARCH ESO DET NCORRS NAME']
+                self.readmode = header['HIERARCH ESO DET NCORRS NAME']
         except KeyError:
             log.warning('READMODE keyword not found')
             self.readmode = ""
                      
         # UT-date of observation
         try:
-            self.datetime_obs = myfits[0].header['DATE-OBS']
+            self.datetime_obs = header['DATE-OBS']
             if self.datetime_obs.count('T'):
                 self.date_obs, self.time_obs = self.datetime_obs.split('T')
             else:
@@ -732,22 +810,22 @@ class ClFits (object):
         # ############################
         try:
             # WCS-coordinates are preferred than RA,DEC (both in degrees)
-            if ('CTYPE1' in myfits[0].header and
-                     'TAN' in myfits[0].header['CTYPE1']): #'RA---TAN' or 'RA---TAN--SIP'
-                m_wcs = wcs.WCS(myfits[0].header)
+            if ('CTYPE1' in header and
+                     'TAN' in header['CTYPE1']): #'RA---TAN' or 'RA---TAN--SIP'
+                m_wcs = wcs.WCS(header)
                 #self._ra, self._dec = wcs.image2sky( self.naxis1/2, self.naxis2/2, True)
                 # No SIP or Paper IV table lookup distortion correction is applied.
                 # Take as reference the coordinates of the center of the detector
-                if myfits[0].header['NAXIS'] == 2:
+                if header['NAXIS'] == 2:
                     self._ra = m_wcs.wcs_pix2world([[self.naxis1 / 2, self.naxis2 / 2]], 1)[0][0]
                 else:
                     self._ra = m_wcs.wcs_pix2world([[self.naxis1 / 2, self.naxis2 / 2, 1]], 1)[0][0]
                 log.debug("Read RA-WCS coordinate =%s", self._ra)
-            elif 'RA' in myfits[0].header:
-                self._ra = myfits[0].header['RA'] # degrees supposed
-            elif 'OBJCTRA' in myfits[0].header:
+            elif 'RA' in header:
+                self._ra = header['RA'] # degrees supposed
+            elif 'OBJCTRA' in header:
                 # Mainly for Roper CCDs
-                a = myfits[0].header['OBJCTRA']
+                a = header['OBJCTRA']
                 self._ra = float(a.split()[0]) + float(a.split()[1])/60.0 + float(a.split()[2])/3600.0
                 # convert to degrees                
                 self._ra = self._ra * 360.0 / 24.0
@@ -765,20 +843,20 @@ class ClFits (object):
         # ############################
         try:
             # WCS-coordinates are preferred than RA,DEC
-            if ('CTYPE2' in myfits[0].header and
-                     'TAN' in myfits[0].header['CTYPE2']): #=='DEC--TAN' or 'DEC--TAN--SIP'
-                m_wcs = wcs.WCS(myfits[0].header)
+            if ('CTYPE2' in header and
+                     'TAN' in header['CTYPE2']): #=='DEC--TAN' or 'DEC--TAN--SIP'
+                m_wcs = wcs.WCS(header)
                 #self._ra, self._dec = wcs.image2sky( self.naxis1/2, self.naxis2/2, True)
                 # No SIP or Paper IV table lookup distortion correction is applied.
-                if myfits[0].header['NAXIS'] == 2:
+                if header['NAXIS'] == 2:
                     self._dec = m_wcs.wcs_pix2world([[self.naxis1 / 2, self.naxis2 / 2]], 1)[0][1]
                 else:
                     self._dec = m_wcs.wcs_pix2world([[self.naxis1 / 2, self.naxis2 / 2, 1]], 1)[0][1]
                 log.debug("Read Dec-WCS coordinate =%s", self._dec)
-            elif 'DEC' in myfits[0].header:
-                self._dec = myfits[0].header['DEC']
-            elif 'OBJCTDEC' in myfits[0].header:
-                a = myfits[0].header['OBJCTDEC']
+            elif 'DEC' in header:
+                self._dec = header['DEC']
+            elif 'OBJCTDEC' in header:
+                a = header['OBJCTDEC']
                 if a.split()[0][0]=='-':
                     self._dec = (-1.0) * float(a.split()[0]) + float(a.split()[1])/60.0 + float(a.split()[2])/3600.0
                     self._dec*=-1.0
@@ -795,35 +873,35 @@ class ClFits (object):
 
         # EQUINOX
         try:
-            self.equinox = myfits[0].header['EQUINOX']
+            self.equinox = header['EQUINOX']
         except KeyError:
             #log.debug("EQUINOX keyword not found")
             self.equinox = -1
             
         # MJD-Modified julian date 'days' of observation
         try:
-            self.mjd = myfits[0].header['MJD-OBS']
+            self.mjd = header['MJD-OBS']
         except KeyError:
             log.warning('MJD-OBS keyword not found')
             self.mjd  = -1
            
         # OBJECT
         try:
-            self.object = myfits[0].header['OBJECT']
+            self.object = header['OBJECT']
         except KeyError:
             log.warning('OBJECT keyword not found')
             self.object  = ''   
         
         # CHIPCODE
         try:
-            self.chipcode = myfits[0].header['CHIPCODE']
+            self.chipcode = header['CHIPCODE']
         except KeyError:
             self.chipcode = 1  # default
         
         # DetectorID
         try:
-            if self.instrument=='hawki' and 'HIERARCH ESO DET CHIP NAME' in myfits[0].header:
-                self.detectorID = myfits[0].header['HIERARCH ESO DET CHIP NAME']
+            if self.instrument=='hawki' and 'HIERARCH ESO DET CHIP NAME' in header:
+                self.detectorID = header['HIERARCH ESO DET CHIP NAME']
             elif self.instrument=='panic':
                 self.detectorID = 'HAWAII-2RG'
             else:
@@ -837,16 +915,16 @@ class ClFits (object):
         
         # OB_ID : Observation Block Id
         try:
-            if self.instrument == 'hawki' and 'HIERARCH ESO OBS ID' in myfits[0].header:
-                self.obID = myfits[0].header['HIERARCH ESO OBS ID']
+            if self.instrument == 'hawki' and 'HIERARCH ESO OBS ID' in header:
+                self.obID = header['HIERARCH ESO OBS ID']
             elif self.instrument == 'omega2000':
-                self.obID = myfits[0].header['POINT_NO'] # for O2000
+                self.obID = header['POINT_NO'] # for O2000
             elif self.instrument == 'panic':
                 # check how was observed
                 if self.obs_tool:
-                    self.obID = myfits[0].header['OB_ID'] # for PANIC using OT
+                    self.obID = header['OB_ID'] # for PANIC using OT
                 else:
-                    self.obID = myfits[0].header['POINT_NO'] # for PANIC using MIDAS or whatever
+                    self.obID = header['POINT_NO'] # for PANIC using MIDAS or whatever
             else:
                 self.obID = -1
         except Exception as e:
@@ -856,14 +934,14 @@ class ClFits (object):
         # OB_PAT : Observation Block Pattern
         try:
             if self.instrument == 'hawki':
-                self.obPat = myfits[0].header['HIERARCH ESO TPL ID']
+                self.obPat = header['HIERARCH ESO TPL ID']
             elif self.instrument == 'omega2000':
-                self.obPat = myfits[0].header['POINT_NO'] # for O2000
+                self.obPat = header['POINT_NO'] # for O2000
             elif self.instrument == 'panic':
                 if self.obs_tool:
-                    self.obPat = myfits[0].header['OB_PAT'] # for PANIC using OT
+                    self.obPat = header['OB_PAT'] # for PANIC using OT
                 else:
-                    self.obPat = myfits[0].header['POINT_NO'] # for PANIC using MIDAS or whatever
+                    self.obPat = header['POINT_NO'] # for PANIC using MIDAS or whatever
             else:
                 self.obPat = -1
         except Exception as e:
@@ -873,14 +951,14 @@ class ClFits (object):
         #PAT_EXPN : Pattern Exposition Number (expono of noexp)
         try:
             if self.instrument == 'hawki':
-                self.pat_expno = myfits[0].header['HIERARCH ESO TPL EXPNO']
+                self.pat_expno = header['HIERARCH ESO TPL EXPNO']
             elif self.instrument == 'omega2000':
-                self.pat_expno = myfits[0].header['DITH_NO']
+                self.pat_expno = header['DITH_NO']
             elif self.instrument == 'panic':
                 if self.obs_tool:
-                    self.pat_expno = myfits[0].header['PAT_EXPN'] # for PANIC using OT
+                    self.pat_expno = header['PAT_EXPN'] # for PANIC using OT
                 else:
-                    self.pat_expno = myfits[0].header['DITH_NO'] # for PANIC using MIDAS or whatever
+                    self.pat_expno = header['DITH_NO'] # for PANIC using MIDAS or whatever
             else:
                 self.pat_expno = -1
         except Exception as e:
@@ -890,12 +968,12 @@ class ClFits (object):
         #PAT_NEXP : Number of Expositions of Pattern (expono of noexp)
         try:
             if self.instrument == 'hawki':
-                self.pat_noexp = myfits[0].header['HIERARCH ESO TPL NEXP']
+                self.pat_noexp = header['HIERARCH ESO TPL NEXP']
             elif self.instrument == 'omega2000':
                 self.pat_noexp = -1 # not available
             elif self.instrument == 'panic':
                 if self.obs_tool:
-                    self.pat_noexp = myfits[0].header['PAT_NEXP'] # for PANIC using OT
+                    self.pat_noexp = header['PAT_NEXP'] # for PANIC using OT
                 else:
                     # we could try to parse OBJECT key
                     self.pat_noexp = -1 # for PANIC using MIDAS or whatever
@@ -909,29 +987,29 @@ class ClFits (object):
         # Has no sense, because file is not opened with 'update' flag
         try:
             if self.instrument == 'omega2000':
-                myfits[0].header.update('PRESS1', 0.0)
-                myfits[0].header.update('PRESS2', 0.0)
+                header.update('PRESS1', 0.0)
+                header.update('PRESS2', 0.0)
         except Exception as e:
             log.warning("Keyword not found : %s ->", str(e))
 
 
         # Telescope
-        if 'TELESCOPE' in myfits[0].header:
-            self.telescope = myfits[0].header['TELESCOPE']
+        if 'TELESCOPE' in header:
+            self.telescope = header['TELESCOPE']
         else:
             self.telescope = "unknown"
         
         # Binning 
-        if 'BINNING' in myfits[0].header:
-            self.binning = int(myfits[0].header['BINNING'])
-        elif 'XBINNING' in myfits[0].header:
-            self.binning = int(myfits[0].header['XBINNING'])
+        if 'BINNING' in header:
+            self.binning = int(header['BINNING'])
+        elif 'XBINNING' in header:
+            self.binning = int(header['XBINNING'])
         else:
             self.binning = 1
 
         # Pixel scale (updated with binning factor)
-        if 'PIXSCALE' in myfits[0].header:
-            self.pix_scale = float(myfits[0].header['PIXSCALE']) * self.binning
+        if 'PIXSCALE' in header:
+            self.pix_scale = float(header['PIXSCALE']) * self.binning
         else:
             if self.instrument == 'omega2000':
                 self.pix_scale = 0.45 * self.binning
@@ -947,18 +1025,6 @@ class ClFits (object):
                 # default scale ?
                 self.pix_scale = 0.45 * self.binning
 
-        # 
-        # Close the file. Some updates can be done (PRESS1, ...) but it mustn't
-        #            
-        try:
-            myfits.close(output_verify='ignore')
-        except Exception as e:
-            log.error("Error while closing FITS file %s   : %s",
-                      self.pathname, str(e))
-        
-        #log.debug("End of FITS recognition: %s"%self.pathname)
-        
-
     def print_info(self):
         print("---------------------------------")
         print("Fichero   : ", self.pathname)
@@ -37,10 +37,10 @@ import copy
 import fileinput
 import glob
 import datetime as dt
-import time
 
 # PAPI modules
 from papi.datahandler.clfits import ClFits
+from papi.misc.check_complete import CompletenessChecker
 from papi.misc.paLog import log
 
         
@@ -96,6 +96,14 @@ class DataCollector (object):
         self.pend_to_read = {}
         self._n_retries_ = 50
 
+        # Check of the files still being saved (by GEIRS); in 'dir' mode,
+        # the close-write events of the source directory are used if
+        # available.
+        if mode == "dir" and os.path.isdir(source):
+            self.checker = CompletenessChecker(source)
+        else:
+            self.checker = CompletenessChecker()
+
         # Some flags
         self.stop = False
     
@@ -154,7 +162,9 @@ class DataCollector (object):
         Sort out input data files by MJD
         
         NOTE 1: this routine takes into account whether a file is still being saved
-        and then try to read it again later upto '_n_retries_' times.
+        and then try to read it again in the next look-ups, upto '_n_retries_' 
+        times. The files still being saved are not returned, so they are
+        found again as new files next time.
 
         NOTE 2: be careful, it could be a heavy routine    
         """
@@ -164,13 +174,15 @@ class DataCollector (object):
             # filter out files already detected as bad files
             if file not in self.bad_files_found:
                 try:
+                    if not self.checker.isComplete(file):
+                        raise IOError("Error, file %s still being saved " % file)
                     fits = ClFits(file, check_integrity=True)
                 except IOError as e:
-                    # ClFits can raise and IOError exception if geirs_save is still running
+                    # File still being saved (or ClFits cannot read it yet);
+                    # it will be checked again in the next look-up (no wait)
                     if file in self.pend_to_read:
                         if self.pend_to_read[file] < self._n_retries_:
                             self.pend_to_read[file] = self.pend_to_read[file] + 1
-                            time.sleep(1)
                         else:
                             # definitely, file is discarted
                             self.bad_files_found.append(file)
@@ -178,12 +190,12 @@ class DataCollector (object):
                             print("[__sortFilesMJD] Definitely file %s , is discarted"%(file))
                     else:
                         self.pend_to_read[file] = 1
-                        time.sleep(0.5)
                 except Exception as e:
                     print("[__sortFilesMJD] Error reading file %s , skipped..." %(file))
                     print(str(e))
                     self.bad_files_found.append(file)      
                 else:
+                    self.pend_to_read.pop(file, None)
                     dataset.append((file, fits.getMJD()))
 
         dataset = sorted(dataset, key=lambda data_file: data_file[1])          
@@ -12,6 +12,7 @@
 # 14/04/2009  : added ra,dec fields 
 # 25/05/2009  : added object field to DB
 # 31/03/2010  : added source as a file_list containing the list files
+# 19/10/2026  : added readmode field
 ################################################################################
 
 # Import required modules
@@ -39,7 +40,7 @@ class DataSet(object):
     ############################################################
     TABLE_COLUMNS = "(id, run_id, ob_id, ob_pat, expn, nexp, filename, date, \
                     ut_time, mjd, type, filter, texp, ra, dec, object, detector_id, \
-                    crepeat, ncoadds, itime)"
+                    crepeat, ncoadds, itime, readmode)"
                     # ncoadds can be diff from crepeat; if crepeat = ncoadds, then 
                     # coaddition was done.
                 
@@ -165,7 +166,7 @@ class DataSet(object):
                 filename, fitsf.date_obs, fitsf.time_obs, fitsf.mjd, fitsf.type, 
                 fitsf.filter, fitsf.exptime, fitsf.ra, fitsf.dec, fitsf.object,
                 fitsf.detectorID,
-                fitsf.nexp, fitsf.ncoadds, fitsf.itime)
+                fitsf.nexp, fitsf.ncoadds, fitsf.itime, fitsf.readmode)
         
         #print "dataDB_tuple = ", data
          
@@ -176,7 +177,7 @@ class DataSet(object):
             (self.instrument == fitsf.getInstrument().lower())):
             try:
                 cur.execute("insert into dataset" + DataSet.TABLE_COLUMNS +
-                            "values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", data)
+                            "values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", data)
                 self.con.commit()
     
             except sqlite.DatabaseError as e:
@@ -1055,6 +1056,29 @@ class DataSet(object):
             raise
         
             
+    ############################################################    
+    def GetTable(self, columns):
+        """
+        Query the given columns of all the files of the dataset.
+
+        Parameters
+        ----------
+        columns: list
+            Names of the columns (see TABLE_COLUMNS), e.g. ['filename', 'mjd']
+
+        Returns
+        -------
+        A list of tuples with the values of the columns, one per file.
+        """
+
+        try:
+            cur = self.con.cursor()
+            cur.execute("select %s from dataset" % ", ".join(columns))
+            return cur.fetchall()
+        except sqlite.DatabaseError:
+            log.exception("Error in DataSet.GetTable function...")
+            raise
+
     ############################################################    
     def ListDataSet(self):
         """
@@ -0,0 +1,396 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# framecatalog.py
+#
+# Compact in-memory catalog of the metadata of a set of frames (type, filter,
+# exposure times, readout mode, shape, ...), kept as a NumPy structured array
+# with one row per frame.
+#
+# The values are read once from the header cards of each frame (see
+# ClFits.recognizeHeader and fitsaccess.get_cards), so the ClFits objects
+# are not re-created (and the files not re-opened) each time a value of a
+# frame is needed, and the checks over a list of frames (same filter, same
+# exposure time, all darks, ...) are a few array comparisons.
+#
+# A row is read again when the size or the modification time of its file
+# changed since it was loaded.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import threading
+
+import numpy
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc.fitsaccess import get_cards, get_shape
+from papi.misc.utils import parallelMap
+from papi.datahandler.clfits import ClFits, HEADER_KEYWORDS
+
+
+__all__ = ['FrameCatalog', 'FRAME_DTYPE']
+
+# Columns of the catalog
+FRAME_DTYPE = numpy.dtype([
+    ('filename', 'O'),
+    ('type', 'O'),
+    ('filter', 'O'),
+    ('exptime', 'f8'),
+    ('itime', 'f8'),
+    ('ncoadds', 'i4'),
+    ('nexp', 'i4'),
+    ('readmode', 'O'),
+    ('instrument', 'O'),
+    ('mjd', 'f8'),
+    ('date_obs', 'O'),
+    ('ra', 'f8'),
+    ('dec', 'f8'),
+    ('object', 'O'),
+    ('ob_id', 'O'),
+    ('ob_pat', 'O'),
+    ('pat_expno', 'O'),
+    ('pat_noexp', 'O'),
+    ('mef', '?'),
+    ('next', 'i4'),
+    ('naxis1', 'i4'),
+    ('naxis2', 'i4'),
+    ('naxis3', 'i4'),
+    ('pix_scale', 'f8'),
+    ('h4rg', '?'),
+    ('size', 'i8'),
+    ('mtime', 'f8'),
+])
+
+# Values of 'type' of each class of frames (see ClFits.isXXX methods)
+DOME_FLAT_TYPES = ('DOME_FLAT_LAMP_ON', 'DOME_FLAT_LAMP_OFF', 'DOME_FLAT')
+TW_FLAT_TYPES = ('TW_FLAT_DUSK', 'TW_FLAT_DAWN', 'TW_FLAT', 'SKY_FLAT')
+MASTER_FLAT_TYPES = ('MASTER_DOME_FLAT', 'MASTER_TW_FLAT', 'MASTER_SKY_FLAT')
+
+# Number of files from which the headers are read concurrently
+MIN_FILES_PARALLEL = 16
+
+
+def _float(value):
+
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return -1.0
+
+
+def readFrame(filename):
+    """
+    Read the catalog row of a frame from its header cards only (no integrity
+    check and no data read).
+
+    Returns
+    -------
+    A tuple with the values of the columns of FRAME_DTYPE.
+
+    Raises
+    ------
+    IOError
+        The file cannot be read or it is not a FITS file.
+    """
+
+    st = os.stat(filename)
+    header = get_cards(filename, HEADER_KEYWORDS)
+    f = ClFits(filename, check_integrity=False, header=header)
+
+    if f.isMEF():
+        # all the extensions are supposed to have the same shape
+        shape = get_shape(filename, 1) if f.getNExt() > 0 else ()
+    else:
+        shape = f.shape
+    shape = (0,) * (3 - len(shape)) + tuple(shape)
+
+    return (filename, f.type, f.getFilter(), _float(f.expTime()),
+            _float(f.getItime()), int(f.getNcoadds()), int(f.nexp),
+            f.getReadMode(), f.getInstrument(), _float(f.getMJD()),
+            f.getDateTimeObs(), _float(f.ra), _float(f.dec), f.object,
+            f.getOBId(), f.getOBPat(), f.getExpNo(), f.getNoExp(),
+            f.isMEF(), f.getNExt(), shape[2], shape[1], shape[0],
+            _float(f.pixScale), f.is_panic_h4rg, st.st_size, st.st_mtime)
+
+
+class FrameCatalog(object):
+    """
+    Catalog of the metadata of a set of frames, one row per frame.
+
+    The methods taking a list of files load the files not yet in the catalog
+    (or changed since they were loaded), and return arrays in the same order
+    as the list, so they can be combined with numpy operations, e.g.::
+
+        cat = FrameCatalog()
+        darks = numpy.array(files)[cat.isDark(files) & (cat.column(files, 'exptime') == 10)]
+    """
+
+    def __init__(self, files=None, n_workers=1):
+        """
+        Parameters
+        ----------
+        files: list
+            Files to be loaded in the catalog (more files can be loaded later)
+        n_workers: int
+            Number of concurrent header reads for large lists of files
+        """
+
+        self.n_workers = n_workers
+        self._rows = numpy.zeros(0, dtype=FRAME_DTYPE)
+        self._index = {}
+        self._lock = threading.Lock()
+
+        if files:
+            self.load(files)
+
+    def __getstate__(self):
+        # the catalog is pickled with the ReductionSet sent to the
+        # multiprocessing Pool, but locks cannot be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, filename):
+        return filename in self._index
+
+    def _isStale(self, filename):
+
+        idx = self._index.get(filename)
+        if idx is None:
+            return True
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return True
+        row = self._rows[idx]
+
+        return st.st_size != row['size'] or st.st_mtime != row['mtime']
+
+    def load(self, files):
+        """
+        Read the rows of the files not yet in the catalog, or modified since
+        they were loaded.
+
+        Raises
+        ------
+        IOError
+            Some file cannot be read (the other files are loaded anyway)
+        """
+
+        to_read = [f for f in dict.fromkeys(files) if self._isStale(f)]
+        if not to_read:
+            return
+
+        n_workers = self.n_workers if len(to_read) >= MIN_FILES_PARALLEL else 1
+        results = parallelMap(self._tryRead, [(f,) for f in to_read], n_workers)
+
+        failed = []
+        with self._lock:
+            new_rows = []
+            for filename, row in zip(to_read, results):
+                if row is None:
+                    failed.append(filename)
+                elif filename in self._index:
+                    self._rows[self._index[filename]] = row
+                else:
+                    self._index[filename] = len(self._rows) + len(new_rows)
+                    new_rows.append(row)
+            if new_rows:
+                self._rows = numpy.concatenate(
+                    (self._rows, numpy.array(new_rows, dtype=FRAME_DTYPE)))
+
+        if failed:
+            raise IOError("Cannot read the header of the files: %s" % failed)
+
+    @staticmethod
+    def _tryRead(filename):
+
+        try:
+            return readFrame(filename)
+        except Exception as e:
+            log.error("Cannot read frame %s : %s" % (filename, str(e)))
+            return None
+
+    def rows(self, files):
+        """
+        Return the rows (structured array) of the given files, in the same
+        order as the list.
+        """
+
+        self.load(files)
+        return self._rows[[self._index[f] for f in files]]
+
+    def row(self, filename):
+        """
+        Return the row (numpy.void, fields by name) of a single file.
+        """
+
+        return self.rows([filename])[0]
+
+    def column(self, files, name):
+        """
+        Return the values of a column for the given files.
+        """
+
+        return self.rows(files)[name]
+
+    def shape(self, filename):
+        """
+        Return the shape of the (extensions of the) frame, as ClFits.shape.
+        """
+
+        row = self.row(filename)
+        if row['naxis3'] > 0:
+            return (int(row['naxis3']), int(row['naxis2']), int(row['naxis1']))
+        return (int(row['naxis2']), int(row['naxis1']))
+
+    # Predicates; each one returns a boolean array with a value per file
+    # (see the ClFits methods with the same name)
+
+    def _typeIn(self, files, types):
+        return numpy.isin(self.column(files, 'type'), types)
+
+    def isDark(self, files):
+        return self._typeIn(files, ('DARK',))
+
+    def isDomeFlat(self, files):
+        return self._typeIn(files, DOME_FLAT_TYPES)
+
+    def isTwFlat(self, files):
+        return self._typeIn(files, TW_FLAT_TYPES)
+
+    def isSky(self, files):
+        return self._typeIn(files, ('SKY',))
+
+    def isFocusSerie(self, files):
+        return self._typeIn(files, ('FOCUS',))
+
+    def isMasterDark(self, files):
+        return self._typeIn(files, ('MASTER_DARK',))
+
+    def isMasterDarkModel(self, files):
+        return self._typeIn(files, ('MASTER_DARK_MODEL',))
+
+    def isMasterFlat(self, files):
+        return self._typeIn(files, MASTER_FLAT_TYPES)
+
+    def isScience(self, files):
+        types = self.column(files, 'type').astype(str)
+        return ((numpy.char.find(types, 'SCIENCE') >= 0) |
+                (numpy.char.find(types, 'STD') >= 0))
+
+    def isObject(self, files):
+        return self.isScience(files)
+
+    def isPANICFullFrame(self, files):
+        rows = self.rows(files)
+        return ((rows['instrument'] == 'panic') & (rows['naxis1'] == 4096) &
+                (rows['naxis2'] == 4096) & ~rows['h4rg'])
+
+    def getType(self, files, distinguish_domeflat=True):
+        """
+        Return the types of the files, as ClFits.getType().
+        """
+
+        types = self.column(files, 'type').copy()
+        if distinguish_domeflat:
+            types[numpy.isin(types, DOME_FLAT_TYPES)] = 'DOME_FLAT'
+        return types
+
+    def mismatch(self, files, names, reference=None):
+        """
+        Look for the files whose values of the given columns differ from the
+        ones of the reference file.
+
+        Parameters
+        ----------
+        files: list
+            Files to check
+        names: list
+            Columns to compare, in order
+        reference: str
+            File with the reference values; the first file by default
+
+        Returns
+        -------
+        A tuple (column, list of files) with the first column (in the order
+        of 'names') for which some files do not match the reference, or
+        None if all the files match.
+        """
+
+        if not files:
+            return None
+
+        rows = self.rows(files)
+        ref = self.row(reference) if reference else rows[0]
+        for name in names:
+            bad = rows[name] != ref[name]
+            if bad.any():
+                return name, list(numpy.array(files, dtype=object)[bad])
+
+        return None
+
+    def same(self, files, names):
+        """
+        Tells whether all the files have the same values of the given columns.
+        """
+
+        return self.mismatch(files, names) is None
+
+    def groupBy(self, files, name):
+        """
+        Group the files by the values of a column.
+
+        Returns
+        -------
+        A list of tuples (value, list of files), sorted by value, with the
+        files of each group in the same order as in the input list.
+        """
+
+        values = self.column(files, name)
+        groups = {}
+        for filename, value in zip(files, values):
+            groups.setdefault(value, []).append(filename)
+
+        return sorted(groups.items(), key=lambda item: item[0])
+
+    def sortByMJD(self, files):
+        """
+        Return the files sorted by MJD.
+        """
+
+        order = numpy.argsort(self.column(files, 'mjd'), kind='stable')
+        return [files[i] for i in order]
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# check_complete.py
+#
+# Tells whether a FITS file is completely written (e.g. by GEIRS), without
+# spawning any external process (see check_open.py):
+#
+#   - the headers of all the HDUs must be complete (END card found);
+#   - the file must be as long as the size given by the headers (BITPIX,
+#     NAXISn, PCOUNT, GCOUNT), and have all the extensions announced by
+#     NEXTEND, if any;
+#   - the file must not be changing: its size and mtime are the same as in the
+#     previous look-up, or it was not modified in the last 'settle_time'
+#     seconds, or a close-write event was received for it (Linux inotify,
+#     only if the optional 'inotify_simple' module is installed).
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import time
+
+# PAPI modules
+from papi.misc.paLog import log
+
+# Close-write events (optional)
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+__all__ = ['fits_expected_size', 'check_complete', 'CompletenessChecker']
+
+# FITS layout
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+
+def _read_header(fd):
+    """
+    Read a header from the current position of the file.
+
+    Returns
+    -------
+    A tuple (header size in bytes, dict of the values of the keywords needed
+    to compute the size of the data), or None if the header is not complete.
+    """
+
+    values = {}
+    size = 0
+    while True:
+        block = fd.read(BLOCK_SIZE)
+        if len(block) < BLOCK_SIZE:
+            return None
+        size += BLOCK_SIZE
+        for i in range(0, BLOCK_SIZE, CARD_SIZE):
+            key = block[i:i + 8].rstrip()
+            if key == b'END':
+                return size, values
+            if key in (b'BITPIX', b'NAXIS', b'PCOUNT', b'GCOUNT', b'NEXTEND') \
+                    or key.startswith(b'NAXIS'):
+                value = block[i + 10:i + CARD_SIZE].split(b'/')[0].strip()
+                try:
+                    values[key.decode()] = int(value)
+                except ValueError:
+                    pass
+
+
+def fits_expected_size(filename):
+    """
+    Compute the size of a FITS file from its headers.
+
+    Returns
+    -------
+    The expected size in bytes (data units padded to 2880 bytes blocks, as
+    required by astropy to read the file with data integrity), or None if
+    any header of the file is not complete yet, or an extension announced
+    by NEXTEND is missing.
+
+    Raises
+    ------
+    ValueError
+        The file is not a FITS file
+    IOError
+        The file cannot be read
+    """
+
+    file_size = os.path.getsize(filename)
+    offset = 0
+    n_ext = -1
+    next_expected = None
+
+    with open(filename, 'rb') as fd:
+        if fd.read(6) != b'SIMPLE':
+            raise ValueError("%s is not a FITS file" % filename)
+        fd.seek(0)
+
+        while True:
+            header = _read_header(fd)
+            if header is None:
+                return None
+            header_size, values = header
+            if n_ext < 0:
+                next_expected = values.get('NEXTEND')
+            n_ext += 1
+
+            data_size = 0
+            naxis = values.get('NAXIS', 0)
+            if naxis > 0:
+                data_size = 1
+                for i in range(1, naxis + 1):
+                    data_size *= values.get('NAXIS%d' % i, 0)
+                data_size = abs(values.get('BITPIX', 8)) // 8 * \
+                            values.get('GCOUNT', 1) * \
+                            (values.get('PCOUNT', 0) + data_size)
+
+            end = offset + header_size + data_size
+            padded = end + (-end % BLOCK_SIZE)
+            if padded >= file_size:
+                if padded > file_size:
+                    return None
+                if next_expected is not None and n_ext < next_expected:
+                    return None
+                return padded
+
+            # next HDU
+            offset = padded
+            fd.seek(offset)
+            if fd.read(8) != b'XTENSION':
+                # not an extension (trailing bytes): nothing more to wait for
+                return padded
+            fd.seek(offset)
+
+
+def check_complete(filename, settle_time=0.0):
+    """
+    Tells whether a FITS file is completely written, i.e., its headers are
+    complete, it is as long as given by its headers, and it was not modified
+    in the last 'settle_time' seconds.
+    """
+
+    try:
+        if fits_expected_size(filename) is None:
+            return False
+        if settle_time > 0:
+            return time.time() - os.path.getmtime(filename) >= settle_time
+        return True
+    except (IOError, OSError) as e:
+        log.debug("Cannot check file %s: %s" % (filename, str(e)))
+        return False
+
+
+class CompletenessChecker(object):
+    """
+    Check whether the files of a directory (e.g. written by GEIRS) are
+    completely written, to be used each time the directory is looked up for
+    new files.
+    """
+
+    def __init__(self, directory=None, settle_time=0.5):
+        """
+        Parameters
+        ----------
+        directory: str
+            If given (and the 'inotify_simple' module is available), the
+            close-write events of the files of the directory are watched, so
+            they are taken as complete as soon as they are closed.
+        settle_time: float
+            Seconds without modification after which a file with the expected
+            size is taken as complete (if it was not seen unchanged or closed
+            before).
+        """
+
+        self.directory = directory
+        self.settle_time = settle_time
+        self._closed = set()
+        self._last_stat = {}
+        self._inotify = None
+
+        if directory and INotify is not None:
+            try:
+                self._inotify = INotify()
+                self._inotify.add_watch(directory,
+                                        flags.CLOSE_WRITE | flags.MOVED_TO)
+            except OSError as e:
+                log.warning("Cannot watch directory %s: %s" % (directory, str(e)))
+                self._inotify = None
+
+    def _readEvents(self):
+
+        if self._inotify is not None:
+            for event in self._inotify.read(timeout=0):
+                self._closed.add(os.path.abspath(
+                                 os.path.join(self.directory, event.name)))
+
+    def isComplete(self, filename):
+        """
+        Tells whether the file is completely written.
+        """
+
+        self._readEvents()
+
+        path = os.path.abspath(filename)
+        try:
+            if fits_expected_size(path) is None:
+                return False
+            st = os.stat(path)
+        except (IOError, OSError, ValueError) as e:
+            log.debug("Cannot check file %s: %s" % (filename, str(e)))
+            return False
+
+        if path in self._closed:
+            self._closed.discard(path)
+            self._last_stat.pop(path, None)
+            return True
+
+        last = self._last_stat.get(path)
+        current = (st.st_size, st.st_mtime)
+        if last == current or time.time() - st.st_mtime >= self.settle_time:
+            self._last_stat.pop(path, None)
+            return True
+
+        self._last_stat[path] = current
+        return False
+
+    def close(self):
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
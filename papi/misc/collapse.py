@@ -27,13 +27,15 @@ import sys
 import os
 import astropy.io.fits as fits
 import fileinput
+import multiprocessing
 import numpy
 
 from papi.misc.paLog import log
+from papi.misc import fitsaccess
 from papi.misc.version import __version__
 
 
-def collapse(frame_list, out_dir="/tmp", mean=False, start=0, end=-1):
+def collapse(frame_list, out_dir="/tmp", mean=False, start=0, end=-1, ncpus=1):
     """
     Collapse (add them up arithmetically) a (list) of data cubes into a single 
     2D image. Files can be MEF or Single.
@@ -57,143 +59,221 @@ def collapse(frame_list, out_dir="/tmp", mean=False, start=0, end=-1):
               say start=0, end=1
               - if we want to collapse only the first plane (not really a collapse),
               we should say start=0, end=0
+        ncpus: int, optional
+            Number of processes used to collapse the files of the list in 
+            parallel; default 1 (serial).
 
 
         Returns
         -------
         Return a list with the new collapsed frames. If no collapse is required, file
         will be created as well.
+
+        Notes
+        -----
+        Cubes are read plane by plane (only the planes in [start, end]) and 
+        accumulated in float64, so that peak memory is about two planes
+        instead of the whole cube.
     """
 
     log.debug("Starting collapse() method ....")
     
-    new_frame_list = [] 
-    n = 0
-
     if not frame_list or len(frame_list) == 0 or not frame_list[0]:
         return []
 
-    for frame_i in frame_list:
-        f = fits.open(frame_i)
-        if mean:
-            t_filename = out_dir + "/" + os.path.basename(frame_i).replace(".fits", "_avg.fits")
-        else:
-            t_filename = out_dir + "/" + os.path.basename(frame_i).replace(".fits", "_coadd.fits")
-        
-        # First, we need to check if we have MEF files
-        if len(f) > 1 and len(f[1].data.shape) == 3:
-            try:
-                log.info("Collapsing a MEF cube %s" % frame_i)
-                out = collapse_mef_cube(frame_i, t_filename, mean, start, end)
-                new_frame_list.append(out)
-            except Exception as e:
-                log.error("Some error collapsing MEF cube: %s" % str(e))
-                f.close()
-                raise e
-        elif len(f) > 1 and len(f[1].data.shape)==2:
-            log.debug("MEF file has no cubes, no collapse required.")
-            # shutil.copyfile(frame_i, t_filename)
-            new_frame_list.append(frame_i)
-        elif len(f[0].data.shape) != 3:  # 2D !
-            log.debug("It is not a FITS-cube image, no collapse required")
-            # shutil.copyfile(frame_i, t_filename)
-            new_frame_list.append(frame_i)
-        else:            
-            # Suppose we have single CUBE file with N planes
-            out_hdulist = fits.HDUList()
-            if mean:
-                log.debug("Averaging data cube...from %s to %s" %(start, end))
-                if end != -1:
-                    prihdu = fits.PrimaryHDU(data = f[0].data[start:end + 1, :, :].mean(0), header=f[0].header)
-                else:
-                    # up to the last plane
-                    prihdu = fits.PrimaryHDU(data = f[0].data[start:, :, :].mean(0), header=f[0].header)
-            else:
-                log.debug("Adding data cube...from %s to %s" %(start, end))
-                if end != -1:               
-                    prihdu = fits.PrimaryHDU(data=f[0].data[start:end + 1, :, :].sum(0), header=f[0].header)
-                else:
-                    prihdu = fits.PrimaryHDU(data=f[0].data[start:, :, :].sum(0), header=f[0].header)
-
-            prihdu.scale('float32') 
-            # Updating PRIMARY header keywords...
-            prihdu.header.set('NCOADDS', f[0].data.shape[0])
-            if mean:
-                prihdu.header.set('EXPTIME', f[0].header['EXPTIME'])
-            else:
-                prihdu.header.set('EXPTIME', f[0].header['EXPTIME'] * f[0].data.shape[0])                
-            prihdu.header.set('PAPIVERS', __version__, "PANIC Pipeline version")
-            # Weird case (OmegaCass), but it produce a fail with WCS lib
-            if 'CTYPE3' in prihdu.header:
-                prihdu.header.remove("CTYPE3")
-            if 'CRPIX3' in prihdu.header:
-                prihdu.header.remove("CRPIX3")
-            if 'CRVAL3' in prihdu.header:
-                prihdu.header.remove("CRVAL3")
-            if 'CDELT3' in prihdu.header:
-                prihdu.header.remove("CDELT3")
-            
-            out_hdulist.append(prihdu)    
-            # out_hdulist.verify ('ignore')
-            # Now, write the new collapsed file
-            out_hdulist.writeto(t_filename, output_verify='ignore',
-                                 overwrite=True)
-            
-            out_hdulist.close(output_verify='ignore')
-            del out_hdulist
-            new_frame_list.append(t_filename)
-            log.info("FITS file %s created" % (new_frame_list[n]))
-            n += 1
-        # always
-        f.close()
+    # A daemonic process (i.e., a worker of a Pool) is not allowed to have
+    # children, so in that case the collapse is always serial.
+    if (ncpus is None or ncpus <= 1 or len(frame_list) == 1 or
+            multiprocessing.current_process().daemon):
+        return [collapse_frame(frame_i, out_dir, mean, start, end) 
+                for frame_i in frame_list]
+
+    log.debug("Collapsing %d files with %d processes" % (len(frame_list), ncpus))
+    pool = multiprocessing.Pool(processes=min(ncpus, len(frame_list)))
+    try:
+        result = pool.map_async(unwrap_collapse_frame,
+                                [(frame_i, out_dir, mean, start, end) 
+                                 for frame_i in frame_list])
+        new_frame_list = result.get()
+    except Exception as e:
+        log.error("Some error collapsing files: %s" % str(e))
+        pool.terminate()
+        raise e
+    finally:
+        # Prevents any more tasks from being submitted to the pool, 
+        # and wait for the worker processes to exit
+        pool.close()
+        pool.join()
      
     return new_frame_list
 
 
-def collapse_mef_cube(inputfile, out_filename=None, mean=False, start=0, end=-1):
+def unwrap_collapse_frame(arg):
     """
-    Collapse each of the extensions of a MEF file
+    Helper for the process pool of collapse(); Pool.map_async() only 
+    passes one argument.
     """
 
-    f = fits.open(inputfile)
+    return collapse_frame(*arg)
 
-    out_hdulist = fits.HDUList()
-    prihdu = fits.PrimaryHDU (data = None, header = f[0].header)
-    prihdu.header.set('NCOADDS', f[1].data.shape[0])
+
+def collapse_frame(frame_i, out_dir="/tmp", mean=False, start=0, end=-1):
+    """
+    Collapse a single file (MEF or Single); see collapse().
+
+    Returns
+    -------
+    The filename of the collapsed file, or the input filename if no collapse
+    is required (not a cube).
+    """
+
+    if mean:
+        t_filename = out_dir + "/" + os.path.basename(frame_i).replace(".fits", "_avg.fits")
+    else:
+        t_filename = out_dir + "/" + os.path.basename(frame_i).replace(".fits", "_coadd.fits")
+
+    # Only the headers are read to find out the kind of file
+    with fitsaccess.fits_open(frame_i) as f:
+        n_hdu = len(f)
+        naxis_0 = f[0].header['NAXIS']
+        naxis_1 = f[1].header['NAXIS'] if n_hdu > 1 else 0
+    
+    # First, we need to check if we have MEF files
+    if n_hdu > 1 and naxis_1 == 3:
+        try:
+            log.info("Collapsing a MEF cube %s" % frame_i)
+            return collapse_mef_cube(frame_i, t_filename, mean, start, end)
+        except Exception as e:
+            log.error("Some error collapsing MEF cube: %s" % str(e))
+            raise e
+    elif n_hdu > 1 and naxis_1 == 2:
+        log.debug("MEF file has no cubes, no collapse required.")
+        # shutil.copyfile(frame_i, t_filename)
+        return frame_i
+    elif naxis_0 != 3:  # 2D !
+        log.debug("It is not a FITS-cube image, no collapse required")
+        # shutil.copyfile(frame_i, t_filename)
+        return frame_i
+
+    # Suppose we have single CUBE file with N planes
     if mean:
-        prihdu.header.set('EXPTIME', f[0].header['EXPTIME'])
+        log.debug("Averaging data cube...from %s to %s" %(start, end))
     else:
-        prihdu.header.set('EXPTIME', f[0].header['EXPTIME']*f[1].data.shape[0])
+        log.debug("Adding data cube...from %s to %s" %(start, end))
+
+    with fitsaccess.fits_open(frame_i) as f:
+        data, n_planes = collapse_planes(f[0], mean, start, end)
+        prihdu = fits.PrimaryHDU(data=data, header=f[0].header.copy())
+
+    out_hdulist = fits.HDUList()
+    prihdu.scale('float32') 
+    # Updating PRIMARY header keywords...
+    prihdu.header.set('NCOADDS', n_planes)
+    if not mean:
+        prihdu.header.set('EXPTIME', prihdu.header['EXPTIME'] * n_planes)
     prihdu.header.set('PAPIVERS', __version__, "PANIC Pipeline version")
+    # Weird case (OmegaCass), but it produce a fail with WCS lib
+    if 'CTYPE3' in prihdu.header:
+        prihdu.header.remove("CTYPE3")
+    if 'CRPIX3' in prihdu.header:
+        prihdu.header.remove("CRPIX3")
+    if 'CRVAL3' in prihdu.header:
+        prihdu.header.remove("CRVAL3")
+    if 'CDELT3' in prihdu.header:
+        prihdu.header.remove("CDELT3")
+    
     out_hdulist.append(prihdu)    
- 
-    # Sum each extension
-    for ext in range(1,len(f)):
-        if mean:
-            log.debug("Averaging MEF data cube...from %s to %s" %(start, end))
-            if end !=-1:
-                hdu = fits.ImageHDU(data=numpy.float32(f[ext].data[start:end + 1, :, :].mean(0)),
-                            header=f[ext].header)
-            else:
-                hdu = fits.ImageHDU(data=numpy.float32(f[ext].data[start:, :, :].mean(0)),
-                            header=f[ext].header)
-        else:
-            log.debug("Adding MEF data cube...from %s to %s" %(start, end))
-            if end !=-1:
-                hdu = fits.ImageHDU(data=numpy.float32(f[ext].data[start:end + 1, :, :].sum(0)),
-                            header=f[ext].header)
+    # out_hdulist.verify ('ignore')
+    # Now, write the new collapsed file
+    out_hdulist.writeto(t_filename, output_verify='ignore',
+                         overwrite=True)
+    
+    out_hdulist.close(output_verify='ignore')
+    del out_hdulist
+    log.info("FITS file %s created" % (t_filename))
+
+    return t_filename
+
+
+def collapse_planes(hdu, mean=False, start=0, end=-1):
+    """
+    Collapse the planes [start, end] of a cube HDU reading one plane each 
+    time (HDU.section), with float64 accumulation.
+
+    Parameters
+    ----------
+    hdu: ImageHDU or PrimaryHDU
+        HDU with a 3D data cube
+    mean: bool
+        If True, the mean of the planes is computed instead of the sum
+    start: int
+        First plane to use
+    end: int
+        Last plane (included) to use, -1 means the last plane
+
+    Returns
+    -------
+    A tuple (data, n_planes) with the float32 collapsed image and the number 
+    of planes used.
+    """
+
+    n_total = hdu.header['NAXIS3']
+    if end == -1 or end >= n_total:
+        last = n_total
+    else:
+        last = end + 1
+    # negative start, as in python slicing
+    first = start if start >= 0 else max(n_total + start, 0)
+    n_planes = last - first
+    if n_planes < 1:
+        msg = "Wrong range of planes [%s, %s] for a cube of %d planes" % (start, end, n_total)
+        log.error(msg)
+        raise Exception(msg)
+
+    acc = numpy.zeros((hdu.header['NAXIS2'], hdu.header['NAXIS1']), 
+                      dtype=numpy.float64)
+    for i in range(first, last):
+        acc += hdu.section[i, :, :]
+
+    if mean:
+        acc /= n_planes
+
+    return acc.astype(numpy.float32), n_planes
+
+
+def collapse_mef_cube(inputfile, out_filename=None, mean=False, start=0, end=-1):
+    """
+    Collapse each of the extensions of a MEF file
+    """
+
+    with fitsaccess.fits_open(inputfile) as f:
+        out_hdulist = fits.HDUList()
+        prihdu = fits.PrimaryHDU (data = None, header = f[0].header.copy())
+        out_hdulist.append(prihdu)    
+        n_total = f[1].header['NAXIS3']
+     
+        # Sum each extension, plane by plane
+        for ext in range(1,len(f)):
+            if mean:
+                log.debug("Averaging MEF data cube...from %s to %s" %(start, end))
             else:
-                hdu = fits.ImageHDU(data=numpy.float32(f[ext].data[start:, :, :].sum(0)),
-                            header=f[ext].header)
-        #hdu.scale('float32') --> bug con astropy 1.3 !!! 
-        out_hdulist.append(hdu)    
+                log.debug("Adding MEF data cube...from %s to %s" %(start, end))
+            data, n_planes = collapse_planes(f[ext], mean, start, end)
+            hdu = fits.ImageHDU(data=data, header=f[ext].header.copy())
+            #hdu.scale('float32') --> bug con astropy 1.3 !!! 
+            out_hdulist.append(hdu)    
+
+    prihdu.header.set('NCOADDS', n_planes)
+    if not mean:
+        prihdu.header.set('EXPTIME', prihdu.header['EXPTIME'] * n_planes)
+    prihdu.header.set('PAPIVERS', __version__, "PANIC Pipeline version")
     
     # Now, write the new collapsed file
     if out_filename is None:
         if mean:
-            outfile = inputfile.replace(".fits", "_avg_%s.fits" % str(f[1].data.shape[0]).zfill(3))
+            outfile = inputfile.replace(".fits", "_avg_%s.fits" % str(n_total).zfill(3))
         else:
-            outfile = inputfile.replace(".fits", "_coadd_%s.fits" % str(f[1].data.shape[0]).zfill(3))
+            outfile = inputfile.replace(".fits", "_coadd_%s.fits" % str(n_total).zfill(3))
     else:
         outfile = out_filename 
     out_hdulist.writeto(outfile, output_verify='ignore', overwrite=True)
@@ -222,10 +302,10 @@ def collapse_distinguish(frame_list, out_filename="/tmp/collapsed.fits"):
     for frame_i in frame_list:
         f = fits.open(frame_i)
         # First, we need to check if we have MEF files
-        if len(f)>1 and len(f[1].data.shape)==3:
+        if len(f)>1 and f[1].header['NAXIS']==3:
             log.error("MEF-cubes files cannot be collapsed. First need to be split !")
             raise Exception("MEF-cubes files cannot be collapsed. First need to be split !")
-        elif len(f)>1 and len(f[1].data.shape)==2:
+        elif len(f)>1 and f[1].header['NAXIS']==2:
             log.error("Not implemented yet.")
             raise Exception("MEF-2D files cannot be collapsed. Not implemented yet.")
             ## TO BE COMPLETED !!! ##
@@ -237,7 +317,7 @@ def collapse_distinguish(frame_list, out_filename="/tmp/collapsed.fits"):
                 header1 = f[0].header
             for i in range(len(f)):
                 sum[i] += f[i+1].data
-        elif len(f)==1 and len(f[0].data.shape)==2:
+        elif len(f)==1 and f[0].header['NAXIS']==2:
             log.debug("Found a 2D-image: %s:"%frame_i)
             new_frame_list.append(frame_i)
             if len(new_frame_list)==1:
@@ -289,13 +369,13 @@ def create_cube(frame_list, out_filename="/tmp/cube.fits"):
     for frame_i in frame_list:
         f = fits.open(frame_i)
         # First, we need to check if we have MEF files
-        if len(f) > 1 and len(f[1].data.shape) == 3:
+        if len(f) > 1 and f[1].header['NAXIS'] == 3:
             log.error("MEF-cubes files cannot be converted to cubes. First need to be split !")
             raise Exception("MEF-cubes files cannot be converted to cubes. First need to be split !")
-        elif len(f)>1 and len(f[1].data.shape)==2:
+        elif len(f)>1 and f[1].header['NAXIS']==2:
             log.error("Not implemented yet.")
             raise Exception("MEF-2D files cannot be converted to a cube. Not implemented yet.")
-        elif len(f)==1 and len(f[0].data.shape)==2:
+        elif len(f)==1 and f[0].header['NAXIS']==2:
             log.debug("Found a 2D-image: %s:" % frame_i)
             new_frame_list.append(frame_i)
             if len(new_frame_list) == 1:
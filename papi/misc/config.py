@@ -424,6 +424,9 @@ def read_config_file(config_file = default_config_file()):
     general["remove_crosstalk"] = read_parameter(config, "general", "remove_crosstalk", bool, False, config_file)
     general["remove_cosmic_ray"] = read_parameter(config, "general", "remove_cosmic_ray", bool, False, config_file)
     general["purge_output"] = read_parameter(config, "general", "purge_output", bool, False, config_file)
+    product_cache = read_parameter(config, "general", "product_cache", bool, False, config_file)
+    general["product_cache"] = False if product_cache is None else product_cache
+    general["cache_dir"] = read_parameter(config, "general", "cache_dir", str, False, config_file)
     general["estimate_fwhm"] = read_parameter(config, "general", "estimate_fwhm", bool, False, config_file)
     
     
@@ -443,6 +446,7 @@ def read_config_file(config_file = default_config_file()):
     general["verbose"] = read_parameter(config, "general", "verbose", bool, False, config_file)
     
     general["mosaic_engine"] = read_parameter(config, "general", "mosaic_engine", str, False, config_file)
+    general["coadd_engine"] = read_parameter(config, "general", "coadd_engine", str, False, config_file)
     
     
     filter_prefix = "filter_name_"
@@ -629,6 +633,9 @@ def read_config_file(config_file = default_config_file()):
     astrometry["satur_level"] = read_parameter(config, "astrometry", "satur_level", int, False, config_file)
     astrometry["catalog"] = read_parameter(config, "astrometry", "catalog", str, True, config_file)
     astrometry["engine"] = read_parameter(config, "astrometry", "engine", str, True, config_file)
+    astrometry["wcs_cache_dir"] = read_parameter(config, "astrometry", "wcs_cache_dir", str, False, config_file)
+    wcs_cache_radius = read_parameter(config, "astrometry", "wcs_cache_radius", float, False, config_file)
+    astrometry["wcs_cache_radius"] = 0.25 if wcs_cache_radius is None else wcs_cache_radius
     
     options["astrometry"] = astrometry  
     
@@ -662,6 +669,13 @@ def read_config_file(config_file = default_config_file()):
     quicklook["output_dir"] = read_parameter(config, "quicklook", "output_dir", str, True, config_file)
     quicklook["temp_dir"] = read_parameter(config, "quicklook", "temp_dir", str, True, config_file)    
     quicklook["run_mode"] = read_parameter(config, "quicklook", "run_mode", str, True, config_file)        
+    # number of concurrent QL jobs and preemption of lower priority ones 
+    quicklook["max_jobs"] = read_parameter(config, "quicklook", "max_jobs", int, False, config_file) or 2
+    preempt = read_parameter(config, "quicklook", "preempt", bool, False, config_file)
+    quicklook["preempt"] = True if preempt is None else preempt
+    # incremental reduction of the dither sequences in Lazy mode
+    incremental = read_parameter(config, "quicklook", "incremental", bool, False, config_file)
+    quicklook["incremental"] = True if incremental is None else incremental
 
     options["quicklook"] = quicklook
 
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# fitsaccess.py
+#
+# Central access point to FITS files for the reduction chain.
+#
+# Full H4RG frames are 4k x 4k float32 (64 MB per plane), and many steps only
+# need a header, the shape or a sub-window of them. The helpers below:
+#
+#   - open files memory-mapped whenever the on-disk layout allows it (i.e.,
+#     not compressed), so only the pages actually touched are read;
+#   - read headers and shapes without materializing the data unit;
+#   - read windows or single planes of a cube through HDU.section, so only
+#     the requested rows are read (and scaled, if BZERO/BSCALE are present);
+#   - guarantee that the file is closed once the data has been read.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+from contextlib import contextmanager
+
+import numpy
+import astropy.io.fits as fits
+
+# PAPI modules
+from papi.misc.paLog import log
+
+
+__all__ = ['can_memmap', 'fits_open', 'get_header', 'get_cards', 'get_shape',
+           'get_next', 'get_window', 'get_data', 'iter_planes']
+
+# Extensions of files that cannot be memory-mapped by astropy
+_COMPRESSED = ('.gz', '.bz2', '.zip', '.z', '.fz')
+
+# FITS header layout
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+
+def can_memmap(filename):
+    """
+    Tells whether the file can be opened memory-mapped, i.e., it is not
+    a compressed (gzip, bzip2, zip, fpack) file.
+    """
+
+    return not filename.lower().endswith(_COMPRESSED)
+
+
+@contextmanager
+def fits_open(filename, mode='readonly', memmap=None, **kwargs):
+    """
+    Context manager to open a FITS file, memory-mapped if possible, that
+    guarantees the file is closed on exit.
+
+    Parameters
+    ----------
+    filename: str
+        FITS filename to open
+    mode: str
+        Open mode, as in astropy.io.fits.open()
+    memmap: bool
+        Use memory-mapping; if None, it is used whenever the file layout
+        allows it (astropy itself falls back to normal reads for scaled
+        data, i.e., BZERO/BSCALE/BLANK).
+    kwargs:
+        Other keywords passed to astropy.io.fits.open()
+
+    Returns
+    -------
+    The HDUList object (to be used inside a 'with' statement).
+
+    Notes
+    -----
+    Arrays obtained from a memory-mapped HDU are only valid inside the
+    'with' block; use get_data() or get_window() to get a detached copy.
+    """
+
+    if memmap is None and not can_memmap(filename):
+        memmap = False
+    kwargs.setdefault('ignore_missing_end', True)
+
+    hdulist = fits.open(filename, mode=mode, memmap=memmap, **kwargs)
+    try:
+        yield hdulist
+    finally:
+        hdulist.close()
+
+
+def get_header(filename, ext=0):
+    """
+    Return the header of the given extension, without reading the data unit.
+    """
+
+    with fits_open(filename) as hdulist:
+        return hdulist[ext].header.copy()
+
+
+def get_cards(filename, keywords):
+    """
+    Return a header with only the given cards of the primary header.
+
+    The header blocks are scanned straight from the file and only the
+    selected cards are parsed, so it is much faster than get_header() when
+    a few values of many files are needed (e.g. log-sheets, catalogs).
+    Compressed files are read with get_header().
+
+    Parameters
+    ----------
+    filename: str
+        FITS filename
+    keywords: set
+        Names of the keywords to read (HIERARCH ones with the 'HIERARCH'
+        prefix, e.g. 'HIERARCH ESO DET NDIT')
+
+    Raises
+    ------
+    IOError
+        The file is not a FITS file, or the header is not complete
+    """
+
+    if not can_memmap(filename):
+        header = get_header(filename)
+        return fits.Header([card for card in header.cards
+                            if card.keyword in keywords or
+                            'HIERARCH ' + card.keyword in keywords])
+
+    cards = []
+    selected = False
+    with open(filename, 'rb') as fd:
+        block = fd.read(BLOCK_SIZE)
+        if not block.startswith(b'SIMPLE'):
+            raise IOError("%s is not a FITS file" % filename)
+        while len(block) == BLOCK_SIZE:
+            for i in range(0, BLOCK_SIZE, CARD_SIZE):
+                card = block[i:i + CARD_SIZE].decode('ascii', 'replace')
+                key = card[:8].rstrip()
+                if key == 'END':
+                    return fits.Header.fromstring(''.join(cards))
+                if key == 'CONTINUE':
+                    # rest of a long string value (of the previous card)
+                    if selected:
+                        cards.append(card)
+                    continue
+                if key == 'HIERARCH':
+                    key = card.split('=', 1)[0].strip()
+                selected = key in keywords
+                if selected:
+                    cards.append(card)
+            block = fd.read(BLOCK_SIZE)
+
+    raise IOError("Header missing END card: %s" % filename)
+
+
+def get_next(filename):
+    """
+    Return the number of HDUs of the file, without reading any data unit.
+    """
+
+    with fits_open(filename) as hdulist:
+        return len(hdulist)
+
+
+def get_shape(filename, ext=0):
+    """
+    Return the shape (numpy order, i.e., [NAXIS3,] NAXIS2, NAXIS1) of the
+    data in the given extension, read from the header keywords only.
+    """
+
+    header = get_header(filename, ext)
+    naxis = header.get('NAXIS', 0)
+
+    return tuple(header['NAXIS%d' % i] for i in range(naxis, 0, -1))
+
+
+def get_window(filename, window, ext=0, dtype=None):
+    """
+    Read a sub-window of an image (or of a cube) without reading the full
+    data unit.
+
+    Parameters
+    ----------
+    filename: str
+        FITS filename
+    window: tuple of slices
+        Window in numpy order, e.g. (slice(y1, y2), slice(x1, x2)) or
+        numpy.s_[y1:y2, x1:x2]
+    ext: int or str
+        Extension number or name
+    dtype: numpy dtype
+        If given, the window is returned with this data type
+
+    Returns
+    -------
+    A numpy array (detached from the file) with the requested window.
+    """
+
+    with fits_open(filename) as hdulist:
+        data = hdulist[ext].section[window]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        # section already returns a copy, except for some trivial cases
+        return numpy.array(data, copy=True) if _is_mapped(data) else data
+
+
+def get_data(filename, ext=0, dtype=None, copy=True):
+    """
+    Read the full data unit of an extension.
+
+    Parameters
+    ----------
+    filename: str
+        FITS filename
+    ext: int or str
+        Extension number or name
+    dtype: numpy dtype
+        If given, the data is returned with this data type
+    copy: bool
+        If True (default), a detached copy is returned and the file is closed;
+        if False, the (read-only) memory-mapped array is returned, which keeps
+        the file mapped while it is referenced.
+
+    Returns
+    -------
+    A numpy array with the data of the extension.
+    """
+
+    with fits_open(filename) as hdulist:
+        data = hdulist[ext].data
+        if data is None:
+            return None
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        if copy and _is_mapped(data):
+            data = numpy.array(data, copy=True)
+        return data
+
+
+def iter_planes(filename, ext=0, start=0, end=None):
+    """
+    Generator that yields, one by one, the 2D planes [start, end) of a
+    data cube, reading only one plane each time.
+
+    Parameters
+    ----------
+    filename: str
+        FITS filename
+    ext: int or str
+        Extension number or name
+    start: int
+        First plane (0-index)
+    end: int
+        Last plane (not included); if None, the last plane of the cube.
+
+    Returns
+    -------
+    Each plane (2D numpy array) of the cube.
+    """
+
+    with fits_open(filename) as hdulist:
+        hdu = hdulist[ext]
+        if hdu.header.get('NAXIS', 0) != 3:
+            msg = "Expected a data cube in %s[%s]" % (filename, ext)
+            log.error(msg)
+            raise Exception(msg)
+
+        if end is None:
+            end = hdu.header['NAXIS3']
+        for i in range(start, end):
+            yield hdu.section[i, :, :]
+
+
+def _is_mapped(data):
+    """
+    Tells whether the array (or its base) is a view on a memory-mapped file.
+    """
+
+    base = data
+    while base is not None:
+        if isinstance(base, numpy.memmap) or type(base).__name__ == 'mmap':
+            return True
+        base = getattr(base, 'base', None)
+
+    return False
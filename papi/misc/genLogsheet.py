@@ -6,10 +6,12 @@
 # genLogsheet.py
 #
 # Created    : 09/12/2009    jmiguel@iaa.es
-# Last update: 09/12/2009    
+# Last update: 19/10/2026    jmiguel@iaa.es
+#              Header-only and parallel reading of the frames, CSV, FITS-table
+#              and HTML output formats.
 #
 # TODO
-#  
+#
 ################################################################################
 
 ################################################################################
@@ -17,27 +19,75 @@
 
 import os
 import sys
+import csv
+import html
 import fileinput
+import multiprocessing
 from datetime import datetime
 import argparse
 
+import astropy.io.fits as fits
+
 # Interact with FITS files
-from papi.datahandler.clfits import ClFits
+from papi.datahandler.clfits import ClFits, HEADER_KEYWORDS
+from papi.misc.fitsaccess import get_cards
 from papi.misc.paLog import log
 
 
+# Columns of the log sheet
+COLUMNS = ("ID", "Filename", "Filter", "Type", "RA", "Dec", "TEXP", "NCOADDS",
+           "ITIME", "READMODE", "DATE_OBS")
+
+# Columns of the DataSet DB with the values of the log sheet columns
+DB_COLUMNS = ["filename", "filter", "type", "ra", "dec", "texp", "ncoadds",
+              "itime", "readmode", "date", "ut_time"]
+
+# Output formats (by filename extension)
+FORMATS = {'.txt': 'txt', '.csv': 'csv', '.fits': 'fits', '.fit': 'fits',
+           '.html': 'html', '.htm': 'html'}
+
+# Below this number of files, they are read in the calling process
+MIN_FILES_PARALLEL = 64
+
+
+def readFrame(filename):
+    """
+    Read the log sheet values of a frame from its header only (no integrity
+    check and no data read).
+
+    Returns
+    -------
+    A tuple (filename, filter, type, ra, dec, texp, ncoadds, itime,
+    readmode, date_obs), or None if the file cannot be read.
+    """
+
+    try:
+        header = get_cards(filename, HEADER_KEYWORDS)
+        f = ClFits(filename, check_integrity=False, header=header)
+        return (filename, f.getFilter(), f.getType(), f.ra, f.dec,
+                f.expTime(), f.getNcoadds(), f.getItime(), f.getReadMode(),
+                f.getDateTimeObs())
+    except Exception as e:
+        log.warning("Unexpected error reading file : `%s`. Skipped ! (%s)"
+                    % (filename, str(e)))
+        return None
+
+
 class LogSheet (object):
     """
-    \brief Class used to build a log sheet from a set of FITS files 
-    
+    \brief Class used to build a log sheet from a set of FITS files
+
     \par Class:
         LogSheet
     \par Purpose:
         Create a log sheet from a set of FITS files
     \par Description:
-            
+        Only the header cards needed are read, in parallel for large sets of
+        files; the values of the files already loaded in a DataSet are taken
+        from its DB. The log sheet can be written as text (default), CSV,
+        FITS table or HTML.
     \par Language:
-        PyRaf
+        Python
     \param file_list
         A list FITS files or directory
     \param output_filename
@@ -46,34 +96,88 @@ class LogSheet (object):
         If no error
     \author
         JMIbannez, IAA-CSIC
-        
+
     """
-    def __init__(self, file_list, output_filename="/tmp/logsheet.txt", 
-                 rows=None, remove_head=False, *a, **k):
+    def __init__(self, file_list, output_filename="/tmp/logsheet.txt",
+                 rows=None, remove_head=False, out_format=None, dataset=None,
+                 n_workers=None, *a, **k):
         """
         @summary: init method for the LogSheet class
-        
+
         @param file_list: list of files to be sorted out
         @param output_filename: filename where the sorted table will write out
-        @param remove_head: if True, the head of the file will no be printed out 
+        @param remove_head: if True, the head of the file will no be printed out
         @param rows: the range of rows in the sorted table to be printed out
-          
+        @param out_format: 'txt', 'csv', 'fits' or 'html'; if None, it is
+            given by the extension of output_filename (default, 'txt')
+        @param dataset: a loaded DataSet; the values of its files are taken
+            from its DB instead of reading the files again
+        @param n_workers: number of processes used to read the files; if
+            None, the number of CPUs
+
         """
-        
+
         super (LogSheet, self).__init__ (*a,**k)
-        
+
         self.__file_list=file_list
         self.__output_filename = output_filename  # full filename (path+filename)
         self.rows = rows
         self.remove_head = remove_head
-        
+        if out_format is None:
+            ext = os.path.splitext(output_filename)[1].lower()
+            out_format = FORMATS.get(ext, 'txt')
+        if out_format not in FORMATS.values():
+            raise Exception("Unknown log sheet format: %s" % out_format)
+        self.out_format = out_format
+        self.dataset = dataset
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+
+    def read(self, filelist):
+        """
+        Read the log sheet values of the given files.
+
+        Returns
+        -------
+        The list of the values (see readFrame()) of the files read, sorted
+        by DATE-OBS (and filename, for frames with the same DATE-OBS).
+        """
+
+        frames = []
+
+        # Files already loaded in the DataSet
+        if self.dataset is not None:
+            in_db = {}
+            for row in self.dataset.GetTable(DB_COLUMNS):
+                date_obs = row[9] + 'T' + row[10] if row[10] else row[9]
+                in_db[row[0]] = tuple(row[:9]) + (date_obs,)
+            frames = [in_db[f] for f in filelist if f in in_db]
+            filelist = [f for f in filelist if f not in in_db]
+            log.debug("%d files found in DataSet" % len(frames))
+
+        # The rest of files, from their headers
+        if len(filelist) < MIN_FILES_PARALLEL or self.n_workers < 2:
+            frames += map(readFrame, filelist)
+        else:
+            chunksize = max(1, len(filelist) // (self.n_workers * 4))
+            pool = multiprocessing.Pool(processes=self.n_workers)
+            try:
+                frames += pool.map(readFrame, filelist, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+
+        frames = [f for f in frames if f is not None]
+        frames.sort(key=lambda f: (f[9], f[0]))
+
+        return frames
+
     def create(self):
-      
+
+        """
+        @summary:  Create a log sheet file from a set of FITS files
         """
-        @summary:  Create a log sheet text file from a set of FITS files
-        """   
         log.debug("Start createLogSheet")
-        
+
         # STEP 0:Get the user-defined list of frames
         if type(self.__file_list) == type([]):
             filelist = self.__file_list
@@ -86,62 +190,107 @@ class LogSheet (object):
         else:
             log.error("Source file type unknown ...")
             return None
-        
-        # STEP 1: Create the logsheet text file
-        logsheet = open(self.__output_filename,"w")
-        if not self.remove_head:    
-            logsheet.write("#-------------------------------------------------------------------------\n")
-            logsheet.write("#LOG SHEET created on %s (sorted by DATE_OBS)\n" %(datetime.now()))
-            logsheet.write("#-------------------------------------------------------------------------\n") 
-            logsheet.write('#%4s  %-32s  %-12s    %-20s  %-12s  %-12s  %-10s  %-10s  %-10s %-20s %-20s\n' % (" ID", "Filename", "Filter", "Type", "RA", "Dec", "TEXP", "NCOADDS","ITIME","READMODE", "DATE_OBS"))
-            logsheet.write("#-------------------------------------------------------------------------------------------------------------------------------------------------------------------\n") 
-        
-        # STEP 2: Sort out the files
-        id = 0
-        sorted_list = {}
-        for file in filelist:
-            try:
-                fitsf = ClFits(file)
-                sorted_list[fitsf.getDateTimeObs()] = fitsf
-            except:
-                log.warning("Unexpected error reading file : `%s`. Skipped !" %file)
-                
-        keys = sorted(sorted_list)
-        
-        if self.rows != None:
-            min = self.rows[0]
-            max = self.rows[1]
+
+        # STEP 1: Read and sort out the files
+        frames = self.read(filelist)
+
+        if self.rows is not None:
+            frames = frames[self.rows[0]:self.rows[1] + 1]
+            for id, f in enumerate(frames, self.rows[0]):
+                print('%4d  %-32s  %-12s  %-20s  %-12f  %-12f  %-10f  %-10d  %-10f  %-20s  %-20s'
+                      % ((id, os.path.basename(f[0])) + f[1:]))
+
+        # STEP 2: Write the logsheet file
+        if self.out_format == 'csv':
+            self._writeCSV(frames)
+        elif self.out_format == 'fits':
+            self._writeFITS(frames)
+        elif self.out_format == 'html':
+            self._writeHTML(frames)
         else:
-            min = 0
-            max = len(keys)
-
-        print("KEYS=", keys)
-        for key in keys:
-            if self.rows is None:  # show all the data
-                f = sorted_list[key]
-                logsheet.write('%4d  %-32s  %-12s  %-20s  %-12f  %-12f  %-10f  %-10d  %-10f  %-20s  %-20s\n' % 
-                    (id, f.pathname, f.getFilter(), f.getType(), f.ra, f.dec, f.expTime(), 
-                        f.getNcoadds(), f.getItime(), f.getReadMode(), f.getDateTimeObs()) )
-            elif id >= min and id <= max:
-                f = sorted_list[key]
-                logsheet.write('%s\n' % (f.pathname))
-                print('%4d  %-32s  %-12s  %-20s  %-12f  %-12f  %-10f  %-10d  %-10f  %-20s  %-20s'\
-                    % (id, os.path.basename(f.filename), f.getFilter(), f.getType(), 
-                       f.ra, f.dec, f.expTime(), f.getNcoadds(), f.getItime(),  f.getReadMode(),\
-                       f.getDateTimeObs()))
-                
-            id +=1
-                         
-        logsheet.close()
+            self._writeText(frames)
+
         log.debug('Saved logsheet to %s' , self.__output_filename)
-        
+
         return self.__output_filename
-    
+
+    def _writeText(self, frames):
+
+        lines = []
+        if not self.remove_head:
+            lines.append("#-------------------------------------------------------------------------\n")
+            lines.append("#LOG SHEET created on %s (sorted by DATE_OBS)\n" %(datetime.now()))
+            lines.append("#-------------------------------------------------------------------------\n")
+            lines.append('#%4s  %-32s  %-12s    %-20s  %-12s  %-12s  %-10s  %-10s  %-10s %-20s %-20s\n' % (" ID", "Filename", "Filter", "Type", "RA", "Dec", "TEXP", "NCOADDS","ITIME","READMODE", "DATE_OBS"))
+            lines.append("#-------------------------------------------------------------------------------------------------------------------------------------------------------------------\n")
+
+        if self.rows is None:  # show all the data
+            for id, f in enumerate(frames):
+                lines.append('%4d  %-32s  %-12s  %-20s  %-12f  %-12f  %-10f  %-10d  %-10f  %-20s  %-20s\n'
+                             % ((id,) + f))
+        else:
+            lines += ['%s\n' % f[0] for f in frames]
+
+        with open(self.__output_filename, "w") as logsheet:
+            logsheet.writelines(lines)
+
+    def _writeCSV(self, frames):
+
+        first = self.rows[0] if self.rows is not None else 0
+        with open(self.__output_filename, "w", newline='') as logsheet:
+            writer = csv.writer(logsheet)
+            if not self.remove_head:
+                writer.writerow(COLUMNS)
+            for id, f in enumerate(frames, first):
+                writer.writerow((id,) + f)
+
+    def _writeFITS(self, frames):
+
+        first = self.rows[0] if self.rows is not None else 0
+        values = list(zip(*frames)) if frames else [()] * (len(COLUMNS) - 1)
+
+        def str_format(column):
+            return "%dA" % max([1] + [len(str(v)) for v in column])
+
+        formats = ['J', str_format(values[0]), str_format(values[1]),
+                   str_format(values[2]), 'D', 'D', 'D', 'J', 'D',
+                   str_format(values[8]), str_format(values[9])]
+        columns = [fits.Column(name="ID", format='J',
+                               array=list(range(first, first + len(frames))))]
+        for name, fmt, column in zip(COLUMNS[1:], formats[1:], values):
+            if fmt.endswith('A'):
+                column = [str(v) for v in column]
+            columns.append(fits.Column(name=name.upper(), format=fmt,
+                                       array=column))
+
+        hdu = fits.BinTableHDU.from_columns(columns)
+        hdu.header['EXTNAME'] = 'LOGSHEET'
+        hdu.header.add_comment("LOG SHEET created on %s (sorted by DATE_OBS)"
+                               % datetime.now())
+        hdu.writeto(self.__output_filename, overwrite=True)
+
+    def _writeHTML(self, frames):
+
+        first = self.rows[0] if self.rows is not None else 0
+        lines = ["<html>\n<head><title>Log sheet</title></head>\n<body>\n"]
+        if not self.remove_head:
+            lines.append("<h3>LOG SHEET created on %s (sorted by DATE_OBS)</h3>\n"
+                         % datetime.now())
+        lines.append("<table border=\"1\">\n<tr>%s</tr>\n"
+                     % "".join("<th>%s</th>" % c for c in COLUMNS))
+        for id, f in enumerate(frames, first):
+            lines.append("<tr>%s</tr>\n" % "".join(
+                "<td>%s</td>" % html.escape(str(v)) for v in (id,) + f))
+        lines.append("</table>\n</body>\n</html>\n")
+
+        with open(self.__output_filename, "w") as logsheet:
+            logsheet.writelines(lines)
+
     def show (self):
         # To be completed
-        os.system("cat %s" % (self.__output_filename))
-        pass
-                
+        if self.out_format in ('txt', 'csv'):
+            os.system("cat %s" % (self.__output_filename))
+
 ################################################################################
 # main
 ################################################################################
@@ -150,24 +299,36 @@ def main(arguments=None):
     # Get and check command-line options
 
     parser = argparse.ArgumentParser(description=desc)
-    
+
     parser.add_argument("-v", "--verbose",
                   action="store_true", dest="verbose", default=True,
                   help="verbose mode [default]")
-    
+
     parser.add_argument("-s", "--source",
                   action="store", dest="source_file_list",
                   help="Source file list of data frames. It can be a file or directory name.")
-    
+
     parser.add_argument("-o", "--output file for logsheet",
                   action="store", dest="output_filename", type=str,
                   default="/tmp/files.txt",
                   help="write output logsheet to specified file (default=%(default)s)")
-    
+
+    parser.add_argument("-f", "--format",
+                  action="store", dest="out_format", default=None,
+                  choices=sorted(set(FORMATS.values())),
+                  help="format of the output logsheet; by default, given by "
+                  "the extension of the output file (.csv, .fits, .html) "
+                  "or text")
+
+    parser.add_argument("-n", "--ncpus",
+                  action="store", dest="ncpus", type=int, default=None,
+                  help="number of processes used to read the files "
+                  "(default: number of CPUs)")
+
     parser.add_argument("-d", "--display",
                   action="store_true", dest="show", default=True,
                   help="show result on screen (stdout)")
-    
+
     parser.add_argument("-r", "--rows", nargs=2,
                   action="store", dest="rows", type=int,
                   help="show only filenames the range of rows specified (0 to N")
@@ -176,18 +337,19 @@ def main(arguments=None):
                   action="store_true", dest="filenames_only", default=False,
                   help="Only print out the filenames")
 
-    options = parser.parse_args()
-    
+    options = parser.parse_args(arguments)
+
     # args is the leftover positional arguments after all options have been processed
     if not options.source_file_list or not options.output_filename:
         parser.print_help()
         parser.error("incorrect number of arguments " )
     if options.verbose:
         print("reading %s ..." % options.source_file_list)
-    
-    
-    logsheet = LogSheet(options.source_file_list, options.output_filename, 
-                        options.rows, options.filenames_only)
+
+
+    logsheet = LogSheet(options.source_file_list, options.output_filename,
+                        options.rows, options.filenames_only,
+                        options.out_format, n_workers=options.ncpus)
     logsheet.create()
 
     if options.show:
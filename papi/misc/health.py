@@ -42,18 +42,19 @@ import sys
 import itertools
 import tempfile
 import os
+import multiprocessing
+from contextlib import ExitStack
 
 import numpy
 import math
-import astropy.io.fits as fits
 import matplotlib.pyplot as plt
             
 
 # PAPI modules
 from papi.misc.paLog import log
 from papi.misc.utils import *
-import papi.misc.robust as robust
 from papi.misc.print_table import print_table
+from papi.misc import fitsaccess
 
 
 
@@ -154,7 +155,7 @@ def stack_frames(file_of_frames, type_comb, f_from, f_to, outframe, sigmaframe,
             
     
 def run_health_check ( input_file, packet_size, f_from, f_to,  window='full-frame',
-                        out_filename="/tmp/hc_out.pdf", temp_dir="/tmp"):
+                        out_filename="/tmp/hc_out.pdf", temp_dir=None, ncpus=None):
     """ 
     Takes a input catalog (ascii file) listing all the files (flat_fields) to 
     be used in the gain and noise computation. 
@@ -179,8 +180,16 @@ def run_health_check ( input_file, packet_size, f_from, f_to,  window='full-fram
         |  Q1  | Q2  |
         |----- |-----|
         
+        For MEF files, window must be a detector (Q1, Q2, Q3, Q4), and the 
+        corresponding extension is used.
+        
     out_filename: str
         filename where results will be saved
+    temp_dir: str
+        deprecated, ignored; no intermediate stack files are written
+    ncpus: int
+        number of processes used to compute the packet stats; if None, 
+        all the CPUs available
 
     Returns
     -------
@@ -197,11 +206,13 @@ def run_health_check ( input_file, packet_size, f_from, f_to,  window='full-fram
       - Do dark subtraction to input files (flat-fields)
       - Do computations per channel and/or detector
       - Allow a custom coordinates for window definition
-      - Support for MEF files.
       
     """
     
     
+    if temp_dir is not None:
+        log.warning("run_health_check: temp_dir is deprecated and ignored")
+
     # Read the file list from input_file
     if os.path.exists(input_file):
         filelist = [line.replace( "\n", "") for line in fileinput.input(input_file)]
@@ -234,62 +245,63 @@ def run_health_check ( input_file, packet_size, f_from, f_to,  window='full-fram
             f_to >0 and f_to <= packet_size)):
         raise Exception("Wrong values of packet file range")
       
-    # check window-shape
-    pf = fits.open(filelist[0])
-    if len(pf)>1:
-        msg = "MEF files are not supported. Expected a 4kx4k single image."
-        log.error(msg)
-        raise Exception(msg)
-    
-    if pf[0].shape!=(4096,4096):
-        msg = "Expected a 4kx4k single FITS image."
-        log.error(msg)
-        raise Exception(msg)
+    # check window-shape (only headers are read)
+    n_hdu = fitsaccess.get_next(filelist[0])
+    if n_hdu > 1:
+        # MEF: the window (detector) is the extension Qi (or SGi_1), 
+        # without the borders
+        if window not in ('Q1', 'Q2', 'Q3', 'Q4'):
+            msg = "For MEF files, window must be a detector (Q1, Q2, Q3, Q4)."
+            log.error(msg)
+            raise Exception(msg)
+        ext = window
+        if ext not in [fitsaccess.get_header(filelist[0], i).get('EXTNAME') 
+                       for i in range(1, n_hdu)]:
+            ext = 'SG%s_1' % window[1]
+        shape = fitsaccess.get_shape(filelist[0], ext)
+        # shape is (ny, nx)
+        x1, y1, x2, y2 = 10, 10, shape[1] - 10, shape[0] - 10
+        log.debug("MEF file, selected extension = %s" % ext)
+    else:
+        ext = 0
+        shape = fitsaccess.get_shape(filelist[0])
+        if shape != (4096, 4096):
+            msg = "Expected a 4kx4k single FITS image."
+            log.error(msg)
+            raise Exception(msg)
 
-    if not (x1 < pf[0].data.shape[0] and x2 < pf[0].data.shape[0] and 
-        y1 < pf[0].data.shape[1] and y2 < pf[0].data.shape[1]):
+    if not (x1 < shape[1] and x2 < shape[1] and 
+        y1 < shape[0] and y2 < shape[0]):
         raise Exception("Wrong window definition; check image and window size")
      
-    #tmp_file, _ = tempfile.mkstemp()
-    tmp_file = temp_dir + "/packet.txt"
-    n = 0
-    for packet in grouper(packet_size, filelist):
-        if len(packet)==packet_size and not (None in packet):
-            listToFile(packet, tmp_file)
-            try:
-                stack_frames(tmp_file, 'median', f_from, f_to, 
-                    temp_dir + "/stack%02d.fits" % n,
-                    temp_dir + "/stack_sigma%02d.fits" % n, 
-                    10, 100000, 3)    
-            except Exception as e:
-                raise e
-            n = n + 1
+    # Statistics of each packet, computed in parallel (one packet per process)
+    packets = [packet[f_from:f_to] for packet in grouper(packet_size, filelist) 
+               if len(packet)==packet_size and not (None in packet)]
+    n = len(packets)
+    if n < 1:
+        raise Exception("Not enough files for a packet of %d files" % packet_size)
 
-            
-    # Get stats from images
+    if not ncpus:
+        ncpus = multiprocessing.cpu_count()
+    args = [(packet, (x1, x2, y1, y2), ext) for packet in packets]
+    if ncpus > 1 and n > 1:
+        pool = multiprocessing.Pool(processes=min(ncpus, n))
+        try:
+            results = pool.map_async(unwrap_packet_stats, args).get()
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [unwrap_packet_stats(arg) for arg in args]
+
+    # Get stats from packets
     stat_values = {}
     itime = numpy.zeros([n], dtype=numpy.float32)
     signal = numpy.zeros([n], dtype=numpy.float32)
     std = numpy.zeros([n], dtype=numpy.float32)
-    kw_time = 'ITIME'
     for i in range(n):
-        try:
-            log.debug("Reading file %s"%(temp_dir+"/stack%02d.fits"%i)) 
-            pf = fits.open(temp_dir + "/stack%02d.fits"%i)
-            pf2 = fits.open(temp_dir + "/stack_sigma%02d.fits"%i)
-        except Exception as  e:
-            log.error("Cannot open file %s"%(temp_dir+"/stack%02d.fits"%i))
-            continue
-        signal[i] = robust.r_nanmean(pf[0].data[x1:x2, y1:y2])
-        std[i] = robust.r_nanmean(pf2[0].data[x1:x2, y1:y2])
-        if kw_time in pf[0].header: 
-            itime[i] = pf[0].header[kw_time]
-        else:
-            itime[i] = numpy.NaN
-
+        itime[i], signal[i], std[i] = results[i]
         stat_values[i] = [itime[i], signal[i], std[i]]
-        pf.close()
-        pf2.close()
         
     
     #print "Signal", signal
@@ -353,15 +365,94 @@ def run_health_check ( input_file, packet_size, f_from, f_to,  window='full-fram
     plt.show()
     
 
-    # remove tmp files
-    os.unlink(tmp_file)
-
     return out_filename, out_filename + "_2.pdf"
 
+def packet_stats(files, window, ext=0, band_size=256):
+    """
+    Compute the statistics of a packet of frames, as done by IRDR::cubemean 
+    (offset, median and sigma planes) but only in the given window, and 
+    without writing the stack planes.
+
+    The frames are normalized with a zero offset (mean background - frame
+    background); then, for each pixel of the window, the median and the 
+    robust sigma (MAD/0.6745) of the packet are computed. The window is
+    processed in bands of rows, and only the bands are read from disk.
+
+    Parameters
+    ----------
+    files: list
+        List of frames of the packet
+    window: tuple
+        (x1, x2, y1, y2) of the window (x along the columns), i.e., 
+        data[y1:y2, x1:x2]
+    ext: int or str
+        Extension to process (0 for single FITS files)
+    band_size: int
+        Number of rows read each time
+
+    Returns
+    -------
+    A tuple (itime, signal, std) where signal is the mean of the median plane
+    and std is the mean of the sigma plane in the window, and itime the ITIME
+    of the first frame.
+    """
+
+    x1, x2, y1, y2 = window
+    nf = len(files)
+    # Same as IRDR kselect: lower median for even number of frames
+    k = nf // 2 - (1 - nf % 2)
+    
+    kw_time = 'ITIME'
+    with ExitStack() as stack:
+        hdus = [stack.enter_context(fitsaccess.fits_open(f))[ext] for f in files]
+
+        if kw_time in hdus[0].header:
+            itime = hdus[0].header[kw_time]
+        else:
+            itime = numpy.nan
+
+        # Background of each frame, from a subsampled frame
+        bkg = numpy.array([numpy.nanmedian(hdu.section[::8, ::8]) for hdu in hdus])
+        scale = bkg.mean() - bkg
+
+        sum_signal = sum_std = 0.0
+        n_signal = n_std = 0
+        cube = numpy.empty((nf, min(band_size, y2 - y1), x2 - x1), 
+                           dtype=numpy.float32)
+        for r0 in range(y1, y2, band_size):
+            r1 = min(r0 + band_size, y2)
+            band = cube[:, 0:r1 - r0, :]
+            for i, hdu in enumerate(hdus):
+                band[i] = hdu.section[r0:r1, x1:x2]
+                band[i] += scale[i]
+            band.partition(k, axis=0)
+            med = band[k].copy()
+            numpy.subtract(band, med, out=band)
+            numpy.abs(band, out=band)
+            band.partition(k, axis=0)
+            sig = band[k] / 0.6745
+
+            good = numpy.isfinite(med)
+            sum_signal += med[good].sum(dtype=numpy.float64)
+            n_signal += good.sum()
+            good = numpy.isfinite(sig)
+            sum_std += sig[good].sum(dtype=numpy.float64)
+            n_std += good.sum()
+
+    return (itime, sum_signal / max(n_signal, 1), sum_std / max(n_std, 1))
+
+def unwrap_packet_stats(arg):
+    """
+    Helper for the process pool of run_health_check(); Pool.map_async() 
+    only passes one argument.
+    """
+
+    return packet_stats(*arg)
+
 def grouper(group_size, iterable, fillvalue=None):
     "grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx"
     args = [iter(iterable)] * group_size
-    return itertools.izip_longest(fillvalue=fillvalue, *args)
+    return itertools.zip_longest(fillvalue=fillvalue, *args)
 
 ################################################################################
 # main
@@ -373,7 +464,8 @@ if __name__ == "__main__":
     usage = "usage: %prog [options] arg1 arg2 ..."
     desc = """Compute the Gain and Noise from a set of Flat images grouped in
 packets and with increased level of Integration Time (ITIME). Flat files should
-be dark corrected and non MEF 4kx4k files."""
+be dark corrected, and 4kx4k files or MEF files (then, the window must be
+a detector: Q1, Q2, Q3 or Q4)."""
     
     parser = OptionParser(usage, description=desc)
     
@@ -407,9 +499,10 @@ be dark corrected and non MEF 4kx4k files."""
                   help="Output plot filename (default = %default)",
                   default="health_check.pdf")
 
-    parser.add_option("-t", "--temp_dir",
-                  action="store", dest="temp_dir", default="/tmp",
-                  help="Temporal directory (default = %default)")
+    parser.add_option("-n", "--ncpus",
+                  action="store", dest="ncpus", type=int, default=None,
+                  help="Number of processes used to compute the packets (default=all CPUs)")
+
     
                                 
     (options, args) = parser.parse_args()
@@ -428,7 +521,7 @@ be dark corrected and non MEF 4kx4k files."""
         run_health_check(options.input_images, options.packet_size,
                          options.start_packet, options.end_packet, 
                          options.window, options.output_file,
-                         options.temp_dir)
+                         ncpus=options.ncpus)
     except Exception as e:
         log.error("Some error while running Health-Check routine: %s" % str(e))
         sys.exit(0)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# imfilter.py
+#
+# Large-window median filtering of images (e.g. smoothing of master flats),
+# to be used instead of IRAF mscmedian.
+#
+# The running median of a large window (e.g. 20x20 pixels) of a flat-field
+# changes slowly from pixel to pixel, so it is computed only on a grid of
+# nodes (by default every half window) and bilinearly interpolated to the
+# rest of pixels. With a step of 1 pixel the result is the exact running
+# median. The medians of the nodes are computed by bands of rows, in
+# parallel threads (numpy releases the GIL while sorting), for all the
+# extensions of a MEF file at once.
+#
+# As in IRAF median/mscmedian, the image is extended with the nearest pixel
+# values at the borders, and the pixels outside [zloreject, zhireject] are
+# excluded from the median.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import multiprocessing
+import tempfile
+
+import numpy
+from numpy.lib.stride_tricks import sliding_window_view
+import astropy.io.fits as fits
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc.utils import parallelMap
+
+
+__all__ = ['median_filter', 'median_filter_file', 'grid_nodes',
+           'interpolate_grid']
+
+# Maximum number of window pixels held in memory by a band of nodes
+MAX_BAND_PIXELS = 2 ** 24
+
+# Default maximum number of threads, each one holding a band in memory (the
+# filters are often run in the processes of a Pool already)
+MAX_WORKERS = 4
+
+
+def grid_nodes(size, step):
+    """
+    Return the positions of the grid nodes along an axis: every 'step'
+    pixels, plus the last pixel.
+    """
+
+    nodes = numpy.arange(0, size, step)
+    if nodes[-1] != size - 1:
+        nodes = numpy.append(nodes, size - 1)
+
+    return nodes
+
+
+class _Plane(object):
+    """
+    A 2D image prepared to compute the median of windows centered on a grid
+    of nodes.
+    """
+
+    def __init__(self, data, xwindow, ywindow, xstep, ystep, zloreject,
+                 zhireject):
+
+        data = numpy.asarray(data, dtype=numpy.float32)
+        self.shape = data.shape
+        self.y_nodes = grid_nodes(data.shape[0], ystep)
+        self.x_nodes = grid_nodes(data.shape[1], xstep)
+
+        # rejected pixels are excluded from the median as NaN
+        self.reject = (zloreject is not None or zhireject is not None or
+                       numpy.isnan(data).any())
+        if zloreject is not None or zhireject is not None:
+            data = data.copy()
+            if zloreject is not None:
+                data[data < zloreject] = numpy.nan
+            if zhireject is not None:
+                data[data > zhireject] = numpy.nan
+
+        # nearest boundary extension, so the windows of the border nodes are
+        # complete
+        padded = numpy.pad(data, ((ywindow // 2, ywindow - 1 - ywindow // 2),
+                                  (xwindow // 2, xwindow - 1 - xwindow // 2)),
+                           mode='edge')
+        self.windows = sliding_window_view(padded, (ywindow, xwindow))
+        self.nodes = numpy.empty((len(self.y_nodes), len(self.x_nodes)),
+                                 dtype=numpy.float32)
+
+        rows = max(1, MAX_BAND_PIXELS // (len(self.x_nodes) * xwindow * ywindow))
+        self.bands = [(i, min(i + rows, len(self.y_nodes)))
+                      for i in range(0, len(self.y_nodes), rows)]
+
+    def computeBand(self, start, end):
+        """
+        Compute the medians of the nodes of the rows [start, end) of the grid.
+        """
+
+        # index both axes at once, so only the windows of the nodes are copied
+        win = self.windows[self.y_nodes[start:end][:, None], self.x_nodes]
+        win = win.reshape(win.shape[0], win.shape[1], -1)
+        if self.reject:
+            self.nodes[start:end] = numpy.nanmedian(win, axis=-1,
+                                                    overwrite_input=True)
+        else:
+            self.nodes[start:end] = numpy.median(win, axis=-1,
+                                                 overwrite_input=True)
+
+    def result(self):
+        """
+        Interpolate the medians of the nodes to all the pixels.
+        """
+
+        nodes = self.nodes
+        bad = numpy.isnan(nodes)
+        if bad.all():
+            log.warning("All the pixels were rejected; median filter not applied")
+            return numpy.full(self.shape, numpy.nan, dtype=numpy.float32)
+        if bad.any():
+            # windows with all the pixels rejected
+            nodes[bad] = numpy.median(nodes[~bad])
+
+        if nodes.shape == self.shape:
+            return nodes
+
+        return interpolate_grid(interpolate_grid(nodes, self.x_nodes,
+                                                 self.shape[1], axis=1),
+                                self.y_nodes, self.shape[0], axis=0)
+
+
+def interpolate_grid(values, nodes, size, axis):
+    """
+    Linear interpolation along an axis from the node positions to all the
+    pixels.
+    """
+
+    if len(nodes) == size:
+        return values
+
+    pixels = numpy.arange(size)
+    i0 = numpy.clip(numpy.searchsorted(nodes, pixels, side='right') - 1,
+                    0, max(len(nodes) - 2, 0))
+    i1 = numpy.minimum(i0 + 1, len(nodes) - 1)
+    span = numpy.maximum(nodes[i1] - nodes[i0], 1)
+    w = ((pixels - nodes[i0]) / span).astype(numpy.float32)
+
+    if axis == 1:
+        return values[:, i0] * (1 - w) + values[:, i1] * w
+
+    return values[i0] * (1 - w)[:, None] + values[i1] * w[:, None]
+
+
+def _planes(data):
+    """
+    Split an array (2D image or cube) into its 2D planes.
+    """
+
+    if data.ndim == 2:
+        return [data]
+
+    return [data[i] for i in numpy.ndindex(data.shape[:-2])]
+
+
+def median_filter(data, xwindow=20, ywindow=20, zloreject=None, zhireject=None,
+                  step=None, n_workers=None):
+    """
+    Median filter of an image (or each plane of a cube).
+
+    Parameters
+    ----------
+    data: numpy array
+        2D image or cube
+    xwindow, ywindow: int
+        Size of the median window
+    zloreject, zhireject: float
+        Pixels with values lower than zloreject or greater than zhireject
+        (and NaN pixels) are excluded from the median
+    step: int
+        Distance (pixels) between the nodes where the median is computed;
+        the result is interpolated between them. By default, half of the
+        window; step=1 computes the exact running median.
+    n_workers: int
+        Number of threads (default, number of CPUs up to MAX_WORKERS)
+
+    Returns
+    -------
+    The filtered image (float32), with the same shape as data.
+    """
+
+    data = numpy.asarray(data)
+    planes = _planes(data)
+    result = _median_filter_planes(planes, xwindow, ywindow, zloreject,
+                                   zhireject, step, n_workers)
+
+    return numpy.array(result).reshape(data.shape)
+
+
+def _median_filter_planes(planes, xwindow, ywindow, zloreject, zhireject,
+                          step, n_workers):
+
+    xstep = step or max(1, xwindow // 2)
+    ystep = step or max(1, ywindow // 2)
+    n_workers = n_workers or min(multiprocessing.cpu_count(), MAX_WORKERS)
+
+    planes = [_Plane(p, xwindow, ywindow, xstep, ystep, zloreject, zhireject)
+              for p in planes]
+    # all the bands of all the planes share the same pool of threads
+    parallelMap(lambda plane, start, end: plane.computeBand(start, end),
+                [(p, start, end) for p in planes for start, end in p.bands],
+                n_workers)
+
+    return [p.result() for p in planes]
+
+
+def median_filter_file(input_file, output_file, xwindow=20, ywindow=20,
+                       zloreject=None, zhireject=None, step=None,
+                       n_workers=None):
+    """
+    Median filter all the images (extensions) of a FITS file, as IRAF
+    mscmedian with outtype='median'.
+
+    Parameters
+    ----------
+    input_file: str
+        Input FITS file (single or MEF)
+    output_file: str
+        Output FITS file; it can be the input file, that is then replaced
+        once the filtered file is completely written.
+    Other parameters: see median_filter().
+
+    Returns
+    -------
+    The output filename.
+    """
+
+    log.debug("Median filtering (%dx%d) of %s" % (xwindow, ywindow, input_file))
+
+    with fits.open(input_file, ignore_missing_end=True) as hdulist:
+        image_hdus = [i for i, hdu in enumerate(hdulist)
+                      if hdu.is_image and hdu.data is not None]
+        planes = []
+        for i in image_hdus:
+            planes += _planes(hdulist[i].data)
+        filtered = _median_filter_planes(planes, xwindow, ywindow, zloreject,
+                                         zhireject, step, n_workers)
+
+        out_hdulist = fits.HDUList()
+        for i, hdu in enumerate(hdulist):
+            if i in image_hdus:
+                shape = hdu.data.shape
+                n_planes = int(numpy.prod(shape[:-2], dtype=int))
+                data = numpy.array(filtered[:n_planes]).reshape(shape)
+                del filtered[:n_planes]
+                header = hdu.header.copy()
+                for key in ('BZERO', 'BSCALE', 'BLANK'):
+                    header.remove(key, ignore_missing=True)
+                header.add_history("Median filtered (%dx%d window)"
+                                   % (xwindow, ywindow))
+                if i == 0:
+                    out_hdulist.append(fits.PrimaryHDU(data, header))
+                else:
+                    out_hdulist.append(fits.ImageHDU(data, header))
+            else:
+                out_hdulist.append(hdu.copy())
+
+        # write to a temporary file, so the output can be the input file
+        out_dir = os.path.dirname(os.path.abspath(output_file))
+        fd, tmp_file = tempfile.mkstemp(suffix='.fits', dir=out_dir)
+        os.close(fd)
+        try:
+            out_hdulist.writeto(tmp_file, overwrite=True, output_verify='ignore')
+        except Exception:
+            os.unlink(tmp_file)
+            raise
+
+    os.rename(tmp_file, output_file)
+
+    return output_file
@@ -329,6 +329,9 @@ class MEF (object):
                         output_verify = 'ignore', overwrite = True)
                 out_hdulist.close(output_verify = 'ignore')
                 del out_hdulist
+                # release the extension data, so that only one extension is
+                # in memory at the same time
+                del hdulist[extname].data
                 log.info("File %s created"%(out_filenames[n]))
                 n += 1
 
@@ -359,13 +362,14 @@ class MEF (object):
                 raise MEF_Exception ("Error, can not open file %s" % file)
             
             # Check if is a MEF-cube file 
-            if len(in_hdulist) > 1 and len(in_hdulist[1].data.shape) > 2:
+            # (shapes are read from the headers, data is read plane by plane)
+            if len(in_hdulist) > 1 and in_hdulist[1].header['NAXIS'] > 2:
                 n_ext = len(in_hdulist) - 1
-                n_planes = in_hdulist[1].data.shape[0]
+                n_planes = in_hdulist[1].header['NAXIS3']
                 log.debug("MEF file with %d extensions and %d planes." %(n_ext, n_planes))
             else:
                 n_ext = 0
-                n_planes = in_hdulist[0].data.shape[0]
+                n_planes = in_hdulist[0].header['NAXIS3']
                 log.debug("Found SEF file with %d planes." %(n_planes))
             
             primaryHeader = in_hdulist[0].header.copy()
@@ -383,14 +387,14 @@ class MEF (object):
                     for i_ext in range(1, n_ext + 1):
                         log.debug("i_ext = %d" % i_ext)
                         hdu_i = fits.ImageHDU(header=in_hdulist[i_ext].header, 
-                                              data=in_hdulist[i_ext].data[i_plane,:,:])
+                                              data=in_hdulist[i_ext].section[i_plane,:,:])
                         out_hdulist.append(hdu_i)
 
                 else:
                     log.debug("Non MEF file found")
                     # Create primary HDU (with data and the common header)    
                     out_hdulist = fits.PrimaryHDU(header=primaryHeader, 
-                                          data=in_hdulist[0].data[i_plane,:,:], 
+                                          data=in_hdulist[0].section[i_plane,:,:], 
                                           scale_back=False)
                     # out_hdulist.scale(type='int32', bzero=0, bscale=1.0)
                     # out_hdulist.append(hdu_i)
@@ -407,6 +411,8 @@ class MEF (object):
                                     overwrite=True)
                 del out_hdulist                
                 log.info("New file created: %s" % new_filename) 
+            
+            in_hdulist.close()
         
         log.info("End of odSlice")
             
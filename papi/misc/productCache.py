@@ -0,0 +1,471 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# productCache.py
+#
+# Cache of the intermediate products of the reduction (NLC corrected frames,
+# dark/flat applied frames, master calibrations, object masks, offsets, ...).
+#
+# Each product is stored under a key computed as the SHA1 of:
+#
+#   - the name of the stage that produced it
+#   - the content (SHA1) of its input files
+#   - the content of the calibration files used
+#   - the config values (section) the stage depends on
+#   - the PAPI version
+#
+# When a stage is re-run with the same key, its products are copied back from
+# the cache instead of being recomputed. As the keys depend on the content of
+# the files and not on their names or dates, the restored products give the
+# same keys in the downstream stages, and only the stages really affected by
+# a change (e.g. of the skysub.hwidth value) are recomputed.
+#
+# The digests of the files are also kept in the cache (indexed by path, size
+# and mtime), so each file is only read once to compute its digest.
+#
+# The cache directory must not be inside the temporal directory, that is
+# emptied by ReductionSet.purgeOutput().
+#
+# The SExtractor catalogs of the astrometric calibration (astrowarp) are not
+# cached: SExtractor, SCAMP and SWarp run as one step that updates the WCS of
+# the frames in place, and the solution depends on the reference catalog
+# (e.g. 2MASS) queried over the network, that cannot be part of the key. The
+# SExtractor run of the object masks is cached with them ('object_mask').
+#
+# Usage:
+#
+#   cache = ProductCache("/opt/PANIC_DATA/cache")
+#   files = cache.run('dark_flat', task.apply, inputs=files,
+#                     calibs=[dark, flat], out_dir=out_dir)
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+import numpy
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc.version import __version__
+
+
+__all__ = ['ProductCache']
+
+# Version of the layout of the cache entries; increase it to invalidate all
+# the entries created by previous versions of this module.
+CACHE_VERSION = 1
+
+MANIFEST = 'manifest.json'
+
+
+# Size of the blocks read to compute the digest of the files
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def _sha1(filename):
+    """
+    Return the SHA1 (hexadecimal) of the content of a file.
+    """
+
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as fd:
+        for block in iter(lambda: fd.read(BLOCK_SIZE), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+class ProductCache(object):
+    """
+    Content-addressed cache of the products of the reduction stages.
+    """
+
+    def __init__(self, cache_dir, enabled=True):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            Directory where the products are stored; it is created if it does
+            not exist.
+        enabled: bool
+            If False, run() always calls the stage function (no cache).
+        """
+
+        self.cache_dir = cache_dir
+        self.enabled = enabled and cache_dir is not None
+
+        if self.enabled:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+            except OSError as e:
+                log.warning("Cannot create cache directory %s: %s. "
+                            "Product cache disabled." % (cache_dir, str(e)))
+                self.enabled = False
+
+    def key(self, stage, inputs, calibs=None, config=None):
+        """
+        Compute the key of the products of a stage.
+
+        Parameters
+        ----------
+        stage: str
+            Name of the stage (e.g. 'nlc', 'dark_flat', 'master_dark')
+        inputs: list
+            Input files of the stage
+        calibs: list
+            Calibration files used by the stage (None values are allowed)
+        config: dict
+            Config values the stage depends on
+
+        Returns
+        -------
+        The key (hexadecimal SHA1 digest).
+        """
+
+        desc = {'cache_version': CACHE_VERSION,
+                'papi_version': __version__,
+                'stage': stage,
+                'inputs': [self.digest(f) for f in inputs],
+                'calibs': [self.digest(f) if f else None for f in (calibs or [])],
+                'config': config}
+        text = json.dumps(desc, sort_keys=True, default=str)
+
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def digest(self, filename):
+        """
+        Return the digest of the content of a file, taken from the index of
+        the cache if the file (path, size and mtime) did not change since it
+        was computed. If the file does not exist, its path is returned, so
+        that a missing file never matches an existing one.
+        """
+
+        path = os.path.realpath(filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return 'missing:' + path
+
+        ident = '%s:%d:%d' % (path, st.st_size, st.st_mtime_ns)
+        index = os.path.join(self.cache_dir, 'index',
+                             hashlib.sha1(ident.encode('utf-8')).hexdigest())
+        try:
+            with open(index) as fd:
+                return fd.read().strip()
+        except (IOError, OSError):
+            pass
+
+        digest = _sha1(path)
+        try:
+            if not os.path.isdir(os.path.dirname(index)):
+                os.makedirs(os.path.dirname(index), exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(index))
+            with os.fdopen(fd, 'w') as f:
+                f.write(digest)
+            os.rename(tmp_file, index)
+        except OSError as e:
+            log.debug("[ProductCache] Cannot index digest of %s: %s" % (path, str(e)))
+
+        return digest
+
+    def _entry_dir(self, key):
+
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def run(self, stage, func, inputs, calibs=None, config=None,
+            out_dir=None, extra_files=None):
+        """
+        Return the products of a stage, from the cache if available, or
+        calling func() and storing its products otherwise.
+
+        Parameters
+        ----------
+        stage, inputs, calibs, config:
+            See key()
+        func: callable
+            Function (without arguments) that runs the stage; it must return
+            a filename, a list of filenames, a numpy array or None.
+        out_dir: str
+            Directory where the files returned by func() are restored; if
+            None, they are restored with their original path.
+        extra_files: list
+            Other files written by func() (not returned) to be cached too,
+            e.g. the offsets file; they are restored with the given path.
+
+        Returns
+        -------
+        The value returned by func() (with the restored filenames when taken
+        from the cache).
+        """
+
+        if not self.enabled:
+            return func()
+
+        key = self.key(stage, inputs, calibs, config)
+        try:
+            result = self._restore(key, out_dir, extra_files or [])
+            log.info("[ProductCache] Stage '%s' served from cache (%s)"
+                     % (stage, key))
+            return result
+        except KeyError:
+            pass
+
+        result = func()
+
+        try:
+            self._store(key, stage, result, extra_files or [])
+        except Exception as e:
+            # the cache must never break the reduction
+            log.warning("[ProductCache] Cannot store products of stage '%s': %s"
+                        % (stage, str(e)))
+
+        return result
+
+    def _restore(self, key, out_dir, extra_files):
+        """
+        Copy the products of an entry to their destination and return the
+        result of the stage. KeyError is raised if the entry is not found
+        or it is not complete.
+        """
+
+        entry = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry, MANIFEST)) as fd:
+                manifest = json.load(fd)
+        except (IOError, OSError, ValueError):
+            raise KeyError(key)
+
+        kind = manifest['kind']
+        files = manifest['files']
+        if len(manifest['extra_files']) != len(extra_files):
+            raise KeyError(key)
+
+        # check the entry is complete before restoring anything
+        sources = [os.path.join(entry, f) for f in files + manifest['extra_files']]
+        if not all(os.path.isfile(f) for f in sources):
+            log.warning("[ProductCache] Incomplete entry %s removed" % key)
+            shutil.rmtree(entry, True)
+            raise KeyError(key)
+
+        restored = []
+        for name, orig in zip(files, manifest['paths']):
+            dest_dir = out_dir if out_dir else os.path.dirname(orig)
+            dest = os.path.join(dest_dir, name)
+            self._copy(os.path.join(entry, name), dest)
+            restored.append(dest)
+
+        for name, dest in zip(manifest['extra_files'], extra_files):
+            self._copy(os.path.join(entry, name), dest)
+
+        if kind == 'file':
+            return restored[0]
+        elif kind == 'files':
+            return restored
+        elif kind == 'array':
+            return numpy.load(os.path.join(entry, 'result.npy'))
+        else:
+            return None
+
+    def _store(self, key, stage, result, extra_files):
+        """
+        Store the products of a stage in a new entry of the cache.
+        """
+
+        if isinstance(result, str):
+            kind, paths = 'file', [result]
+        elif isinstance(result, (list, tuple)) and \
+                all(isinstance(f, str) for f in result):
+            kind, paths = 'files', list(result)
+        elif isinstance(result, numpy.ndarray):
+            kind, paths = 'array', []
+        elif result is None:
+            kind, paths = 'none', []
+        else:
+            log.debug("[ProductCache] Result of stage '%s' cannot be cached" % stage)
+            return
+
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+
+        # The entry is built in a temporal directory and then renamed, so
+        # that concurrent processes never see a partial entry.
+        parent = os.path.dirname(entry)
+        if not os.path.isdir(parent):
+            os.makedirs(parent, exist_ok=True)
+        tmp_entry = tempfile.mkdtemp(prefix='.tmp_', dir=parent)
+        try:
+            files = []
+            for path in paths:
+                name = os.path.basename(path)
+                shutil.copy2(path, os.path.join(tmp_entry, name))
+                files.append(name)
+            extra = []
+            for i, path in enumerate(extra_files):
+                name = 'extra_%d_%s' % (i, os.path.basename(path))
+                shutil.copy2(path, os.path.join(tmp_entry, name))
+                extra.append(name)
+            if kind == 'array':
+                numpy.save(os.path.join(tmp_entry, 'result.npy'), result)
+
+            manifest = {'key': key,
+                        'stage': stage,
+                        'papi_version': __version__,
+                        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        'kind': kind,
+                        'files': files,
+                        'paths': [os.path.abspath(p) for p in paths],
+                        'extra_files': extra}
+            with open(os.path.join(tmp_entry, MANIFEST), 'w') as fd:
+                json.dump(manifest, fd, indent=2)
+
+            os.rename(tmp_entry, entry)
+            log.debug("[ProductCache] Stage '%s' stored in cache (%s)" % (stage, key))
+        except OSError:
+            # another process stored the same entry meanwhile
+            if os.path.isdir(entry):
+                return
+            raise
+        finally:
+            if os.path.isdir(tmp_entry):
+                shutil.rmtree(tmp_entry, True)
+
+    @staticmethod
+    def _copy(src, dest):
+        """
+        Copy a product (keeping its mtime, so its digest is taken from the
+        index). A copy, and not a link, is done because some stages modify
+        their input files in place.
+        """
+
+        if os.path.exists(dest):
+            os.unlink(dest)
+        shutil.copy2(src, dest)
+
+    def entries(self):
+        """
+        Return the list of manifests (dict) of the entries in the cache.
+        """
+
+        manifests = []
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return manifests
+
+        for prefix in sorted(os.listdir(self.cache_dir)):
+            pdir = os.path.join(self.cache_dir, prefix)
+            if prefix == 'index' or not os.path.isdir(pdir):
+                continue
+            for key in sorted(os.listdir(pdir)):
+                try:
+                    with open(os.path.join(pdir, key, MANIFEST)) as fd:
+                        manifests.append(json.load(fd))
+                except (IOError, OSError, ValueError):
+                    continue
+
+        return manifests
+
+    def clear(self, older_than=None):
+        """
+        Remove the entries of the cache.
+
+        Parameters
+        ----------
+        older_than: float
+            If given, only the entries created more than 'older_than' days
+            ago are removed.
+
+        Returns
+        -------
+        The number of entries removed.
+        """
+
+        n_removed = 0
+        now = time.time()
+        for manifest in self.entries():
+            entry = self._entry_dir(manifest['key'])
+            if older_than is not None and \
+                    now - os.path.getmtime(entry) < older_than * 86400:
+                continue
+            shutil.rmtree(entry, True)
+            n_removed += 1
+
+        return n_removed
+
+
+################################################################################
+# main
+def main(arguments=None):
+
+    desc = "List or clear the cache of intermediate products of PAPI."
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument("-c", "--cache_dir",
+                  action="store", dest="cache_dir", required=True,
+                  help="Cache directory (general.cache_dir)")
+
+    parser.add_argument("-l", "--list",
+                  action="store_true", dest="list", default=False,
+                  help="List the entries of the cache")
+
+    parser.add_argument("-x", "--clear",
+                  action="store_true", dest="clear", default=False,
+                  help="Remove the entries of the cache")
+
+    parser.add_argument("-d", "--days",
+                  action="store", dest="days", type=float, default=None,
+                  help="With --clear, remove only the entries older than "
+                  "the given number of days")
+
+    options = parser.parse_args(arguments)
+
+    if not os.path.isdir(options.cache_dir):
+        parser.error("Cache directory %s not found" % options.cache_dir)
+
+    cache = ProductCache(options.cache_dir)
+
+    if options.list:
+        for m in cache.entries():
+            print("%s  %-14s %s  %d file(s)" % (m['key'], m['stage'],
+                                                m['created'],
+                                                len(m['files']) + len(m['extra_files'])))
+    if options.clear:
+        n = cache.clear(options.days)
+        print("%d entries removed" % n)
+
+    return 0
+
+######################################################################
+if __name__ == "__main__":
+    sys.exit(main())
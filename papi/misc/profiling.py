@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# profiling.py
+#
+# Stage-level instrumentation of the reduction. For each stage of a task
+# (e.g. reduceSingleObj) and for each external tool called inside it (IRDR,
+# SExtractor, SCAMP, SWarp, astrometry.net), it records:
+#
+#   - wall time
+#   - CPU time of the process and of its (finished) children
+#   - peak RSS of the process and of its (largest) child, up to the end of
+#     the stage (ru_maxrss is a peak over the whole process lifetime), and
+#     how much the stage raised them
+#   - bytes read/written from/to storage (Linux /proc/self/io)
+#
+# and writes them as a JSON report when the task finishes.
+#
+# Usage:
+#
+#   with Profiler("reduceSingleObj", "/out/PANIC.xxx.profile.json"):
+#       next_stage("1-dark_flat")
+#       ...
+#       next_stage("2-super_flat")
+#       with tool_call("sex"):
+#           run_sextractor()
+#
+# next_stage() and tool_call() do nothing if there is no active Profiler, so
+# they can be used in any module.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import time
+import json
+import socket
+import datetime
+import resource
+from contextlib import contextmanager
+
+# PAPI modules
+from papi.misc.paLog import log
+
+
+__all__ = ['Profiler', 'next_stage', 'tool_call', 'active_profiler']
+
+# Stack of active profilers of the current process (the last one is used)
+_active = []
+
+
+def _io_counters():
+    """
+    Return the (read_bytes, write_bytes) done by the process (and its
+    finished children) to the storage layer, or (None, None) if not available.
+    """
+
+    try:
+        with open('/proc/self/io') as fd:
+            counters = dict(line.split(':') for line in fd if ':' in line)
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (IOError, OSError, KeyError, ValueError):
+        return None, None
+
+
+def _snapshot():
+    """
+    Take a snapshot of the resources used by the process up to now.
+    """
+
+    times = os.times()
+    rbytes, wbytes = _io_counters()
+    # ru_maxrss is given in KB (Linux)
+    rss_self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return {'wall': time.time(),
+            'cpu': times[0] + times[1],
+            'cpu_children': times[2] + times[3],
+            'rss': rss_self,
+            'rss_children': rss_children,
+            'read': rbytes,
+            'write': wbytes}
+
+
+def _delta(name, start, end):
+    """
+    Build the record of a stage/tool from the snapshots taken at its start
+    and end.
+    """
+
+    def diff(key):
+        if start[key] is None or end[key] is None:
+            return None
+        return end[key] - start[key]
+
+    return {'name': name,
+            'wall_s': round(end['wall'] - start['wall'], 3),
+            'cpu_s': round(diff('cpu'), 3),
+            'cpu_children_s': round(diff('cpu_children'), 3),
+            # peaks over the process lifetime up to the end of the stage, and
+            # their increase during the stage (0 if it stayed below the former
+            # peak)
+            'process_peak_rss_mb': round(end['rss'] / 1024.0, 1),
+            'children_peak_rss_mb': round(end['rss_children'] / 1024.0, 1),
+            'peak_rss_increase_mb': round(diff('rss') / 1024.0, 1),
+            'children_peak_rss_increase_mb': round(diff('rss_children') / 1024.0, 1),
+            'read_bytes': diff('read'),
+            'write_bytes': diff('write')}
+
+
+class Profiler(object):
+    """
+    Record the resources used by the stages of a task and by the external
+    tools called inside them, and write them as a JSON report.
+    """
+
+    def __init__(self, name, report_file=None, **meta):
+        """
+        Parameters
+        ----------
+        name: str
+            Name of the task profiled
+        report_file: str
+            Filename of the JSON report to be written when the task finishes;
+            if None, no report is written (see report()).
+        meta:
+            Other info to be included in the report (e.g., input files)
+        """
+
+        self.name = name
+        self.report_file = report_file
+        self.meta = meta
+        self.stages = []
+        self._start = None
+        self._stage = None       # (name, start snapshot, tools) of current stage
+        self._status = None
+
+    def __enter__(self):
+
+        self._start = _snapshot()
+        _active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self._close_stage()
+        self._status = 'OK' if exc_type is None else 'FAILED: %s' % str(exc_value)
+        _active.remove(self)
+        if self.report_file:
+            try:
+                self.write(self.report_file)
+            except Exception as e:
+                log.warning("Cannot write profiling report %s: %s"
+                            % (self.report_file, str(e)))
+        # exceptions are propagated
+        return False
+
+    def next_stage(self, name):
+        """
+        Close the current stage (if any) and start a new one.
+        """
+
+        self._close_stage()
+        self._stage = (name, _snapshot(), [])
+
+    def _close_stage(self):
+
+        if self._stage is not None:
+            name, start, tools = self._stage
+            record = _delta(name, start, _snapshot())
+            record['tools'] = tools
+            self.stages.append(record)
+            log.debug("[profiling] %s: stage '%s' %.2f s"
+                      % (self.name, name, record['wall_s']))
+            self._stage = None
+
+    @contextmanager
+    def tool_call(self, name):
+        """
+        Context manager to record an external tool call inside the current
+        stage.
+        """
+
+        start = _snapshot()
+        try:
+            yield
+        finally:
+            record = _delta(name, start, _snapshot())
+            if self._stage is None:
+                self.next_stage('unnamed')
+            self._stage[2].append(record)
+
+    def report(self):
+        """
+        Return the report (dict) of the resources used up to now.
+        """
+
+        total = _delta(self.name, self._start, _snapshot())
+        total.pop('name')
+        report = {'task': self.name,
+                  'host': socket.gethostname(),
+                  'pid': os.getpid(),
+                  'start': datetime.datetime.fromtimestamp(
+                                self._start['wall']).isoformat(),
+                  'status': self._status,
+                  'total': total,
+                  'stages': self.stages}
+        report.update(self.meta)
+
+        return report
+
+    def write(self, report_file):
+        """
+        Write the report as a JSON file.
+        """
+
+        with open(report_file, 'w') as fd:
+            json.dump(self.report(), fd, indent=2)
+        log.info("Profiling report written to %s" % report_file)
+
+
+def active_profiler():
+    """
+    Return the Profiler active in the current process, or None.
+    """
+
+    return _active[-1] if _active else None
+
+
+def next_stage(name):
+    """
+    Start a new stage in the active Profiler, if any.
+    """
+
+    if _active:
+        _active[-1].next_stage(name)
+
+
+@contextmanager
+def tool_call(name):
+    """
+    Record an external tool call in the active Profiler, if any.
+    """
+
+    if _active:
+        with _active[-1].tool_call(name):
+            yield
+    else:
+        yield
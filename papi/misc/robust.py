@@ -14,6 +14,8 @@ been incorporated into the AstroIDL User's Library.  Function included are:
   * reject_outliers - reject outlier value from input data (jmiguel@iaa.es)
   * r_division - scalar robust division
   * r_divisionN - Array robust division
+  * array_stats - median/mean/mode/MAD of an array on a strided subsample
+  * frame_stats - cached array_stats of a window of a FITS file
 
 For the fitting routines, the coefficients are returned in the same order as
 numpy.polyfit, i.e., with the coefficient of the highest power listed first.
@@ -24,13 +26,20 @@ For additional information about the original IDL routines, see:
 
 from __future__ import division
 
+import os
 import math
+import json
+import hashlib
+from collections import OrderedDict
+
 import numpy
 
+from papi.misc import fitsaccess
+
 __version__ = '0.4'
 __revision__ = '$Rev$'
 __all__ = ['biweightMean', 'mean', 'std', 'checkfit', 'linefit', 'polyfit', 
-           '__version__', '__revision__', '__all__']
+           'array_stats', 'frame_stats', '__version__', '__revision__', '__all__']
 
 __iterMax = 25
 __delta = 5.0e-7
@@ -766,3 +775,145 @@ def MAD(a, c=0.6745, axis=None):
         m = ma.median(ma.fabs(aswp - d) / c, axis=0)
 
     return m
+
+
+##
+## Frame statistics service
+##
+
+# Max. number of entries of the in-memory cache of frame_stats()
+__statsCacheSize = 512
+__statsCache = OrderedDict()
+
+def array_stats(data, step=1):
+    """
+    Compute the basic (NaN-safe) statistics used to gate or normalize frames
+    on a deterministic subsample of the input array, i.e., one of every 
+    'step' pixels along each of the two last axes.
+    
+    Parameters:
+    -----------
+    data : array_like
+        Input 2D image or cube of images.
+    step : int
+        Sampling step along rows and columns; step=1 uses all the pixels.
+
+    Returns:
+    --------
+    A dictionary with 'median', 'mean', 'mode' (3*median - 2*mean), 'mad' 
+    (MAD/0.6745, i.e., a sigma estimation), 'std', 'npix' (number of finite 
+    samples used) and the standard errors 'mean_err' and 'median_err' of the 
+    mean and median estimated from the sample, that bound the error due to the
+    subsampling.
+    """
+
+    step = max(1, int(step))
+    sample = numpy.asarray(data)[..., ::step, ::step]
+    sample = sample[numpy.isfinite(sample)].astype(numpy.float64)
+    npix = sample.size
+    if npix == 0:
+        nan = float('nan')
+        return {'median': nan, 'mean': nan, 'mode': nan, 'mad': nan, 'std': nan,
+                'npix': 0, 'mean_err': nan, 'median_err': nan}
+
+    median = float(numpy.median(sample))
+    mean = float(sample.mean())
+    std = float(sample.std())
+    # in place, sample is not needed anymore
+    numpy.subtract(sample, median, out=sample)
+    numpy.fabs(sample, out=sample)
+    mad = float(numpy.median(sample)) / 0.6745
+
+    return {'median': median, 'mean': mean, 'mode': 3 * median - 2 * mean,
+            'mad': mad, 'std': std, 'npix': npix,
+            'mean_err': std / math.sqrt(npix),
+            # asymptotic error of the median, using the robust sigma
+            'median_err': 1.2533 * mad / math.sqrt(npix)}
+
+def frame_stats(filename, ext=0, window=None, step=4, cache_dir=None):
+    """
+    Compute array_stats() of a window of a FITS file (image or cube), reading 
+    from disk only the sampled rows of the window.
+
+    Results are cached per (file, extension, window, step), and invalidated
+    when the file is modified, so the repeated calls done through the 
+    reduction of a sequence (i.e., master flat normalization) are free.
+
+    Parameters:
+    -----------
+    filename : str
+        FITS filename
+    ext : int or str
+        Extension number or name
+    window : tuple of slices
+        Window in numpy order, e.g. numpy.s_[y1:y2, x1:x2]; for cubes, it is 
+        applied to all the planes. If None, the full image is used.
+    step : int
+        Sampling step along rows and columns; step=1 uses all the pixels.
+    cache_dir : str
+        If given, the results are also saved as JSON sidecar files in this
+        directory, so they are shared between processes and sessions.
+
+    Returns:
+    --------
+    The dictionary returned by array_stats(), plus the 'shape' of the full 
+    data unit (numpy order).
+    """
+
+    step = max(1, int(step))
+    stat = os.stat(filename)
+    if window is None:
+        window = (slice(None), slice(None))
+    key = repr((os.path.realpath(filename), ext,
+                tuple((s.start, s.stop, s.step) for s in window),
+                step, stat.st_mtime_ns, stat.st_size))
+
+    if key in __statsCache:
+        __statsCache.move_to_end(key)
+        return dict(__statsCache[key])
+
+    sidecar = None
+    if cache_dir:
+        sidecar = os.path.join(cache_dir, 
+                    hashlib.sha1(key.encode()).hexdigest() + '.stats.json')
+        try:
+            with open(sidecar) as fd:
+                result = json.load(fd)
+            result['shape'] = tuple(result['shape'])
+            __cacheStats(key, result)
+            return dict(result)
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+    with fitsaccess.fits_open(filename) as hdulist:
+        hdu = hdulist[ext]
+        naxis = hdu.header.get('NAXIS', 0)
+        shape = tuple(hdu.header['NAXIS%d' % i] for i in range(naxis, 0, -1))
+        # strided window, for all the planes of a cube
+        y_s, x_s = window
+        sampling = (slice(y_s.start, y_s.stop, (y_s.step or 1) * step),
+                    slice(x_s.start, x_s.stop, (x_s.step or 1) * step))
+        if naxis > 2:
+            sampling = (slice(None),) + sampling
+        result = array_stats(hdu.section[sampling])
+    result['shape'] = shape
+    __cacheStats(key, result)
+
+    if sidecar:
+        try:
+            with open(sidecar, 'w') as fd:
+                json.dump(result, fd)
+        except (IOError, OSError):
+            pass
+
+    return dict(result)
+
+def __cacheStats(key, result):
+    """
+    Insert a result into the in-memory cache of frame_stats(), dropping the
+    least recently used entries.
+    """
+
+    __statsCache[key] = result
+    while len(__statsCache) > __statsCacheSize:
+        __statsCache.popitem(last=False)
@@ -33,13 +33,16 @@
 # Import necessary modules
 
 # System modules
+import os
 import time
 import subprocess
 import fileinput
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # PAPI modules
 from papi.misc.paLog import log
+from papi.misc import profiling
 
 class clock:
 
@@ -134,22 +137,24 @@ def runCmd(str_cmd, p_shell=True ):
     """
            
     log.debug("Running command : %s \n", str_cmd)
-    try:
-        p = subprocess.Popen(str_cmd, bufsize=0, shell=True, stdin=subprocess.PIPE, 
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
-                             close_fds=True)
-        # new, added 2015-01-26
-        # p.wait()
-    except:
-        log.error("Some error while running command...")
-        raise 
-    
-    # Warning
-    # We use communicate() rather than .stdin.write, .stdout.read or .stderr.read
-    # to avoid deadlocks due to any of the other OS pipe buffers filling up and
-    # blocking the child process.(Python Ref.doc)
+    # (the call is recorded in the active Profiler, if any)
+    with profiling.tool_call(os.path.basename(str_cmd.split()[0])):
+        try:
+            p = subprocess.Popen(str_cmd, bufsize=0, shell=True, stdin=subprocess.PIPE, 
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, 
+                                 close_fds=True)
+            # new, added 2015-01-26
+            # p.wait()
+        except:
+            log.error("Some error while running command...")
+            raise 
+        
+        # Warning
+        # We use communicate() rather than .stdin.write, .stdout.read or .stderr.read
+        # to avoid deadlocks due to any of the other OS pipe buffers filling up and
+        # blocking the child process.(Python Ref.doc)
 
-    (stdoutdata, stderrdata) = p.communicate()
+        (stdoutdata, stderrdata) = p.communicate()
     err = stdoutdata.decode() + " " + stderrdata.decode()
 
     if len(err) > 1:
@@ -168,3 +173,36 @@ def runCmd(str_cmd, p_shell=True ):
         return 1  # NO ERROR
 
 
+def parallelMap(func, args_list, n_workers):
+    """
+    Run func(*args) for each args tuple of args_list in a bounded pool of
+    threads, and return the results in the same order as args_list.
+
+    Threads (and not processes) are used because it is intended for tasks
+    that mainly wait for an external program (solve-field, SExtractor, ...),
+    and it can be called from the daemonic processes of a multiprocessing
+    Pool, that are not allowed to have children.
+
+    Parameters
+    ----------
+    func: callable
+        Function to run
+    args_list: list
+        List of tuples with the arguments of each call
+    n_workers: int
+        Maximum number of concurrent calls
+
+    Returns
+    -------
+    The list of results. If any call raised an exception, the first one
+    (in the order of args_list) is raised once all the calls finished.
+    """
+
+    n_workers = max(1, min(int(n_workers), len(args_list)))
+    if n_workers == 1:
+        return [func(*args) for args in args_list]
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(func, *args) for args in args_list]
+
+    return [future.result() for future in futures]
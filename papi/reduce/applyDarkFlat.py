@@ -50,6 +50,7 @@ from papi.misc.fileUtils import removefiles
 from papi.misc.utils import clock
 import papi.misc.robust as robust
 from papi.datahandler.clfits import ClFits, isaFITS
+from papi.misc import fitsaccess
 
 # Logging
 from papi.misc.paLog import log
@@ -231,15 +232,17 @@ class ApplyDarkFlat(object):
                 # Take the center of the image
                 off_naxis1 = int(naxis1 * 0.1)
                 off_naxis2 = int(naxis2 * 0.1)
-                dat = flat[ext].data[off_naxis2: naxis2 - off_naxis2, 
-                                     off_naxis1: naxis1 - off_naxis1]
+                # (only the window is read from disk, and the stats are
+                # cached, as the same master flat is applied to many frames)
                 # NaN values must not be replaced with 0.0 !!!
-                # dat[numpy.isnan(dat)]= 0.0 #
-
                 # Normalization is done with a robust estimator --> np.median()
-                median = robust.r_nanmedian(dat)
-                mean = robust.r_nanmean(dat)
-                mode = 3 * median - 2 * mean
+                stats = robust.frame_stats(self.__mflat, ext,
+                                           numpy.s_[off_naxis2: naxis2 - off_naxis2,
+                                                    off_naxis1: naxis1 - off_naxis1],
+                                           step=1)
+                median = stats['median']
+                mean = stats['mean']
+                mode = stats['mode']
                 
                 log.info("Flat stats: MEDIAN= %f  MEAN=%f MODE(estimated)=%f ", \
                            median, mean, mode)
@@ -260,9 +263,9 @@ class ApplyDarkFlat(object):
         if self.__bpm != None and self.__bpm_action != 'none':
             out_suffix = out_suffix.replace(".fits","_BPM.fits") 
             if self.__mdark == None and self.__mflat == None:
-                with fits.open(self.__bpm) as bp:
-                    if len(bp) == 1: n_ext = 1
-                    else: n_ext = len(bp) - 1
+                n_bp = fitsaccess.get_next(self.__bpm)
+                if n_bp == 1: n_ext = 1
+                else: n_ext = n_bp - 1
         elif self.__mdark == None and self.__mflat == None and self.__bpm != None and self.__bpm_action == 'none':
             log.error("Please, choose a BPM action (grab or fix)")
             raise Exception("No BPM action selected")
@@ -280,6 +283,9 @@ class ApplyDarkFlat(object):
         # List of files generated as result of this procedure and that will be returned
         result_file_list = [] 
         
+        # BPM extensions are read only once for all the science frames
+        bpm_cache = {}
+        
         #
         # Start the applying of calibrations
         #
@@ -370,8 +376,10 @@ class ApplyDarkFlat(object):
 
                         # Get BPM
                         if self.__bpm != None: 
-                            bpm_data = fits.getdata(self.__bpm, extname = chip_name,
-                                                      header=False)
+                            if chip_name not in bpm_cache:
+                                bpm_cache[chip_name] = fitsaccess.get_data(self.__bpm,
+                                                                           ext=chip_name)
+                            bpm_data = bpm_cache[chip_name]
 
                     # Single
                     else:
@@ -418,7 +426,12 @@ class ApplyDarkFlat(object):
                         if self.__bpm != None:
                             # bpm_data: must be an array that is True or >0 
                             # where bad pixels
-                            bpm_data = fits.getdata(self.__bpm, header=False)
+                            if 0 not in bpm_cache:
+                                bpm_cache[0] = fitsaccess.get_data(self.__bpm)
+                                if bpm_cache[0] is None:
+                                    # empty primary HDU
+                                    bpm_cache[0] = fitsaccess.get_data(self.__bpm, ext=1)
+                            bpm_data = bpm_cache[0]
                                                                
                     
                     # To avoid NaN values due to zero division by FLAT
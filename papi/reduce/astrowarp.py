@@ -41,6 +41,8 @@ from papi.misc.paLog import log
 from papi.misc.version import __version__
 from papi.misc.config import read_config_file
 from papi.reduce.solveAstrometry import solveField
+from papi.reduce.wcsCache import WCSCache
+from papi.misc.utils import parallelMap
 
 
 def initWCS(input_image, pixel_scale):
@@ -550,7 +552,7 @@ class AstroWarp(object):
     def __init__(self, input_files, catalog=None, 
                  coadded_file="/tmp/astrowarp.fits", config_dict=None, 
                  do_votable=False, resample=True, subtract_back=True,
-                 weight_maps=None):
+                 weight_maps=None, n_workers=None):
         """ 
         Instantiation method for AstroWarp class.
 
@@ -570,6 +572,8 @@ class AstroWarp(object):
         weight_maps   - List of input weight-map filenames; if the list has a
                         single file, it will be used for all the input files.
                         0 = bad pixel, >1 = good pixels
+        n_workers     - Maximum number of input files processed concurrently
+                        (solve-field, SExtractor); if None, general.ncpus.
         """
 
         # PAPI_HOME
@@ -601,6 +605,12 @@ class AstroWarp(object):
         self.temp_dir = config_dict['general']['temp_dir']
         self.output_dir = config_dict['general']['output_dir']
         self.weight_maps = weight_maps
+        if n_workers is None:
+            n_workers = config_dict['general']['ncpus']
+        self.n_workers = n_workers
+        # Last good solutions, to warm-start the astrometry of each frame
+        self.wcs_cache = WCSCache(config_dict['astrometry'].get('wcs_cache_dir'),
+                                  config_dict['astrometry'].get('wcs_cache_radius', 0.25))
 
     def run(self, engine='SCAMP'):
         """
@@ -618,6 +628,57 @@ class AstroWarp(object):
         else:
             self.runWithAstrometryNet()
 
+    def _solveField(self, file):
+        """
+        Run the astrometric calibration (Astrometry.net) of a file, unless it
+        is already solved, and return the filename of the solved file.
+        """
+
+        solved_msg = "--Start of Astrometry.net WCS solution--"
+        if solved_msg in fits.getheader(file)['COMMENT']:
+            log.warning("Image %s already astrometrically solved by Astrometry.net" % file)
+            return file
+
+        try:
+            return solveField(file,
+                              self.output_dir,
+                              self.temp_dir,
+                              self.config_dict['general']['pix_scale'],
+                              wcs_cache=self.wcs_cache)
+        except Exception as e:
+            raise Exception("[runWithAstrometryNet] Cannot solve "
+                            "Astrometry for file: %s\n%s" % (file, str(e)))
+
+    def _createCatalog(self, file):
+        """
+        Create the SExtractor catalog (file.ldac) of a file to be used by
+        SCAMP.
+        """
+
+        sex = SExtractor()
+        sex.config['CATALOG_TYPE'] = "FITS_LDAC"
+        sex.config['CATALOG_NAME'] = file + ".ldac"
+        sex.config['DETECT_THRESH'] = self.config_dict['astrometry']['mask_thresh']
+        sex.config['DETECT_MINAREA'] = self.config_dict['astrometry']['mask_minarea']
+        # SATUR_LEVEL and NCOADD
+        try:
+            dh = ClFits(file, check_integrity=False)
+            nc = dh.getNcoadds()
+        except:
+            log.warning("Cannot read NCOADDS. Taken default (=1)")
+            nc = 1
+
+        sex.config['SATUR_LEVEL'] = int(nc) * int(self.config_dict['astrometry']['satur_level'])
+
+        try:
+            log.debug("*** Calling SExtractor....")
+            sex.run(file, updateconfig=True, clean=False)
+        except Exception as e:
+            log.error("Error in SExtractor call: %s" % str(e))
+            raise e
+
+        return file + ".ldac"
+
     def runWithAstrometryNet(self):
         """ 
         Start the computing of the coadded image, following the next steps:
@@ -641,60 +702,18 @@ class AstroWarp(object):
 
         ## STEP 0: Run solveAstrometry for first 
         log.debug("***Running solveAstrometry initialization ...")
-        # Cannot call solveAstrometry.runMultiSolver because of next error:
-        # "daemonic processes are not allowed to have children".
-        # A pool cannot call a function that creates a new pool.
-        # http://stackoverflow.com/questions/6974695/python-process-pool-non-daemonic
-        # Then, we solve sequentially.
-        solved_files = []
-        
-        # Check if input images have already been astrometrically calibrated.
-        for file in self.input_files:
-            solved_msg = "--Start of Astrometry.net WCS solution--"
-            if not solved_msg in fits.getheader(file)['COMMENT']:
-                try:
-                    solved = solveField(file,
-                                        self.output_dir,
-                                        self.temp_dir,
-                                        self.config_dict['general']['pix_scale'])
-                except Exception as e:
-                    raise Exception("[runWithAstrometryNet] Cannot solve "
-                                    "Astrometry for file: %s" % (file, str(e)))
-                else:
-                    solved_files.append(solved)
-            else:
-                log.warning("Image %s already astrometrically solved by Astrometry.net"%file)
-                solved_files.append(file)
+        # solveAstrometry.runMultiSolver cannot be called because this can
+        # run in a daemonic process of a Pool ("daemonic processes are not
+        # allowed to have children"). Instead, the files are solved in a
+        # bounded pool of threads (solve-field is an external program).
+        solved_files = parallelMap(self._solveField,
+                                   [(f,) for f in self.input_files],
+                                   self.n_workers)
 
         ## STEP 1: Create SExtractor catalogs (.ldac)
         log.debug("*** Creating objects catalog (SExtractor)....")
-        for file in solved_files:
-            sex = SExtractor()
-            #sex.config['CONFIG_FILE']="/disk-a/caha/panic/DEVELOP/PIPELINE/PANIC/trunk/config_files/sex.conf"
-            #sex.ext_config['CHECKIMAGE_TYPE'] = "OBJECTS"
-            sex.config['CATALOG_TYPE'] = "FITS_LDAC"
-            sex.config['CATALOG_NAME'] = file + ".ldac"
-            sex.config['DETECT_THRESH'] = self.config_dict['astrometry']['mask_thresh']
-            sex.config['DETECT_MINAREA'] = self.config_dict['astrometry']['mask_minarea']
-            # SATUR_LEVEL and NCOADD
-            try:
-                dh = ClFits(file, check_integrity=False)
-                nc = dh.getNcoadds()
-            except:
-                log.warning("Cannot read NCOADDS. Taken default (=1)")
-                nc = 1
-
-            sex.config['SATUR_LEVEL'] = int(nc) * int(self.config_dict['astrometry']['satur_level'])
-            
-            try:
-                log.debug("*** Calling SExtractor....")
-                sex.run(file, updateconfig=True, clean=False)
-            except Exception as e:
-                log.error("Error in SExtractor call: %s" %str(e))
-                raise e
-
-            
-            #filter_area(file + ".ldac")    
+        parallelMap(self._createCatalog, [(f,) for f in solved_files],
+                    self.n_workers)
                         
         ## STEP 2: Make the multi-astrometric calibration for each file (all overlapped-files together)
         log.debug("*** Doing multi-astrometric calibration (SCAMP)....")
@@ -846,36 +865,8 @@ class AstroWarp(object):
 
         ## STEP 1: Create SExtractor catalogs (.ldac)
         log.debug("*** Creating objects catalog (SExtractor)....")
-        for file in self.input_files:
-            sex = SExtractor()
-            sex.config['CATALOG_TYPE'] = "FITS_LDAC"
-            sex.config['CATALOG_NAME'] = file + ".ldac"
-            sex.config['DETECT_THRESH'] = self.config_dict['astrometry']['mask_thresh']
-            sex.config['DETECT_MINAREA'] = self.config_dict['astrometry']['mask_minarea']
-            # Test-PSFEx
-            #sex.ext_config['PSF_NAME'] = '/home/panic/DEVELOP/papi/tests/psfex/test.psf'
-            #sex.ext_config['PATTERN_TYPE'] = 'RINGS-HARMONIC'
-            #sex.ext_config['PARAMETERS_NAME'] = '/home/panic/DEVELOP/papi/tests/psfex/sextractor_psfex_psf.param'
-            # End-test-psfex
-            
-            # SATUR_LEVEL and NCOADD
-            try:
-                dh = ClFits(file, check_integrity=False)
-                nc = dh.getNcoadds()
-            except:
-                log.warning("Cannot read NCOADDS. Taken default (=1)")
-                nc = 1
-        
-            sex.config['SATUR_LEVEL'] = int(nc) * int(self.config_dict['astrometry']['satur_level'])
-
-            
-            try:
-                sex.run(file, updateconfig=True, clean=False)
-            except Exception as e:
-                raise e
-
-            
-            #filter_area(file + ".ldac")    
+        parallelMap(self._createCatalog, [(f,) for f in self.input_files],
+                    self.n_workers)
                         
         ## STEP 2: Make the multi-astrometric calibration for each file (all overlapped-files together)
         log.debug("*** Doing multi-astrometric calibration (SCAMP)....")
@@ -885,11 +876,40 @@ class AstroWarp(object):
         scamp.ext_config['SOLVE_PHOTOM'] = "N"
         cat_files = [(f + ".ldac") for f in self.input_files]
         #updateconfig=False means scamp will use the specified config file instead of the single config parameters
+
+        # Warm start: the cached solutions of the same pointing are given
+        # to SCAMP as .ahead files, and then a narrow search is enough.
+        ahead_files = []
+        if self.wcs_cache.enabled:
+            for file in self.input_files:
+                ahead = self.wcs_cache.writeAhead(file, self.pix_scale)
+                if ahead:
+                    ahead_files.append(ahead)
+            log.debug("Found %d cached WCS solutions" % len(ahead_files))
         
         try:
+            if len(ahead_files) == len(self.input_files):
+                scamp.ext_config['POSITION_MAXERR'] = 1.0
+                scamp.ext_config['POSANGLE_MAXERR'] = 1.0
             scamp.run(cat_files, updateconfig=False, clean=False)
         except Exception as e:
-            raise e
+            if not ahead_files:
+                raise e
+            log.warning("SCAMP failed from the cached WCS solutions (%s), "
+                        "trying again without them" % str(e))
+            for ahead in ahead_files:
+                os.remove(ahead)
+            ahead_files = []
+            scamp.ext_config.pop('POSITION_MAXERR', None)
+            scamp.ext_config.pop('POSANGLE_MAXERR', None)
+            scamp.run(cat_files, updateconfig=False, clean=False)
+        finally:
+            for ahead in ahead_files:
+                if os.path.exists(ahead):
+                    os.remove(ahead)
+
+        for file in self.input_files:
+            self.wcs_cache.storeFile(file, file + ".head", self.pix_scale)
         
         
         ## STEP 3: Make the coadding with SWARP, and using .head files created by SCAMP
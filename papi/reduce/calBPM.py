@@ -42,6 +42,7 @@ import datetime
 import os
 import sys
 import fileinput
+from concurrent.futures import ThreadPoolExecutor
 from scipy import interpolate, ndimage
 
 
@@ -61,6 +62,7 @@ from papi.misc.utils import clock
 from papi.datahandler.clfits import ClFits, isaFITS
 
 import papi.misc.robust as robust
+from papi.misc import fitsaccess
 from papi.misc.version import __version__
 
 
@@ -80,7 +82,7 @@ class BadPixelMask(object):
     """
 
     def __init__(self, input_file, outputfile=None, lthr=4.0, hthr=4.0, 
-                 temp_dir="/tmp", raw_flag=False):
+                 temp_dir="/tmp", raw_flag=False, step=4):
         
         self.input_file = input_file # file with the list of files to read and process 
         # Default parameters values
@@ -91,6 +93,9 @@ class BadPixelMask(object):
         # If true, neither check image type or readout mode
         self.raw_flag = raw_flag
 
+        # Sampling step (rows and columns) for the stats of the flattened flats
+        self.step = step
+
         if outputfile == None:
             dt = datetime.datetime.now()
             self.output = self.temp_dir + 'BadPixMask' + dt.strftime("-%Y%m%d%H%M%S")
@@ -181,82 +186,31 @@ class BadPixelMask(object):
         log.debug("Flatcombine created %s"%flat_comb)
 
         # STEP 2: Compute normalized flat 
-        # - Divide the resulting combined flat by its median (robust estimator)
+        # - Divide the resulting combined flat by its median (robust estimator);
+        # the inverse is stored, so each flat is later 'divided' by a product
         log.debug("Divide the resulting combined flat by its median...")
-        flat_comb_hdu = fits.open(flat_comb)
-        nExt = 1 if len(flat_comb_hdu)==1 else len(flat_comb_hdu)-1
-        if nExt ==1:
-            median = numpy.nanmedian(flat_comb_hdu[0].data)
-            flat_comb_hdu[0].data = flat_comb_hdu[0].data / median
-        else:
-            for i_nExt in range(0, nExt):
-                median = numpy.nanmedian(flat_comb_hdu[i_nExt+1].data)
-                flat_comb_hdu[i_nExt+1].data = flat_comb_hdu[i_nExt+1].data / median
-
+        with fitsaccess.fits_open(flat_comb) as flat_comb_hdu:
+            nExt = 1 if len(flat_comb_hdu)==1 else len(flat_comb_hdu)-1
+            exts = [0] if nExt == 1 else list(range(1, nExt + 1))
+            inv_flats = []
+            for ext in exts:
+                comb = flat_comb_hdu[ext].data.astype(numpy.float32)
+                comb /= numpy.nanmedian(comb)
+                # to avoid zero division error
+                comb[~(comb >= __epsilon)] = numpy.nan
+                inv_flats.append(numpy.reciprocal(comb, out=comb))
                 
         # STEP 3: Create and zero the rejection mask
-        if nExt==1: nx1,nx2 = flat_comb_hdu[0].data.shape
-        else: nx1,nx2 = flat_comb_hdu[1].data.shape
+        nx1, nx2 = inv_flats[0].shape
         bpm = numpy.zeros([nExt, nx1, nx2], dtype=numpy.uint8)
 
         # STEP 4: Loop for all input images and divide each by the master norm Flat
-        tmpf = numpy.zeros([nx1, nx2], dtype=numpy.float32)
-        for flat in good_flats:
-            log.debug("*** Processing file %s" % flat)
-            f_i = fits.open(flat)
-            for i_nExt in range(0, nExt):
-                log.info("*** Detector %d" % (i_nExt + 1))
-                if nExt == 1:
-                    # to avoid zero division error
-                    mydata = numpy.where(flat_comb_hdu[0].data < __epsilon, 
-                                        numpy.NaN, 
-                                        flat_comb_hdu[0].data) 
-                    tmpf = f_i[0].data / mydata
-                else:
-                    # to avoid zero division error
-                    mydata = numpy.where(flat_comb_hdu[i_nExt+1].data < __epsilon, 
-                                        numpy.NaN, 
-                                        flat_comb_hdu[i_nExt+1].data) 
-                    tmpf = f_i[i_nExt + 1].data / mydata
-
-                #mdat = numpy.ma.masked_array(tmpf, numpy.isnan(tmpf))
-                mdat = tmpf
-                std = numpy.nanstd(mdat)
-                r_std = robust.std(mdat)
-                median = numpy.nanmedian(mdat)
-                mad = numpy.nanmedian(numpy.abs(mdat - median))
-                # 1 / 0.6745 is the constant to convert from MAD to std
-                mad*=1.4826
-            
-                log.info("    Median: %s " % median)
-                log.info("    STD: %s" % std)
-                log.info("    STD(robust): %s" % r_std)
-                log.info("    MAD: %s" % mad)
-            
-                # Normalize the flattened image
-                tmpf = tmpf / median
-                r_std2 = robust.std(tmpf)
-
-                # Define the H and L thresholds
-                low = 1.0 - self.lthr * mad / median
-                high = 1.0 + self.hthr * mad / median
-                
-                log.info("    Low Threshold: %f" % low)
-                log.info("    High Threshold: %f" % high)
-            
-                # Count the number of NaN values (due to < __epsilon)
-                n_nan = numpy.count_nonzero(numpy.isnan(tmpf))
-                log.debug("Number of NaNs :%s" % n_nan)
-
-                # STEP 4.3 Define the bad pixels
-                tmpf.shape = nx1, nx2
-                #bpm[ i_nExt, numpy.isnan(tmpf)]+=1
-                bpm[ i_nExt, (tmpf < low) | (tmpf > high) | numpy.isnan(tmpf)]+=1
-            
-            log.debug("BPM updated with current flat %s", flat)
-            f_i.close()
-            
-        flat_comb_hdu.close()
+        # Each extension (detector) is processed in its own thread (numpy
+        # releases the GIL), reading each flat once.
+        with ThreadPoolExecutor(max_workers=nExt) as executor:
+            list(executor.map(self.__accumulateBadPixels,
+                              [good_flats] * nExt, exts, inv_flats, bpm))
+        del inv_flats
         
         # STEP 5: Go through the rejection mask and if a pixel has been marked bad 
         # more than a set number of times (a quarter of number of images), 
@@ -329,6 +283,59 @@ class BadPixelMask(object):
 
         return self.output
         
+    def __accumulateBadPixels(self, flats, ext, inv_flat, counts):
+        """
+        Accumulate in place, into the rejection mask 'counts' of a detector, 
+        the number of times each pixel is out of the [low, high] thresholds
+        in the input flats divided by the normalized master flat.
+
+        Parameters
+        ----------
+        flats: list
+            Dome flat filenames
+        ext: int
+            Extension of the detector in the flat files
+        inv_flat: array
+            Inverse of the normalized master flat of the detector (NaN 
+            where it is < epsilon)
+        counts: array
+            uint8 rejection mask of the detector, updated in place
+        """
+
+        tmpf = numpy.empty(inv_flat.shape, dtype=numpy.float32)
+        bad = numpy.empty(inv_flat.shape, dtype=bool)
+        for flat in flats:
+            log.debug("*** Processing file %s [%d]" % (flat, ext))
+            with fitsaccess.fits_open(flat) as f_i:
+                numpy.multiply(f_i[ext].data, inv_flat, out=tmpf, 
+                               casting='unsafe')
+
+            # Stats of the flattened image on a subsample
+            stats = robust.array_stats(tmpf, step=self.step)
+            median = stats['median']
+            # (MAD already converted to std)
+            mad = stats['mad']
+            log.info("*** Detector %d - %s" % (max(ext, 1), flat))
+            log.info("    Median: %s " % median)
+            log.info("    STD: %s" % stats['std'])
+            log.info("    MAD: %s" % mad)
+
+            # Normalize the flattened image
+            tmpf /= median
+
+            # Define the H and L thresholds
+            low = 1.0 - self.lthr * mad / median
+            high = 1.0 + self.hthr * mad / median
+            log.info("    Low Threshold: %f" % low)
+            log.info("    High Threshold: %f" % high)
+
+            # STEP 4.3 Define the bad pixels (NaNs, due to < __epsilon, included)
+            numpy.greater_equal(tmpf, low, out=bad)
+            bad &= (tmpf <= high)
+            numpy.logical_not(bad, out=bad)
+            counts += bad
+            log.debug("BPM updated with current flat %s", flat)
+
     def create_JM(self):
             """ 
              Algorith to create the BPM
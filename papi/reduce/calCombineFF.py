@@ -69,6 +69,7 @@ import astropy.io.fits as fits
 from papi.misc.paLog import log
 from papi.misc.fileUtils import removefiles
 from papi.datahandler.clfits import isaFITS
+from papi.misc.imfilter import median_filter_file
 from papi.misc.version import __version__
 
 
@@ -117,33 +118,16 @@ def combineFF(domeFF, skyFF, combinedFF=None):
         #smooth the domeFF
         log.debug("Doing Median smooth of domeFF ...")
         removefiles(domeFF.replace(".fits", "_smooth.fits"))
-        iraf.mscmedian(
-                    input=domeFF,
-                    output=domeFF.replace(".fits", "_smooth.fits"),
-                    xwindow=20,
-                    ywindow=20,
-                    outtype="median",
-                    fmedian='no',
-                    zloreject=0.2,
-                    zhireject=2.0)
-
-        # Or using scipy ( a bit slower then iraf...)
-        # from scipy import ndimage
-        # filtered = ndimage.gaussian_filter(f[0].data, 20)
+        median_filter_file(domeFF, domeFF.replace(".fits", "_smooth.fits"),
+                           xwindow=20, ywindow=20,
+                           zloreject=0.2, zhireject=2.0)
 
         # smooth the skyFF
         log.debug("Doing Median smooth of skyFF ...")
         removefiles(skyFF.replace(".fits", "_smooth.fits"))
-        iraf.mscmedian(
-                    input=skyFF,
-                    output=skyFF.replace(".fits", "_smooth.fits"),
-                    xwindow=20,
-                    ywindow=20,
-                    outtype="median",
-                    fmedian='no',
-                    zloreject=0.2,
-                    zhireject=2.0
-                    )
+        median_filter_file(skyFF, skyFF.replace(".fits", "_smooth.fits"),
+                           xwindow=20, ywindow=20,
+                           zloreject=0.2, zhireject=2.0)
                        
         # Divide domeFF by smoothed version
         removefiles(domeFF.replace(".fits", "_div_smooth.fits"))
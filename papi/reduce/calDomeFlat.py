@@ -71,6 +71,7 @@ from papi.misc.utils import clock, listToFile
 from papi.datahandler.clfits import ClFits, isaFITS
 from papi.misc.collapse import collapse
 import papi.misc.robust as robust
+from papi.misc.imfilter import median_filter_file
 from papi.misc.version import __version__
 
 # Pyraf modules
@@ -382,15 +383,8 @@ class MasterDomeFlat(object):
         # Median smooth the master (normalized) flat
         if self.__median_smooth:
             log.debug("Doing Median smooth of FF ...")
-            iraf.mscmedian(
-                    input=self.__output_filename,
-                    output=self.__output_filename.replace(".fits","_smooth.fits").replace("//","/"),
-                    xwindow=20,
-                    ywindow=20,
-                    outtype="median"
-                    )
-            shutil.move(self.__output_filename.replace(".fits", "_smooth.fits"),
-                        self.__output_filename)
+            median_filter_file(self.__output_filename, self.__output_filename,
+                               xwindow=20, ywindow=20)
 
 
         # Change back to the original working directory
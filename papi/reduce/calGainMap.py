@@ -297,7 +297,8 @@ class GainMap(object):
             extN = 0
         
         log.debug("STEP #1# - median computation")
-        rmed = robust.r_nanmedian(myflat[extN].data)
+        # (just to check if it is normalized, a subsample is enough)
+        rmed = robust.frame_stats(self.flat, extN)['median']
         log.debug("Median: %s", rmed)
 
         if rmed > 10 or rmed < -10:
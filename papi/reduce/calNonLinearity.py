@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+#
+# PAPI (PANIC PIpeline)
+#
+# calNonLinearity.py
+#
+# Build the per-pixel Non-Linearity model (LINMAX/LINPOLY) used by
+# correctNonLinearity_P4K.NonLinearityCorrection from a series of flat CDS
+# frames with increasing ITIME.
+#
+# It follows the algorithm of the commissioning scripts
+# (p_47_cyc7_nonlinearity_data.py, steps 3, 5 and 5.1; BD, PANIC-DEC-TN-02):
+#
+#   1. Linear extrapolation: for each pixel, fit the exponential ramp
+#      a + alpha * (1 - exp(-t / beta)) to the points below 20% of saturation
+#      (max. 10 points); the linear signal is a + (alpha / beta) * t.
+#   2. Polynomial: fit linear signal VS measured signal with a polynomial of
+#      order porder, from all the points down to minpts points, until the
+#      relative residuals of the used points have |mean| < 0.002 and
+#      std < 0.008. LINMAX is the last measured signal used in the fit.
+#   3. LINMAX is lowered by 2% (LINMAX / 0.98 * 0.96), as the models used in
+#      production (NONLIN_*_0003); with adjust_max=False, the unadjusted
+#      model (NONLIN_*_0002) is created.
+#
+# But instead of looping over the 16M pixels with np.polyfit/curve_fit, all
+# the pixels of a tile (band of rows) are fitted at once solving the normal
+# equations (batched Levenberg-Marquardt for the exponential), with vectorized
+# acceptance tests, and the tiles are processed in a pool of processes.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+################################################################################
+# Import necessary modules
+
+import sys
+import os
+import fileinput
+import argparse
+import datetime
+import multiprocessing
+
+# Interact with FITS files
+import astropy.io.fits as fits
+import numpy as np
+
+# PAPI
+from papi.misc.paLog import log
+from papi.misc import fitsaccess
+from papi.misc.version import __version__
+
+
+def unwrap_self_fitTile(arg, **kwarg):
+    return NonLinearityModel.fitTile(*arg, **kwarg)
+
+
+class NonLinearityModel(object):
+    """
+    Class used to build the Non-Linearity model of a PANIC (H4RG) detector
+    from a series of flat CDS frames (SEF) taken with increasing ITIME.
+
+    The model file created has the format expected by
+    correctNonLinearity_P4K.NonLinearityCorrection: a primary header and two
+    extensions, LINMAX (max. level for the correction) and LINPOLY (cube of
+    polynomial coefficients, highest first, without offset).
+    """
+
+    def __init__(self, input_files, output_filename="/tmp/nl_model.fits",
+                 porder=4, minpts=10, skip_first=1, min_signal=10000,
+                 use_after=None, tile_rows=8, ncpus=None, adjust_max=True):
+        """
+        Init the object.
+
+        Parameters
+        ----------
+        input_files: list
+            List of flat CDS frames (each one, the median of several
+            exposures) with different ITIME.
+        output_filename: str
+            Filename of the model to be created.
+        porder: int
+            Order of the polynomial to fit.
+        minpts: int
+            Minimum number of points used in the polynomial fit.
+        skip_first: int
+            Number of first points not used to compute the residuals of the
+            polynomial fit (1 for rrr-mpia, 2 for lir).
+        min_signal: float
+            Pixels with all the signals below this value are not correctable.
+        use_after: str
+            Date (YYYY-MM-DD) from which the model can be used (USE_AFT);
+            default, DATE-OBS of the input data.
+        tile_rows: int
+            Number of rows of each tile processed at once.
+        ncpus: int
+            Number of processes; if None, all the CPUs available.
+        adjust_max: bool
+            Lower LINMAX by 2% (LINMAX / 0.98 * 0.96), as step 5.1 of the 
+            commissioning scripts.
+        """
+
+        self.input_files = input_files
+        self.output_filename = output_filename
+        self.porder = porder
+        self.minpts = minpts
+        self.skip_first = skip_first
+        self.min_signal = min_signal
+        self.use_after = use_after
+        self.tile_rows = tile_rows
+        self.ncpus = ncpus if ncpus else multiprocessing.cpu_count()
+        self.adjust_max = adjust_max
+
+        if len(self.input_files) < self.minpts:
+            msg = "Found %d input files, but at least %d are required" % \
+                (len(self.input_files), self.minpts)
+            log.error(msg)
+            raise Exception(msg)
+
+        # Files are sorted by ITIME
+        self.itimes = np.array([float(fitsaccess.get_header(f)['ITIME'])
+                                for f in self.input_files])
+        order = np.argsort(self.itimes, kind='stable')
+        self.itimes = self.itimes[order]
+        self.input_files = [self.input_files[i] for i in order]
+
+        self.shape = fitsaccess.get_shape(self.input_files[0])
+        if len(self.shape) != 2:
+            msg = "Input files must be 2D single (non MEF) FITS images"
+            log.error(msg)
+            raise Exception(msg)
+        for f in self.input_files[1:]:
+            if fitsaccess.get_shape(f) != self.shape:
+                msg = "Input file %s does not match the shape %s" % (f, self.shape)
+                log.error(msg)
+                raise Exception(msg)
+
+    def create(self):
+        """
+        Build the Non-Linearity model and write it to the output file.
+
+        Returns
+        -------
+        The filename of the model created.
+        """
+
+        log.info("Start creating Non-Linearity model from %d files" %
+                 len(self.input_files))
+
+        ny, nx = self.shape
+        nlmaxs = np.empty((ny, nx), dtype=np.float32)
+        nlpolys = np.empty((self.porder, ny, nx), dtype=np.float32)
+
+        tiles = [(r0, min(r0 + self.tile_rows, ny))
+                 for r0 in range(0, ny, self.tile_rows)]
+
+        if self.ncpus > 1 and len(tiles) > 1:
+            pool = multiprocessing.Pool(processes=self.ncpus)
+            try:
+                results = pool.map_async(unwrap_self_fitTile,
+                                         zip([self] * len(tiles), tiles)).get()
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [self.fitTile(tile) for tile in tiles]
+
+        for (r0, r1), (tile_max, tile_poly) in zip(tiles, results):
+            nlmaxs[r0:r1] = tile_max
+            nlpolys[:, r0:r1] = tile_poly
+
+        if self.adjust_max:
+            # 2% lower correction limit (step 5.1)
+            nlmaxs = nlmaxs / np.float32(0.98) * np.float32(0.96)
+
+        n_bad = np.isnan(nlmaxs).sum()
+        log.info("Non-correctable pixels: %d (%.2f%%)" %
+                 (n_bad, 100.0 * n_bad / nlmaxs.size))
+
+        self.__write(nlmaxs, nlpolys)
+        log.info("Non-Linearity model created: %s" % self.output_filename)
+
+        return self.output_filename
+
+    def fitTile(self, tile):
+        """
+        Fit the model for the pixels of a tile (band of rows).
+
+        Parameters
+        ----------
+        tile: tuple
+            (r0, r1) rows of the tile
+
+        Returns
+        -------
+        A tuple (nlmaxs, nlpolys) of the tile, with shapes (rows, nx) and
+        (porder, rows, nx).
+        """
+
+        r0, r1 = tile
+        nx = self.shape[1]
+        npix = (r1 - r0) * nx
+
+        # signals: (npix, npts), only the rows of the tile are read
+        signals = np.empty((npix, len(self.input_files)), dtype=np.float64)
+        for i, f in enumerate(self.input_files):
+            signals[:, i] = fitsaccess.get_window(f, np.s_[r0:r1, :]).ravel()
+
+        a, b = self.linearExtrapolation(signals)
+        linsignals = a[:, None] + b[:, None] * self.itimes[None, :]
+        nlmaxs, nlpolys = self.polynomialFit(signals, linsignals, np.isfinite(b))
+
+        return (nlmaxs.reshape(r1 - r0, nx).astype(np.float32),
+                nlpolys.T.reshape(self.porder, r1 - r0, nx).astype(np.float32))
+
+    def linearExtrapolation(self, signals, max_iter=50):
+        """
+        Fit for each pixel the exponential ramp a + alpha * (1 - exp(-t/beta))
+        to the first points (below 20% of the saturation, max. 10 points,
+        min. 3 points), with a batched Levenberg-Marquardt.
+
+        Parameters
+        ----------
+        signals: array
+            (npix, npts) measured signals, sorted by ITIME
+        max_iter: int
+            Number of iterations
+
+        Returns
+        -------
+        A tuple (a, b) of arrays with the intercept and the slope
+        (alpha / beta) of the linear signal of each pixel; NaN for
+        non-correctable pixels.
+        """
+
+        t = self.itimes[None, :]
+        # points used: < 20% saturation (last point), first 10 at most
+        w = (signals < 0.20 * signals[:, -1:]).astype(np.float64)
+        w[:, 10:] = 0
+        valid = (signals.max(axis=1) >= self.min_signal) & (w.sum(axis=1) >= 3)
+
+        # p = (a, alpha, beta), initial values as in the commissioning scripts
+        n = valid.sum()
+        y = signals[valid]
+        w = w[valid]
+        p = np.tile(np.array([0.0, 4e5, 2e2]), (n, 1))
+        lam = np.full(n, 1e-3)
+
+        def model(p):
+            e = np.exp(-t / p[:, 2:3])
+            return p[:, 0:1] + p[:, 1:2] * (1 - e), e
+
+        f, e = model(p)
+        cost = (w * (y - f) ** 2).sum(axis=1)
+        for _ in range(max_iter):
+            # Jacobian (n, npts, 3)
+            jac = np.empty(y.shape + (3,))
+            jac[..., 0] = 1.0
+            jac[..., 1] = 1 - e
+            jac[..., 2] = -p[:, 1:2] * e * t / p[:, 2:3] ** 2
+            jtw = jac * w[..., None]
+            jtj = np.einsum('nki,nkj->nij', jtw, jac)
+            jtr = np.einsum('nki,nk->ni', jtw, y - f)
+            # Marquardt damping
+            damp = jtj.copy()
+            idx = np.arange(3)
+            damp[:, idx, idx] *= (1 + lam[:, None])
+            damp[:, idx, idx] += 1e-12
+            dp = _solve(damp, jtr)
+
+            p_new = p + dp
+            # beta must be positive
+            p_new[:, 2] = np.where(p_new[:, 2] > 0, p_new[:, 2], p[:, 2] / 2)
+            f_new, e_new = model(p_new)
+            cost_new = (w * (y - f_new) ** 2).sum(axis=1)
+
+            better = np.isfinite(cost_new) & (cost_new < cost)
+            p[better] = p_new[better]
+            f[better] = f_new[better]
+            e[better] = e_new[better]
+            cost[better] = cost_new[better]
+            lam = np.where(better, lam / 10, lam * 10)
+            lam = np.clip(lam, 1e-10, 1e10)
+
+        a = np.full(signals.shape[0], np.nan)
+        b = np.full(signals.shape[0], np.nan)
+        a[valid] = p[:, 0]
+        b[valid] = p[:, 1] / p[:, 2]
+
+        return a, b
+
+    def polynomialFit(self, signals, linsignals, valid):
+        """
+        Fit for each pixel the polynomial linear signal VS measured signal,
+        reducing the number of points until the fit is good enough.
+
+        Parameters
+        ----------
+        signals: array
+            (npix, npts) measured signals, sorted by ITIME
+        linsignals: array
+            (npix, npts) linear signals
+        valid: array
+            (npix) pixels with valid linear extrapolation
+
+        Returns
+        -------
+        A tuple (nlmaxs, nlpolys) with the max. correctable signal (npix) and
+        the polynomial coefficients (npix, porder), highest first and without
+        offset.
+        """
+
+        npix, npts = signals.shape
+        porder = self.porder
+        nlmaxs = np.full(npix, np.nan)
+        # non-correctable pixels: polynomial [0, ..., 0, 1] (identity)
+        nlpolys = np.zeros((npix, porder))
+        nlpolys[:, -1] = 1.0
+
+        # Scale the signals to [0, 1] to keep the normal equations
+        # well-conditioned
+        scale = np.abs(signals).max(axis=1)
+        scale[scale == 0] = 1.0
+        x = signals / scale[:, None]
+        # powers x^0 ... x^(2*porder), (npix, npts, 2*porder+1)
+        xpow = x[..., None] ** np.arange(2 * porder + 1)
+        ij = np.arange(porder + 1)[:, None] + np.arange(porder + 1)[None, :]
+
+        pending = valid.copy()
+        for ipt in range(npts, self.minpts - 1, -1):
+            # skip if last point is > 98% saturation
+            cand = pending & ~(signals[:, ipt - 1] > signals[:, -1] * 0.98)
+            if not cand.any():
+                continue
+            sel = np.where(cand)[0]
+
+            # normal equations for all the candidate pixels at once
+            psum = xpow[sel, :ipt].sum(axis=1)
+            ata = psum[:, ij]
+            atb = np.einsum('nkp,nk->np', xpow[sel, :ipt, :porder + 1],
+                            linsignals[sel, :ipt])
+            coef = _solve(ata, atb)   # lowest power first, scaled x
+
+            # relative residual of all points
+            fit = np.einsum('nkp,np->nk', xpow[sel, :, :porder + 1], coef)
+            relerror = (fit - linsignals[sel]) / linsignals[sel]
+            res = relerror[:, self.skip_first:ipt]
+            resmean = res.mean(axis=1)
+            resstd = res.std(axis=1)
+            good = (np.abs(resmean) < 0.002) & (resstd < 0.008)
+            if not good.any():
+                continue
+            sel = sel[good]
+            coef = coef[good]
+
+            # skip super-corrected pixels: large linear signal
+            correction = linsignals[sel, :ipt] / signals[sel, :ipt]
+            ok = ~np.any(correction > 1.5, axis=1)
+            sel_ok = sel[ok]
+            # unscale, highest power first, without the offset
+            powers = np.arange(porder, 0, -1)
+            nlpolys[sel_ok] = coef[ok][:, powers] / scale[sel_ok, None] ** powers
+            nlmaxs[sel_ok] = signals[sel_ok, ipt - 1]
+            pending[sel] = False
+
+        return nlmaxs, nlpolys
+
+    def __write(self, nlmaxs, nlpolys):
+        """
+        Write the model to the output file.
+        """
+
+        header = fitsaccess.get_header(self.input_files[0])
+        date_obs = header.get('DATE-OBS', '')
+        if not self.use_after:
+            self.use_after = str(date_obs)[:10]
+
+        hdu = fits.PrimaryHDU()
+        # keywords checked by NonLinearityCorrection.checkHeader
+        keys = ['INSTRUME', 'PREAD', 'PSKIP', 'LSKIP', 'READMODE', 'IDLEMODE',
+                'IDLETYPE', 'DETROT90', 'DETXYFLI', 'B_EXT1', 'B_DSUB1',
+                'B_VREST1', 'B_VBIAG1', 'DETSEC', 'CHIPID']
+        for key in keys:
+            if key in header:
+                hdu.header.set(key, header[key], header.comments[key])
+
+        name = os.path.splitext(os.path.basename(self.output_filename))[0]
+        hdu.header['ID'] = name
+        hdu.header['DESCR'] = 'Non-linearity correction data %s mode' % \
+            header.get('READMODE', '')
+        hdu.header['PAPITYPE'] = ('MASTER_LINEARITY', 'TYPE of PANIC Pipeline generated file')
+        hdu.header['USE_AFT'] = (self.use_after, 'Use for data taken after this date')
+        hdu.header['DATE-OBS'] = (date_obs, 'UTC date of reference data')
+        hdu.header['DATE'] = (datetime.datetime.utcnow().isoformat(), 'UTC date of file creation')
+        hdu.header['NLPORDER'] = (self.porder, 'Order of the NL polynomial')
+        hdu.header['NLMINPTS'] = (self.minpts, 'Min. number of points of the fit')
+        hdu.header['NCOMBINE'] = (len(self.input_files), 'Number of files used')
+        hdu.header['NLADJMAX'] = (self.adjust_max, 'LINMAX lowered by 2% (/0.98*0.96)')
+        hdu.header.set('PAPIVERS', __version__, 'PANIC Pipeline version')
+        for f in self.input_files:
+            hdu.header.add_history('File used: %s' % os.path.basename(f))
+
+        # add saturation map and polynomial in extensions
+        maphdu = fits.ImageHDU(nlmaxs, name='LINMAX')
+        maphdu.header['BUNIT'] = 'ADU'
+        maphdu.header['DESCR'] = 'Max level for linearity correction'
+        polyhdu = fits.ImageHDU(nlpolys, name='LINPOLY')
+        polyhdu.header['DESCR'] = 'Polynomial coefficients (highest first), no offset'
+
+        fits.HDUList([hdu, maphdu, polyhdu]).writeto(self.output_filename,
+                                                     overwrite=True)
+
+
+def _solve(a, b):
+    """
+    Solve the stack of linear systems a[i] x[i] = b[i]; singular systems
+    are solved in the least-squares sense.
+    """
+
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('nij,nj->ni', np.linalg.pinv(a), b)
+
+
+################################################################################
+# main
+def main(arguments=None):
+
+    desc = """Build the per-pixel Non-Linearity model (LINMAX, LINPOLY) of a
+PANIC detector from a list of flat CDS frames with increasing ITIME.
+"""
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument("-s", "--source",
+                  action="store", dest="source_file_list",
+                  help="Source file list of flat CDS frames (SEF), with different ITIME.")
+
+    parser.add_argument("-o", "--output", type=str, dest="output_filename",
+                  action="store", default="/tmp/nl_model.fits",
+                  help="filename of the NL model to create (default: %(default)s)")
+
+    parser.add_argument("-p", "--porder", type=int, dest="porder",
+                  action="store", default=4,
+                  help="Order of the polynomial (default: %(default)s)")
+
+    parser.add_argument("-m", "--minpts", type=int, dest="minpts",
+                  action="store", default=10,
+                  help="Min. number of points of the polynomial fit (default: %(default)s)")
+
+    parser.add_argument("-k", "--skip_first", type=int, dest="skip_first",
+                  action="store", default=1,
+                  help="First points not used for the fit residuals, "
+                  "1 for rrr-mpia, 2 for lir (default: %(default)s)")
+
+    parser.add_argument("-u", "--use_after", type=str, dest="use_after",
+                  action="store", default=None,
+                  help="Date (YYYY-MM-DD) from which the model can be used "
+                  "(default: DATE-OBS of data)")
+
+    parser.add_argument("-n", "--ncpus", type=int, dest="ncpus",
+                  action="store", default=None,
+                  help="Number of processes (default: all CPUs)")
+
+    parser.add_argument("-a", "--no_adjust_max", dest="adjust_max",
+                  action="store_false", default=True,
+                  help="Do not lower LINMAX by 2%% (unadjusted model, "
+                  "as NONLIN_*_0002)")
+
+    args = parser.parse_args()
+
+    if len(sys.argv[1:]) < 1:
+       parser.print_help()
+       sys.exit(0)
+
+    if not args.source_file_list or not os.path.isfile(args.source_file_list):
+        parser.print_help()
+        parser.error("incorrect number of arguments ")
+
+    filelist = [line.replace("\n", "") for line in fileinput.input(args.source_file_list)]
+
+    try:
+        nlm = NonLinearityModel(filelist, args.output_filename, args.porder,
+                                args.minpts, args.skip_first,
+                                use_after=args.use_after, ncpus=args.ncpus,
+                                adjust_max=args.adjust_max)
+        nlm.create()
+    except Exception as e:
+        log.error("Error creating NL model: %s" % str(e))
+        raise e
+
+######################################################################
+if __name__ == "__main__":
+    sys.exit(main())
@@ -56,6 +56,7 @@ from papi.misc.utils import clock, listToFile
 from papi.datahandler.clfits import ClFits, isaFITS, checkDataProperties
 from papi.misc.collapse import collapse
 import papi.misc.robust as robust
+from papi.misc.imfilter import median_filter_file
 from papi.misc.version import __version__
 
 # Interact with FITS files
@@ -184,18 +185,7 @@ class SuperSkyFlat(object):
         ## Median smooth the master (normalized) flat
         if self.__median_smooth:
             log.debug("Doing Median smooth of FF ...")
-            iraf.mscmedian(
-                    input=tmp1,
-                    output=tmp1.replace(".fits","_smooth.fits"),
-                    xwindow=20,
-                    ywindow=20,
-                    outtype="median"
-                    )
-            shutil.move(tmp1.replace(".fits","_smooth.fits"), tmp1)
-            
-            # Or using scipy ( a bit slower then iraf...)
-            #from scipy import ndimage
-            #filtered = ndimage.gaussian_filter(f[0].data, 20)
+            median_filter_file(tmp1, tmp1, xwindow=20, ywindow=20)
 
 
         
@@ -227,14 +217,12 @@ class SuperSkyFlat(object):
                 naxis2 = f[1].header['NAXIS2']
                 offset1 = int(naxis1 * 0.1)
                 offset2 = int(naxis2 * 0.1)
-                median = robust.r_nanmedian(f[ext_name].data[offset1 : naxis1 - offset1,
-                                                    offset2 : naxis2 - offset2])
-                mean = robust.r_nanmean(f[ext_name].data[offset1 : naxis1 - offset1, 
-                                                  offset2 : naxis2 - offset2])
-            
-                mode = 3 * median - 2 * mean
-                rob_mean = robust.r_nanmean(f[ext_name].data[offset1 : naxis1 - offset1, 
-                                                  offset2 : naxis2 - offset2])
+                stats = robust.array_stats(f[ext_name].data[offset1 : naxis1 - offset1,
+                                                            offset2 : naxis2 - offset2])
+                median = stats['median']
+                mean = stats['mean']
+                mode = stats['mode']
+                rob_mean = stats['mean']
                 log.debug("MEDIAN = %f" % median)
                 log.debug("MEAN = %f" % mean)
                 log.debug("ROB_MEAN = %f" % rob_mean)
@@ -250,7 +238,8 @@ class SuperSkyFlat(object):
                 # Do the normalization wrt chip 1
                 for i_ext in range(1, len(f)):
                     f[i_ext].data = robust.r_divisionN(f[i_ext].data, norm_value)
-                    norm_mean = robust.r_nanmean(f[i_ext].data)
+                    # (sanity check, a subsample is enough)
+                    norm_mean = robust.array_stats(f[i_ext].data, step=4)['mean']
                     if norm_mean < 0.5 or norm_mean > 1.5:
                         log.warning("Suspicious normalized SuperFlat obtained. Mean value =%f" % norm_mean)
                 
@@ -263,13 +252,11 @@ class SuperSkyFlat(object):
                 # Note that in Numpy, arrays are indexed as rows X columns (y, x),
                 # contrary to FITS standard (NAXIS1=columns, NAXIS2=rows).
                 #
-                median = robust.r_nanmedian(f[0].data[200: 2048-200, 2048+200: 4096-200])
-                #
-                mean = robust.r_nanmean(f[0].data[200: 2048-200, 2048+200: 4096-200])
-                #
-                rob_mean = robust.r_nanmean(f[0].data[200: 2048-200, 2048+200: 4096-200])
-
-                mode = 3 * median - 2 * mean
+                stats = robust.array_stats(f[0].data[200: 2048-200, 2048+200: 4096-200])
+                median = stats['median']
+                mean = stats['mean']
+                rob_mean = stats['mean']
+                mode = stats['mode']
                 log.debug("MEDIAN = %s" % median)
                 log.debug("MEAN = %s" % mean)
                 log.debug("ROB_MEAN = %s" % rob_mean)
@@ -283,7 +270,7 @@ class SuperSkyFlat(object):
                 
                 #f[0].data = f[0].data / rob_mean
                 f[0].data = robust.r_division(f[0].data, norm_value)
-                norm_mean = robust.r_nanmean(f[0].data)
+                norm_mean = robust.array_stats(f[0].data, step=4)['mean']
                 if norm_mean < 0.5 or norm_mean > 1.5:
                     log.warning("Suspicious normalized SuperFlat obtained. Mean value =%f" % norm_mean)
                     
@@ -294,13 +281,12 @@ class SuperSkyFlat(object):
                 naxis2 = f[0].header['NAXIS2']
                 offset1 = int(naxis1 * 0.1)
                 offset2 = int(naxis2 * 0.1)
-                median = robust.r_nanmedian(f[0].data[offset1: naxis1 - offset1,
-                                                    offset2: naxis2 - offset2])
-                mean = robust.r_nanmean(f[0].data[offset1: naxis1 - offset1,
-                                                  offset2: naxis2 - offset2])
-                rob_mean = robust.r_nanmean(f[0].data[offset1: naxis1 - offset1,
-                                                  offset2: naxis2 - offset2])
-                mode = 3 * median - 2 * mean
+                stats = robust.array_stats(f[0].data[offset1: naxis1 - offset1,
+                                                     offset2: naxis2 - offset2])
+                median = stats['median']
+                mean = stats['mean']
+                rob_mean = stats['mean']
+                mode = stats['mode']
                 log.debug("MEDIAN = %f" % median)
                 log.debug("MEAN = %f" % mean)
                 log.debug("MEAN_ROB = %f" % rob_mean)
@@ -314,7 +300,7 @@ class SuperSkyFlat(object):
                 msg = "Normalization of master (PANIC single detector frame or O2k) flat frame by value = %d)" % norm_value
                 
                 f[0].data = robust.r_division(f[0].data, norm_value)
-                norm_mean = robust.r_nanmean(f[0].data)
+                norm_mean = robust.array_stats(f[0].data, step=4)['mean']
                 log.debug("NORM_MEAN = %f" % norm_mean)
                 if norm_mean < 0.5 or norm_mean > 1.5:
                     log.warning("Suspicious normalized SuperFlat obtained. Mean value = %f" % norm_mean)
@@ -68,6 +68,7 @@ from papi.misc.collapse import collapse
 import papi.misc.robust as robust
 from papi.misc.version import __version__
 from papi.misc.mef import MEF
+from papi.misc.imfilter import median_filter_file
 
 # Pyraf modules
 from pyraf import iraf
@@ -258,32 +259,30 @@ class MasterTwilightFlat(object):
             #log.debug("Flat frame '%s' - EXPTIME= %f TYPE= %s FILTER= %s" 
             #    %(iframe, f.expTime(), f.getType(), f.getFilter()))
             # Compute the mean count value in chip to find out good frames (good enough ??)
-            mean = 0
-            myfits = fits.open(iframe, ignore_missing_end=True)
+            # (a subsample is enough for this check, and only it is read from disk)
             if f.mef:
                 log.debug("Found a MEF file")
                 try:
-                    for i in range(1, f.next + 1):
-                        mean += robust.r_nanmean(myfits[i].data)
-                    mean = float(mean / f.next)
+                    means = [robust.frame_stats(iframe, i)
+                             for i in range(1, f.next + 1)]
+                    mean = float(sum([m['mean'] for m in means]) / f.next)
                 except Exception as e:
                     log.error("Error computing MEAN of image")
                     raise e
                 
                 # take into account cubes (they will be summed aritmetically)
-                if len(myfits[1].data.shape) > 2:
-                    mean = mean * myfits[1].data.shape[0]
+                if len(means[0]['shape']) > 2:
+                    mean = mean * means[0]['shape'][0]
                     
                 log.debug("MEAN value of TwFlat (MEF) = %f", mean)
             else:
-                myfits = fits.open(iframe, ignore_missing_end=True)
-                mean = robust.r_nanmean(myfits[0].data)
+                stats = robust.frame_stats(iframe, 0)
+                mean = stats['mean']
                 # take into account cubes (they will be summed aritmetically)
-                if len(myfits[0].data.shape) > 2:
-                    mean = mean * myfits[0].data.shape[0]
+                if len(stats['shape']) > 2:
+                    mean = mean * stats['shape'][0]
                 log.debug("MEAN value of Twflat (SEF) = %d", mean)
                 
-            myfits.close()            
             
             if ( f_expt!=-1 and (f.getFilter()!=f_filter or f.getType()!=f_type 
                                  or f.getReadMode() != f_readmode)):
@@ -505,19 +504,8 @@ class MasterTwilightFlat(object):
         # Median smooth the master flat
         if self.__median_smooth:
             log.debug("Doing Median smooth of FF ...")
-            iraf.mscred.mscmedian(
-                    input=comb_flat_frame,
-                    output=comb_flat_frame.replace(".fits","_smooth.fits"),
-                    xwindow=20,
-                    ywindow=20,
-                    outtype="median"
-                    )
-            shutil.move(comb_flat_frame.replace(".fits","_smooth.fits"), 
-                        comb_flat_frame)
-            
-        # Or using scipy (a bit slower than iraf...)
-        # from scipy import ndimage
-        # filtered = ndimage.gaussian_filter(f[0].data, 20)
+            median_filter_file(comb_flat_frame, comb_flat_frame,
+                               xwindow=20, ywindow=20)
         
         # STEP 4: Normalize the flat-field (if MEF, normalize wrt chip SG1)
         # Compute the mean of the image
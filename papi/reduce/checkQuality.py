@@ -43,11 +43,14 @@ import os
 import astropy.io.fits as fits
 import sys
 import re
+import tempfile
 
 from pyraf import iraf
 
 from papi.astromatic.sextractor import SExtractor
+from papi.astromatic import toolrunner
 from papi.misc.paLog import log
+from papi.misc import fitsaccess
 
 
 class CheckQuality(object):
@@ -96,11 +99,11 @@ class CheckQuality(object):
             self.sex_input_file = input_file
         
         # Compute SATUR_LEVEL from NCOADD in header
-        with fits.open(input_file) as hdu:
-            if 'NCOADDS' in hdu[0].header:
-                self.satur_level = hdu[0].header['NCOADDS'] * 50000
-            else:
-                self.satur_level = sat_level
+        header = fitsaccess.get_header(input_file)
+        if 'NCOADDS' in header:
+            self.satur_level = header['NCOADDS'] * 50000
+        else:
+            self.satur_level = sat_level
                 
     def estimateFWHM(self, psfmeasure=False):
         """ 
@@ -132,38 +135,9 @@ class CheckQuality(object):
         
         # Check whether detector selection can be done
         if self.window != 'all':
-            f = fits.open(self.input_file)
-            if len(f) != 5:
+            if fitsaccess.get_next(self.input_file) != 5:
                 raise Exception("Error, expected a MEF file with 4 extensions")
 
-        # SExtractor configuration
-        catalog_file = "test.cat"
-        try:
-            papi_home = os.path.dirname(sys.modules['papi'].__file__)
-            sex_cnf = papi_home + "/config_files/sextractor.sex"
-        except Exception as e:
-            log.error("Error, cannot get papi home directory")
-            raise e
-        
-        sex = SExtractor()
-        sex.config['CONFIG_FILE'] = sex_cnf
-        # sex.config['PARAMETERS_NAME'] = os.environ['PAPI_HOME'] + "/irdr/src/config/default.param"
-        sex.ext_config['CATALOG_TYPE'] = "ASCII"
-        sex.ext_config['CHECKIMAGE_TYPE'] = "NONE"
-        sex.ext_config['PIXEL_SCALE'] = self.pixsize
-        sex.ext_config['GAIN'] = self.gain
-        sex.ext_config['SATUR_LEVEL'] = self.satur_level
-        sex.ext_config['CATALOG_NAME'] = catalog_file
-        # sex.ext_config['DETECT_THRESH'] = config_dict['astrometry']['mask_thresh']
-        # sex.ext_config['DETECT_MINAREA'] = config_dict['astrometry']['mask_minarea']
-        
-        # SExtractor execution
-        try:
-            sex.run(self.sex_input_file, updateconfig=False, clean=False)
-        except Exception as e:
-            log.error("Error running SExtractor: %s"%str(e))  
-            raise e
-        
         ## SExtractor Catalog columns required and expected (sextractor.param)
         # 0 NUMBER           # Running object number
         # --------- Position Parameters --------------
@@ -191,83 +165,16 @@ class CheckQuality(object):
         # 14 FLUXERR_AUTO     # RMS error for AUTO flux [counts]
         # 15 XWIN_IMAGE       # Windowed position estimate along x [pix]
         # 16 YWIN_IMAGE       # Windowed position estimate along y [pix]
-      
-        source_file = catalog_file
-
-        try:
-            if self.write:
-                fits_file = fits.open(self.input_file, 'update')
-            else:
-                fits_file = fits.open(self.input_file, 'readonly')
-        except Exception as e:
-            log.error("Error while openning file %s", self.input_file)
-            raise e
-        
-        try:
-            if len(fits_file) > 1:  # is a MEF
-                naxis1 = fits_file[1].header['NAXIS1']
-                naxis2 = fits_file[1].header['NAXIS2']
-            else:  # is a simple FITS      
-                naxis1 = fits_file[0].header['NAXIS1']
-                naxis2 = fits_file[0].header['NAXIS2']
-        except KeyError as e:
-            log.error("Error while reading FITS header NAXIS keywords :%s",str(e))
-            raise Exception("Error while reading FITS header NAXIS keywords")
-            
-        
-        # Now, read the SEx catalog
-        # fwhm_world=[float(line.split()[7]) for line in fileinput.input(source_file)]
-        # matrix=[line.split() for line in fileinput.input(source_file)]
-        # b=numpy.array(matrix)
-
-        a = numpy.loadtxt(source_file, ndmin=2)
+        a = self._extract(self.sex_input_file)
 
         if len(a) == 0:
             raise Exception("Empty catalog, No stars found.")
 
-        good_stars = []
+        naxis2, naxis1 = self._imageSize()
+
         # Select 'best' stars for the estimation
-        std = numpy.std(a[:, 8])
-        print("Initial STD of FWHM=", std)
-        for i in range(0, a.shape[0]):
-            x = a[i, 1]
-            y = a[i, 2]
-            xwin = a[i, 15]
-            ywin = a[i, 16]
-            isoarea = a[i, 6]
-            ellipticity = a[i, 7]
-            fwhm = a[i, 8]
-            flux = a[i, 10]
-            flux_err = a[i, 11]
-            flags = a[i, 12]
-            # fa=a[i,13]
-            # fea=a[i,14]
-            if flux_err != 0:
-                snr = flux / flux_err
-                # print("SNR= %s" %snr)
-            else:
-                continue
-            if (x > self.edge_x and x < naxis1 - self.edge_x and 
-                y > self.edge_y and y < naxis2 - self.edge_y and
-                ellipticity < self.ellipmax and fwhm > 0.1 and 
-                fwhm < 20 and flags == 0 and   
-                isoarea > float(self.isomin) and snr > self.min_snr): 
-                # and fwhm<5*std it does not work many times
-                good_stars.append(a[i, :])
-                # print "%s SNR_APER= %s " %(i, snr)
-                # print "ISO_AREA= %s  ISO_MIN=%s"%(isoarea,self.isomin)
-            else:
-                """
-                print "STAR #%s"%i
-                print "X=%s  Y=%s"%(x,y)
-                print "  SNR=",snr
-                print "  FWHM=",fwhm
-                print "  AREA=",isoarea
-                print "  ELLIP=", ellipticity
-                """
-                pass
-
-        m_good_stars = numpy.array(good_stars)
+        print("Initial STD of FWHM=", numpy.std(a[:, 8]))
+        m_good_stars = self._goodStars(a, naxis1, naxis2)
         
         print("Found <%d> GOOD stars" % len(m_good_stars))
         
@@ -283,7 +190,13 @@ class CheckQuality(object):
                   ma.masked_outside(m_good_stars[:, 8], 0.01, 3*std).mean())
             
             if self.write:
-                fits_file[0].header.set('hierarch PAPI.SEEING', efwhm*self.pixsize)
+                try:
+                    with fits.open(self.input_file, 'update') as fits_file:
+                        fits_file[0].header.set('hierarch PAPI.SEEING',
+                                                efwhm*self.pixsize)
+                except Exception as e:
+                    log.error("Error while openning file %s", self.input_file)
+                    raise e
 
             # 2nd Estimation Method (psfmeasure)
             if psfmeasure:
@@ -300,18 +213,136 @@ class CheckQuality(object):
                     log.error("%s" % str(e))
         else:
             print("Not enough good stars found !!")
-            fits_file.close(output_verify='ignore')    
             return -1, -1, -1, -1
         
-        # print "FWHM-median(pixels)= ", numpy.median(fwhm_world), numpy.amin(fwhm_world), numpy.amax(fwhm_world)
-        # print "FWHM-mean(pixels)= ", numpy.mean(fwhm_world)
+        # coordinates of the last star of the catalog
+        return efwhm, std, a[-1, 15], a[-1, 16]
+
+    def estimateFWHMWindows(self):
+        """
+        Estimate the FWHM of the whole image and, for MEF files, of each
+        window/detector (Q1, Q2, ... = extension 1, 2, ...) from a single 
+        SExtractor run on the whole file (the extension of each object is
+        taken from the EXT_NUMBER column of the catalog).
         
-        fits_file.close(output_verify='ignore')
+        The 'best' stars are selected as in estimateFWHM().
+
+        Returns
+        -------
+        A dictionary {window: (efwhm, std)}, with the windows 'all' and 
+        'Q1'...'Qn' (only for MEF files); (-1, -1) if not enough good 
+        stars were found in the window.
+        """
+
+        n_ext = fitsaccess.get_next(self.input_file) - 1
+        a = self._extract(self.input_file, ext_number=n_ext > 0)
+
+        if len(a) == 0:
+            raise Exception("Empty catalog, No stars found.")
+
+        naxis2, naxis1 = self._imageSize()
+
+        windows = {'all': a}
+        for ext in range(1, n_ext + 1):
+            windows['Q%d' % ext] = a[a[:, -1] == ext]
+
+        result = {}
+        for window, stars in windows.items():
+            good_stars = self._goodStars(stars, naxis1, naxis2)
+            if len(good_stars) > self.MIN_NUMBER_GOOD_STARS:
+                result[window] = (numpy.median(good_stars[:, 8]),
+                                  numpy.std(good_stars[:, 8]))
+            else:
+                result[window] = (-1, -1)
+
+        return result
+
+    def _extract(self, source, ext_number=False):
+        """
+        Run SExtractor on the source (file or file[ext]) and return its
+        catalog (see the columns in estimateFWHM()) as an array with a row
+        per object. If ext_number is True, the extension number of the
+        objects is added as last column.
+        """
+
+        # SExtractor configuration
+        try:
+            papi_home = os.path.dirname(sys.modules['papi'].__file__)
+            sex_cnf = papi_home + "/config_files/sextractor.sex"
+        except Exception as e:
+            log.error("Error, cannot get papi home directory")
+            raise e
         
-        # cleanup files
-        # os.unlink(catalog_file)
+        # a catalog per run, so several files can be evaluated concurrently
+        fd, catalog_file = tempfile.mkstemp(suffix='.cat', prefix='papi_cq_')
+        os.close(fd)
+
+        sex = SExtractor()
+        sex.config['CONFIG_FILE'] = sex_cnf
+        sex.ext_config['CATALOG_TYPE'] = "ASCII"
+        sex.ext_config['CHECKIMAGE_TYPE'] = "NONE"
+        sex.ext_config['PIXEL_SCALE'] = self.pixsize
+        sex.ext_config['GAIN'] = self.gain
+        sex.ext_config['SATUR_LEVEL'] = self.satur_level
+        sex.ext_config['CATALOG_NAME'] = catalog_file
+        if ext_number:
+            with open(papi_home + "/config_files/sextractor.param") as param_file:
+                params = param_file.read()
+            sex.ext_config['PARAMETERS_NAME'] = toolrunner.materialize(
+                params + "\nEXT_NUMBER\n", '.param')
+        # sex.ext_config['DETECT_THRESH'] = config_dict['astrometry']['mask_thresh']
+        # sex.ext_config['DETECT_MINAREA'] = config_dict['astrometry']['mask_minarea']
         
-        return efwhm, std, xwin, ywin
+        # SExtractor execution
+        try:
+            sex.run(source, updateconfig=False, clean=False)
+            return numpy.loadtxt(catalog_file, ndmin=2)
+        except Exception as e:
+            log.error("Error running SExtractor: %s"%str(e))  
+            raise e
+        finally:
+            os.unlink(catalog_file)
+
+    def _imageSize(self):
+        """
+        Return the size (naxis2, naxis1) of the image (of the extensions, if
+        it is a MEF).
+        """
+
+        try:
+            ext = 1 if fitsaccess.get_next(self.input_file) > 1 else 0
+            shape = fitsaccess.get_shape(self.input_file, ext)
+        except KeyError as e:
+            log.error("Error while reading FITS header NAXIS keywords :%s",str(e))
+            raise Exception("Error while reading FITS header NAXIS keywords")
+
+        return shape[-2], shape[-1]
+
+    def _goodStars(self, a, naxis1, naxis2):
+        """
+        Select the 'best' stars of a catalog to estimate the FWHM: away from
+        the edges, round, not flagged, and with enough area and SNR
+        (FLUX_APER/FLUXERR_APER).
+        """
+
+        if len(a) == 0:
+            return a
+
+        x, y = a[:, 1], a[:, 2]
+        fwhm = a[:, 8]
+        flux, flux_err = a[:, 10], a[:, 11]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            snr = numpy.where(flux_err != 0, flux / flux_err, 0)
+
+        # and fwhm<5*std it does not work many times
+        good = ((flux_err != 0) &
+                (x > self.edge_x) & (x < naxis1 - self.edge_x) &
+                (y > self.edge_y) & (y < naxis2 - self.edge_y) &
+                (a[:, 7] < self.ellipmax) & (fwhm > 0.1) & (fwhm < 20) &
+                (a[:, 12] == 0) & (a[:, 6] > float(self.isomin)) &
+                (snr > self.min_snr))
+
+        return a[good]
 
     
     def getAverageFWHMfromPsfmeasure(self, image, coord_file):
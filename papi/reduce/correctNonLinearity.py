@@ -43,6 +43,7 @@ import os
 import fileinput
 import argparse
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 
 # PAPI modules
@@ -62,7 +63,8 @@ class NonLinearityCorrection(object):
     algorithm described by Bernhard Dorner at PANIC-DEC-TN-02_0_1.pdf.
     """
     def __init__(self, r_offset, model, input_files, out_dir='/tmp', 
-                suffix='_LC', force=False, coadd_correction=True):
+                suffix='_LC', force=False, coadd_correction=True,
+                tile_rows=256, n_threads=1):
         """
         Init the object.
         
@@ -101,6 +103,16 @@ class NonLinearityCorrection(object):
             If true and NCOADDS>1, divide the data by NCOADDS, apply NLC and then 
             multiply by NCOADDS.
 
+        tile_rows: int
+            Number of detector rows evaluated at once by correctData(); the
+            working set of a tile (data + 4 coeff planes) fits in the CPU cache
+            for the default value.
+
+        n_threads: int
+            Number of threads used to evaluate the tiles (NumPy releases the GIL);
+            keep it to 1 when the files are already processed in parallel with
+            runMultiNLC().
+
         Returns
         -------
         outfitsname: list
@@ -114,6 +126,8 @@ class NonLinearityCorrection(object):
         self.out_dir = out_dir
         self.force = force
         self.coadd_correction = coadd_correction
+        self.tile_rows = max(1, int(tile_rows))
+        self.n_threads = max(1, int(n_threads))
         
         if not os.access(self.out_dir, os.F_OK):
             try:
@@ -248,11 +262,12 @@ class NonLinearityCorrection(object):
             try:
                 ref_offset_hdu = fits.open(self.r_offset)
                 ref_offset = ref_offset_hdu[0].data.astype('float32')
+                ref_offset_hdu.close()
             except Exception as e:
                 log.error("Cannot read reference offset file '%s'" % self.r_offset)
                 raise e
         else:
-            ref_offset = np.zeros(hdulist[0].data.shape, dtype='float32')
+            ref_offset = None
             log.warning("No reference offset file provided. Using zero offset.")
 
         
@@ -319,56 +334,33 @@ class NonLinearityCorrection(object):
         # Fin-del-parche 
 
         
-        # load file data
+        # load file data (LINPOLY planes are kept as they are, c4 to c1)
         data = hdulist[0].data
         nlmaxs = nlhdulist['LINMAX'].data
-        nlpolys = np.rollaxis(nlhdulist['LINPOLY'].data, 0, 3)
-
+        nlpolys = nlhdulist['LINPOLY'].data
 
         # Check if data is a subset of the full detector
         # (if so, we need to crop the data)
         # Extract subsection using DETSEC
         try:
             x1, x2, y1, y2 = self.parse_detsec(datadetsec)
+            # Print x,y ranges for debugging
+            log.debug(f"Using DETSEC: x1={x1}, x2={x2}, y1={y1}, y2={y2}")
             nlmaxs_subsection = nlmaxs[y1:y2, x1:x2]
-            nlpolys_subsection = nlpolys[y1:y2, x1:x2, :]  # Assuming last dimension is polynomial coefficients
-            sub_r_offset = ref_offset[y1:y2, x1:x2]
+            nlpolys_subsection = nlpolys[:, y1:y2, x1:x2]
+            sub_r_offset = ref_offset[y1:y2, x1:x2] if ref_offset is not None else None
         except ValueError:
             log.warning("Using full data since DETSEC parsing failed")
             nlmaxs_subsection = nlmaxs
             nlpolys_subsection = nlpolys
-
-        # Print x,y ranges for debugging
-        log.debug(f"Using DETSEC: x1={x1}, x2={x2}, y1={y1}, y2={y2}")
-
-        # subtract reference offset taking into account the coadd_correction (repetitions integrated)
-        log.info("Subtracting reference offset")
-        log.debug("Mean value of reference offset: %s" % str(np.mean(ref_offset)))
-        log.debug("Mean value of data: %s" % str(np.mean(data)))
-        data = data - sub_r_offset*n_coadd
-        log.debug("Mean value of data after offset: %s" % str(np.mean(data)))
-        # Correct data from n_coadd  
-        data = data / n_coadd
-
-        # calculate linear corrected data
-        lindata = self.polyval_map(nlpolys_subsection, data)
-        
-        # mask saturated inputs - to use nan it has to be a float array
-        lindata[data > nlmaxs_subsection] = np.nan
-        # mask where max range is nan
-        # (first, take into account the option of cubes as input images) 
-        if len(lindata.shape) == 3: 
-            # we have a 3D image (cube)
-            for i in range(lindata.shape[0]):
-                lindata[i, np.isnan(nlmaxs_subsection)] = np.nan
-        else:
-            # we have a single 2D image
-            lindata[np.isnan(nlmaxs_subsection)] = np.nan
-
-        
-        # Undo the coadd_correction
-        lindata = lindata * n_coadd       
-        linhdu.data = lindata.astype('float32')
+            sub_r_offset = ref_offset
+
+        # Subtract the reference offset taking into account the coadd_correction
+        # (repetitions integrated), evaluate the model, mask saturated pixels
+        # and undo the coadd_correction, all in one pass
+        log.info("Subtracting reference offset and applying NLC model")
+        linhdu.data = self.correctData(data, nlpolys_subsection, 
+                                       nlmaxs_subsection, sub_r_offset, n_coadd)
         
         # add some info in the header
         linhdu.header['HISTORY'] = 'Nonlinearity correction applied'
@@ -389,7 +381,6 @@ class NonLinearityCorrection(object):
         # close input files
         hdulist.close()
         nlhdulist.close()
-        ref_offset_hdu.close()
         linhdulist.close()
 
         log.info("Non-linearity correction applied to file '%s'" % outfitsname)
@@ -454,8 +445,8 @@ class NonLinearityCorrection(object):
     def polyval_map(self, poly, map):
         """
         Evaluate individual polynomials on an array. Looping over each pixel
-        is stupid, therefore we loop over the order and calculate the
-        polynomial directly.
+        is stupid, therefore we loop over the order and evaluate the
+        polynomial with the Horner scheme (no power arrays are computed).
         Note: The output is a float array!
         
         Input
@@ -473,11 +464,88 @@ class NonLinearityCorrection(object):
         """
 
         order = poly.shape[-1]
-        polymap = map * 0.
-        for io in range(order):
-            polymap += poly[Ellipsis, -io-1] * map**(io+1)
+        polymap = poly[Ellipsis, 0] * map
+        for io in range(1, order):
+            polymap += poly[Ellipsis, io]
+            polymap *= map
         return polymap
 
+    def correctData(self, data, nlpolys, nlmaxs, r_offset=None, n_coadd=1):
+        """
+        Apply the NL model to a 2D image or a cube of 2D images. The evaluation
+        is done in float32 with the Horner scheme, in place, over tiles of 
+        'tile_rows' rows, fusing the reference offset subtraction, the coadd 
+        correction, the saturation masking and the final rescaling, so no 
+        full-frame temporaries are created. Equivalent to:
+
+            d = (data - r_offset * n_coadd) / n_coadd
+            lin = polyval_map(nlpolys, d) * n_coadd
+            lin[(d > nlmaxs) | isnan(nlmaxs)] = nan
+
+        Parameters
+        ----------
+        data: array_like
+            Raw data, a 2D image or a cube (planes along the first axis).
+        nlpolys: array_like
+            Polynomial coefficients without constant offset (c4 to c1), as 
+            planes along the first axis (LINPOLY layout).
+        nlmaxs: array_like
+            Maximum linearity range of each pixel (NaN for bad pixels).
+        r_offset: array_like
+            Reference offset (bias) to subtract, or None.
+        n_coadd: int
+            Number of coadds integrated in data.
+
+        Returns
+        -------
+        lindata: array_like
+            float32 array with the corrected data (saturated and uncorrectable 
+            pixels set to NaN), same shape as data.
+        """
+
+        lindata = np.empty(data.shape, dtype=np.float32)
+        nlpolys = np.asarray(nlpolys, dtype=np.float32)
+        nlmaxs = np.asarray(nlmaxs, dtype=np.float32)
+        if r_offset is not None:
+            # offset in the units of the input (integrated) data
+            r_offset = np.asarray(r_offset, dtype=np.float32) * np.float32(n_coadd)
+        
+        n_coadd = np.float32(n_coadd)
+        n_rows = data.shape[-2]
+        n_planes = data.shape[0] if data.ndim == 3 else 0
+        tiles = [(p, r, min(r + self.tile_rows, n_rows)) 
+                 for p in (range(n_planes) if n_planes else [None])
+                 for r in range(0, n_rows, self.tile_rows)]
+
+        def correct_tile(tile):
+            p, r1, r2 = tile
+            src = data[r1:r2] if p is None else data[p, r1:r2]
+            out = lindata[r1:r2] if p is None else lindata[p, r1:r2]
+            # the only temporary: the normalized input tile
+            d = np.array(src, dtype=np.float32)
+            if r_offset is not None:
+                d -= r_offset[r1:r2]
+            if n_coadd != 1:
+                d /= n_coadd
+            # Horner: ((c4*d + c3)*d + c2)*d + c1)*d
+            np.multiply(nlpolys[0, r1:r2], d, out=out)
+            for c in nlpolys[1:]:
+                out += c[r1:r2]
+                out *= d
+            if n_coadd != 1:
+                out *= n_coadd
+            # mask saturated inputs and pixels where max range is NaN
+            np.copyto(out, np.nan, where=~(d <= nlmaxs[r1:r2]))
+
+        if self.n_threads > 1 and len(tiles) > 1:
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                list(executor.map(correct_tile, tiles))
+        else:
+            for tile in tiles:
+                correct_tile(tile)
+        
+        return lindata
+
 ################################################################################
 # main
 
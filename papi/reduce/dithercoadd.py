@@ -0,0 +1,653 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+# PAPI (PANIC PIpeline)
+#
+# dithercoadd.py
+#
+# Register and coadd a stack of dithered frames (shift-and-add). It is a
+# native (NumPy) implementation of IRDR::dithercubemean, with the same
+# input list format, shift convention, background/sigma estimation
+# (histogram mode, hist.c), weighting scheme:
+#
+#    weight_i = NCOMBINE * EXPTIME * gainmap / sigma_i^2
+#
+# and combinations:
+#
+#    average: clipped weighted mean of the non-masked values of each pixel,
+#             rejecting the values beyond NSIG*sigma (MAD) from the median
+#             when there are MINCLIP or more values (IRDR::cube_mean)
+#    sum:     mean of the upper half of the values of each pixel, without
+#             weights (IRDR::cube_mean_max); EXPTIME is set to the total
+#             exposure time of the stack
+#    median:  median of the non-masked values of each pixel (not in IRDR)
+#
+# All the values of a pixel are needed, so the stack is combined in bands of
+# rows of the output canvas, reading only the rows of each frame that fall
+# into the band; i.e., the memory is bounded by 'max_mem' instead of
+# O(n_frames x canvas) as in IRDR.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+################################################################################
+# Import necessary modules
+
+import sys
+import argparse
+import warnings
+
+import numpy
+import astropy.io.fits as fits
+
+# PAPI
+from papi.misc.paLog import log
+from papi.misc.version import __version__
+
+
+# Clipping threshold and minimun number of values required for clipping,
+# as in IRDR (cube.c and mean.c)
+NSIG = 2.0
+MINCLIP = 5
+# Value set to pixels with no data (zero weight)
+BLANK = 0.0
+# Histogram analysis of the background (IRDR hist.c)
+HIST_BLOCKSIZE = 256
+HIST_MAXNBINS = 400000
+HIST_MAXNITER = 5
+HIST_NSIG = 5.0
+HIST_TOL = 0.01
+
+
+def read_stack_list(input_list):
+    """
+    Read the list of frames to coadd and their dither offsets.
+
+    Parameters
+    ----------
+    input_list: str or list
+        A text file with lines as 'filename  x_offset  y_offset [...]' (the
+        format used by IRDR::dithercubemean and produced by
+        ReductionSet.getWCSPointingOffsets()), or a python list of
+        (filename, x_offset, y_offset) tuples.
+
+    Returns
+    -------
+    Two lists, the filenames and a (N x 2) array with the offsets (pixels).
+    """
+
+    files = []
+    offsets = []
+    if isinstance(input_list, list):
+        for item in input_list:
+            files.append(item[0])
+            offsets.append((float(item[1]), float(item[2])))
+    else:
+        with open(input_list, "r") as fd:
+            for line in fd:
+                fields = line.split()
+                if len(fields) < 3 or fields[0].startswith("#"):
+                    continue
+                files.append(fields[0])
+                offsets.append((float(fields[1]), float(fields[2])))
+
+    return files, numpy.array(offsets, dtype=numpy.float64).reshape(-1, 2)
+
+
+def get_border(offsets, pad=4):
+    """
+    Compute the border (pixels) to add to the frame size to hold all the
+    shifted frames (same as get_border() in IRDR::shift.c).
+    """
+
+    if len(offsets) == 0:
+        return pad
+    maxshift = numpy.max(numpy.abs(offsets)) + 2
+    imax = int(maxshift + 1.0)
+    imax += (pad - (imax % pad))
+
+    return imax
+
+
+def _mean32(values):
+    """
+    Mean of a 1D array with a sequential single precision sum, as in IRDR.
+    """
+
+    return numpy.float32(numpy.cumsum(values, dtype=numpy.float32)[-1] /
+                         numpy.float32(len(values)))
+
+
+def _lower_median(values):
+    """
+    Median of a 1D array as IRDR median(): lower of the middle two values.
+    """
+
+    n = len(values)
+    return numpy.partition(values, (n - 1) // 2)[(n - 1) // 2]
+
+
+def clipped_mean(values, nsig):
+    """
+    Clipped mean of a 1D array as IRDR mean_nw(): values beyond nsig*sigma
+    (MAD) from the median are rejected if there are MINCLIP or more values.
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float32)
+    n = len(values)
+    if n == 0:
+        return BLANK
+    if n < MINCLIP:
+        return float(_mean32(values))
+
+    med = _lower_median(values)
+    absdev = numpy.abs(values.astype(numpy.float64) - med).astype(numpy.float32)
+    sig = numpy.float32(numpy.partition(absdev, n // 2)[n // 2] / 0.6745)
+    nsig = numpy.float32(nsig)
+    good = values[(values >= med - nsig * sig) & (values <= med + nsig * sig)]
+
+    return float(_mean32(good)) if len(good) else BLANK
+
+
+def _bisearch(x, cbins):
+    """
+    Interpolated position of the count x in the cumulative histogram, as
+    IRDR bisearch() (bins centered on integers).
+    """
+
+    f32 = numpy.float32
+    if x <= cbins[0]:
+        return f32(0.0)
+    if x > cbins[-1]:
+        return f32(len(cbins))
+    right = int(numpy.searchsorted(cbins, x, side='left'))
+    left = right - 1
+
+    return (f32(left) + (f32(x) - f32(cbins[left])) /
+            f32(cbins[right] - cbins[left]) + f32(0.5))
+
+
+def _histogram_mode(bins):
+    """
+    Mode and sigma of a histogram (counts of consecutive integer values) by
+    iterative k-sigma clipping, as IRDR histmode() (with the same single
+    and double precision operations).
+    """
+
+    f32 = numpy.float32
+    nbins = len(bins)
+    cbins = numpy.cumsum(bins, dtype=numpy.int64)
+    wcbins = numpy.cumsum(numpy.arange(nbins, dtype=f32) * bins.astype(f32),
+                          dtype=f32)
+    lcut, hcut = 0, nbins - 1
+    prevsig = f32(9e9)
+    for i in range(HIST_MAXNITER):
+        dn0 = cbins[lcut - 1] if lcut > 0 else 0
+        wdn0 = float(wcbins[lcut - 1]) if lcut > 0 else 0.0
+        dn = int(cbins[hcut] - dn0)
+        wdn = float(wcbins[hcut]) - wdn0
+        q25 = _bisearch(dn0 + dn // 4, cbins)
+        med = _bisearch(dn0 + dn // 2, cbins)
+        sig = f32((float(med) - float(q25)) / 0.6745)
+        avg = f32(wdn / dn) if dn > 0 else f32(lcut)
+
+        if sig < 0.1 or abs(float(sig / prevsig) - 1.0) < HIST_TOL:
+            break
+
+        lcut = max(int(float(med) - HIST_NSIG * float(sig) - 0.5), 0)
+        hcut = min(int(float(med) + HIST_NSIG * float(sig) + 0.5), nbins - 1)
+        prevsig = sig
+
+    if avg > med:
+        mode = f32(3.0 * float(med) - 2.0 * float(avg))
+    else:
+        mode = avg
+
+    return mode, sig
+
+
+def histogram_stats(data, block=HIST_BLOCKSIZE):
+    """
+    Background (mode) and sigma of a frame as IRDR histcalcf(): histogram
+    analysis of the pixel values (rounded to integers) in blocks of
+    block x block pixels, and clipped mean of the modes and sigmas of
+    the blocks.
+
+    Returns
+    -------
+    (bkg, sigma)
+    """
+
+    ny, nx = data.shape
+    nyb = min(block, ny)
+    nxb = min(block, nx)
+    modes = []
+    sigmas = []
+    for i in range(0, ny - nyb + 1, nyb):
+        for j in range(0, nx - nxb + 1, nxb):
+            values = numpy.asarray(data[i:i + nyb, j:j + nxb],
+                                   dtype=numpy.float32).ravel() + 0.5
+            # values that do not fit in the histogram are not used
+            values = values[(values > -1) & (values < HIST_MAXNBINS)]
+            if values.size == 0:
+                continue
+            ivalues = values.astype(numpy.int64)
+            minbin = int(ivalues.min())
+            bins = numpy.bincount(ivalues - minbin)
+            mode, sig = _histogram_mode(bins)
+            modes.append(numpy.float32(minbin) + mode)
+            sigmas.append(sig)
+
+    modes = numpy.array(modes, dtype=numpy.float32)
+    sigmas = numpy.array(sigmas, dtype=numpy.float32)
+
+    return clipped_mean(modes, 5.0), clipped_mean(sigmas, 5.0)
+
+
+def shift_frame(data, wmap, xshift, yshift, border, rows=None):
+    """
+    Shift a frame and its weight map with bilinear interpolation into the
+    output canvas (same algorithm as shift_image() in IRDR::shift.c).
+
+    Only the block of the canvas covered by the frame is computed, so no
+    canvas-sized arrays are allocated.
+
+    Parameters
+    ----------
+    data, wmap: 2D arrays
+        frame data and weight map (same shape); bad pixels must have
+        weight = 0.
+    xshift, yshift: float
+        shift to apply (canvas = input + shift + border)
+    border: int
+        border added to each side of the frame in the canvas
+    rows: tuple
+        (i0, i1) range of input rows to use; default, all the rows. The
+        data and wmap arrays must contain the rows [i0, i1+1).
+
+    Returns
+    -------
+    (y0, x0, wdata, weight): canvas position of the block and the shifted
+    weighted data (weight * value) and weights.
+    """
+
+    # single precision, in the same order of operations as IRDR
+    xpos = numpy.float32(border + numpy.float32(xshift))
+    ypos = numpy.float32(border + numpy.float32(yshift))
+    ixoffset = int(xpos + 1)
+    iyoffset = int(ypos + 1)
+    xfrac = numpy.float32(ixoffset) - xpos
+    yfrac = numpy.float32(iyoffset) - ypos
+    area = [numpy.float32(a) for a in
+            ((1.0 - float(xfrac)) * (1.0 - float(yfrac)),
+             float(xfrac) * (1.0 - float(yfrac)),
+             (1.0 - float(xfrac)) * float(yfrac),
+             float(xfrac) * float(yfrac))]
+
+    aw = [area[0] * wmap[:-1, :-1], area[1] * wmap[:-1, 1:],
+          area[2] * wmap[1:, :-1], area[3] * wmap[1:, 1:]]
+    weight = aw[0] + aw[1] + aw[2] + aw[3]
+    wdata = (aw[0] * data[:-1, :-1] + aw[1] * data[:-1, 1:] +
+             aw[2] * data[1:, :-1] + aw[3] * data[1:, 1:])
+    del aw
+
+    i0 = rows[0] if rows else 0
+
+    return (iyoffset + i0, ixoffset, wdata, weight)
+
+
+class DitherCoadd(object):
+    """
+    Coadd (shift-and-add) a set of dithered frames into a single frame,
+    using the dither offsets and a gain map as weight map.
+
+    It is a replacement of IRDR::dithercubemean, but keeping into memory only
+    the output canvas (and the weights) and a band of rows of the stack.
+    """
+
+    def __init__(self, input_list, gain_file, output_file, weight_file=None,
+                 type_comb='average', nsig=NSIG, zero_offset=True,
+                 max_mem=512):
+        """
+        Init the object.
+
+        Parameters
+        ----------
+        input_list: str or list
+            file listing the frames to coadd and the offsets between each one
+            (see read_stack_list())
+
+        gain_file: str
+            gain map to use for the weights (bad pixels = 0); if None, unity
+            weights are used.
+
+        output_file: str
+            filename of the output coadded frame
+
+        weight_file: str
+            filename of the output weight map; if None, it is derived from
+            output_file (.weight.fits).
+
+        type_comb: str
+            combination type:
+            - average: weighted mean of the stack rejecting the values
+              beyond nsig*sigma from the median (as IRDR::cube_mean)
+            - sum: mean of the upper half of the values of the stack,
+              without weights, as the 'sum' of IRDR::dithercubemean
+              (IRDR::cube_mean_max)
+            - median: median of the stack (weights only used as mask)
+
+        nsig: float
+            clipping threshold for 'average'
+
+        zero_offset: bool
+            if True, background level of the frames is normalized with an
+            additive zero offset (as IRDR does).
+
+        max_mem: int
+            maximum memory (MB) to use for the bands of rows of the stack.
+        """
+
+        self.files, self.offsets = read_stack_list(input_list)
+        if len(self.files) == 0:
+            raise Exception("No valid frames found in input list")
+
+        self.gain_file = gain_file
+        self.output_file = output_file
+        if weight_file:
+            self.weight_file = weight_file
+        else:
+            self.weight_file = output_file.replace(".fits", ".weight.fits")
+
+        if type_comb not in ('average', 'sum', 'median'):
+            raise Exception("Combination type '%s' not supported" % type_comb)
+        self.type_comb = type_comb
+        self.nsig = nsig
+        self.zero_offset = zero_offset
+        self.max_mem = max_mem
+
+        # Computed in coadd()
+        self.border = get_border(self.offsets)
+        self.bkg = numpy.zeros(len(self.files), dtype=numpy.float32)
+        self.scale = numpy.zeros(len(self.files), dtype=numpy.float32)
+        self.wscale = numpy.ones(len(self.files), dtype=numpy.float32)
+
+    def __readGain(self, shape):
+        """
+        Read the gain map, or unity weights if no gain map was given.
+        """
+
+        if self.gain_file:
+            gain = fits.getdata(self.gain_file).astype(numpy.float32)
+            if gain.shape != shape:
+                raise Exception("Gain map and images have different shapes")
+            gain[~numpy.isfinite(gain)] = 0.0
+        else:
+            gain = numpy.ones(shape, dtype=numpy.float32)
+
+        return gain
+
+    def __frameScales(self):
+        """
+        Compute background, zero offset and weight scale of each frame.
+        The frames are read one by one.
+        """
+
+        shape = None
+        for i, f in enumerate(self.files):
+            with fits.open(f, memmap=True, ignore_missing_end=True) as hdu:
+                header = hdu[0].header
+                if shape is None:
+                    shape = hdu[0].shape
+                elif hdu[0].shape != shape:
+                    raise Exception("Frame %s has a different shape" % f)
+                bkg, sig = histogram_stats(hdu[0].data)
+
+            if bkg <= 0 or sig <= 0:
+                raise Exception("Background/sigma <= 0 for %s (BKG=%f, SIG=%f)"
+                                % (f, bkg, sig))
+
+            if 'INT_TIME' in header:
+                exptime = header['INT_TIME']
+            else:
+                exptime = header.get('EXPTIME', 1.0)
+            ncombine = header.get('NCOMBINE', 1.0)
+            # single precision, as IRDR getwmap()
+            sig = numpy.float32(sig)
+            variance = sig * sig
+            self.bkg[i] = bkg
+            self.wscale[i] = (numpy.float32(ncombine) *
+                              numpy.float32(exptime) / variance)
+            log.debug("%s BKG=%f SIG=%f OFFSETS=%s" % (f, bkg, sig,
+                                                       self.offsets[i]))
+
+        if self.zero_offset:
+            self.scale = _mean32(self.bkg) - self.bkg
+
+        return shape
+
+    def coadd(self):
+        """
+        Run the coaddition and write the output frame (and weight map).
+
+        Returns
+        -------
+        (output_file, weight_file); weight_file is None for 'sum'.
+        """
+
+        log.info("Start DitherCoadd (%s) of %d frames" % (self.type_comb,
+                                                          len(self.files)))
+        shape = self.__frameScales()
+        ny, nx = shape
+        gain = self.__readGain(shape)
+        canvas_shape = (ny + 2 * self.border, nx + 2 * self.border)
+        log.debug("Adding border of %d pixels" % self.border)
+
+        coadd, sumw = self.__bands(gain, canvas_shape)
+
+        # Write output frame, using the header of the first frame
+        header = fits.getheader(self.files[0])
+        header.set('NCOMBINE', len(self.files), 'Number of frames combined')
+        header.set('DATAMODE', float(_mean32(self.bkg)), 'Mean background level')
+        if self.type_comb == 'sum':
+            itime = header.get('ITIME', 1.0)
+            nexp = header.get('NEXP', 1)
+            header.set('EXPTIME', len(self.files) * itime * nexp)
+        header.set('PAPIVERS', __version__, 'PANIC Pipeline version')
+        header.add_history("[dithercoadd] %s coadd of %d frames" %
+                           (self.type_comb, len(self.files)))
+        fits.writeto(self.output_file, coadd, header=header,
+                     overwrite=True, output_verify='ignore')
+
+        weight_file = None
+        if self.type_comb != 'sum':
+            fits.writeto(self.weight_file, sumw, header=header,
+                         overwrite=True, output_verify='ignore')
+            weight_file = self.weight_file
+
+        log.debug("Coadded frame created: %s" % self.output_file)
+
+        return (self.output_file, weight_file)
+
+    def __bands(self, gain, canvas_shape):
+        """
+        Combine the stack in bands of canvas rows.
+        """
+
+        nframes = len(self.files)
+        ny_c, nx_c = canvas_shape
+        ny = ny_c - 2 * self.border
+        # values, weights and the sorted copies of the combination, float32
+        row_bytes = nframes * nx_c * 4 * 6
+        band = max(8, int(self.max_mem * 1024 * 1024 / row_bytes))
+        log.debug("Combining in bands of %d rows" % band)
+
+        coadd = numpy.full(canvas_shape, BLANK, dtype=numpy.float32)
+        sumw = numpy.zeros(canvas_shape, dtype=numpy.float32)
+        hdus = [fits.open(f, memmap=True, ignore_missing_end=True)
+                for f in self.files]
+        try:
+            for r0 in range(0, ny_c, band):
+                r1 = min(ny_c, r0 + band)
+                values = numpy.full((nframes, r1 - r0, nx_c), numpy.nan,
+                                    dtype=numpy.float32)
+                if self.type_comb == 'sum':
+                    # as in IRDR, all the values are used: no data = 0.0
+                    values[:] = self.scale[:, None, None]
+                weights = numpy.zeros((nframes, r1 - r0, nx_c),
+                                      dtype=numpy.float32)
+                for i in range(nframes):
+                    iy = int(numpy.float32(self.border + numpy.float32(
+                        -self.offsets[i][1])) + 1)
+                    # input rows [i0, i1) produce canvas rows [i0+iy, i1+iy)
+                    i0 = max(0, r0 - iy)
+                    i1 = min(ny - 1, r1 - iy)
+                    if i1 <= i0:
+                        continue
+                    data = numpy.array(hdus[i][0].section[i0:i1 + 1, :],
+                                       dtype=numpy.float32)
+                    wmap = gain[i0:i1 + 1] * self.wscale[i]
+                    bad = ~numpy.isfinite(data)
+                    if bad.any():
+                        data[bad] = 0.0
+                        wmap = numpy.where(bad, 0.0, wmap)
+                    y0, x0, wd, w = shift_frame(data, wmap,
+                                                -self.offsets[i][0],
+                                                -self.offsets[i][1],
+                                                self.border, rows=(i0, i1))
+                    rows = slice(y0 - r0, y0 - r0 + w.shape[0])
+                    cols = slice(x0, x0 + w.shape[1])
+                    good = w > 0
+                    values[i, rows, cols] = numpy.where(
+                        good, wd / numpy.where(good, w, 1.0),
+                        0.0 if self.type_comb == 'sum' else numpy.nan) + \
+                        self.scale[i]
+                    weights[i, rows, cols] = w
+
+                c, sw = self.__combineBand(values, weights)
+                coadd[r0:r1] = c
+                sumw[r0:r1] = sw
+        finally:
+            for hdu in hdus:
+                hdu.close()
+
+        return coadd, sumw
+
+    def __combineBand(self, values, weights):
+        """
+        Combine a band of values (n_frames x rows x cols); NaN values are
+        not used.
+        """
+
+        if self.type_comb == 'sum':
+            # mean of the upper half of the values (IRDR::cube_mean_max)
+            n = values.shape[0] // 2
+            top = numpy.sort(values, axis=0)[n:]
+            return top.sum(axis=0) / max(n, 1), weights.sum(axis=0)
+
+        valid = numpy.isfinite(values)
+        nvalid = valid.sum(axis=0)
+
+        if self.type_comb == 'median':
+            # All-NaN pixels (no data) raise warnings in nanmedian
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                med = numpy.nanmedian(values, axis=0)
+            sumw = numpy.where(valid, weights, 0.0).sum(axis=0)
+            return numpy.where(nvalid > 0, med, BLANK), sumw
+
+        # average, as IRDR mean(): median and MAD as in IRDR median() and
+        # median_absdev() (lower and upper of the middle two values), and
+        # no clipping if < MINCLIP values
+        weights = numpy.where(valid, weights, 0.0)
+        svalues = numpy.sort(values, axis=0)   # NaN at the end
+        med = numpy.take_along_axis(
+            svalues, numpy.maximum((nvalid - 1) // 2, 0)[None], axis=0)[0]
+        absdev = numpy.sort(numpy.abs(values - med), axis=0)
+        # (division in double precision, as in C)
+        sig = numpy.take_along_axis(
+            absdev, numpy.minimum(nvalid // 2, len(values) - 1)[None],
+            axis=0)[0] / numpy.float64(0.6745)
+        sig = numpy.where(nvalid > 1, sig, 0.0).astype(numpy.float32)
+        lcut = med - self.nsig * sig
+        hcut = med + self.nsig * sig
+        with numpy.errstate(invalid='ignore'):
+            keep = valid & ((nvalid < MINCLIP) |
+                            ((values > lcut) & (values < hcut)))
+        w = numpy.where(keep, weights, 0.0).astype(numpy.float32)
+        sumw = w.sum(axis=0)
+        sumwx = numpy.where(keep, w * values, 0.0).sum(axis=0)
+        mean = numpy.full(sumw.shape, BLANK, dtype=numpy.float32)
+        numpy.divide(sumwx, sumw, out=mean, where=sumw > 0)
+
+        return mean, sumw
+
+
+################################################################################
+# main
+def main(arguments=None):
+
+    desc = """Register and coadd a stack of dithered frames using the offsets
+and a gain map (native implementation of IRDR::dithercubemean)."""
+
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument("-i", "--input",
+                  action="store", dest="input_list",
+                  help="Text file listing the frames and offsets "
+                  "(filename x_off y_off)")
+
+    parser.add_argument("-g", "--gain",
+                  action="store", dest="gain_file", default=None,
+                  help="Gain map (bad pixels = 0) used for the weights")
+
+    parser.add_argument("-o", "--output",
+                  action="store", dest="output_file",
+                  help="Output coadded frame")
+
+    parser.add_argument("-w", "--weight",
+                  action="store", dest="weight_file", default=None,
+                  help="Output weight map (default: output.weight.fits)")
+
+    parser.add_argument("-t", "--type_comb",
+                  action="store", dest="type_comb", default="average",
+                  help="Combination type (average|sum|median) "
+                  "(default: %(default)s)")
+
+    options = parser.parse_args(arguments)
+
+    if not options.input_list or not options.output_file:
+        parser.print_help()
+        parser.error("incorrect number of arguments " )
+
+    try:
+        dc = DitherCoadd(options.input_list, options.gain_file,
+                         options.output_file, options.weight_file,
+                         options.type_comb)
+        dc.coadd()
+    except Exception as e:
+        log.error("Error: %s" % str(e))
+        return 1
+
+######################################################################
+if __name__ == "__main__":
+    sys.exit(main())
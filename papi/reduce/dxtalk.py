@@ -67,6 +67,7 @@ import numpy
 
 # papi
 import papi.misc.robust as robust
+from papi.misc import fitsaccess
 from papi.misc.paLog import log
 from papi.misc.version import __version__
 
@@ -142,14 +143,16 @@ def de_crosstalk_o2k(in_image, out_image=None, overwrite=False):
             out_file = out_image
             
     try:
-        f_in = fits.open(in_image)
-        if len(f_in) == 1:
-            data_in = f_in[0].data
-        else:
-            log.errro("MEF files currently not supported !")
-            raise Exception("MEF files currently not supported !")
+        # the file is opened once, and closed once read
+        with fitsaccess.fits_open(in_image) as f_in:
+            if len(f_in) == 1:
+                hdr_in = f_in[0].header.copy()
+                data_in = numpy.array(f_in[0].data)
+            else:
+                log.errro("MEF files currently not supported !")
+                raise Exception("MEF files currently not supported !")
             
-        if f_in[0].header['INSTRUME'].lower() != 'omega2000':
+        if hdr_in['INSTRUME'].lower() != 'omega2000':
             log.error("Only O2k instrument is supported !")
             raise Exception("Only O2k instrument is supported !")
     except Exception as e:
@@ -162,7 +165,7 @@ def de_crosstalk_o2k(in_image, out_image=None, overwrite=False):
     #### Q1 #### left-bottom, horizontal stripes 
     n_stripes = 8  # = no. channels
     width_st = 1024
-    # width_st = f_in[0].data.shape[0] / 2
+    # width_st = data_in.shape[0] / 2
     height_st = 128
     x_orig = 0
     y_orig = 0
@@ -293,7 +296,7 @@ def de_crosstalk_o2k(in_image, out_image=None, overwrite=False):
     hdu.data = data_out.astype('float32')
     hdulist = fits.HDUList([hdu])
     
-    hdr0 = fits.getheader(in_image)
+    hdr0 = hdr_in
     hdr0.add_history('De-crosstalk procedure executed ')
     hdr0.set('PAPIVERS', __version__, 'PANIC Pipeline version')
     hdu.header = hdr0
@@ -352,15 +355,17 @@ def de_crosstalk_PANIC_full_detector(in_image, out_image=None, overwrite=False):
             out_file = out_image
             
     try:
-        f_in = fits.open(in_image)
-        if len(f_in)==1:
-            data_in = f_in[0].data
-        else:
-            log.errro("MEF files currently not supported !")
-            raise Exception("MEF files currently not supported !")
+        # the file is opened once, and closed once read
+        with fitsaccess.fits_open(in_image) as f_in:
+            if len(f_in) == 1:
+                hdr_in = f_in[0].header.copy()
+                data_in = numpy.array(f_in[0].data)
+            else:
+                log.errro("MEF files currently not supported !")
+                raise Exception("MEF files currently not supported !")
             
-        if f_in[0].header['INSTRUME'].lower() != 'panic':
-            log.error("Instrument %s is not supported !"%f_in[0].header['INSTRUME'])
+        if hdr_in['INSTRUME'].lower() != 'panic':
+            log.error("Instrument %s is not supported !"%hdr_in['INSTRUME'])
             raise Exception("Instrument is not supported !")
     except Exception as e:
         log.error("Error openning FITS file : %s" % in_image)
@@ -466,7 +471,7 @@ def de_crosstalk_PANIC_full_detector(in_image, out_image=None, overwrite=False):
     hdu.data = data_out.astype('float32')
     hdulist = fits.HDUList([hdu])
     
-    hdr0 = fits.getheader(in_image)
+    hdr0 = hdr_in
     hdr0.add_history('De-crosstalk procedure executed ')
     hdr0.set('PAPIVERS', __version__, 'PANIC Pipeline version')
     hdu.header = hdr0
@@ -522,15 +527,17 @@ def de_crosstalk_PANIC(in_image, out_image=None, overwrite=False):
             out_file = out_image
             
     try:
-        f_in = fits.open(in_image)
-        if len(f_in)==1:
-            data_in = f_in[0].data
-        else:
-            log.errro("MEF files currently not supported !")
-            raise Exception("MEF files currently not supported !")
+        # the file is opened once, and closed once read
+        with fitsaccess.fits_open(in_image) as f_in:
+            if len(f_in) == 1:
+                hdr_in = f_in[0].header.copy()
+                data_in = numpy.array(f_in[0].data)
+            else:
+                log.errro("MEF files currently not supported !")
+                raise Exception("MEF files currently not supported !")
             
-        if f_in[0].header['INSTRUME'].lower()!='panic':
-            log.error("Instrument %s is not supported !"%f_in[0].header['INSTRUME'])
+        if hdr_in['INSTRUME'].lower()!='panic':
+            log.error("Instrument %s is not supported !"%hdr_in['INSTRUME'])
             raise Exception("Instrument is not supported !")
     except Exception as e:
         log.error("Error openning FITS file : %s"%in_image)
@@ -569,7 +576,7 @@ def de_crosstalk_PANIC(in_image, out_image=None, overwrite=False):
     hdu.data = data_out.astype('float32')
     hdulist = fits.HDUList([hdu])
     
-    hdr0 = fits.getheader(in_image)
+    hdr0 = hdr_in
     hdr0.add_history('De-crosstalk procedure executed ')
     hdr0.set('PAPIVERS', __version__, 'PANIC Pipeline version')
     hdu.header = hdr0
@@ -606,15 +613,17 @@ def de_crosstalk_PANIC_H4RG(in_image, out_image=None, overwrite=False):
             out_file = out_image
             
     try:
-        f_in = fits.open(in_image)
-        if len(f_in) == 1:
-            data_in = f_in[0].data
-        else:
-            log.errro("MEF files currently not supported !")
-            raise Exception("MEF files currently not supported !")
+        # the file is opened once, and closed once read
+        with fitsaccess.fits_open(in_image) as f_in:
+            if len(f_in) == 1:
+                hdr_in = f_in[0].header.copy()
+                data_in = numpy.array(f_in[0].data)
+            else:
+                log.errro("MEF files currently not supported !")
+                raise Exception("MEF files currently not supported !")
             
-        if f_in[0].header['INSTRUME'].lower() != 'panic':
-            log.error("Instrument %s is not supported !"%f_in[0].header['INSTRUME'])
+        if hdr_in['INSTRUME'].lower() != 'panic':
+            log.error("Instrument %s is not supported !"%hdr_in['INSTRUME'])
             raise Exception("Instrument is not supported !")
     except Exception as e:
         log.error("Error openning FITS file : %s"%in_image)
@@ -652,7 +661,7 @@ def de_crosstalk_PANIC_H4RG(in_image, out_image=None, overwrite=False):
     hdu.data = data_out.astype('float32')
     hdulist = fits.HDUList([hdu])
     
-    hdr0 = fits.getheader(in_image)
+    hdr0 = hdr_in
     hdr0.add_history('De-crosstalk procedure executed ')
     hdr0.set('PAPIVERS', __version__, 'PANIC Pipeline version')
     hdu.header = hdr0
@@ -30,12 +30,14 @@ import sys
 import os
 import os.path
 import fileinput
+import multiprocessing
 
 import numpy as np
-import astropy.io.fits as fits
 import matplotlib.pyplot as plt
 
 from papi.reduce import checkQuality
+from papi.misc import fitsaccess
+from papi.misc.utils import parallelMap
 
 
 class TFOCUSNotFound(Exception):
@@ -52,7 +54,7 @@ class FocusSerie(object):
     """
     
     def __init__(self, input_files, output, pix_size, sat_level, show=False, 
-                    window='all', min_isoarea=32, *a, **k):
+                    window='all', min_isoarea=32, n_workers=None, *a, **k):
         """
         Init method.
 
@@ -79,6 +81,9 @@ class FocusSerie(object):
         min_isoarea: int
             Minimum isoarea for the detected objects.
 
+        n_workers: int
+            Number of files evaluated concurrently (default, number of CPUs).
+
         """
         
         super(FocusSerie, self).__init__(*a, **k)
@@ -97,6 +102,10 @@ class FocusSerie(object):
         self.show = show  # whether or not to show the pdf plot file generated
         self.window = window
         self.min_isoarea = min_isoarea
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        # FWHM of all the windows and T-FOCUS of each file already evaluated,
+        # so the serie can be evaluated again for other window/detector
+        self.measurements = {}
              
     def eval_serie(self):
         """
@@ -119,48 +128,24 @@ class FocusSerie(object):
         good_files = []
         
         # Check whether detector selection can be done
-        with fits.open(self.input_files[0]) as myfits:
-            if len(myfits)!=5 and self.window!='all':
-                raise Exception("Detector selection only supported for MEF files.")
-
-        # Find out the FWHM of each image
-        for file in self.input_files:
-            try:
-                print("Evaluating %s\n" % file)
-                print("Detector %s\n" % self.window)
-                cq = checkQuality.CheckQuality(file, 
-                                               pixsize=self.pix_size, 
-                                               sat_level=self.sat_level,
-                                               isomin=self.min_isoarea,
-                                               ellipmax=0.9,  # basically, no limit !
-                                               window=self.window)
-                try:
-                    fwhm = cq.estimateFWHM()[0]
-                except Exception as e:
-                    sys.stderr.write("Error while computing FWHM for file %s" % file)
-                    sys.stderr.write(str(e))
-                    continue
-                else:
-                    fwhm_values.append(fwhm)
-
-                # Try to read Telescope Focus (T-FOCUS)
-                try:
-                    focus = self.get_t_focus(file)
-                except TFOCUSNotFound as e:
-                    # Because we could be interested in knowing the best FWHM
-                    # of the files even if the do not have the TFOCUS, we use
-                    # a special value (-1) for this purpose. Obviously, no
-                    # Poly fit will be done, but only show the FWHM values
-                    # obtained for each file.
-                    focus = -1
-                focus_values.append(focus)
-                good_files.append(file)
-                print(" >> FWHM =%f, T-FOCUS =%f <<\n" % (fwhm, focus))
-            except Exception as e:
-                sys.stderr.write("Some error while processing file %s\n"
-                    " >>Error: %s\n"%(file,str(e)))
-                raise Exception("Some error while processing file %s"%file)
-                #log.debug("Some error happened") 
+        if fitsaccess.get_next(self.input_files[0]) != 5 and self.window != 'all':
+            raise Exception("Detector selection only supported for MEF files.")
+
+        # Find out the FWHM of each image (of all the windows at once), 
+        # several files at a time
+        print("Evaluating %d files, Detector %s\n" % (len(self.input_files),
+                                                     self.window))
+        results = parallelMap(self.measure, [(f,) for f in self.input_files],
+                              self.n_workers)
+
+        for file, (fwhms, focus) in zip(self.input_files, results):
+            if fwhms is None or self.window not in fwhms:
+                continue
+            fwhm = fwhms[self.window][0]
+            fwhm_values.append(fwhm)
+            focus_values.append(focus)
+            good_files.append(file)
+            print(" >> %s : FWHM =%f, T-FOCUS =%f <<\n" % (file, fwhm, focus))
     
         # First, check if we have good values (!=-1) for T-FOCUS
         good_focus_values = [v for v in focus_values if v != -1]
@@ -245,6 +230,62 @@ class FocusSerie(object):
             min_filename = good_files[np.argmin(fwhm_values)]
             return min_fwhm, min_filename
            
+    def measure(self, file):
+        """
+        Compute the FWHM of all the windows/detectors of a file (from a
+        single SExtractor run) and read its T-FOCUS. The results are kept,
+        so each file is measured only once.
+
+        Parameters
+        ----------
+        file: str
+            Name of FITS file to evaluate
+
+        Returns
+        -------
+        A tuple (fwhms, focus), where fwhms is a dictionary {window: (fwhm,
+        std)} (see CheckQuality.estimateFWHMWindows), or None if the FWHM
+        could not be computed, and focus is the T-FOCUS value (-1 if not
+        found).
+        """
+
+        if file in self.measurements:
+            return self.measurements[file]
+
+        try:
+            cq = checkQuality.CheckQuality(file, 
+                                           pixsize=self.pix_size, 
+                                           sat_level=self.sat_level,
+                                           isomin=self.min_isoarea,
+                                           ellipmax=0.9,  # basically, no limit !
+                                           window='all')
+            try:
+                fwhms = cq.estimateFWHMWindows()
+                # windows without enough good stars
+                fwhms = dict((w, v) for w, v in fwhms.items() if v[0] != -1)
+            except Exception as e:
+                sys.stderr.write("Error while computing FWHM for file %s" % file)
+                sys.stderr.write(str(e))
+                fwhms = None
+
+            # Try to read Telescope Focus (T-FOCUS)
+            try:
+                focus = self.get_t_focus(file)
+            except TFOCUSNotFound as e:
+                # Because we could be interested in knowing the best FWHM
+                # of the files even if the do not have the TFOCUS, we use
+                # a special value (-1) for this purpose. Obviously, no
+                # Poly fit will be done, but only show the FWHM values
+                # obtained for each file.
+                focus = -1
+        except Exception as e:
+            sys.stderr.write("Some error while processing file %s\n"
+                " >>Error: %s\n"%(file,str(e)))
+            raise Exception("Some error while processing file %s"%file)
+
+        self.measurements[file] = (fwhms, focus)
+        return fwhms, focus
+
     def get_t_focus(self, file):
         """
         Look for the focus value into the FITS header keyword "T-FOCUS"
@@ -260,18 +301,14 @@ class FocusSerie(object):
         
         """ 
                 
-        focus = -1           
-        try:
-            mfits = fits.open(file)
-            if "T-FOCUS" in mfits[0].header:
-                focus = mfits[0].header["T-FOCUS"]
-            elif "T_FOCUS" in mfits[0].header:
-                focus = mfits[0].header["T_FOCUS"]
-            else:
-                sys.stderr.write("Cannot find the T-FOCUS value")
-                raise TFOCUSNotFound("Cannot find the T-FOCUS value")
-        finally:
-            mfits.close()
+        header = fitsaccess.get_header(file)
+        if "T-FOCUS" in header:
+            focus = header["T-FOCUS"]
+        elif "T_FOCUS" in header:
+            focus = header["T_FOCUS"]
+        else:
+            sys.stderr.write("Cannot find the T-FOCUS value")
+            raise TFOCUSNotFound("Cannot find the T-FOCUS value")
         
         return focus
         
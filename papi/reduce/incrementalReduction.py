@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# incrementalReduction.py
+#
+# Incremental quick-look reduction of a dither sequence.
+#
+# When the QL reduces a growing dither sequence, each new frame used to start
+# a new reduction (dark/flat, sky, offsets and coadd) of the whole sequence.
+# IncrementalReduction keeps in memory the state of the sequence:
+#
+#   - the calibration frames (dark, normalized flat, gain map), read once
+#   - the running sky window (the last 2*hwidth calibrated frames)
+#   - the WCS pointing offsets wrt the first frame
+#   - the coadd accumulator (sum(w*x)) and the weight map (sum(w))
+#
+# so adding the k-th frame only costs the calibration and sky subtraction of
+# that frame, its shift-and-add into the accumulator (see dithercoadd.py) and
+# the writing of the updated coadd; i.e., O(1) frames of work, no matter the
+# length of the sequence.
+#
+# The sky of each frame is the median of the 2*hwidth former frames (scaled
+# to its background level); the first 2*hwidth frames are kept until the
+# window is full, and then each one is sky subtracted with the others.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import sys
+import math
+import argparse
+import threading
+import warnings
+from collections import deque
+
+import numpy
+import astropy.io.fits as fits
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc import fitsaccess
+import papi.misc.robust as robust
+from papi.misc.version import __version__
+from papi.datahandler.clfits import ClFits
+from papi.reduce.dithercoadd import shift_frame, get_border, BLANK
+
+
+class IncrementalReduction(object):
+    """
+    Quick-look reduction (calibration, sky subtraction, offsets and coadd) of
+    a dither sequence, updated frame by frame as the frames are received.
+
+    add_frame() can be called from any thread, but concurrent calls are not
+    served in any given order; to keep the order of arrival (that sets the 
+    sky window and the reference frame), the frames are queued with 
+    queue_frame() and each worker thread calls add_queued_frame().
+    """
+
+    def __init__(self, output_file, master_dark=None, master_flat=None,
+                 bpm=None, hwidth=2, mingain=0.5, maxgain=1.5, pad=64):
+        """
+        Init the object.
+
+        Parameters
+        ----------
+        output_file: str
+            Filename of the coadd of the sequence, updated with each new
+            frame; the weight map is written as .weight.fits.
+
+        master_dark: str
+            Master dark (or dark model) to subtract (optional)
+
+        master_flat: str
+            Master flat to divide by (optional); it is also used as gain map
+            for the weights of the coadd.
+
+        bpm: str
+            Bad pixel mask (bad pixels > 0) to mask (optional)
+
+        hwidth: int
+            Half width of the sky window; the sky of each frame is computed
+            from the 2*hwidth former frames.
+
+        mingain, maxgain: float
+            Pixels of the normalized flat out of [mingain, maxgain] are
+            considered bad (weight = 0).
+
+        pad: int
+            Minimum border (pixels) of the coadd canvas; it is enlarged if the
+            dither offsets require it.
+        """
+
+        self.output_file = output_file
+        self.weight_file = output_file.replace(".fits", ".weight.fits")
+        self.master_dark = master_dark
+        self.master_flat = master_flat
+        self.bpm = bpm
+        self.n_sky = max(1, 2 * int(hwidth))
+        self.mingain = mingain
+        self.maxgain = maxgain
+        self.pad = pad
+
+        # Frames added so far and their offsets (pixels) wrt the first one
+        self.files = []
+        self.offsets = []
+
+        self._lock = threading.Lock()
+        self._queue = deque()     # frames queued, in order of arrival
+        self._shape = None
+        self._dark = None
+        self._dark_time = None
+        self._flat = None
+        self._gain = None
+        self._ref = None          # (ra0, dec0, pix_scale) of the first frame
+        self._header = None       # header of the first frame
+        # Running sky window (last n_sky + 1 frames) and frames waiting for
+        # the window to be filled
+        self._window = deque(maxlen=self.n_sky + 1)
+        self._pending = []
+        # Coadd accumulator and weight map
+        self._border = 0
+        self._sumwx = None
+        self._sumw = None
+        self._ncombine = 0
+
+    def add_frame(self, filename):
+        """
+        Add a new frame of the sequence and update the coadd.
+
+        Parameters
+        ----------
+        filename: str
+            Raw frame (single HDU) to add.
+
+        Returns
+        -------
+        The filename of the updated coadd, or None if there are not enough
+        frames yet to compute the sky.
+        """
+
+        with self._lock:
+            return self.__add(filename)
+
+    def queue_frame(self, filename):
+        """
+        Queue a new frame of the sequence, to be added by the next call to
+        add_queued_frame(); it must be called in the order the frames are 
+        received (e.g., from the GUI thread).
+        """
+
+        self._queue.append(filename)
+
+    def add_queued_frame(self):
+        """
+        Add the oldest frame queued with queue_frame() and update the coadd;
+        whatever the order the calling threads are served, the frames are 
+        added in the order they were queued.
+
+        Returns
+        -------
+        See add_frame().
+        """
+
+        with self._lock:
+            return self.__add(self._queue.popleft())
+
+    def __add(self, filename):
+
+        log.info("[IncrementalReduction] Adding frame %s (#%d)"
+                 % (filename, len(self.files) + 1))
+        frame = self.__calibrate(filename)
+        self.files.append(filename)
+        self.offsets.append(frame['offset'])
+        self._window.append(frame)
+
+        if len(self._window) <= self.n_sky:
+            self._pending.append(frame)
+            log.info("[IncrementalReduction] Waiting for %d frames to "
+                     "compute the sky" % (self.n_sky + 1 - len(self._window)))
+            return None
+
+        # The first frames are sky subtracted when the window is full,
+        # using the other frames of the window
+        for p in self._pending:
+            self.__accumulate(p, [f for f in self._window if f is not p])
+        self._pending = []
+
+        self.__accumulate(frame, list(self._window)[:-1])
+
+        return self.__write()
+
+    def __calibrate(self, filename):
+        """
+        Read a raw frame, subtract the dark and divide by the flat.
+        """
+
+        if fitsaccess.get_next(filename) > 1:
+            msg = "MEF files are not supported (%s)" % filename
+            log.error(msg)
+            raise Exception(msg)
+
+        cf = ClFits(filename, check_integrity=False)
+        exptime = float(cf.expTime())
+        data = fitsaccess.get_data(filename, dtype=numpy.float32)
+
+        if self._shape is None:
+            self.__initialize(filename, data.shape, cf)
+        elif data.shape != self._shape:
+            msg = "Frame %s has a different shape" % filename
+            log.error(msg)
+            raise Exception(msg)
+
+        # Dark (straight subtraction or scaled from a dark model)
+        if self._dark is not None:
+            if self._dark.ndim == 3:
+                data -= self._dark[1] * exptime + self._dark[0]
+            elif numpy.isclose(exptime, self._dark_time, atol=1e-01):
+                data -= self._dark
+            else:
+                log.warning("Dark EXPTIME mismatch; dark not subtracted")
+
+        # Flat (and bad pixels)
+        if self._flat is not None:
+            data /= self._flat
+        data[self._gain <= 0] = numpy.nan
+
+        # WCS pointing offsets wrt the first frame (as in
+        # ReductionSet.getWCSPointingOffsets)
+        ra0, dec0, pix_scale = self._ref
+        offset = (((cf.ra - ra0) * 3600 * math.cos(cf.dec / 57.29578)) / pix_scale,
+                  ((dec0 - cf.dec) * 3600) / pix_scale)
+
+        stats = robust.array_stats(data, step=8)
+        bkg, sigma = stats['median'], stats['mad']
+        log.debug("%s BKG=%f SIG=%f OFFSETS=%s" % (filename, bkg, sigma,
+                                                   str(offset)))
+
+        return {'filename': filename, 'data': data, 'bkg': bkg,
+                'exptime': exptime, 'offset': offset}
+
+    def __initialize(self, filename, shape, cf):
+        """
+        Read the calibrations and set the reference of the sequence with its
+        first frame.
+        """
+
+        self._shape = shape
+        self._header = fitsaccess.get_header(filename)
+        self._ref = (cf.ra, cf.dec, float(cf.pixScale))
+
+        if self.master_dark:
+            self._dark = fitsaccess.get_data(self.master_dark,
+                                             dtype=numpy.float32)
+            self._dark_time = float(ClFits(self.master_dark,
+                                           check_integrity=False).expTime())
+            if self._dark.shape[-2:] != shape:
+                msg = "Master dark and frames do not match image shape"
+                log.error(msg)
+                raise Exception(msg)
+
+        gain = numpy.ones(shape, dtype=numpy.float32)
+        if self.master_flat:
+            flat = fitsaccess.get_data(self.master_flat, dtype=numpy.float32)
+            if flat.shape != shape:
+                msg = "Master flat and frames do not match image shape"
+                log.error(msg)
+                raise Exception(msg)
+            median = robust.array_stats(flat, step=4)['median']
+            flat /= median
+            bad = ~numpy.isfinite(flat) | (flat < self.mingain) | \
+                (flat > self.maxgain)
+            flat[bad] = 1.0
+            gain = flat.copy()
+            gain[bad] = 0.0
+            self._flat = flat
+
+        if self.bpm:
+            bpm_data = fitsaccess.get_data(self.bpm)
+            if bpm_data is None:
+                bpm_data = fitsaccess.get_data(self.bpm, ext=1)
+            if bpm_data.shape != shape:
+                msg = "Source data and BPM do not match image shape"
+                log.error(msg)
+                raise Exception(msg)
+            gain[bpm_data > 0] = 0.0
+
+        self._gain = gain
+
+    def __accumulate(self, frame, sky_frames):
+        """
+        Subtract the sky to the frame, computed from the given frames, and add
+        it to the coadd accumulator.
+        """
+
+        # Sky = median of the frames normalized to their background, scaled
+        # to the background of the frame
+        stack = numpy.empty((len(sky_frames),) + self._shape, dtype=numpy.float32)
+        for i, f in enumerate(sky_frames):
+            numpy.multiply(f['data'], 1.0 / f['bkg'] if f['bkg'] else 1.0,
+                           out=stack[i])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            sky = numpy.nanmedian(stack, axis=0)
+        del stack
+        sky *= frame['bkg']
+        data = frame['data'] - sky
+        del sky
+
+        # Weight as in DitherCoadd (EXPTIME / sigma^2)
+        sigma = robust.array_stats(data, step=8)['mad']
+        wscale = frame['exptime'] / (sigma * sigma if sigma > 0 else 1.0)
+        bad = ~numpy.isfinite(data)
+        data[bad] = 0.0
+        wmap = numpy.where(bad, 0.0, self._gain * wscale)
+
+        self.__resize()
+        y0, x0, wd, w = shift_frame(data, wmap, -frame['offset'][0],
+                                    -frame['offset'][1], self._border)
+        block = (slice(y0, y0 + w.shape[0]), slice(x0, x0 + w.shape[1]))
+        self._sumwx[block] += wd
+        self._sumw[block] += w
+        self._ncombine += 1
+
+    def __resize(self):
+        """
+        Allocate the accumulator or enlarge its border to hold the offsets of
+        all the frames received.
+        """
+
+        border = max(self.pad, get_border(numpy.array(self.offsets)))
+        if self._sumwx is None:
+            ny, nx = self._shape
+            self._border = border
+            canvas = (ny + 2 * border, nx + 2 * border)
+            self._sumwx = numpy.zeros(canvas, dtype=numpy.float64)
+            self._sumw = numpy.zeros(canvas, dtype=numpy.float64)
+        elif border > self._border:
+            delta = border - self._border
+            log.debug("Enlarging coadd border to %d pixels" % border)
+            self._sumwx = numpy.pad(self._sumwx, delta, mode='constant')
+            self._sumw = numpy.pad(self._sumw, delta, mode='constant')
+            self._border = border
+
+    def __write(self):
+        """
+        Write the current coadd and weight map.
+        """
+
+        coadd = numpy.full(self._sumw.shape, BLANK, dtype=numpy.float32)
+        numpy.divide(self._sumwx, self._sumw, out=coadd, where=self._sumw > 0,
+                     casting='unsafe')
+
+        header = self._header.copy()
+        header.set('NCOMBINE', self._ncombine, 'Number of frames combined')
+        header.set('PAPIVERS', __version__, 'PANIC Pipeline version')
+        header.add_history("[IncrementalReduction] quick coadd of %d frames" %
+                           self._ncombine)
+        fits.writeto(self.output_file, coadd, header=header, overwrite=True,
+                     output_verify='ignore')
+        fits.writeto(self.weight_file, self._sumw.astype(numpy.float32),
+                     header=header, overwrite=True, output_verify='ignore')
+        log.info("[IncrementalReduction] Coadd of %d frames updated: %s"
+                 % (self._ncombine, self.output_file))
+
+        return self.output_file
+
+
+################################################################################
+# main
+def main(arguments=None):
+
+    desc = "Incremental quick-look reduction of a dither sequence; the " \
+           "frames are added one by one to the coadd."
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument("-s", "--source", action="store", dest="source_file",
+                        help="Source file listing the frames of the sequence "
+                        "(sorted by MJD).")
+
+    parser.add_argument("-o", "--output", action="store", dest="output_file",
+                        help="Output coadd filename.")
+
+    parser.add_argument("-d", "--dark", action="store", dest="master_dark",
+                        help="Master dark to subtract (optional).")
+
+    parser.add_argument("-f", "--flat", action="store", dest="master_flat",
+                        help="Master flat to divide by (optional).")
+
+    parser.add_argument("-b", "--bpm", action="store", dest="bpm",
+                        help="Bad pixel mask (optional).")
+
+    parser.add_argument("-H", "--hwidth", action="store", dest="hwidth",
+                        type=int, default=2,
+                        help="Half width of the sky window [default=%(default)s]")
+
+    options = parser.parse_args(arguments)
+
+    if not options.source_file or not options.output_file:
+        parser.print_help()
+        parser.error("incorrect number of arguments ")
+
+    with open(options.source_file) as fd:
+        files = [line.strip() for line in fd if line.strip()]
+
+    reduction = IncrementalReduction(options.output_file, options.master_dark,
+                                     options.master_flat, options.bpm,
+                                     options.hwidth)
+    try:
+        for filename in files:
+            reduction.add_frame(filename)
+    except Exception as e:
+        log.error("Error in incremental reduction: %s" % str(e))
+        return 1
+
+    return 0
+
+######################################################################
+if __name__ == "__main__":
+    sys.exit(main())
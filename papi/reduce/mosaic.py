@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# mosaic.py
+#
+# Native mosaicking of astrometrically calibrated images (e.g. the reduced
+# detectors of a PANIC sequence, or several pointings), to be used instead
+# of Montage (see montage.py) when mosaic_engine = native:
+#
+#   - the output grid (TAN, north up, finest input pixel scale) covers the
+#     footprints of all the input images;
+#   - the output is built tile by tile, in parallel threads: each tile is
+#     reprojected from the (windows of the) input images overlapping it with
+#     bilinear interpolation, using their WCS (distortion terms included),
+#     and combined as the weighted mean (weight maps of the inputs, if any);
+#   - the pixel coordinates are transformed exactly only on a coarse grid of
+#     each tile and interpolated in between;
+#   - optionally, the backgrounds are matched with additive offsets fitted
+#     (least squares) to the median differences in the overlaps.
+#
+# The output image and its weight map are written directly to disk by tiles,
+# so the memory used does not depend on the size of the mosaic, and no
+# intermediate files are created.
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import sys
+import copy
+import math
+import warnings
+import fileinput
+from optparse import OptionParser
+
+import numpy
+from scipy import ndimage
+import astropy.io.fits as fits
+from astropy import wcs
+from astropy.wcs.utils import proj_plane_pixel_area
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc.fitsaccess import get_header, get_window
+from papi.misc.imfilter import grid_nodes, interpolate_grid
+from papi.misc.utils import parallelMap
+
+
+__all__ = ['Mosaic', 'mosaic']
+
+# Keywords copied from the first input image to the mosaic
+COPY_KEYWORDS = ('OBJECT', 'INSTRUME', 'TELESCOP', 'FILTER', 'EXPTIME',
+                 'DATE-OBS', 'MJD-OBS', 'EQUINOX', 'RADESYS')
+
+# Distance (output pixels) between the samples used to match the backgrounds
+BACKGROUND_STEP = 16
+
+# Minimum number of common samples of two images to match their backgrounds
+MIN_OVERLAP_SAMPLES = 50
+
+
+def _readWCS(header):
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return wcs.WCS(header).celestial
+
+
+class _Input(object):
+    """
+    An input image of the mosaic.
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        header = get_header(filename)
+        if header.get('NAXIS', 0) != 2:
+            raise Exception("Only single 2D images can be mosaiced: %s" % filename)
+        self.shape = (header['NAXIS2'], header['NAXIS1'])
+        self.wcs = _readWCS(header)
+        if not self.wcs.has_celestial:
+            raise Exception("No WCS found in %s" % filename)
+        self.pix_area = proj_plane_pixel_area(self.wcs)
+
+        self.weight_file = filename.replace('.fits', '.weight.fits')
+        if not os.path.isfile(self.weight_file):
+            self.weight_file = None
+
+        self.header = header
+        self.offset = 0.0
+        self.flux_scale = 1.0
+        # bounding box (y0, y1, x0, x1) in the output grid
+        self.bbox = None
+
+    def footprint(self):
+        """
+        Return the sky coordinates of points along the edges of the image.
+        """
+
+        ny, nx = self.shape
+        x = numpy.concatenate((numpy.linspace(-0.5, nx - 0.5, 9),
+                               numpy.full(9, nx - 0.5),
+                               numpy.linspace(nx - 0.5, -0.5, 9),
+                               numpy.full(9, -0.5)))
+        y = numpy.concatenate((numpy.full(9, -0.5),
+                               numpy.linspace(-0.5, ny - 0.5, 9),
+                               numpy.full(9, ny - 0.5),
+                               numpy.linspace(ny - 0.5, -0.5, 9)))
+
+        return self.wcs.all_pix2world(x, y, 0)
+
+    def overlaps(self, y0, y1, x0, x1):
+
+        by0, by1, bx0, bx1 = self.bbox
+        return by0 < y1 and y0 < by1 and bx0 < x1 and x0 < bx1
+
+    def sample(self, ix, iy):
+        """
+        Interpolate (bilinear) the image and its weight at the given pixel
+        coordinates (0-based). Only the window of the image covering the
+        coordinates is read.
+
+        Returns
+        -------
+        The values (background offset and flux scale applied) and the
+        weights, with weight 0 outside the image and for non-valid pixels,
+        or None if no coordinate falls in the image.
+        """
+
+        ny, nx = self.shape
+        valid = (ix > -0.5) & (ix < nx - 0.5) & (iy > -0.5) & (iy < ny - 0.5)
+        if not valid.any():
+            return None
+
+        x_lo = max(int(math.floor(ix[valid].min())), 0)
+        x_hi = min(int(math.ceil(ix[valid].max())) + 1, nx)
+        y_lo = max(int(math.floor(iy[valid].min())), 0)
+        y_hi = min(int(math.ceil(iy[valid].max())) + 1, ny)
+        window = (slice(y_lo, y_hi), slice(x_lo, x_hi))
+        coords = [numpy.where(valid, iy - y_lo, 0), numpy.where(valid, ix - x_lo, 0)]
+
+        data = get_window(self.filename, window, dtype=numpy.float32)
+        values = ndimage.map_coordinates(data, coords, order=1, mode='nearest',
+                                         prefilter=False)
+        if self.weight_file:
+            weights = get_window(self.weight_file, window, dtype=numpy.float32)
+            weights = ndimage.map_coordinates(weights, coords, order=1,
+                                              mode='nearest', prefilter=False)
+        else:
+            weights = numpy.ones(values.shape, dtype=numpy.float32)
+
+        bad = ~valid | ~numpy.isfinite(values) | ~(weights > 0)
+        weights[bad] = 0
+        values[bad] = 0
+        values = (values - self.offset) * self.flux_scale
+
+        return values, weights
+
+
+class Mosaic(object):
+    """
+    Build a mosaic from a set of images with WCS, reprojected onto a common
+    grid tile by tile.
+    """
+
+    def __init__(self, input_files, output_file, background_match=True,
+                 tile_size=1024, grid_step=32, n_workers=1):
+        """
+        Parameters
+        ----------
+        input_files: list
+            Images to mosaic (single 2D images, with WCS); their weight maps
+            (filename.weight.fits) are used if found
+        output_file: str
+            Filename of the mosaic; its weight map is written as
+            output_file.weight.fits
+        background_match: bool
+            Whether the backgrounds of the images are matched in the overlaps
+        tile_size: int
+            Size (pixels) of the output tiles
+        grid_step: int
+            Distance (pixels) between the points where the coordinates are
+            transformed exactly
+        n_workers: int
+            Number of tiles built concurrently
+        """
+
+        self.input_files = input_files
+        self.output_file = output_file
+        self.weight_file = output_file.replace('.fits', '.weight.fits')
+        self.background_match = background_match
+        self.tile_size = tile_size
+        self.grid_step = grid_step
+        self.n_workers = n_workers
+
+        self.inputs = None
+        self.wcs = None
+        self.shape = None
+
+    def _outputGrid(self):
+        """
+        Compute the output grid (WCS and shape) covering all the inputs, and
+        the bounding box of each input in it.
+        """
+
+        footprints = [inp.footprint() for inp in self.inputs]
+        ra = numpy.radians(numpy.concatenate([f[0] for f in footprints]))
+        dec = numpy.radians(numpy.concatenate([f[1] for f in footprints]))
+        # center: mean of the unit vectors of the footprints
+        v = numpy.array([numpy.cos(dec) * numpy.cos(ra),
+                         numpy.cos(dec) * numpy.sin(ra),
+                         numpy.sin(dec)]).mean(axis=1)
+        ra0 = math.degrees(math.atan2(v[1], v[0])) % 360.0
+        dec0 = math.degrees(math.atan2(v[2], math.hypot(v[0], v[1])))
+        scale = math.sqrt(min(inp.pix_area for inp in self.inputs))
+
+        self.wcs = wcs.WCS(naxis=2)
+        self.wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        self.wcs.wcs.crval = [ra0, dec0]
+        self.wcs.wcs.cdelt = [-scale, scale]
+        self.wcs.wcs.crpix = [1.0, 1.0]
+
+        boxes = []
+        for f in footprints:
+            x, y = self.wcs.wcs_world2pix(f[0], f[1], 0)
+            boxes.append((y.min(), y.max(), x.min(), x.max()))
+        y_min = math.floor(min(b[0] for b in boxes))
+        x_min = math.floor(min(b[2] for b in boxes))
+        self.wcs.wcs.crpix = [1.0 - x_min, 1.0 - y_min]
+        self.shape = (int(math.ceil(max(b[1] for b in boxes))) - y_min + 1,
+                      int(math.ceil(max(b[3] for b in boxes))) - x_min + 1)
+
+        for inp, b in zip(self.inputs, boxes):
+            inp.bbox = (int(math.floor(b[0])) - y_min, int(math.ceil(b[1])) - y_min + 1,
+                        int(math.floor(b[2])) - x_min, int(math.ceil(b[3])) - x_min + 1)
+            inp.flux_scale = scale ** 2 / inp.pix_area
+
+        log.debug("Mosaic grid: %dx%d pixels, center (%.5f, %.5f), scale %.4f arcsec"
+                  % (self.shape[1], self.shape[0], ra0, dec0, scale * 3600))
+
+    def _mapping(self, inp, ys, xs):
+        """
+        Return the pixel coordinates in the input image of the output pixels
+        of the grid (ys, xs).
+        """
+
+        # astropy WCS objects are not shared between threads
+        out_wcs = copy.deepcopy(self.wcs)
+        in_wcs = copy.deepcopy(inp.wcs)
+
+        x, y = numpy.meshgrid(xs, ys)
+        ra, dec = out_wcs.wcs_pix2world(x, y, 0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            ix, iy = in_wcs.all_world2pix(ra, dec, 0, quiet=True)
+
+        return ix, iy
+
+    def _matchBackgrounds(self):
+        """
+        Fit the additive offsets of the backgrounds of the inputs to the
+        median differences of the images in their overlaps.
+        """
+
+        step = BACKGROUND_STEP
+        n_x = self.shape[1] // step + 1
+
+        def sample(inp):
+            y0, y1, x0, x1 = inp.bbox
+            ys = numpy.arange(-(-max(y0, 0) // step) * step, min(y1, self.shape[0]), step)
+            xs = numpy.arange(-(-max(x0, 0) // step) * step, min(x1, self.shape[1]), step)
+            if len(ys) == 0 or len(xs) == 0:
+                return None
+            ix, iy = self._mapping(inp, ys, xs)
+            result = inp.sample(ix, iy)
+            if result is None:
+                return None
+            values, weights = result
+            index = (ys[:, None] // step) * n_x + xs[None, :] // step
+            good = weights > 0
+            return index[good], values[good]
+
+        samples = parallelMap(sample, [(inp,) for inp in self.inputs],
+                              self.n_workers)
+
+        rows, b, w = [], [], []
+        n = len(self.inputs)
+        for i in range(n):
+            for j in range(i + 1, n):
+                if samples[i] is None or samples[j] is None:
+                    continue
+                common, ii, jj = numpy.intersect1d(samples[i][0], samples[j][0],
+                                                   assume_unique=True,
+                                                   return_indices=True)
+                if len(common) < MIN_OVERLAP_SAMPLES:
+                    continue
+                row = numpy.zeros(n)
+                row[i], row[j] = 1.0, -1.0
+                rows.append(row)
+                b.append(numpy.median(samples[i][1][ii] - samples[j][1][jj]))
+                w.append(math.sqrt(len(common)))
+
+        if not rows:
+            log.debug("No overlaps found; backgrounds not matched")
+            return
+
+        # only the images overlapping others get an offset, with zero mean
+        matched = numpy.abs(numpy.array(rows)).sum(axis=0) > 0
+        rows.append(matched.astype(float))
+        b.append(0.0)
+        w.append(1.0)
+        a = numpy.array(rows)[:, matched] * numpy.array(w)[:, None]
+        offsets = numpy.linalg.lstsq(a, numpy.array(b) * numpy.array(w),
+                                     rcond=None)[0]
+
+        for inp, offset in zip(numpy.array(self.inputs)[matched], offsets):
+            # sample() applies the flux scale after removing the offset
+            inp.offset = offset / inp.flux_scale
+            log.debug("Background offset of %s : %f" % (inp.filename, offset))
+
+    def _createOutput(self, filename, header):
+        """
+        Create an output image (float32, zero-filled) without writing its
+        data, and return it memory-mapped.
+        """
+
+        header = header.copy()
+        header_bytes = header.tostring().encode('ascii')
+        data_size = self.shape[0] * self.shape[1] * 4
+        with open(filename, 'wb') as fd:
+            fd.write(header_bytes)
+            fd.seek(data_size + (-data_size % 2880) - 1, os.SEEK_CUR)
+            fd.write(b'\0')
+
+        return numpy.memmap(filename, dtype='>f4', mode='r+',
+                            offset=len(header_bytes), shape=self.shape)
+
+    def _buildTile(self, out_data, out_weight, y0, y1, x0, x1):
+
+        ys = y0 + grid_nodes(y1 - y0, self.grid_step)
+        xs = x0 + grid_nodes(x1 - x0, self.grid_step)
+
+        num = numpy.zeros((y1 - y0, x1 - x0), dtype=numpy.float64)
+        den = numpy.zeros((y1 - y0, x1 - x0), dtype=numpy.float64)
+        for inp in self.inputs:
+            if not inp.overlaps(y0, y1, x0, x1):
+                continue
+            ix, iy = self._mapping(inp, ys, xs)
+            ix = interpolate_grid(interpolate_grid(ix, xs - x0, x1 - x0, axis=1),
+                                  ys - y0, y1 - y0, axis=0)
+            iy = interpolate_grid(interpolate_grid(iy, xs - x0, x1 - x0, axis=1),
+                                  ys - y0, y1 - y0, axis=0)
+            result = inp.sample(ix, iy)
+            if result is None:
+                continue
+            values, weights = result
+            num += values * weights
+            den += weights
+
+        covered = den > 0
+        out_data[y0:y1, x0:x1] = numpy.where(covered, num / numpy.where(covered, den, 1), 0)
+        out_weight[y0:y1, x0:x1] = den
+
+    def build(self):
+        """
+        Build the mosaic.
+
+        Returns
+        -------
+        The filename of the mosaic created.
+        """
+
+        log.info("Building mosaic of %d images: %s" % (len(self.input_files),
+                                                       self.output_file))
+
+        self.inputs = [_Input(f) for f in self.input_files]
+        self._outputGrid()
+
+        if self.background_match and len(self.inputs) > 1:
+            self._matchBackgrounds()
+
+        header = fits.Header()
+        header['SIMPLE'] = True
+        header['BITPIX'] = -32
+        header['NAXIS'] = 2
+        header['NAXIS1'] = self.shape[1]
+        header['NAXIS2'] = self.shape[0]
+        header['EXTEND'] = True
+        first = self.inputs[0].header
+        for key in COPY_KEYWORDS:
+            if key in first:
+                header[key] = first[key]
+        header.extend(self.wcs.to_header(), update=True)
+        header['NCOMBINE'] = (len(self.inputs), "Number of images in the mosaic")
+        header.add_history("Mosaic of: %s" % ", ".join(os.path.basename(f)
+                                                       for f in self.input_files))
+
+        out_data = self._createOutput(self.output_file, header)
+        out_weight = self._createOutput(self.weight_file, header)
+        try:
+            tiles = [(out_data, out_weight, y, min(y + self.tile_size, self.shape[0]),
+                      x, min(x + self.tile_size, self.shape[1]))
+                     for y in range(0, self.shape[0], self.tile_size)
+                     for x in range(0, self.shape[1], self.tile_size)]
+            parallelMap(self._buildTile, tiles, self.n_workers)
+            out_data.flush()
+            out_weight.flush()
+        finally:
+            del out_data, out_weight
+
+        log.info("Mosaic created: %s" % self.output_file)
+
+        return self.output_file
+
+
+def mosaic(files_to_mosaic, out_mosaic, background_match=True, n_workers=1):
+    """
+    Build the mosaic of the files provided (see Mosaic class).
+
+    Returns
+    -------
+    filename: str
+        Path to the mosaic file created.
+    """
+
+    return Mosaic(files_to_mosaic, out_mosaic, background_match=background_match,
+                  n_workers=n_workers).build()
+
+
+# #######################################################
+# main
+# #######################################################
+if __name__ == "__main__":
+
+    usage = "usage: %prog [options]"
+    desc = "Build mosaic from input images with WCS (native PAPI engine)."
+    parser = OptionParser(usage, description=desc)
+
+    parser.add_option("-l", "--source_file_list",
+                  action="store", dest="source_file_list",
+                  help="file listing the input images ")
+
+    parser.add_option("-o", "--output",
+                  action="store", dest="output_image",
+                  help="output filename for mosaic (default = %default)",
+                  default="mosaic.fits")
+
+    parser.add_option("-b", "--no_background_match",
+                  action="store_false", dest="background_match", default=True,
+                  help="do not match the backgrounds of the images")
+
+    parser.add_option("-n", "--ncpus", type="int",
+                  action="store", dest="ncpus", default=1,
+                  help="number of tiles built concurrently (default = %default)")
+
+    (options, args) = parser.parse_args()
+
+    if len(sys.argv[1:]) < 1:
+       parser.print_help()
+       sys.exit(0)
+
+    if not options.source_file_list or len(args) != 0:
+        parser.print_help()
+        parser.error("wrong number of arguments ")
+
+    files_to_mosaic = [line.replace("\n", "")
+                       for line in fileinput.input(options.source_file_list)]
+    try:
+        mosaic(files_to_mosaic, options.output_image,
+               background_match=options.background_match,
+               n_workers=options.ncpus)
+    except Exception as e:
+        log.error("Fail of mosaic procedure: %s" % str(e))
+        sys.exit(1)
+    else:
+        log.info("Well done!")
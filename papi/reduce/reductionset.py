@@ -53,19 +53,24 @@ from papi.misc.version import __version__
 # PAPI packages
 from papi.reduce.checkQuality import CheckQuality
 from papi.misc.fileUtils import removefiles, linkSourceFiles
-from papi.misc.utils import listToFile, runCmd
+from papi.misc.utils import listToFile, runCmd, parallelMap
+from papi.misc import profiling
+from papi.misc.productCache import ProductCache
 from papi.reduce.makeobjmask import makeObjMask
 from papi.misc.imtrim import imgTrim
 from papi.reduce.remove_cosmics import remove_cr
 from papi.reduce.astrowarp import AstroWarp
 from papi.reduce.solveAstrometry import solveField
+from papi.reduce.wcsCache import WCSCache
 from papi.misc.mef import MEF
 from papi.datahandler.clfits import ClFits
+from papi.datahandler.framecatalog import FrameCatalog
 from papi.datahandler.dataset import DataSet
 from papi.misc.collapse import collapse
 import papi.reduce.correctNonLinearity as correctNonLinearity
 import papi.misc.cleanBadPix as cleanBadPix
 import papi.reduce.montage as montage
+from papi.reduce.mosaic import Mosaic
 from papi.reduce.calDark import MasterDark
 from papi.reduce.calDarkModel import MasterDarkModel
 from papi.reduce.calTwFlat import MasterTwilightFlat
@@ -78,6 +83,7 @@ from papi.reduce.applyDarkFlat import ApplyDarkFlat
 from papi.reduce.checkQuality import CheckQuality
 from papi.reduce.astrowarp import doAstrometry
 from papi.reduce.dxtalk import remove_crosstalk
+from papi.reduce.dithercoadd import DitherCoadd
 
 
 
@@ -283,6 +289,40 @@ class ReductionSet(object):
         if not os.path.exists(self.out_dir):
             raise Exception("Output dir does not exist.")
         
+        # Cache of intermediate products (NLC, dark/flat, master calibrations,
+        # object masks and offsets), shared by all the reductions. It cannot
+        # be inside temp_dir, that is emptied by purgeOutput().
+        cache_dir = None
+        if self.config_dict and self.config_dict['general'].get('product_cache'):
+            cache_dir = self.config_dict['general'].get('cache_dir')
+            tmp_path = os.path.realpath(self.temp_dir) + os.sep
+            if cache_dir and os.path.realpath(cache_dir).startswith(tmp_path):
+                log.warning("Cache dir %s is inside temp_dir; product cache disabled" % cache_dir)
+                cache_dir = None
+        self.cache = ProductCache(cache_dir, enabled=cache_dir is not None)
+
+        # Last good astrometric solutions, to warm-start the astrometry of
+        # the frames of the same pointing
+        if self.config_dict:
+            self.wcs_cache = WCSCache(self.config_dict['astrometry'].get('wcs_cache_dir'),
+                                      self.config_dict['astrometry'].get('wcs_cache_radius', 0.25))
+        else:
+            self.wcs_cache = WCSCache(None)
+
+        # Metadata (type, filter, texp, ...) of the frames of the set, read
+        # once from their headers and shared by all the checks and look-ups
+        if self.config_dict:
+            self.frames = FrameCatalog(n_workers=self.config_dict['general']['ncpus'])
+        else:
+            self.frames = FrameCatalog()
+        
+        # Maximum number of frames/outputs solved concurrently (astrometry);
+        # it is shared out among the detectors reduced in parallel.
+        if self.config_dict:
+            self.astrometry_workers = self.config_dict['general']['ncpus']
+        else:
+            self.astrometry_workers = 1
+        
         # Main output file resulted from the data reduction process
         if out_file == None: 
             self.out_file = None
@@ -560,16 +600,16 @@ class ReductionSet(object):
         else:
             files_to_check = self.m_LAST_FILES
             
-        f = ClFits(files_to_check[0])
+        f = self.frames.row(files_to_check[0])
         
-        filter_0 = f.getFilter()
-        type_0 = f.getType()
-        expt_0 = f.expTime()
-        itime_0 = f.getItime()
-        ncoadd_0 = f.getNcoadds()
-        readmode_0 = f.getReadMode()
-        shape_0 = f.shape
-        instrument_0 = f.getInstrument().lower()
+        filter_0 = f['filter']
+        type_0 = self.frames.getType([files_to_check[0]])[0]
+        expt_0 = f['exptime']
+        itime_0 = f['itime']
+        ncoadd_0 = f['ncoadds']
+        readmode_0 = f['readmode']
+        shape_0 = self.frames.shape(files_to_check[0])
+        instrument_0 = f['instrument'].lower()
         
         log.info("Values to check: FILTER=%s TYPE=%s EXPT=%s ITIME=%s NCOADD=%s READMODE=%s SHAPE=%s INST=%s",
                  filter_0, type_0, expt_0, itime_0, ncoadd_0, readmode_0, shape_0, instrument_0)
@@ -587,102 +627,86 @@ class ReductionSet(object):
             log.error("INSTRUMENT value mismatch -- %s "%instrument_0)
             return (False, "chk_instrument") 
         
-        mismatch_filter = False
-        mismatch_type = False
-        mismatch_expt = False
-        mismatch_itime = False
-        mismatch_ncoadd = False
-        mismatch_cont = False
-        mismatch_readmode = False
-        mismatch_shape = False
-        mismatch_instrument = False
-        
-        prev_MJD = -1
-        for file in files_to_check:
-            fi = ClFits(file)
-            if chk_instrument and not mismatch_instrument: 
-                if fi.getInstrument() != instrument_0:
-                    log.debug("File %s does not match INSTRUMENT", file)
-                    mismatch_instrument = True
-                    info_mismatch = "chk_instrument"
-                    break
-            if chk_shape and not mismatch_shape: 
-                if fi.shape != shape_0:
-                    log.debug("File %s does not match SHAPE", file)
-                    mismatch_shape = True
-                    info_mismatch = "chk_shape"
-                    break
-            if chk_filter and not mismatch_filter: 
-                if fi.getFilter() != filter_0:
-                    log.debug("File %s does not match FILTER", file)
-                    mismatch_filter = True
-                    info_mismatch = "chk_filter"
-                    break
-            
-            if chk_type and not mismatch_type: 
-                if fi.getType() != type_0:
-                    log.debug("File %s does not match TYPE", file)
-                    mismatch_type = True
-                    info_mismatch = "chk_type"
-                    break
-                
-            if chk_expt and not mismatch_expt: 
-                if fi.expTime() != expt_0:
-                #if prev_MJD!=-1 and ((fi.expTime()+self.MAX_MJD_DIFF)<expt_0 or
-                #    (fi.expTime()-self.MAX_MJD_DIFF)>expt_0):   # more relaxed situation
-                    log.debug("File %s does not match EXPTIME", file)
-                    mismatch_expt = True
-                    info_mismatch = "chk_expt"
-                    break
-            if chk_itime and not mismatch_itime: 
-                if fi.getItime() != itime_0:
-                    log.debug("File %s does not match ITIME", file)
-                    mismatch_itime = True
-                    info_mismatch = "chk_itime"
-                    break
-            if chk_ncoadd and not mismatch_ncoadd: 
-                if fi.getNcoadds() != ncoadd_0:
-                    log.debug("File %s does not match NCOADD", file)
-                    mismatch_ncoadd = True
-                    info_mismatch = "chk_ncoadd"
-                    break
-            if chk_readmode and not mismatch_readmode: 
-                if fi.getReadMode() != readmode_0:
-                    log.debug("File %s does not match READMODE", file)
-                    mismatch_readmode = True
-                    info_mismatch = "chk_readmode"
-                    break
-            if chk_cont and not mismatch_cont:
-                if prev_MJD != -1 and (fi.getMJD() - prev_MJD)>self.MAX_MJD_DIFF:
-                    log.error("Maximmun time distant between two consecutives frames exceeded. File= %s",file)
-                    mismatch_cont = True
-                    info_mismatch = "chk_cont"
-                    break
-                else:
-                    prev_MJD = fi.getMJD()
-        
-        
-        if mismatch_shape or mismatch_filter or mismatch_type or mismatch_expt or  \
-            mismatch_itime or mismatch_ncoadd or mismatch_cont:
-            log.error("Data checking found a mismatch....check your data files....")
+        checks = [name for name, flag in (('chk_instrument', chk_instrument),
+                                          ('chk_shape', chk_shape),
+                                          ('chk_filter', chk_filter),
+                                          ('chk_type', chk_type),
+                                          ('chk_expt', chk_expt),
+                                          ('chk_itime', chk_itime),
+                                          ('chk_ncoadd', chk_ncoadd),
+                                          ('chk_readmode', chk_readmode),
+                                          ('chk_cont', chk_cont)) if flag]
+        mismatch = self.findDataMismatch(files_to_check, checks)
+        
+        if mismatch:
+            info_mismatch, bad_files = mismatch
+            log.error("Data checking found a mismatch (%s) in files %s ....check your data files...."
+                      % (info_mismatch, bad_files))
             #raise Exception("Error while checking data (filter, type, ExpT, Itime, NCOADDs, MJD)")
             return (False, info_mismatch)             
         else:    
             log.debug("All files match same file filter")
             return (True, None)
+
+    def findDataMismatch(self, file_list, checks):
+        """
+        Batched check of the data properties of a list of files (see 
+        checkData()). The values of all the files are taken from the frame 
+        catalog (read at once, in parallel, for the files not loaded yet) and
+        each criterion is evaluated over the whole list with array operations.
+        
+        Parameters
+        ----------
+        file_list: list
+            FITS files to check; the first one gives the reference values
+        
+        checks: list
+            Criteria to evaluate, in order: 'chk_instrument', 'chk_shape', 
+            'chk_filter', 'chk_type', 'chk_expt', 'chk_itime', 'chk_ncoadd',
+            'chk_readmode' (same value as the first file) and 'chk_cont' 
+            (temporal continuity, MJD distance between consecutive frames 
+            lower than MAX_MJD_DIFF)
+        
+        Returns
+        -------
+        A tuple (criterion, list of offending files) with the first criterion
+        not fulfilled, or None if all the files match.
+        """
+        
+        rows = self.frames.rows(file_list)
+        files = numpy.array(file_list, dtype=object)
+        columns = {'chk_instrument': [rows['instrument']],
+                   'chk_shape': [rows['naxis1'], rows['naxis2'], rows['naxis3']],
+                   'chk_filter': [rows['filter']],
+                   'chk_type': [self.frames.getType(file_list)],
+                   'chk_expt': [rows['exptime']],
+                   'chk_itime': [rows['itime']],
+                   'chk_ncoadd': [rows['ncoadds']],
+                   'chk_readmode': [rows['readmode']]}
+        
+        for check in checks:
+            bad = numpy.zeros(len(files), dtype=bool)
+            if check == 'chk_cont':
+                # frames without MJD (-1) are not checked against the next one
+                mjd = rows['mjd']
+                bad[1:] = (mjd[:-1] != -1) & (numpy.diff(mjd) > self.MAX_MJD_DIFF)
+            else:
+                for values in columns[check]:
+                    bad |= values != values[0]
+            if bad.any():
+                return check, list(files[bad])
+        
+        return None
             
     def checkFilter(self):
         """
         Return true is all files in file have the same filter type, otherwise False.
         """
-        f = ClFits(self.m_LAST_FILES[0])
-        filter_0 = f.getFilter()
-        self.m_filter = filter_0
-        for file in self.m_LAST_FILES:
-            fi = ClFits(file)
-            if fi.getFilter() != filter_0:
-                log.debug("File %s does not match file filter", file)
-                return False
+        self.m_filter = self.frames.row(self.m_LAST_FILES[0])['filter']
+        mismatch = self.frames.mismatch(self.m_LAST_FILES, ['filter'])
+        if mismatch:
+            log.debug("Files %s do not match file filter", mismatch[1])
+            return False
             
         log.debug("All files match same file filter")
         return True
@@ -697,17 +721,17 @@ class ReductionSet(object):
         \return True or False
         """
         
+        frame_types = self.frames.getType(self.m_LAST_FILES)
         if type_to_check == None:
-            f = ClFits(self.m_LAST_FILES[0])
-            type_0 = f.getType()
+            type_0 = frame_types[0]
         else:
             type_0 = type_to_check
              
-        for file in self.m_LAST_FILES:
-            fi = ClFits(file)
-            if fi.getType() != type_0:
-                log.debug("File %s does not match file type %s", file, type_0)
-                return False
+        bad = frame_types != type_0
+        if bad.any():
+            log.debug("File %s does not match file type %s",
+                      self.m_LAST_FILES[bad.argmax()], type_0)
+            return False
             
         log.debug("All files match same file type")
         return True
@@ -717,22 +741,12 @@ class ReductionSet(object):
         Ascending sort of input data files by MJD
         """
         
-        dataset = []
         if list==None:
             m_list = self.m_LAST_FILES
         else:
             m_list = list
             
-        for file in m_list:
-            fits = ClFits(file)
-            dataset.append((file, fits.getMJD()))
-            
-        dataset = sorted(dataset, key=lambda data_file: data_file[1])          
-        sorted_files = []
-        for tuple in dataset:
-            sorted_files.append(tuple[0])
-        
-        return sorted_files
+        return self.frames.sortByMJD(m_list)
 
     def split(self, frame_list):
         """ 
@@ -833,43 +847,24 @@ class ReductionSet(object):
                    
         # Step 1: we suppose list file is sorted out  by MJD
         # Step 2: get the data type of the first file and check sequence starting from this file
-        fits_0 = ClFits(self.m_LAST_FILES[0])
-        fits_1 = ClFits(self.m_LAST_FILES[1])
-        i = 0
-        if fits_0.isSky() and fits_1.isObject():
+        is_sky = self.frames.isSky(self.m_LAST_FILES)
+        is_obj = self.frames.isObject(self.m_LAST_FILES)
+        if is_sky[0] and is_obj[1]:
             mode = 'dither_off_on'
             # Then, we are going to suppose the sequence S-T-S-T-S- .... (dither_off_on)
-            for file in self.m_LAST_FILES:
-                if not i % 2:  # even (par)
-                    fits = ClFits(file)
-                    if not fits.isSky():
-                        return 'other'
-                elif i%2: # odd
-                    fits = ClFits(file)
-                    if not fits.isObject():
-                        return 'other'
-                i = i + 1         
-        elif fits_0.isObject() and fits_1.isSky():
+            if not (is_sky[0::2].all() and is_obj[1::2].all()):
+                return 'other'
+        elif is_obj[0] and is_sky[1]:
             # Then, we are going to suppose the sequence T-S-T-S-T- .... (dither_on_off)
             mode = 'dither_on_off'
-            for file in self.m_LAST_FILES:
-                if not i%2: # even (par)
-                    fits = ClFits(file)
-                    if not fits.isObject():
-                        return 'other'
-                elif i%2: # odd
-                    fits = ClFits(file)
-                    if not fits.isSky():
-                        return 'other'
-                i += 1
-        elif fits_0.isObject() and fits_1.isObject():
+            if not (is_obj[0::2].all() and is_sky[1::2].all()):
+                return 'other'
+        elif is_obj[0] and is_obj[1]:
             # check if all are objects ...
             # and if are, then, we are going to suppose the sequence T-T-T-T-T- .... (dither)
             mode = 'dither'
-            for file in self.m_LAST_FILES:
-                fits = ClFits(file)
-                if not fits.isObject():
-                    return 'other'
+            if not is_obj.all():
+                return 'other'
         else:
             # it might be a lab test or whatever ...
             mode = 'other'
@@ -882,18 +877,13 @@ class ReductionSet(object):
         'sky' frames in the m_LAST_FILES
         """
        
-        sky_list = []
         if list is None:
             m_list = self.m_LAST_FILES
         else:
             m_list = list
             
-        for file in m_list:
-            fits = ClFits(file)
-            if fits.isSky():
-                sky_list.append(file)
-                
-        return sky_list
+        is_sky = self.frames.isSky(m_list)
+        return [file for file, sky in zip(m_list, is_sky) if sky]
 
     def getCalibFor(self, sci_obj_list):
         """
@@ -922,12 +912,12 @@ class ReductionSet(object):
         master_flat = [] # we'll get a list of master flat candidates
         master_bpm = [] # we'll get a list of master flat candidates
         
-        obj_frame = ClFits(sci_obj_list[0])
+        obj_frame = self.frames.row(sci_obj_list[0])
         # We take as sample, the first frame in the list, but all frames must
         # have the same features (expT,filter,ncoadd, readout-mode, ...)
-        expTime = obj_frame.expTime()
-        filter = obj_frame.getFilter()
-        ncoadds = obj_frame.getNcoadds()
+        expTime = float(obj_frame['exptime'])
+        filter = obj_frame['filter']
+        ncoadds = int(obj_frame['ncoadds'])
 
         
         # Init the DB (ext_db is always initialited whether db!=None)
@@ -1097,11 +1087,10 @@ class ReductionSet(object):
         # query the DB for DARK frames 
         m_list = self.db.GetFilesT('DARK')
         
-        match_list = []
-        for file in m_list:
-            fits = ClFits(file)
-            if fits.isDark():
-                match_list.append((file, fits.expTime()))
+        is_dark = self.frames.isDark(m_list)
+        texp = self.frames.column(m_list, 'exptime')
+        match_list = [(file, texp[i]) for i, file in enumerate(m_list)
+                      if is_dark[i]]
         
         # Sort out frames by TEXP
         match_list = sorted(match_list, key=lambda data_file: data_file[1]) 
@@ -1116,11 +1105,10 @@ class ReductionSet(object):
 
         # query the DB for TW_FLAT frames for any TEXP,FILTER 
         m_list = self.db.GetFilesT('SKY_FLAT')
-        match_list = []
-        for file in m_list:
-            fits = ClFits(file)
-            if fits.isTwFlat():
-                match_list.append((file, fits.getFilter()))
+        is_flat = self.frames.isTwFlat(m_list)
+        filters = self.frames.column(m_list, 'filter')
+        match_list = [(file, filters[i]) for i, file in enumerate(m_list)
+                      if is_flat[i]]
         
         
         # Sort out frames by FILTER
@@ -1327,11 +1315,11 @@ class ReductionSet(object):
         m_list = self.db.GetFilesT('DOME_FLAT_LAMP_ON')
         m_list2 = self.db.GetFilesT('DOME_FLAT_LAMP_OFF')
         
-        match_list = []
-        for file in m_list+m_list2:
-            fits = ClFits(file)
-            if fits.isDomeFlat():
-                match_list.append((file, fits.getFilter()))
+        m_list = m_list + m_list2
+        is_flat = self.frames.isDomeFlat(m_list)
+        filters = self.frames.column(m_list, 'filter')
+        match_list = [(file, filters[i]) for i, file in enumerate(m_list)
+                      if is_flat[i]]
         
         
         # Sort out frames by FILTER
@@ -1355,11 +1343,11 @@ class ReductionSet(object):
             return True
         
         """
-        for file in self.rs_filelist:
-            fi = ClFits(file)
-            if fi.isScience():
-                log.debug("File %s does not match as calibration file type %s", file)
-                return False
+        is_sci = self.frames.isScience(self.rs_filelist)
+        if is_sci.any():
+            log.debug("File %s does not match as calibration file type",
+                      self.rs_filelist[is_sci.argmax()])
+            return False
             
         log.debug("All files seem to be calibration files")
         return True
@@ -1460,8 +1448,9 @@ class ReductionSet(object):
         
         output_lines = []
         try:
-            output_lines  = subprocess.check_output(args, stderr = subprocess.STDOUT, 
-                                                    shell=False, bufsize=0)
+            with profiling.tool_call(os.path.basename(args[0])):
+                output_lines  = subprocess.check_output(args, stderr = subprocess.STDOUT, 
+                                                        shell=False, bufsize=0)
             log.debug("irdr::skyfilter command executed ...")
             sys.stdout.flush()
             sys.stderr.flush()
@@ -1609,6 +1598,41 @@ class ReductionSet(object):
             
         return out_filename
     
+    def solveFrame(self, input_file, out_dir):
+        """
+        Astrometric calibration (Astrometry.net) of a sky-subtracted frame.
+        It can be run concurrently for the frames of a sequence (see
+        parallelMap).
+
+        Parameters
+        ----------
+        input_file: str
+            Filename of the frame to be solved
+        out_dir: str
+            Output directory for solve-field (self.temp_dir produces 
+            collision)
+
+        Returns
+        -------
+        The filename of the solved frame (input_file renamed to .ast.fits)
+        """
+
+        try:
+            solved = solveField(input_file,
+                                out_dir,
+                                self.temp_dir,
+                                self.config_dict['general']['pix_scale'],
+                                wcs_cache=self.wcs_cache)
+        except Exception as e:
+            raise Exception("[solveAstrometry] Cannot solve Astrometry for file: %s \n%s" % (input_file, str(e)))
+
+        # Rename the file
+        out_filename = input_file.replace(".fits", ".ast.fits")
+        shutil.move(solved, out_filename)
+        log.debug("New file calibrated: %s" % out_filename)
+
+        return out_filename
+
     def getWCSPointingOffsets(self, images_in,
                               p_offsets_file="/tmp/offsets.pap"):
       """
@@ -1843,15 +1867,18 @@ class ReductionSet(object):
             gain: gain map file to use for the coaddition (it take into account 
                   the BPM)
             
-            type_comb : type of combination to use (currently, only average 
-                        available):
+            type_comb : type of combination to use:
                         - average: calculate robust mean of stack (using weights)
                         - sum: arithmetic sum of the stack (without weights)
+                        - median: median of the stack (only with 'papi' engine)
             
         OUTPUTS:
             output : coadded image (and the weight map .weight.fits)
             
-        TODO: allow other kind of combination (median, ...see iraf.imcombine)
+        Notes:
+            The coadd engine is selected with 'general.coadd_engine' in the 
+            config file: 'irdr' (default) uses IRDR::dithercubemean, 'papi' 
+            uses the in-process engine (reduce/dithercoadd.py).
             
         """
                                                   
@@ -1874,7 +1901,22 @@ class ReductionSet(object):
             
         weight_file = output_file.replace(".fits",".weight.fits")
         
-        # STEP 2: Run the coadd                                           
+        coadd_engine = self.config_dict['general'].get('coadd_engine')
+        if not coadd_engine:
+            coadd_engine = 'irdr'
+        
+        # STEP 2: Run the coadd
+        if coadd_engine.lower() == 'papi':
+            try:
+                dc = DitherCoadd(input_file, gain_file, output_file,
+                                 weight_file, type_comb)
+                dc.coadd()
+            except Exception as e:
+                log.error("Some error while running DitherCoadd: %s" % str(e))
+                return (None, None)
+            log.debug("Successful ending of coaddStackImages")
+            return (output, weight_file)
+        
         if type_comb == 'average': # (use IRDR::dithercubemean)
             prog = self.m_irdr_path + "/dithercubemean "
             cmd = prog + " " + input_file + " " + gain_file + " " + output_file + " " + weight_file
@@ -1882,7 +1924,6 @@ class ReductionSet(object):
             # actually, weight_file is not used
             prog = self.m_irdr_path + "/dithercubemean "
             cmd  = prog + " " + input_file + " " + gain_file + " " + output_file + " " + weight_file + " sum " 
-        #elif type_comb=='median': # (use IRAF::imcombine)
         else: 
             return (None,None)
         
@@ -2547,7 +2588,11 @@ class ReductionSet(object):
                 log.info("NLC offset: %s"%self.non_linearity_cds_offset_cntsr)
                 nl_task = correctNonLinearity.NonLinearityCorrection(self.non_linearity_cds_offset_cntsr, master_nl, 
                             sequence, out_dir=self.temp_dir, suffix='_LC')
-                corr_sequence = nl_task.runMultiNLC()
+                corr_sequence = self.cache.run('nlc', nl_task.runMultiNLC,
+                                               inputs=sequence,
+                                               calibs=[master_nl, self.non_linearity_cds_offset_cntsr],
+                                               config=self.config_dict['nonlinearity'],
+                                               out_dir=self.temp_dir)
 
             except Exception as e:
                 log.error("Error while applying NL model: %s" % str(e))
@@ -2589,7 +2634,7 @@ class ReductionSet(object):
                 os.unlink(outfile) # we only need the name
                 
                 # Check and collapse if required (cube images)
-                sequence = collapse(sequence, out_dir=self.temp_dir)
+                sequence = collapse(sequence, out_dir=self.temp_dir, ncpus=n_cpus)
                 
                 # Check for EXPT in order to know how to create the master dark 
                 # (dark model or fixed EXPT)     
@@ -2609,11 +2654,14 @@ class ReductionSet(object):
                     
                     
                     red_parameters = ()
-                    result = pool.apply_async(task.createMaster, 
-                                                 red_parameters)
+                    def create_master():
+                        result = pool.apply_async(task.createMaster, 
+                                                  red_parameters)
+                        result.wait()
+                        return result.get()
                     
-                    result.wait()
-                    out = result.get()
+                    out = self.cache.run('master_dark', create_master,
+                                         inputs=sequence, out_dir=self.out_dir)
                     
                     log.result("OUTPUT file generated %s"%out)
                     pool.close()
@@ -2630,10 +2678,14 @@ class ReductionSet(object):
                         #out = task.createDarkModel()
                         
                         red_parameters = ()
-                        result = pool.apply_async(task.createDarkModel, 
-                                                 red_parameters)
-                        result.wait()
-                        out = result.get()
+                        def create_model():
+                            result = pool.apply_async(task.createDarkModel, 
+                                                      red_parameters)
+                            result.wait()
+                            return result.get()
+                        
+                        out = self.cache.run('master_dark_model', create_model,
+                                             inputs=sequence, out_dir=self.out_dir)
                     
                         pool.close()
                         pool.join()
@@ -2663,7 +2715,7 @@ class ReductionSet(object):
                 os.unlink(outfile) # we only need the name
 
                 # Check and collapse if required (cube images)
-                sequence = collapse(sequence, out_dir=self.temp_dir)
+                sequence = collapse(sequence, out_dir=self.temp_dir, ncpus=n_cpus)
 
                 m_smooth = self.config_dict['dflats']['median_smooth']
                 task = MasterDomeFlat(sequence,
@@ -2673,10 +2725,16 @@ class ReductionSet(object):
                 #out = task.createMaster()
                 
                 red_parameters = ()
-                result = pool.apply_async(task.createMaster, 
-                                                 red_parameters)
-                result.wait()
-                out = result.get()
+                def create_master():
+                    result = pool.apply_async(task.createMaster, 
+                                              red_parameters)
+                    result.wait()
+                    return result.get()
+                
+                out = self.cache.run('master_dome_flat', create_master,
+                                     inputs=sequence,
+                                     config=self.config_dict['dflats'],
+                                     out_dir=self.out_dir)
                     
                 pool.close()
                 pool.join()
@@ -2741,7 +2799,7 @@ class ReductionSet(object):
                     os.unlink(outfile) # we only need the name
 
                     # Check and collapse if required (cube images)
-                    sequence = collapse(sequence, out_dir=self.temp_dir)
+                    sequence = collapse(sequence, out_dir=self.temp_dir, ncpus=n_cpus)
 
                     m_smooth = self.config_dict['twflats']['median_smooth']
                     
@@ -2757,10 +2815,17 @@ class ReductionSet(object):
                                               median_smooth=m_smooth)
                     # out = task.createMaster()
                     red_parameters = ()
-                    result = pool.apply_async(task.createMaster, 
-                                                 red_parameters)
-                    result.wait()
-                    out = result.get()
+                    def create_master():
+                        result = pool.apply_async(task.createMaster, 
+                                                  red_parameters)
+                        result.wait()
+                        return result.get()
+                    
+                    out = self.cache.run('master_tw_flat', create_master,
+                                         inputs=sequence,
+                                         calibs=[master_dark_model] + master_darks,
+                                         config=self.config_dict['twflats'],
+                                         out_dir=self.out_dir)
                     
                     pool.close()
                     pool.join()
@@ -2797,7 +2862,7 @@ class ReductionSet(object):
                 os.unlink(outfile) # we only need the name
 
                 # Check and collapse if required (cube images)
-                sequence = collapse(sequence, out_dir=self.temp_dir)
+                sequence = collapse(sequence, out_dir=self.temp_dir, ncpus=n_cpus)
                 #
                 listToFile(sequence, self.temp_dir+"/focus.list")
                 pix_scale = self.config_dict['general']['pix_scale']
@@ -2839,7 +2904,7 @@ class ReductionSet(object):
                                                             self.config_dict['general']['min_frames']))
             else:
                 # Check and collapse if required (cube images)
-                sequence = collapse(sequence, out_dir=self.temp_dir)
+                sequence = collapse(sequence, out_dir=self.temp_dir, ncpus=n_cpus)
                 
                 #
                 # Get calibration files.
@@ -2906,6 +2971,10 @@ class ReductionSet(object):
                         ##calc = results.manage(pprocess.MakeReusable(self.reduceSingleObj))
 
                         results = []
+                        
+                        # The CPUs are shared out among the detectors reduced
+                        # at the same time (astrometry of their frames)
+                        self.astrometry_workers = max(1, n_cpus // next)
                           
                         for n in range(next):
                             if next == 1 and q >= 0:
@@ -2996,6 +3065,7 @@ class ReductionSet(object):
                     
                 else:
                     ######## Serial #########
+                    self.astrometry_workers = n_cpus
                     for n in range(next):
                         if next == 1 and q >= 0:  # single detector processing
                             q_ext = q + 1
@@ -3119,6 +3189,15 @@ class ReductionSet(object):
                     except Exception as ex:
                         log.error("Some error while building final Mosaic (Montage)")
                         raise ex
+                elif self.config_dict['general']['mosaic_engine'] == 'native':
+                    # Build Mosaic reprojecting the detectors by tiles
+                    log.debug("Building final mosaic using native engine")
+                    try:
+                        Mosaic(out_ext, seq_result_outfile, background_match=True,
+                               n_workers=self.config_dict['general']['ncpus']).build()
+                    except Exception as ex:
+                        log.error("Some error while building final Mosaic (native)")
+                        raise ex
                 else:
                     # Default: no mosaic is built
                     log.warning("No final mosaic is built, but a MEF file")
@@ -3228,9 +3307,33 @@ class ReductionSet(object):
             If 'red_mode' = 'lemon', the method return a file listing the files
             obtained of the pre-processing done (dark, flat and sky subtraction) 
         
+        Notes
+        -----
+        The resources used by each stage (and by the external tools called) are
+        written as a JSON report (*.profile.json) in the output directory.
+        """
+        
+        if output_file:
+            report = os.path.join(out_dir, 
+                os.path.splitext(os.path.basename(output_file))[0] + '.profile.json')
+        else:
+            report = os.path.join(out_dir, 'reduceSingleObj.%d.profile.json' % os.getpid())
+        
+        with profiling.Profiler("reduceSingleObj", report, 
+                                red_mode=red_mode,
+                                input_files=list(obj_frames),
+                                output_file=output_file):
+            return self._reduceSingleObj(obj_frames, master_dark, master_flat,
+                                         master_bpm, red_mode, out_dir, 
+                                         output_file)
+
+    def _reduceSingleObj(self, obj_frames, master_dark, master_flat, master_bpm,
+                          red_mode, out_dir, output_file):
+        """
+        Implementation of reduceSingleObj(); see its description above.
         """
         
-        self.m_filter = ClFits(obj_frames[0]).getFilter()
+        self.m_filter = self.frames.row(obj_frames[0])['filter']
         log.info("#########################################")
         log.info("#### Starting Object Data Reduction #####")
         log.info("#### MODE = %s  ", self.red_mode)
@@ -3264,6 +3367,7 @@ class ReductionSet(object):
             self.m_LAST_FILES = obj_frames
             
         
+        profiling.next_stage("0-data_validation")
         ########################################################################
         # 0 - Some checks (filter, ....) 
         ########################################################################
@@ -3310,6 +3414,7 @@ class ReductionSet(object):
         # keep a copy of the original file names
         self.m_rawFiles = self.m_LAST_FILES        
 
+        profiling.next_stage("0-bad_pixels")
         ########################################################################
         # 0 - Bad Pixels; three options:
         # 'none': nothing to do, BPM file is ignored.
@@ -3334,6 +3439,7 @@ class ReductionSet(object):
             master_bpm_4fix = None
             bpm_action = 'none'
 
+        profiling.next_stage("1-dark_flat")
         ########################################################################
         # 1 - Apply dark, flat to ALL files 
         ########################################################################
@@ -3345,8 +3451,12 @@ class ReductionSet(object):
                                        master_flat,
                                        master_bpm_4fix, 
                                        out_dir)
-            self.m_LAST_FILES = res.apply()
+            self.m_LAST_FILES = self.cache.run('dark_flat', res.apply,
+                                               inputs=self.m_LAST_FILES,
+                                               calibs=[master_dark, master_flat, master_bpm_4fix],
+                                               out_dir=out_dir)
         
+        profiling.next_stage("2-super_flat")
         ########################################################################
         # 2 - Compute Super Sky Flat-Field --> GainMap
         #      The 'local_master_flat' is ONLY used to build the GainMap, and
@@ -3386,6 +3496,7 @@ class ReductionSet(object):
             local_master_flat = master_flat 
             log.info("Using the given (dome or twlight) master flat")
                  
+        profiling.next_stage("3-gain_map")
         ########################################################################
         # 3 - Compute Gain map and apply BPM
         ########################################################################
@@ -3490,6 +3601,7 @@ class ReductionSet(object):
             return self.m_LAST_FILES[0]
             
                         
+        profiling.next_stage("4-first_sky")
         ########################################################################
         # 4 - First Sky subtraction (IRDR) - sliding window technique
         #     (and set bad pixels to bkg lvl)
@@ -3518,6 +3630,7 @@ class ReductionSet(object):
                                            None,
                                            fix_type)
         
+        profiling.next_stage("4.1-crosstalk")
         ########################################################################
         # 4.1 - Remove crosstalk - (only if bright stars are present)
         #       (if red_mode!=quick, then crosstalk will be done later)
@@ -3535,6 +3648,7 @@ class ReductionSet(object):
             except Exception as e:
                 raise e      
 
+        profiling.next_stage("4.2-post_sky_processing")
         ########################################################################
         # 4.2 - Divide by the master flat after sky subtraction ! 
         # some people think it is better do it now (M.J.Irwing, CASU)
@@ -3553,30 +3667,19 @@ class ReductionSet(object):
                                        master_flat,
                                        None, 
                                        out_dir)
-            self.m_LAST_FILES = res.apply()
+            self.m_LAST_FILES = self.cache.run('dark_flat', res.apply,
+                                               inputs=self.m_LAST_FILES,
+                                               calibs=[None, master_flat, None],
+                                               out_dir=out_dir)
         
         ########################################################################
         # Preliminary Astrometric calibration of sky-subtracted frames.
         # ######################################################################
         if self.config_dict['offsets']['method'] == 'wcs':
             log.info("**** Preliminary Astrometric calibration ****")
-            new_files = []
-            for my_file in self.m_LAST_FILES:
-                # Run astrometric calibration
-                try:
-                    solved = solveField(my_file,
-                                out_dir,  # self.temp_dir produces collision
-                                self.temp_dir,
-                                self.config_dict['general']['pix_scale'])
-                except Exception as e:
-                    raise Exception("[solveAstrometry] Cannot solve Astrometry for file: %s \n%s" % (my_file, str(e)))
-                else:
-                    # Rename the file
-                    out_filename = my_file.replace(".fits", ".ast.fits")
-                    new_files.append(out_filename)
-                    shutil.move(solved, out_filename)
-
-            self.m_LAST_FILES = new_files
+            self.m_LAST_FILES = parallelMap(self.solveFrame,
+                                            [(f, out_dir) for f in self.m_LAST_FILES],
+                                            self.astrometry_workers)
 
         ########################################################################
         # 4.3 - TEST - Clean Bad Pixels (probably only required for LEMON)    
@@ -3612,6 +3715,7 @@ class ReductionSet(object):
             log.info("Quick-LEMON output generated !")
             return papi_output
          
+        profiling.next_stage("5-offsets")
         ########################################################################
         # 5 - Compute dither offsets:
         #        - using astrometric calibration (wcs)
@@ -3630,12 +3734,17 @@ class ReductionSet(object):
             log.info("Computing dither offsets using cross-correlation")
             listToFile(self.m_LAST_FILES, out_dir + "/files_skysub.list")
             try:
-                offset_mat = self.getPointingOffsets(out_dir + "/files_skysub.list", 
-                                                    out_dir + '/offsets1.pap')
+                offset_mat = self.cache.run('offsets',
+                                lambda: self.getPointingOffsets(out_dir + "/files_skysub.list", 
+                                                                out_dir + '/offsets1.pap'),
+                                inputs=self.m_LAST_FILES,
+                                config=[self.config_dict['offsets'], self.m_filter],
+                                extra_files=[out_dir + '/offsets1.pap'])
             except Exception as e:
                 log.error("Error while getting pointing offsets. Cannot continue with data reduction...")
                 raise e
         
+        profiling.next_stage("6-first_coadd")
         ########################################################################
         # End of first cycle: SINGLE REDUCTION (quick mode or extended object !)    
         # 6 - Preliminary coaddition and registering of the stack. Two options:
@@ -3737,6 +3846,7 @@ class ReductionSet(object):
             log.info("#########################################")
             return output_file
        
+        profiling.next_stage("8-object_mask")
         ########################################################################
         # 8 - Create master object mask of the 1st stack coadd.
         ########################################################################
@@ -3746,8 +3856,12 @@ class ReductionSet(object):
 
         # Build masterObjMask of the first coadded stack
         log.info("**** Master object mask creation ****")
-        obj_mask = self.__createMasterObjMask(output_file, 
-                                               out_dir + '/masterObjMask.fits')
+        obj_mask = self.cache.run('object_mask',
+                        lambda: self.__createMasterObjMask(output_file, 
+                                                           out_dir + '/masterObjMask.fits'),
+                        inputs=[output_file],
+                        config=[self.config_dict['skysub'], self.config_dict['general']['dilate']],
+                        out_dir=out_dir)
             
         ########################################################################
         # Re-compute dither offsets taking into account the object mask
@@ -3778,8 +3892,12 @@ class ReductionSet(object):
             # Create a object mask for each sky-subtracted file
             obj_mask_skysub = []
             for im in self.m_LAST_FILES:
-                res = self.__createMasterObjMask(im,
-                                  out_dir + "/" + os.path.basename(im).replace(".fits", ".obj.fits"))
+                res = self.cache.run('object_mask',
+                        lambda: self.__createMasterObjMask(im,
+                                  out_dir + "/" + os.path.basename(im).replace(".fits", ".obj.fits")),
+                        inputs=[im],
+                        config=[self.config_dict['skysub'], self.config_dict['general']['dilate']],
+                        out_dir=out_dir)
                 obj_mask_skysub.append(res)
         else:
             # Only a common and deeper object mask
@@ -3791,6 +3909,7 @@ class ReductionSet(object):
         ########################################################################
         # TODO ? In principle, it is not necessary.
         
+        profiling.next_stage("9-second_sky")
         ########################################################################
         # 9 - Second Sky subtraction (IRDR) using then OBJECT MASK
         ########################################################################
@@ -3837,6 +3956,7 @@ class ReductionSet(object):
         self.m_LAST_FILES = self.skyFilter(out_dir + "/skylist2.pap", gainmap, 
                                            'mask', self.obs_mode)
         
+        profiling.next_stage("9.1-crosstalk")
         ########################################################################
         # 9.1 - Remove crosstalk - (only if bright stars are present)    
         ########################################################################
@@ -3894,30 +4014,19 @@ class ReductionSet(object):
                                        master_flat,
                                        None, 
                                        out_dir)
-            self.m_LAST_FILES = res.apply()
+            self.m_LAST_FILES = self.cache.run('dark_flat', res.apply,
+                                               inputs=self.m_LAST_FILES,
+                                               calibs=[None, master_flat, None],
+                                               out_dir=out_dir)
 
+        profiling.next_stage("9.5-astrometry")
 	########################################################################
         # 9.5 Preliminary Astrometric calibration of sky-subtracted frames.
         ########################################################################
         log.info("**** Preliminary Astrometric calibatrion (2nd sky) ****")
-        new_files = []
-        for my_file in self.m_LAST_FILES:
-            # Run astrometric calibration
-            try:
-                solved = solveField(my_file,
-                               out_dir, # self.temp_dir produces collision
-                               self.temp_dir,
-                               self.config_dict['general']['pix_scale'])
-            except Exception as e:
-                raise Exception("[solveAstrometry] Cannot solve Astrometry for file: %s \n%s"%(my_file, str(e)))
-            else:
-                # Rename the file
-                out_filename = my_file.replace(".fits", ".ast.fits")
-                new_files.append(out_filename)
-                shutil.move(solved, out_filename)
-                log.debug("New file calibrated: %s"%out_filename)
-        
-        self.m_LAST_FILES = new_files
+        self.m_LAST_FILES = parallelMap(self.solveFrame,
+                                        [(f, out_dir) for f in self.m_LAST_FILES],
+                                        self.astrometry_workers)
         
         ########################################################################
         # 9.6 - LEMON connection - End here for LEMON processing    
@@ -3934,6 +4043,7 @@ class ReductionSet(object):
                      len(self.m_LAST_FILES))
             return papi_output
         
+        profiling.next_stage("10-final_coadd")
         #######################################################################
         # 10 - Compute field distortion and make final stack:
         #       1-Remove field distortion from individual images (SCAMP+SWARP)
@@ -39,10 +39,12 @@ import re
 
 # Project modules
 from astropy import wcs
+from astropy.wcs.utils import proj_plane_pixel_scales
 import astropy.io.fits as fits
 import numpy
 import papi.misc.robust as robust
 from papi.misc.paLog import log as logging
+from papi.misc import profiling
 
 
 try: 
@@ -109,7 +111,8 @@ def readHeader(filename, extension=1):
         return scale, ra, dec, instrument, is_science, naxis1, naxis2
         
     
-def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, downsample=1):
+def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, downsample=1,
+               wcs_cache=None):
     """
     Do astrometric calibration to the given filename using Astrometry.net 
     function 'solve-field'.
@@ -136,6 +139,12 @@ def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, d
         In case of MEF file, extension to be used to solve field. Default 0
         extension means 'no-mef', and thus one single extension.
 
+    wcs_cache: WCSCache
+        If given, the cached solution of the same pointing (if any) is used
+        to give tight scale/position hints and a WCS to verify to
+        solve-field; if the field is not solved with them, it is solved as
+        usual. The new solution is stored in the cache.
+
     Returns
     -------
     Filename of solved file (filename.new.fits) 
@@ -235,29 +244,27 @@ def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, d
         str_cmd = "%s/solve-field -O -p -D %s --temp-dir %s %s %s --downsample %s\
         " % (path_astrometry, out_dir, tmp_dir, filename, ext_str, downsample)
     
-    logging.debug("CMD=" + str_cmd)
-    print("CMD_Astrometry.net =", str_cmd)
-
-    try:
-        p = subprocess.Popen(str_cmd, bufsize=0, shell=True,
-                             stdin=subprocess.PIPE,
-                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                             close_fds=True)
-    except Exception as e:
-        logging.error("Some error while running subprocess: " + str_cmd)
-        logging.error(str(e))
-        raise e
-
-    # Warning:
-    # We use communicate() rather than .stdin.write, .stdout.read or .stderr.read 
-    # to avoid deadlocks due to any of the other OS pipe buffers filling up and 
-    # blocking the child process.(Python Ref.doc)
-
-    (stdoutdata, stderrdata) = p.communicate()
-    solve_out = stdoutdata.decode() + "\n" + stderrdata.decode()
-
-    if len(solve_out) > 1:
-        logging.info("Solve-field output:" + solve_out)
+    # 4) A solution of the same pointing is cached (warm start): tight hints
+    # and the predicted WCS to be verified; the previous command is kept
+    # in case the field is not solved with them.
+    commands = [str_cmd]
+    raw_header = None
+    verify_file = None
+    if wcs_cache is not None and extension == 0:
+        raw_header = fits.getheader(filename)
+        predicted = wcs_cache.lookup(raw_header, pix_scale)
+        if predicted is not None:
+            m_wcs = wcs.WCS(predicted)
+            c_ra, c_dec = m_wcs.wcs_pix2world([[nx1 / 2.0, nx2 / 2.0]], 1)[0]
+            c_scale = proj_plane_pixel_scales(m_wcs).mean() * 3600.0
+            verify_file = os.path.join(tmp_dir, "%s.verify.wcs"
+                                % os.path.splitext(os.path.basename(filename))[0])
+            fits.PrimaryHDU(header=predicted).writeto(verify_file, overwrite=True)
+            logging.debug("Using cached WCS: RA= %s Dec= %s Scale= %s" % (c_ra, c_dec, c_scale))
+            commands.insert(0, "%s/solve-field -O -p --tweak-order 1 --scale-units arcsecperpix --scale-low %s \
+            --scale-high %s --ra %s --dec %s --radius 0.1 --verify %s -D %s --temp-dir %s %s %s --downsample %s\
+            " % (path_astrometry, c_scale * 0.98, c_scale * 1.02, c_ra, c_dec, verify_file,
+                 out_dir, tmp_dir, filename, ext_str, downsample))
 
     #
     # Look for filename.solved to know if field was solved
@@ -265,6 +272,41 @@ def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, d
     solved_file = os.path.join(out_dir, 
         os.path.splitext(os.path.basename(filename))[0] + ".solved")
 
+    for str_cmd in commands:
+        logging.debug("CMD=" + str_cmd)
+        print("CMD_Astrometry.net =", str_cmd)
+
+        # (the call is recorded in the active Profiler, if any)
+        with profiling.tool_call("solve-field"):
+            try:
+                p = subprocess.Popen(str_cmd, bufsize=0, shell=True,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     close_fds=True)
+            except Exception as e:
+                logging.error("Some error while running subprocess: " + str_cmd)
+                logging.error(str(e))
+                raise e
+
+            # Warning:
+            # We use communicate() rather than .stdin.write, .stdout.read or .stderr.read 
+            # to avoid deadlocks due to any of the other OS pipe buffers filling up and 
+            # blocking the child process.(Python Ref.doc)
+
+            (stdoutdata, stderrdata) = p.communicate()
+        solve_out = stdoutdata.decode() + "\n" + stderrdata.decode()
+
+        if len(solve_out) > 1:
+            logging.info("Solve-field output:" + solve_out)
+
+        if os.path.exists(solved_file):
+            break
+        elif str_cmd != commands[-1]:
+            logging.warning("Field not solved from the cached WCS, trying again without it")
+
+    if verify_file and os.path.exists(verify_file):
+        os.remove(verify_file)
+
     if os.path.exists(solved_file):
         logging.info("Field solved !")
         new_file = os.path.join(out_dir, os.path.splitext(os.path.basename(filename))[0] + ".new")
@@ -296,6 +338,10 @@ def solveField(filename, out_dir, tmp_dir="/tmp", pix_scale=None, extension=0, d
         
         # Write value into fits header
         fits.setval(out_file, keyword="ROTANGLE", value=ROT_ANGLE, comment="degrees E of N", ext=0)
+
+        # Keep the solution for the next frames of the same pointing
+        if raw_header is not None:
+            wcs_cache.store(raw_header, fits.getheader(out_file), filename, pix_scale)
         
         # in any case try to remove the files created by astrometry.net
         try:
@@ -361,18 +407,27 @@ def calc(args):
     return solveField(*args)
 
 
-def runMultiSolver(files, out_dir, tmp_dir, pix_scale=None, extension=0, downsample=1):
+def runMultiSolver(files, out_dir, tmp_dir, pix_scale=None, extension=0, downsample=1,
+                   ncpus=None):
     """
     Run a parallel proceesing to solve astrometry for the input files taking
     advantege of multi-core CPUs.
 
+    Parameters
+    ----------
+    ncpus: int
+        Number of files solved at the same time (e.g., general.ncpus); if 
+        None, all the CPUs available in the computer are used.
+
     Returns
     -------
     On succes, a list with the filenames of the fields solved.
     """
 
-    # use all CPUs available in the computer
-    n_cpus = multiprocessing.cpu_count()
+    if ncpus is None:
+        n_cpus = multiprocessing.cpu_count()
+    else:
+        n_cpus = max(1, min(ncpus, len(files)))
     logging.debug("N_CPUS :" + str(n_cpus))
     pool = multiprocessing.Pool(processes=n_cpus)
     
@@ -459,6 +514,11 @@ in principle previously reduced, but not mandatory; Astromety.net tool is used.
     parser.add_argument("-r", "--recursive",
                   action="store_true", dest="recursive", default=False,
                   help="Recursive subdirectories if source is a directory name (only first level)")
+
+    parser.add_argument("-n", "--ncpus",
+                  action="store", dest="ncpus", type=int, default=None,
+                  help="Number of files solved at the same time "
+                  "[default: number of CPUs]")
     
                                 
     options = parser.parse_args()
@@ -497,7 +557,8 @@ in principle previously reduced, but not mandatory; Astromety.net tool is used.
                                       options.temp_dir,
                                       options.pixel_scale,
                                       options.extension,
-                                      options.downsample)
+                                      options.downsample,
+                                      options.ncpus)
         for file in filelist:
             ren_file = os.path.join(options.output_dir,
                     os.path.basename(os.path.splitext(file)[0] + ".ast.fits"))
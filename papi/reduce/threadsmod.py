@@ -21,8 +21,17 @@
 
 # Import requered modules
 
+import os
+import heapq
+import signal
+import itertools
+import pickle
 import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
 import papi.misc.display as display
+from papi.misc.paLog import log
 
 
 #######################################
@@ -63,6 +72,426 @@ class ExecTaskThread(threading.Thread):
             #self._event.set() # signal for the waiting thread (consumer)
 
             
+# Progress queue of the current process, when it is a TaskExecutor worker 
+_progress_queue = None
+
+def _init_worker(progress_queue):
+    """
+    Initializer of the TaskExecutor worker processes.
+    """
+    global _progress_queue
+    _progress_queue = progress_queue
+
+def _run_task(task_id, cwd, task, args):
+    """
+    Run a task in a TaskExecutor worker process, in the working directory
+    the task was submitted from, notifying when it is started.
+    """
+    if _progress_queue is not None:
+        _progress_queue.put((task_id, "INITIATED", os.getpid()))
+    os.chdir(cwd)
+    return task(*args)
+
+
+class TaskExecutor(object):
+    """
+    Executor of the QL tasks in a pool of worker processes, so they do not
+    compete for the GIL with the GUI and independent tasks can run 
+    concurrently. 
+    
+    It keeps the ExecTaskThread protocol: when a task finishes, a TaskInfo 
+    with its result is appended to the given task_info_list, that is polled
+    by the GUI. Besides, progress messages (task_id, status, pid) are sent 
+    when a task starts/finishes, and pending tasks can be cancelled.
+
+    Tasks (and their arguments) that cannot be pickled are run with an 
+    ExecTaskThread in the current process.
+    """
+    def __init__(self, max_workers=None):
+
+        if not max_workers or max_workers < 1:
+            max_workers = multiprocessing.cpu_count()
+        self._progress = multiprocessing.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=max_workers,
+                                         initializer=_init_worker,
+                                         initargs=(self._progress,))
+        self._futures = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, task, task_info_list, *args):
+        """
+        Submit a task to be run in the pool with the given arguments.
+
+        Returns
+        -------
+        The task_id (int) used in the progress messages and to cancel it.
+        """
+
+        task_id = next(self._ids)
+        name = getattr(task, '__qualname__', getattr(task, '__name__', str(task)))
+        try:
+            pickle.dumps((task, args))
+        except Exception as e:
+            log.debug("Task %s cannot be run in a process (%s); using a thread" 
+                      % (name, str(e)))
+            ExecTaskThread(task, task_info_list, *args).start()
+            return task_id
+        
+        future = self._pool.submit(_run_task, task_id, os.getcwd(), task, args)
+        with self._lock:
+            self._futures[task_id] = future
+        future.add_done_callback(
+            lambda f: self._done(task_id, name, f, task_info_list))
+        log.debug("Task %s submitted (id=%d)" % (name, task_id))
+
+        return task_id
+
+    def _done(self, task_id, name, future, task_info_list):
+        """
+        Called when the task finishes (or it is cancelled), to deliver its
+        TaskInfo to the task_info_list.
+        """
+        
+        task_info = TaskInfo()
+        task_info._name = name
+        task_info._curr_status = "FINISHED"
+        try:
+            task_info._return = future.result()
+            task_info._exit_status = 0      # EXIT_SUCCESS, all was OK
+        except CancelledError:
+            task_info._exit_status = 1
+            task_info._exc = Exception("Task %s cancelled" % name)
+            task_info._curr_status = "CANCELLED"
+        except Exception as e:
+            task_info._exit_status = 1      # EXIT_FAILURE, some error happened
+            task_info._exc = e
+
+        with self._lock:
+            self._futures.pop(task_id, None)
+        self._progress.put((task_id, task_info._curr_status, None))
+        task_info_list.append(task_info)
+
+    def cancel(self, task_id=None):
+        """
+        Cancel a pending task, or all of them if task_id is None. Tasks 
+        already running cannot be cancelled.
+
+        Returns
+        -------
+        The number of tasks cancelled.
+        """
+
+        with self._lock:
+            futures = [f for t_id, f in self._futures.items() 
+                       if task_id is None or t_id == task_id]
+        
+        return sum([f.cancel() for f in futures])
+
+    def pending(self):
+        """
+        Return the number of tasks submitted and not finished yet.
+        """
+
+        with self._lock:
+            return len(self._futures)
+
+    def progress(self):
+        """
+        Return the list of progress messages (task_id, status, pid) received 
+        since the last call; it never blocks.
+        """
+
+        messages = []
+        while True:
+            try:
+                messages.append(self._progress.get_nowait())
+            except Exception:
+                break
+
+        return messages
+
+    def shutdown(self, wait=False):
+        """
+        Cancel the pending tasks and release the pool of processes.
+        """
+
+        self.cancel()
+        self._pool.shutdown(wait=wait)
+
+
+# Priorities of the QL jobs (lower value, higher priority)
+PRIO_SCIENCE = 0      # reduction of (science) sequences, user requests
+PRIO_LAZY = 1         # per-frame QL processing of the incoming files
+PRIO_CALIBRATION = 2  # (re)building of master calibrations
+
+def _job_worker(conn, func, args):
+    """
+    Run a JobScheduler job in its own process group (so it can be suspended or
+    killed with all its children) and send back the result, or the exception
+    raised.
+    """
+    os.setpgrp()
+    try:
+        result = func(*args)
+    except Exception as e:
+        log.error("[worker] Error while processing task: %s" % str(e))
+        result = e
+    try:
+        conn.send(result)
+    except Exception as e:
+        # the result cannot be pickled
+        conn.send(Exception("Cannot return the job result: %s" % str(e)))
+    finally:
+        conn.close()
+
+
+class Job(object):
+    """
+    A job of the JobScheduler.
+    """
+    def __init__(self, job_id, func, args, priority, key, name, workdir=None):
+
+        self.id = job_id
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.key = key           # jobs with the same key supersede the older ones
+        self.name = name
+        self.workdir = workdir   # jobs sharing a workdir are never run together
+        self.status = "QUEUED"   # QUEUED, RUNNING, SUSPENDED, FINISHED, CANCELLED
+        self.process = None
+
+    def __lt__(self, other):
+        # priority, then arrival order
+        return (self.priority, self.id) < (other.priority, other.id)
+
+
+class JobScheduler(object):
+    """
+    Prioritized, multi-slot scheduler of QL jobs, each one run in its own 
+    process.
+
+    - Jobs are started by priority (PRIO_*), and then by arrival order, on 
+      up to 'slots' concurrent processes.
+    - If all the slots are busy and a job with higher priority arrives, the 
+      running job with the lowest priority is preempted, i.e., suspended 
+      (SIGSTOP) until a slot is free again (SIGCONT).
+    - A new job with the same 'key' (e.g., the same sequence) than older ones
+      supersedes them: pending ones are discarded and running ones killed.
+    - Jobs with the same 'workdir' (e.g., ReductionSets sharing out_dir and 
+      temp_dir, that clean up and reuse fixed file names there) are run one
+      after the other: a job is not started, nor preempts, while another one
+      of the same workdir is running or suspended.
+    - Completion is event-driven: a thread waits for the result of each job
+      and calls notify(job, result), from that thread; the receiver must 
+      call finished(job) from the thread owning the scheduler (i.e., the GUI
+      thread), that starts the next pending jobs.
+    """
+    def __init__(self, notify, slots=2, preempt=True):
+
+        self._notify = notify
+        self.slots = max(1, slots or 1)
+        self.preempt = preempt
+        self._pending = []       # heap of QUEUED and SUSPENDED jobs
+        self._running = {}       # job_id: Job
+        self._ids = itertools.count(1)
+
+    def submit(self, func, args=(), priority=PRIO_SCIENCE, key=None, name=None,
+               workdir=None):
+        """
+        Queue a new job and dispatch the pending jobs.
+
+        Returns
+        -------
+        The Job object created.
+        """
+
+        if name is None:
+            name = getattr(func, '__qualname__', getattr(func, '__name__', str(func)))
+        job = Job(next(self._ids), func, args, priority, key, name, workdir)
+        if key is not None:
+            self.cancel(key=key)
+        heapq.heappush(self._pending, job)
+        log.debug("Job #%d (%s) queued with priority %d" % (job.id, name, priority))
+        self.dispatch()
+
+        return job
+
+    def dispatch(self):
+        """
+        Start (or resume) the pending jobs with highest priority on the free
+        slots, preempting lower priority jobs if required.
+        """
+
+        for job in sorted(self._pending):
+            if self._busy(job):
+                continue
+            active = [j for j in self._running.values() if j.status == "RUNNING"]
+            if len(active) >= self.slots:
+                if not self.preempt:
+                    break
+                victim = max(active)
+                if victim.priority <= job.priority:
+                    break
+                if not self._suspend(victim):
+                    # the victim has just finished; its slot is released by 
+                    # finished()
+                    break
+            self._pending.remove(job)
+            heapq.heapify(self._pending)
+            if job.status == "SUSPENDED":
+                self._resume(job)
+            else:
+                self._start(job)
+
+    def _busy(self, job):
+        """
+        Whether another job with the same workdir is running or suspended.
+        """
+
+        if job.workdir is None:
+            return False
+        others = list(self._running.values()) + [j for j in self._pending 
+                                                  if j.status == "SUSPENDED"]
+        return any(j is not job and j.workdir == job.workdir for j in others)
+
+    def _start(self, job):
+        
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        job.process = multiprocessing.Process(target=_job_worker,
+                                              args=(writer, job.func, job.args))
+        job.process.start()
+        writer.close()
+        job.status = "RUNNING"
+        self._running[job.id] = job
+        # release references to (big) arguments in the GUI process
+        job.func = job.args = None
+        threading.Thread(target=self._wait, args=(job, reader), 
+                         daemon=True).start()
+        log.debug("Job #%d (%s) started, PID %d" % (job.id, job.name, job.process.pid))
+
+    def _wait(self, job, reader):
+        """
+        Wait (in its own thread) for the result of the job.
+        """
+        try:
+            result = reader.recv()
+        except EOFError:
+            # the process died without sending anything (killed or crashed)
+            result = Exception("Job %s finished abnormally" % job.name)
+        finally:
+            reader.close()
+        job.process.join()
+        if job.status != "CANCELLED":
+            self._notify(job, result)
+
+    def _signal(self, job, sig):
+        """
+        Send the signal to the process (group) of the job.
+
+        Returns
+        -------
+        False if the process has already finished (and maybe been reaped, so 
+        its pid could belong to another process), True otherwise.
+        """
+
+        if job.process.exitcode is not None or not job.process.is_alive():
+            return False
+        try:
+            try:
+                os.killpg(job.process.pid, sig)
+            except ProcessLookupError:
+                # process group not created yet
+                os.kill(job.process.pid, sig)
+        except ProcessLookupError:
+            # the process has just finished
+            return False
+
+        return True
+
+    def _suspend(self, job):
+        """
+        Suspend the running job; returns False if it has already finished,
+        and then it is left to be completed by finished().
+        """
+
+        if not self._signal(job, signal.SIGSTOP):
+            return False
+        job.status = "SUSPENDED"
+        del self._running[job.id]
+        heapq.heappush(self._pending, job)
+        log.info("Job #%d (%s) preempted" % (job.id, job.name))
+
+        return True
+
+    def _resume(self, job):
+        self._running[job.id] = job
+        job.status = "RUNNING"
+        if self._signal(job, signal.SIGCONT):
+            log.info("Job #%d (%s) resumed" % (job.id, job.name))
+        else:
+            # it died while suspended; _wait() notifies its (failed) result
+            log.warning("Job #%d (%s) finished while suspended" 
+                        % (job.id, job.name))
+
+    def finished(self, job):
+        """
+        Mark the job as finished and start the next pending ones.
+        """
+        
+        job.status = "FINISHED"
+        self._running.pop(job.id, None)
+        self.dispatch()
+
+    def cancel(self, job_id=None, key=None):
+        """
+        Cancel the job with the given id, the jobs with the given key, or all
+        of them if both are None. Running (or suspended) jobs are killed.
+
+        Returns
+        -------
+        The number of jobs cancelled.
+        """
+
+        def match(job):
+            if job_id is not None:
+                return job.id == job_id
+            if key is not None:
+                return job.key == key
+            return True
+
+        cancelled = [j for j in self._pending if match(j)]
+        self._pending = [j for j in self._pending if not match(j)]
+        heapq.heapify(self._pending)
+        cancelled += [j for j in list(self._running.values()) if match(j)]
+        for job in cancelled:
+            was_running = job.process is not None
+            job.status = "CANCELLED"
+            self._running.pop(job.id, None)
+            if was_running:
+                self._signal(job, signal.SIGKILL)
+            log.info("Job #%d (%s) cancelled" % (job.id, job.name))
+        if cancelled:
+            self.dispatch()
+
+        return len(cancelled)
+
+    def size(self):
+        """
+        Return the number of jobs pending or in execution.
+        """
+
+        return len(self._pending) + len(self._running)
+
+    def running(self):
+        """
+        Return the number of jobs in execution.
+        """
+
+        return len(self._running)
+
+
 class WaitTaskThread(threading.Thread):
     """ 
     NOT USED until now
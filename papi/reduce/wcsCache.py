@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# wcsCache.py
+#
+# Cache of the last good astrometric solutions (WCS and distortion terms),
+# used to warm-start the astrometric calibration of the next frames of the
+# same pointing:
+#
+#   - SCAMP: the cached solution is written as the '.ahead' file of the frame,
+#     so SCAMP starts from it instead of from the rough initWCS() header;
+#   - Astrometry.net: the cached solution gives tight scale/position hints and
+#     a WCS to be verified by solve-field.
+#
+# The solutions are grouped by (detector, rotator, pixel scale), and inside a
+# group they are looked up by the nearest telescope pointing (RA, DEC
+# keywords). The solution found is shifted by the pointing offset between the
+# cached frame and the new one, so the dither offsets are taken into account.
+#
+# Layout of the cache directory:
+#
+#   <cache_dir>/<group>/<cell>.json     (one solution per pointing cell)
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import re
+import json
+import math
+import time
+import hashlib
+import tempfile
+
+import astropy.io.fits as fits
+
+# PAPI modules
+from papi.misc.paLog import log
+
+
+__all__ = ['WCSCache']
+
+# Keywords of the WCS (and distortion) solution that are cached
+_WCS_KEYWORDS = re.compile(r"^(CTYPE[12]|CUNIT[12]|CRVAL[12]|CRPIX[12]|"
+                           r"CD[12]_[12]|PV[12]_\d+|RADESYS|RADECSYS|EQUINOX|"
+                           r"LONPOLE|LATPOLE|[AB]P?_ORDER|[AB]P?_\d+_\d+)$")
+
+# SIP terms (Astrometry.net) are not understood by SCAMP
+_SIP_KEYWORDS = re.compile(r"^([AB]P?_ORDER|[AB]P?_\d+_\d+)$")
+
+# Keywords with the position of the instrument rotator
+_ROTATOR_KEYWORDS = ('CASSPOS', 'ROT-RTA', 'ROTATOR')
+
+# Size (degrees) of the pointing cells: only one solution (the last one) is
+# kept per cell
+CELL_SIZE = 0.05
+
+
+def _pointing(header):
+    """
+    Return the telescope pointing (RA, DEC keywords, degrees) of a header, or
+    None if not available.
+    """
+
+    try:
+        return float(header['RA']), float(header['DEC'])
+    except (KeyError, ValueError, TypeError):
+        return None
+
+
+def _rotator(header):
+    """
+    Return the rotator position (degrees, rounded) of a header, or None.
+    """
+
+    for key in _ROTATOR_KEYWORDS:
+        if key in header:
+            try:
+                return int(round(float(header[key])))
+            except (ValueError, TypeError):
+                pass
+
+    return None
+
+
+class WCSCache(object):
+    """
+    Cache of astrometric solutions indexed by (pointing, detector, rotator,
+    pixel scale).
+    """
+
+    def __init__(self, cache_dir, max_offset=0.25):
+        """
+        Parameters
+        ----------
+        cache_dir: str
+            Directory where the solutions are stored; it is created if it does
+            not exist.
+        max_offset: float
+            Maximum distance (degrees) between the pointing of a frame and the
+            pointing of a cached solution to be used for it.
+        """
+
+        self.cache_dir = cache_dir
+        self.max_offset = max_offset
+        self.enabled = cache_dir is not None
+
+        if self.enabled:
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+            except OSError as e:
+                log.warning("Cannot create WCS cache directory %s: %s. "
+                            "WCS cache disabled." % (cache_dir, str(e)))
+                self.enabled = False
+
+    def group(self, header, pix_scale=None):
+        """
+        Return the name of the group (detector, rotator, pixel scale) of the
+        solutions valid for a frame with the given header.
+
+        The image size is part of the detector, so the solutions of coadds
+        and of single frames are never mixed.
+        """
+
+        detector = header.get('DET_ID', header.get('EXTNAME',
+                                                   header.get('INSTRUME', 'unknown')))
+        detector = "%s_%sx%s" % (detector, header.get('NAXIS1', 0),
+                                 header.get('NAXIS2', 0))
+        rotator = _rotator(header)
+        scale = header.get('PIXSCALE', pix_scale)
+        try:
+            scale = "%.3f" % float(scale)
+        except (ValueError, TypeError):
+            scale = 'NA'
+
+        name = "%s|%s|%s" % (detector, rotator, scale)
+
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+    def lookup(self, header, pix_scale=None):
+        """
+        Look for the cached solution of the nearest pointing of the group of
+        the frame.
+
+        Parameters
+        ----------
+        header: astropy.io.fits.Header
+            Header of the frame to be solved (raw telescope pointing)
+        pix_scale: float
+            Pixel scale to use if not found in the header
+
+        Returns
+        -------
+        A Header with the predicted WCS of the frame (the cached solution
+        shifted by the pointing offset), or None if no solution was found.
+        """
+
+        if not self.enabled:
+            return None
+
+        pointing = _pointing(header)
+        gdir = os.path.join(self.cache_dir, self.group(header, pix_scale))
+        if pointing is None or not os.path.isdir(gdir):
+            return None
+
+        ra, dec = pointing
+        cos_dec = math.cos(math.radians(dec))
+        best, best_dist = None, self.max_offset
+        for name in os.listdir(gdir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(gdir, name)) as fd:
+                    entry = json.load(fd)
+            except (IOError, OSError, ValueError):
+                continue
+            d_ra = ((entry['ra'] - ra + 180.0) % 360.0 - 180.0) * cos_dec
+            dist = math.hypot(d_ra, entry['dec'] - dec)
+            if dist <= best_dist:
+                best, best_dist = entry, dist
+
+        if best is None:
+            return None
+
+        log.debug("Found cached WCS solution of %s (%.3f deg away)"
+                  % (best['source'], best_dist))
+
+        predicted = fits.Header()
+        for key, value in best['wcs']:
+            predicted[key] = value
+        predicted['CRVAL1'] = (predicted['CRVAL1'] + ra - best['ra']) % 360.0
+        predicted['CRVAL2'] = predicted['CRVAL2'] + dec - best['dec']
+
+        return predicted
+
+    def store(self, header, solution, source=None, pix_scale=None):
+        """
+        Store a good astrometric solution of a frame, replacing the previous
+        one of the same pointing cell.
+
+        Parameters
+        ----------
+        header: astropy.io.fits.Header
+            Header of the frame before the solution (raw telescope pointing)
+        solution: astropy.io.fits.Header
+            Header with the WCS solution (e.g. SCAMP .head or the header of
+            the file solved by Astrometry.net)
+        source: str
+            Name of the solved file (only for information)
+        pix_scale: float
+            Pixel scale to use if not found in the header
+        """
+
+        if not self.enabled:
+            return
+
+        pointing = _pointing(header)
+        if pointing is None:
+            log.debug("No pointing found in the header; WCS solution not cached")
+            return
+
+        cards = [(key, solution[key]) for key in solution.keys()
+                 if _WCS_KEYWORDS.match(key)]
+        keys = [key for key, value in cards]
+        if not all(k in keys for k in ('CRVAL1', 'CRVAL2', 'CRPIX1', 'CRPIX2')):
+            log.debug("Incomplete WCS solution; not cached")
+            return
+
+        gdir = os.path.join(self.cache_dir, self.group(header, pix_scale))
+        ra, dec = pointing
+        cell = "%+09.3f_%+08.3f" % (round(ra / CELL_SIZE) * CELL_SIZE,
+                                    round(dec / CELL_SIZE) * CELL_SIZE)
+        entry = {'ra': ra, 'dec': dec, 'source': source,
+                 'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 'wcs': cards}
+
+        try:
+            if not os.path.isdir(gdir):
+                os.makedirs(gdir, exist_ok=True)
+            fd, tmp_file = tempfile.mkstemp(suffix='.tmp', dir=gdir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            # atomic, the last solution of the cell wins
+            os.rename(tmp_file, os.path.join(gdir, cell + '.json'))
+        except (IOError, OSError) as e:
+            log.warning("Cannot store WCS solution in cache: %s" % str(e))
+
+    def storeFile(self, filename, solution_file, pix_scale=None):
+        """
+        Store the solution of a frame from its SCAMP output header
+        (.head file) or from its solved FITS file.
+        """
+
+        if not self.enabled:
+            return
+
+        try:
+            header = fits.getheader(filename)
+            if solution_file.endswith('.head'):
+                # text header, one card per line
+                with open(solution_file) as fd:
+                    cards = [line.rstrip('\n') for line in fd
+                             if line.strip() and line.strip() != 'END']
+                solution = fits.Header.fromstring('\n'.join(cards), sep='\n')
+            else:
+                solution = fits.getheader(solution_file)
+        except Exception as e:
+            log.warning("Cannot read WCS solution of %s: %s" % (filename, str(e)))
+            return
+
+        self.store(header, solution, filename, pix_scale)
+
+    def writeAhead(self, filename, pix_scale=None):
+        """
+        Write the SCAMP '.ahead' file (filename + '.ahead', next to its
+        filename + '.ldac' catalog) of a frame from the cached solution of
+        its pointing.
+
+        Returns
+        -------
+        The filename of the .ahead file written, or None if no solution was
+        found.
+        """
+
+        predicted = self.lookup(fits.getheader(filename), pix_scale)
+        if predicted is None:
+            return None
+
+        for key in list(predicted.keys()):
+            if _SIP_KEYWORDS.match(key):
+                del predicted[key]
+        for key in ('CTYPE1', 'CTYPE2'):
+            if key in predicted:
+                predicted[key] = predicted[key].replace('-SIP', '')
+
+        ahead_file = filename + '.ahead'
+        with open(ahead_file, 'w') as fd:
+            for card in predicted.cards:
+                fd.write(str(card).rstrip() + '\n')
+            fd.write('END\n')
+
+        return ahead_file
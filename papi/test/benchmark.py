@@ -0,0 +1,903 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2026 IAA-CSIC  - All rights reserved.
+# Instituto de Astrofisica de Andalucia, IAA-CSIC
+#
+# This file is part of PAPI (PANIC Pipeline)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+################################################################################
+#
+# PAPI (PANIC PIpeline)
+#
+# benchmark.py
+#
+# Reproducible benchmark suite of the main steps of the reduction.
+#
+# A synthetic PANIC data set is generated (with a fixed seed) for one of the
+# detector layouts:
+#
+#   - H2RG: MEF files with 4 detectors of 2k x 2k (old PANIC)
+#   - H4RG: single HDU files of 4k x 4k (PANICv2)
+#
+# having darks, dome and twilight flats, dithered science frames (stars over
+# a sky with gradient), the master calibrations and a non-linearity model
+# (LINPOLY cube + LINMAX). Then, the entry points below are timed, each one
+# in its own process, reporting wall/CPU time, throughput (frames/s, MB/s),
+# peak RSS and I/O:
+#
+#   dataset_load     DataSet.load
+#   apply_dark_flat  ApplyDarkFlat.apply
+#   nlc              NonLinearityCorrection.runMultiNLC
+#   super_flat       SuperSkyFlat.create
+#   gain_map         GainMap.create
+#   sky_filter       ReductionSet.skyFilter (IRDR)
+#   coadd            ReductionSet.coaddStackImages
+#   dxtalk           dxtalk.remove_crosstalk
+#
+# No external data nor network access is needed; benchmarks whose
+# dependencies are not available (e.g., IRAF, IRDR binaries, a valid config
+# file) are reported as SKIPPED.
+#
+# Usage:
+#
+#   python benchmark.py -d H4RG -w /tmp/papi_bench -o /tmp/bench_h4rg.json
+#   python benchmark.py -d H2RG -s 512 -b dataset_load,apply_dark_flat
+#
+# Created    : 19/10/2026
+#
+################################################################################
+
+# System modules
+import os
+import sys
+import time
+import json
+import socket
+import logging
+import argparse
+import datetime
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+import numpy
+import astropy
+import astropy.io.fits as fits
+
+# PAPI modules
+from papi.misc.paLog import log
+from papi.misc import profiling
+from papi.misc import config
+from papi.misc.version import __version__
+
+
+# Layout of the PANIC detectors: number of extensions (0 = single HDU) and
+# shape of each detector
+DETECTORS = {'H2RG': {'n_ext': 4, 'shape': (2048, 2048), 'camera': 'PANIC H2RG'},
+             'H4RG': {'n_ext': 0, 'shape': (4096, 4096), 'camera': 'PANIC H4RG'}}
+
+# Version of the synthetic data generator; increase it whenever the generated
+# data changes, so that cached data sets are not reused.
+DATASET_VERSION = 1
+
+PIXSCALE = 0.45       # arcsec/pixel
+RON = 15.0            # ADU
+DARK_LEVEL = 300.0    # ADU (offset)
+DARK_CURRENT = 0.05   # ADU/s
+SKY_LEVEL = 3000.0    # ADU
+FLAT_LEVEL = 20000.0  # ADU
+
+
+class SkipBenchmark(Exception):
+    """
+    Raised by a benchmark whose dependencies are not available.
+    """
+    pass
+
+
+class SyntheticDataset(object):
+    """
+    Synthetic PANIC data set used by the benchmarks.
+
+    The data set is written in 'out_dir' together with a manifest
+    (dataset.json); if a manifest with the same parameters already exists,
+    the files are reused instead of generated again.
+    """
+
+    def __init__(self, out_dir, detector='H4RG', shape=None, n_darks=3,
+                 n_flats=3, n_science=9, seed=2026):
+        """
+        Parameters
+        ----------
+        out_dir: str
+            Directory where the data set is written
+        detector: str
+            Detector layout, 'H2RG' (MEF, 4 detectors) or 'H4RG' (single HDU)
+        shape: tuple
+            Shape (ny, nx) of each detector; if None, the native one.
+        n_darks: int
+            Number of raw darks
+        n_flats: int
+            Number of raw dome flats (lamp on) and of twilight flats
+        n_science: int
+            Number of dithered science frames
+        seed: int
+            Seed of the random generator
+        """
+
+        detector = detector.upper()
+        if detector not in DETECTORS:
+            msg = "Detector %s not supported (%s)" % (detector, list(DETECTORS))
+            log.error(msg)
+            raise Exception(msg)
+
+        self.out_dir = os.path.abspath(out_dir)
+        self.detector = detector
+        self.n_ext = DETECTORS[detector]['n_ext']
+        self.shape = tuple(shape) if shape else DETECTORS[detector]['shape']
+        self.n_darks = n_darks
+        self.n_flats = n_flats
+        self.n_science = n_science
+        self.seed = seed
+        self.files = {}
+
+        self._rng = None
+        self._response = None
+
+    def params(self):
+        """
+        Return the parameters that define the data set.
+        """
+
+        return OrderedDict([('version', DATASET_VERSION),
+                            ('detector', self.detector),
+                            ('shape', list(self.shape)),
+                            ('n_darks', self.n_darks),
+                            ('n_flats', self.n_flats),
+                            ('n_science', self.n_science),
+                            ('seed', self.seed)])
+
+    def generate(self):
+        """
+        Generate the data set (or reuse the existing one).
+
+        Returns
+        -------
+        A dictionary with the lists/filenames of each kind of frame.
+        """
+
+        manifest = os.path.join(self.out_dir, 'dataset.json')
+        if os.path.exists(manifest):
+            with open(manifest) as fd:
+                content = json.load(fd)
+            if (content.get('params') == self.params() and
+                all(os.path.exists(f) for f in _flatten(content['files']))):
+                log.info("Reusing synthetic data set in %s" % self.out_dir)
+                self.files = content['files']
+                return self.files
+
+        if not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        log.info("Generating synthetic %s data set in %s" % (self.detector,
+                                                            self.out_dir))
+        t0 = time.time()
+        self._rng = numpy.random.default_rng(self.seed)
+        self._response = self._make_response()
+
+        files = OrderedDict()
+        files['darks'] = [self._write_raw('dark_%02d.fits' % i, 'DARK', 10.0, i)
+                          for i in range(self.n_darks)]
+        files['dome_flats'] = [self._write_raw('domeflat_%02d.fits' % i,
+                                               'DOME_FLAT_LAMP_ON', 10.0, i)
+                               for i in range(self.n_flats)]
+        files['tw_flats'] = [self._write_raw('twflat_%02d.fits' % i,
+                                             'TW_FLAT_DUSK', 10.0, i)
+                             for i in range(self.n_flats)]
+        files['science'] = [self._write_raw('science_%02d.fits' % i,
+                                            'SCIENCE', 10.0, i)
+                            for i in range(self.n_science)]
+        # Single detector frames (for MEF data, the first detector, as
+        # produced by the split done in the reduction)
+        if self.n_ext:
+            files['science_det'] = [self._write_detector(f, 1)
+                                    for f in files['science']]
+        else:
+            files['science_det'] = list(files['science'])
+        files['offsets'] = self._offsets().tolist()
+        files['master_dark'] = self._write_master('master_dark.fits',
+                                                  'MASTER_DARK')
+        files['master_flat'] = self._write_master('master_flat.fits',
+                                                  'MASTER_DOME_FLAT')
+        files['gainmap_det'] = self._write_master('gainmap.fits',
+                                                  'MASTER_GAINMAP', single=True)
+        files['nlc_model'], files['nlc_offset'] = self._write_nlc_model()
+
+        with open(manifest, 'w') as fd:
+            json.dump({'params': self.params(), 'files': files}, fd, indent=2)
+
+        log.info("Data set generated in %.1f s" % (time.time() - t0))
+        self.files = files
+
+        return files
+
+    def _make_response(self):
+        """
+        Pixel response (flat-field) of each detector: large scale variation,
+        pixel-to-pixel noise and ~0.1% of dead pixels.
+        """
+
+        ny, nx = self.shape
+        y, x = numpy.ogrid[0:ny, 0:nx]
+        response = []
+        for i in range(max(1, self.n_ext)):
+            r = self._rng.normal(1.0, 0.01, self.shape).astype(numpy.float32)
+            r *= (1.0 + 0.03 * numpy.cos(numpy.pi * (x / nx - 0.5)) *
+                  numpy.cos(numpy.pi * (y / ny - 0.5)) - 0.015 * i).astype(numpy.float32)
+            dead = self._rng.random(self.shape) < 0.001
+            r[dead] = 0.05
+            response.append(r)
+
+        return response
+
+    def _offsets(self):
+        """
+        Dither offsets (pixels) of the science frames (3x3 pattern, repeated).
+        """
+
+        step = max(8, self.shape[1] // 64)
+        pattern = [(0, 0), (1, 1), (-1, -1), (1, -1), (-1, 1),
+                   (0, 1), (0, -1), (1, 0), (-1, 0)]
+
+        return numpy.array([pattern[i % len(pattern)] for i in
+                            range(self.n_science)], dtype=numpy.float64) * step
+
+    def _pixels(self, frame_type, exptime, index, det):
+        """
+        Build the pixel values of a detector of a raw frame.
+        """
+
+        ny, nx = self.shape
+        rng = self._rng
+        data = numpy.full(self.shape, DARK_LEVEL + DARK_CURRENT * exptime,
+                          dtype=numpy.float32)
+
+        if frame_type == 'DOME_FLAT_LAMP_ON':
+            data += FLAT_LEVEL * (1.0 + 0.01 * index) * self._response[det]
+        elif frame_type == 'TW_FLAT_DUSK':
+            data += FLAT_LEVEL * (1.0 - 0.15 * index) * self._response[det]
+        elif frame_type == 'SCIENCE':
+            y, x = numpy.ogrid[0:ny, 0:nx]
+            sky = (SKY_LEVEL * (1.0 + 0.002 * index) *
+                   (1.0 + 0.05 * (x / nx - 0.5) + 0.03 * (y / ny - 0.5)))
+            sky = sky.astype(numpy.float32)
+            self._add_stars(sky, self._offsets()[index], det)
+            sky *= self._response[det]
+            data += sky
+
+        # shot noise (gaussian approximation) + read-out noise
+        noise = rng.standard_normal(self.shape, dtype=numpy.float32)
+        noise *= numpy.sqrt(numpy.maximum(data - DARK_LEVEL, 0) + RON ** 2,
+                            dtype=numpy.float32)
+        data += noise
+
+        return data
+
+    def _add_stars(self, data, offset, det):
+        """
+        Add a fixed star field (gaussian PSF, FWHM~3 pix) shifted by the
+        dither offset.
+        """
+
+        ny, nx = self.shape
+        # the star field is the same for all the frames of a detector
+        rng = numpy.random.default_rng(self.seed + 100 + det)
+        n_stars = max(20, nx * ny // 50000)
+        xs = rng.uniform(0, nx, n_stars) - offset[0]
+        ys = rng.uniform(0, ny, n_stars) - offset[1]
+        fluxes = 10 ** rng.uniform(3, 6, n_stars)
+
+        sigma = 3.0 / 2.3548
+        hw = 7
+        yy, xx = numpy.mgrid[-hw:hw + 1, -hw:hw + 1]
+        for x, y, flux in zip(xs, ys, fluxes):
+            ix, iy = int(round(x)), int(round(y))
+            if ix < hw or iy < hw or ix >= nx - hw or iy >= ny - hw:
+                continue
+            psf = numpy.exp(-((xx - (x - ix)) ** 2 + (yy - (y - iy)) ** 2)
+                            / (2 * sigma ** 2))
+            psf *= flux / (2 * numpy.pi * sigma ** 2)
+            data[iy - hw:iy + hw + 1, ix - hw:ix + hw + 1] += psf
+
+    def _header(self, frame_type, exptime, index):
+        """
+        Primary header of a raw frame, with the keywords used by ClFits.
+        """
+
+        ny, nx = self.shape
+        date = (datetime.datetime(2026, 10, 19, 20, 0, 0) +
+                datetime.timedelta(seconds=60 * index +
+                                   3600 * ['DARK', 'DOME_FLAT_LAMP_ON',
+                                           'TW_FLAT_DUSK',
+                                           'SCIENCE'].index(frame_type)))
+        mjd = 40587.0 + (date - datetime.datetime(1970, 1, 1)).total_seconds() / 86400.0
+        ra, dec = 150.0, 2.0
+        if frame_type == 'SCIENCE':
+            dx, dy = self._offsets()[index]
+            ra += dx * PIXSCALE / 3600.0 / numpy.cos(numpy.radians(dec))
+            dec += dy * PIXSCALE / 3600.0
+
+        header = fits.Header()
+        header.set('INSTRUME', 'PANIC', 'Instrument')
+        header.set('TELESCOP', 'CA-2.2', 'Telescope')
+        header.set('CAMERA', DETECTORS[self.detector]['camera'], 'Camera')
+        header.set('CREATOR', 'papi-benchmark', 'Software')
+        header.set('OBS_TOOL', 'OT_V1.1', 'Observing tool')
+        header.set('IMAGETYP', frame_type, 'Image type')
+        header.set('OBJECT', 'BENCH_' + frame_type, 'Object name')
+        header.set('FILTER', 'H', 'Filter')
+        header.set('EXPTIME', exptime, 'Exposure time (s)')
+        header.set('ITIME', exptime, 'Integration time (s)')
+        header.set('NCOADDS', 1, 'Number of coadds')
+        header.set('NEXP', 1, 'Number of exposures')
+        header.set('READMODE', 'line.interlaced.read', 'Read mode')
+        header.set('DATE-OBS', date.isoformat(), 'Date of observation')
+        header.set('MJD-OBS', mjd, 'Modified Julian Date')
+        header.set('RA', ra, 'RA (deg)')
+        header.set('DEC', dec, 'DEC (deg)')
+        header.set('EQUINOX', 2000.0)
+        header.set('OB_ID', 1 + ['DARK', 'DOME_FLAT_LAMP_ON', 'TW_FLAT_DUSK',
+                                 'SCIENCE'].index(frame_type), 'OB id')
+        header.set('OB_PAT', '9-point', 'OB pattern')
+        header.set('PAT_EXPN', index + 1, 'Exposure number in pattern')
+        header.set('PAT_NEXP', self.n_science if frame_type == 'SCIENCE'
+                   else (self.n_darks if frame_type == 'DARK' else self.n_flats),
+                   'Number of exposures in pattern')
+        header.set('PIXSCALE', PIXSCALE, 'Pixel scale (arcsec/pix)')
+        header.set('DETROT90', 2)
+        header.set('DETXYFLI', 0)
+        if not self.n_ext:
+            header.set('CHIPID', 1, 'Chip id')
+            header.set('DETSEC', '[1:%d,1:%d]' % (nx, ny), 'Detector section')
+            self._wcs(header, ra, dec)
+
+        return header
+
+    def _wcs(self, header, ra, dec):
+        """
+        Add a simple TAN WCS to the header.
+        """
+
+        ny, nx = self.shape
+        header.set('CTYPE1', 'RA---TAN')
+        header.set('CTYPE2', 'DEC--TAN')
+        header.set('CRVAL1', ra)
+        header.set('CRVAL2', dec)
+        header.set('CRPIX1', nx / 2.0)
+        header.set('CRPIX2', ny / 2.0)
+        header.set('CD1_1', -PIXSCALE / 3600.0)
+        header.set('CD1_2', 0.0)
+        header.set('CD2_1', 0.0)
+        header.set('CD2_2', PIXSCALE / 3600.0)
+
+    def _write(self, filename, header, data_list):
+        """
+        Write a frame (single HDU or MEF, depending on the detector layout).
+        """
+
+        pathname = os.path.join(self.out_dir, filename)
+        if self.n_ext:
+            ny, nx = self.shape
+            hdus = [fits.PrimaryHDU(header=header)]
+            hdus[0].header.set('NEXTEND', self.n_ext)
+            for i, data in enumerate(data_list):
+                hdu = fits.ImageHDU(data=data)
+                hdu.header.set('EXTNAME', 'Q%d' % (i + 1))
+                hdu.header.set('DET_ID', 'SG%d' % (i + 1))
+                hdu.header.set('CHIPID', i + 1)
+                # 2x2 mosaic of detectors
+                x0, y0 = (i % 2) * nx, (i // 2) * ny
+                hdu.header.set('DETSEC', '[%d:%d,%d:%d]' % (x0 + 1, x0 + nx,
+                                                            y0 + 1, y0 + ny))
+                if 'RA' in header:
+                    self._wcs(hdu.header, header['RA'], header['DEC'])
+                hdus.append(hdu)
+        else:
+            hdus = [fits.PrimaryHDU(data=data_list[0], header=header)]
+
+        fits.HDUList(hdus).writeto(pathname, overwrite=True)
+
+        return pathname
+
+    def _write_raw(self, filename, frame_type, exptime, index):
+        """
+        Generate and write a raw frame.
+        """
+
+        header = self._header(frame_type, exptime, index)
+        data = [self._pixels(frame_type, exptime, index, det)
+                for det in range(max(1, self.n_ext))]
+
+        return self._write(filename, header, data)
+
+    def _write_detector(self, filename, ext):
+        """
+        Write the given extension of a MEF file as a single detector frame.
+        """
+
+        with fits.open(filename) as hdulist:
+            header = hdulist[0].header.copy()
+            del header['NEXTEND']
+            for card in hdulist[ext].header.cards:
+                if card.keyword not in ('XTENSION', 'BITPIX', 'NAXIS', 'NAXIS1',
+                                        'NAXIS2', 'PCOUNT', 'GCOUNT', 'EXTNAME'):
+                    header.set(card.keyword, card.value, card.comment)
+            data = hdulist[ext].data
+            # the detector is taken as it was a full frame
+            ny, nx = data.shape
+            header.set('DETSEC', '[1:%d,1:%d]' % (nx, ny))
+            out = filename.replace('.fits', '.Q%02d.fits' % ext)
+            fits.PrimaryHDU(data=data, header=header).writeto(out, overwrite=True)
+
+        return out
+
+    def _write_master(self, filename, papitype, single=False):
+        """
+        Write a master calibration (dark, normalized flat or gainmap).
+        """
+
+        header = self._header('DARK' if papitype == 'MASTER_DARK' else
+                              'DOME_FLAT_LAMP_ON', 10.0, 0)
+        header.set('PAPITYPE', papitype, 'PAPI type')
+        header.set('IMAGETYP', papitype)
+        n_det = 1 if single else max(1, self.n_ext)
+        data = []
+        for det in range(n_det):
+            if papitype == 'MASTER_DARK':
+                data.append(numpy.full(self.shape, DARK_LEVEL + DARK_CURRENT * 10.0,
+                                       dtype=numpy.float32))
+            elif papitype == 'MASTER_GAINMAP':
+                gain = self._response[det].copy()
+                gain[(gain < 0.5) | (gain > 1.5)] = 0.0
+                data.append(gain)
+            else:
+                data.append(self._response[det] / numpy.median(self._response[0]))
+
+        if single and self.n_ext:
+            pathname = os.path.join(self.out_dir, filename)
+            ny, nx = self.shape
+            header.set('CHIPID', 1)
+            header.set('DETSEC', '[1:%d,1:%d]' % (nx, ny))
+            fits.PrimaryHDU(data=data[0], header=header).writeto(pathname,
+                                                                 overwrite=True)
+            return pathname
+
+        return self._write(filename, header, data)
+
+    def _write_nlc_model(self):
+        """
+        Write the non-linearity model (LINMAX + LINPOLY cube with the c4..c1
+        coeffs) and the reference offset of a single detector.
+        """
+
+        ny, nx = self.shape
+        rng = numpy.random.default_rng(self.seed + 1)
+
+        primary = fits.PrimaryHDU()
+        primary.header.set('PAPITYPE', 'MASTER_LINEARITY')
+        primary.header.set('INSTRUME', 'PANIC')
+        primary.header.set('ID', 'BENCH-NLC-%d' % DATASET_VERSION)
+        primary.header.set('USE_AFT', '2020-01-01T00:00:00')
+        primary.header.set('CHIPID', 1)
+        primary.header.set('DETSEC', '[1:%d,1:%d]' % (nx, ny))
+        primary.header.set('READMODE', 'line.interlaced.read')
+
+        linmax = fits.ImageHDU(data=numpy.full(self.shape, 40000.0,
+                                               dtype=numpy.float32),
+                               name='LINMAX')
+        coeffs = numpy.empty((4,) + self.shape, dtype=numpy.float32)
+        coeffs[0] = rng.normal(1e-18, 1e-19, self.shape)
+        coeffs[1] = rng.normal(-1e-13, 1e-14, self.shape)
+        coeffs[2] = rng.normal(2e-6, 1e-7, self.shape)
+        coeffs[3] = rng.normal(1.0, 0.001, self.shape)
+        linpoly = fits.ImageHDU(data=coeffs, name='LINPOLY')
+
+        model = os.path.join(self.out_dir, 'nlc_model.fits')
+        fits.HDUList([primary, linmax, linpoly]).writeto(model, overwrite=True)
+
+        offset = os.path.join(self.out_dir, 'nlc_offset.fits')
+        fits.PrimaryHDU(data=numpy.full(self.shape, 50.0, dtype=numpy.float32)
+                        ).writeto(offset, overwrite=True)
+
+        return model, offset
+
+
+def _flatten(files):
+    """
+    Return the list of filenames of the dictionary of the data set.
+    """
+
+    names = []
+    for value in files.values():
+        if isinstance(value, list):
+            names += [v for v in value if isinstance(v, str)]
+        elif isinstance(value, str):
+            names.append(value)
+
+    return names
+
+
+def _size(files):
+    """
+    Return the total size (bytes) of the given files.
+    """
+
+    return sum(os.path.getsize(f) for f in files)
+
+
+def _reduction_set(files, work_dir, config_file):
+    """
+    Create a ReductionSet for the given files, or raise SkipBenchmark if
+    it cannot be created in this environment.
+    """
+
+    try:
+        from papi.reduce.reductionset import ReductionSet
+    except ImportError as e:
+        raise SkipBenchmark("cannot import ReductionSet (%s)" % str(e))
+
+    try:
+        config_dict = config.read_config_file(config_file)
+    except (SystemExit, Exception):
+        raise SkipBenchmark("cannot read config file %s" % config_file)
+
+    return ReductionSet(files, work_dir, config_dict=config_dict,
+                        check_data=False, temp_dir=work_dir)
+
+
+################################################################################
+# Benchmarks
+#
+# Each one receives the files of the data set, a working directory and the
+# config file, and returns the number of frames and bytes processed.
+################################################################################
+
+def bench_dataset_load(files, work_dir, config_file):
+
+    from papi.datahandler.dataset import DataSet
+
+    frames = files['darks'] + files['dome_flats'] + files['tw_flats'] + \
+        files['science']
+    ds = DataSet(frames, instrument='panic')
+    ds.createDB()
+    ds.load()
+
+    return len(frames), _size(frames)
+
+
+def bench_apply_dark_flat(files, work_dir, config_file):
+
+    from papi.reduce.applyDarkFlat import ApplyDarkFlat
+
+    frames = files['science']
+    ApplyDarkFlat(frames, files['master_dark'], files['master_flat'],
+                  out_dir_=work_dir).apply()
+
+    return len(frames), _size(frames)
+
+
+def bench_nlc(files, work_dir, config_file):
+
+    from papi.reduce.correctNonLinearity import NonLinearityCorrection
+
+    frames = files['science_det']
+    nlc = NonLinearityCorrection(files['nlc_offset'], files['nlc_model'],
+                                 frames, work_dir, force=True)
+    if len(nlc.runMultiNLC()) != len(frames):
+        raise Exception("Not all the frames were corrected")
+
+    return len(frames), _size(frames)
+
+
+def bench_super_flat(files, work_dir, config_file):
+
+    try:
+        from papi.reduce.calSuperFlat import SuperSkyFlat
+    except ImportError as e:
+        raise SkipBenchmark("cannot import SuperSkyFlat (%s)" % str(e))
+
+    frames = files['science']
+    SuperSkyFlat(frames, os.path.join(work_dir, 'superflat.fits'),
+                 temp_dir=work_dir).create()
+
+    return len(frames), _size(frames)
+
+
+def bench_gain_map(files, work_dir, config_file):
+
+    try:
+        from papi.reduce.calGainMap import GainMap
+    except ImportError as e:
+        raise SkipBenchmark("cannot import GainMap (%s)" % str(e))
+
+    GainMap(files['master_flat'], os.path.join(work_dir, 'gainmap.fits')).create()
+
+    return 1, _size([files['master_flat']])
+
+
+def bench_sky_filter(files, work_dir, config_file):
+
+    # skyfilter writes the results next to the input files
+    frames = []
+    for f in files['science_det']:
+        link = os.path.join(work_dir, os.path.basename(f))
+        os.symlink(f, link)
+        frames.append(link)
+
+    rs = _reduction_set(frames, work_dir, config_file)
+    if not os.path.exists(rs.m_irdr_path + '/skyfilter'):
+        raise SkipBenchmark("IRDR skyfilter not found in %s" % rs.m_irdr_path)
+
+    list_file = os.path.join(work_dir, 'skylist.list')
+    with open(list_file, 'w') as fd:
+        fd.write('\n'.join(frames) + '\n')
+    out = rs.skyFilter(list_file, files['gainmap_det'], 'nomask', 'dither')
+    if not out:
+        raise Exception("No sky subtracted frames were produced")
+
+    return len(frames), _size(frames)
+
+
+def bench_coadd(files, work_dir, config_file):
+
+    frames = files['science_det']
+    rs = _reduction_set(frames, work_dir, config_file)
+
+    stack = os.path.join(work_dir, 'stack.pap')
+    with open(stack, 'w') as fd:
+        for f, (dx, dy) in zip(frames, files['offsets']):
+            fd.write("%s  %f  %f\n" % (f, -dx, -dy))
+    output = os.path.join(work_dir, 'coadd.fits')
+    rs.coaddStackImages(stack, files['gainmap_det'], output)
+    if not os.path.exists(output):
+        raise Exception("Coadd was not produced")
+
+    return len(frames), _size(frames)
+
+
+def bench_dxtalk(files, work_dir, config_file):
+
+    from papi.reduce.dxtalk import remove_crosstalk
+
+    frames = files['science_det']
+    shape = fits.getdata(frames[0]).shape
+    native = DETECTORS['H4RG' if 'H4RG' in fits.getval(frames[0], 'CAMERA')
+                       else 'H2RG']['shape']
+    if shape != native:
+        raise SkipBenchmark("dxtalk requires native detector size %s" % str(native))
+
+    for f in frames:
+        remove_crosstalk(f, os.path.join(work_dir, os.path.basename(f)))
+
+    return len(frames), _size(frames)
+
+
+BENCHMARKS = OrderedDict([('dataset_load', bench_dataset_load),
+                          ('apply_dark_flat', bench_apply_dark_flat),
+                          ('nlc', bench_nlc),
+                          ('super_flat', bench_super_flat),
+                          ('gain_map', bench_gain_map),
+                          ('sky_filter', bench_sky_filter),
+                          ('coadd', bench_coadd),
+                          ('dxtalk', bench_dxtalk)])
+
+
+def _run_child(conn, name, files, work_dir, config_file):
+    """
+    Run a benchmark (in a child process) and send the result to the parent.
+    """
+
+    try:
+        with profiling.Profiler(name) as prof:
+            n_frames, n_bytes = BENCHMARKS[name](files, work_dir, config_file)
+        total = prof.report()['total']
+        conn.send({'status': 'OK', 'frames': n_frames, 'bytes': n_bytes,
+                   'total': total})
+    except SkipBenchmark as e:
+        conn.send({'status': 'SKIPPED', 'reason': str(e)})
+    except BaseException as e:
+        conn.send({'status': 'FAILED', 'reason': str(e),
+                   'traceback': traceback.format_exc()})
+    finally:
+        conn.close()
+
+
+def run_benchmark(name, files, work_dir, config_file):
+    """
+    Run a benchmark in a new process (so that the peak RSS of each one is
+    measured independently) and return its result.
+
+    Returns
+    -------
+    A dictionary with the status (OK|SKIPPED|FAILED) and, if OK, the time,
+    memory, I/O and throughput figures.
+    """
+
+    run_dir = os.path.join(work_dir, name)
+    if os.path.isdir(run_dir):
+        for f in os.listdir(run_dir):
+            os.remove(os.path.join(run_dir, f))
+    else:
+        os.makedirs(run_dir)
+
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    p = ctx.Process(target=_run_child,
+                    args=(child_conn, name, files, run_dir, config_file))
+    p.start()
+    child_conn.close()
+    try:
+        result = parent_conn.recv()
+    except EOFError:
+        result = {'status': 'FAILED',
+                  'reason': 'process died (exit code %s)' % p.exitcode}
+    p.join()
+
+    result['name'] = name
+    if result['status'] == 'OK':
+        total = result.pop('total')
+        wall = max(total['wall_s'], 1e-6)
+        result.update(total)
+        result['frames_per_s'] = round(result['frames'] / wall, 3)
+        result['mb_per_s'] = round(result['bytes'] / 2.0 ** 20 / wall, 2)
+
+    return result
+
+
+def run_suite(dataset, names, work_dir, config_file, repeat=1):
+    """
+    Run the given benchmarks on the data set.
+
+    Returns
+    -------
+    The report (dict) of the suite; for repeated runs, the run with the
+    median wall time of each benchmark is reported.
+    """
+
+    files = dataset.generate()
+    results = []
+    for name in names:
+        runs = [run_benchmark(name, files, work_dir, config_file)
+                for i in range(repeat)]
+        ok = sorted([r for r in runs if r['status'] == 'OK'],
+                    key=lambda r: r['wall_s'])
+        if ok:
+            result = ok[len(ok) // 2]
+            result['runs_wall_s'] = [r['wall_s'] for r in ok]
+        else:
+            result = runs[0]
+        results.append(result)
+        _print_result(result)
+
+    return {'suite': 'papi-benchmark',
+            'date': datetime.datetime.now().isoformat(),
+            'host': socket.gethostname(),
+            'n_cpus': multiprocessing.cpu_count(),
+            'papi_version': __version__,
+            'python': sys.version.split()[0],
+            'numpy': numpy.__version__,
+            'astropy': astropy.__version__,
+            'dataset': dataset.params(),
+            'results': results}
+
+
+def _print_result(result):
+
+    if result['status'] == 'OK':
+        print("%-16s %8.2f s  cpu %8.2f s (+%7.2f s)  %7.2f frames/s  "
+              "%8.2f MB/s  process peak RSS %7.1f MB (children %7.1f MB)"
+              % (result['name'], result['wall_s'], result['cpu_s'],
+                 result['cpu_children_s'], result['frames_per_s'],
+                 result['mb_per_s'], result['process_peak_rss_mb'],
+                 result['children_peak_rss_mb']))
+    else:
+        print("%-16s %s: %s" % (result['name'], result['status'],
+                                result.get('reason', '')))
+        if result['status'] == 'FAILED' and log.isEnabledFor(logging.DEBUG):
+            print(result.get('traceback', ''))
+    sys.stdout.flush()
+
+
+################################################################################
+# main
+def main(arguments=None):
+
+    desc = "Reproducible benchmark suite of PAPI with synthetic PANIC frames."
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument("-d", "--detector", action="store", dest="detector",
+                        default="H4RG", choices=sorted(DETECTORS),
+                        help="Detector layout of the synthetic data "
+                        "[default=%(default)s]")
+
+    parser.add_argument("-w", "--work_dir", action="store", dest="work_dir",
+                        default="/tmp/papi_bench",
+                        help="Working directory for the data set and the "
+                        "products [default=%(default)s]")
+
+    parser.add_argument("-s", "--size", action="store", dest="size", type=int,
+                        help="Size (pixels) of each detector, to run a reduced "
+                        "version of the suite [default=native]")
+
+    parser.add_argument("-n", "--n_science", action="store", dest="n_science",
+                        type=int, default=9,
+                        help="Number of science frames [default=%(default)s]")
+
+    parser.add_argument("-b", "--benchmarks", action="store", dest="benchmarks",
+                        default=",".join(BENCHMARKS),
+                        help="Comma-separated list of benchmarks to run "
+                        "[default=all]")
+
+    parser.add_argument("-r", "--repeat", action="store", dest="repeat",
+                        type=int, default=1,
+                        help="Number of runs of each benchmark "
+                        "[default=%(default)s]")
+
+    parser.add_argument("-c", "--config", action="store", dest="config_file",
+                        default=os.path.join(os.path.dirname(os.path.dirname(
+                            os.path.abspath(__file__))),
+                            'config_files', 'papi.cfg'),
+                        help="PAPI config file, used by the ReductionSet "
+                        "benchmarks [default=%(default)s]")
+
+    parser.add_argument("-o", "--output", action="store", dest="output",
+                        help="Output JSON file with the report")
+
+    parser.add_argument("-S", "--seed", action="store", dest="seed", type=int,
+                        default=2026,
+                        help="Seed of the synthetic data [default=%(default)s]")
+
+    parser.add_argument("-v", "--verbose", action="store_true", dest="verbose",
+                        default=False, help="Show the PAPI log messages")
+
+    options = parser.parse_args(arguments)
+
+    names = [n.strip() for n in options.benchmarks.split(",") if n.strip()]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark '%s' (%s)" % (name,
+                                                         ",".join(BENCHMARKS)))
+
+    log.setLevel(logging.DEBUG if options.verbose else logging.WARNING)
+
+    shape = (options.size, options.size) if options.size else None
+    dataset = SyntheticDataset(os.path.join(options.work_dir,
+                                            'data_%s' % options.detector),
+                               options.detector, shape,
+                               n_science=options.n_science, seed=options.seed)
+    report = run_suite(dataset, names, options.work_dir, options.config_file,
+                       options.repeat)
+
+    if options.output:
+        with open(options.output, 'w') as fd:
+            json.dump(report, fd, indent=2)
+        print("Report written to %s" % options.output)
+
+    return 1 if any(r['status'] == 'FAILED' for r in report['results']) else 0
+
+######################################################################
+if __name__ == "__main__":
+    sys.exit(main())
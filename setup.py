@@ -134,13 +134,17 @@ setup(
                             'calTwFlat=papi.reduce.calTwFlat:main',
                             'calGainMap=papi.reduce.calGainMap:main',
                             'dxtalk=papi.reduce.dxtalk:main',
+                            'dithercoadd=papi.reduce.dithercoadd:main',
+                            'incrementalReduction=papi.reduce.incrementalReduction:main',
                             'makeobjmask=papi.reduce.makeobjmask:main',
                             'photometry=papi.photo.photometry:main',
                             'correctNonLinearity=papi.reduce.correctNonLinearity:main',
+                            'calNonLinearity=papi.reduce.calNonLinearity:main',
                             'remove_cosmics=papi.reduce.remove_cosmics:main',
                             'modFITS=papi.misc.modFITS:main',
                             'genLogsheet=papi.misc.genLogsheet:main',
                             'collapse=papi.misc.collapse:main',
+                            'productCache=papi.misc.productCache:main',
                             'checkQuality=papi.reduce.checkQuality:main',
                             'eval_focus_serie=papi.reduce.eval_focus_serie:main',
                             'imtrim=papi.misc.imtrim:main']